@@ -0,0 +1,137 @@
+# ============== 准入控制 ==============
+# 在本地维护ComfyUI队列深度，/generate 无需每次同步请求 /queue：
+# - 后台线程定期刷新 /queue 快照
+# - 本进程提交的任务与websocket完成事件在两次刷新之间实时修正深度
+# - 提交前在锁内原子预留名额，关闭并发提交越过上限的竞态
+import logging
+import threading
+import time
+
+from comfy_events import queue_prompt_ids
+
+logger = logging.getLogger("ComfyUI-API")
+
+
+class AdmissionController:
+    """基于缓存队列深度的准入控制（线程安全）"""
+
+    def __init__(self, client, max_depth: int, refresh_interval: float = 2.0, stale_after: float = 10.0):
+        self.client = client
+        self.max_depth = max_depth
+        self.refresh_interval = refresh_interval
+        self.stale_after = stale_after
+        self.lock = threading.Lock()
+        self.upstream_ids = set()  # 最近一次 /queue 快照中的任务
+        self.in_flight = {}  # 本进程提交、尚未结束的任务 -> 提交时间
+        self.reserved = 0  # 已预留、正在提交的名额
+        self.refreshed_at = None
+        self.rejected = 0
+        self.admitted = 0
+        self.failures = 0  # 连续刷新或提交失败次数（节点池据此判断健康状态）
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    # ---------- 深度与准入 ----------
+    def _depth(self) -> int:
+        return len(self.upstream_ids.union(self.in_flight))
+
+    def depth(self) -> int:
+        with self.lock:
+            return self._depth()
+
+    def load(self) -> int:
+        """队列深度 + 正在提交的名额，用于选择负载最低的节点"""
+        with self.lock:
+            return self._depth() + self.reserved
+
+    def local_load(self) -> int:
+        """本进程提交到该节点、尚未结束的任务数"""
+        with self.lock:
+            return len(self.in_flight) + self.reserved
+
+    def in_flight_ids(self) -> list:
+        with self.lock:
+            return list(self.in_flight)
+
+    @property
+    def fresh(self) -> bool:
+        return self.refreshed_at is not None and time.monotonic() - self.refreshed_at < self.stale_after
+
+    def try_reserve(self) -> bool:
+        """原子地预留一个名额；队列已满或深度数据过期时返回False"""
+        with self.lock:
+            if not self.fresh:
+                return False
+            if self._depth() + self.reserved >= self.max_depth:
+                self.rejected += 1
+                return False
+            self.reserved += 1
+            return True
+
+    def commit(self, task_id: str):
+        """预留的名额提交成功，转为进行中的任务"""
+        with self.lock:
+            self.reserved -= 1
+            self.admitted += 1
+            self.in_flight[task_id] = time.monotonic()
+
+    def release(self):
+        """提交失败，归还预留的名额"""
+        with self.lock:
+            self.reserved -= 1
+
+    def submit_failed(self):
+        """向节点提交任务失败（如连接被拒绝）：与刷新失败一样计入连续失败次数，下次刷新成功前节点视为不健康"""
+        self.failures += 1
+
+    def task_finished(self, task_id: str):
+        """任务结束（由事件跟踪回调）"""
+        with self.lock:
+            self.upstream_ids.discard(task_id)
+            self.in_flight.pop(task_id, None)
+
+    # ---------- 刷新 ----------
+    def refresh(self):
+        """同步刷新一次 /queue 快照"""
+        requested_at = time.monotonic()
+        queue = self.client.get_queue()
+        ids = set(queue_prompt_ids(queue.get("queue_running")))
+        ids.update(queue_prompt_ids(queue.get("queue_pending")))
+        with self.lock:
+            self.upstream_ids = ids
+            # 快照请求前提交却不在快照中的任务已经结束
+            self.in_flight = {task_id: submitted_at for task_id, submitted_at in self.in_flight.items()
+                              if task_id in ids or submitted_at > requested_at}
+            self.refreshed_at = time.monotonic()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.refresh()
+                self.failures = 0
+            except Exception as e:
+                self.failures += 1
+                logger.warning(f"队列状态刷新失败 ({self.client.base_url}): {str(e)}")
+            self._stop_event.wait(self.refresh_interval)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="queue-depth", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "depth": self._depth(),
+                "max_depth": self.max_depth,
+                "reserved": self.reserved,
+                "in_flight": len(self.in_flight),
+                "upstream": len(self.upstream_ids),
+                "refreshed_seconds_ago": round(time.monotonic() - self.refreshed_at, 2)
+                if self.refreshed_at is not None else None,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+            }
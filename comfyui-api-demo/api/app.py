@@ -1,280 +1,539 @@
-from flask import Flask, request, jsonify, send_from_directory
-import os
-import json
-import base64
-import requests
-import random
-import time
-import uuid
-import logging
-from datetime import datetime
-
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
-
-app = Flask(__name__)
-
-# 任务存储（在生产环境中应使用数据库）
-tasks = {}
-
-# ComfyUI API端点
-COMFY_API_HOST = os.environ.get("COMFY_API_HOST", "http://127.0.0.1:8188")
-
-@app.route('/')
-def index():
-    # 在生产环境中，这里应重定向到static目录下的index.html
-    return send_from_directory('../public', 'index.html')
-
-@app.route('/static/<path:path>')
-def serve_static(path):
-    return send_from_directory('../public/static', path)
-
-@app.route('/api/ping', methods=['GET'])
-def ping():
-    return jsonify({"status": "ok", "message": "API is running"}), 200
-
-@app.route('/generate', methods=['POST'])
-def generate_handler():
-    try:
-        # 获取请求数据
-        data = request.json
-        if not data:
-            return jsonify({"error": "没有提供数据"}), 400
-
-        # 必填字段
-        required_fields = ["prompt", "width", "height"]
-        for field in required_fields:
-            if field not in data:
-                return jsonify({"error": f"缺少'{field}'字段"}), 400
-
-        # 提取参数
-        prompt = data["prompt"]
-        width = int(data["width"])
-        height = int(data["height"])
-        
-        # 可选参数，设置默认值
-        seed = data.get("seed", random.randint(0, 2**32 - 1))
-        steps = int(data.get("steps", 30))
-        guidance = float(data.get("guidance", 7.0))
-        max_shift = float(data.get("max_shift", 1.0))
-        base_shift = float(data.get("base_shift", 0.5))
-        denoise = float(data.get("denoise", 1.0))
-        batch_count = int(data.get("batch_count", 1))
-
-        # 验证参数
-        if not (128 <= width <= 2048) or not (128 <= height <= 2048):
-            return jsonify({"error": "图像尺寸无效，宽度和高度必须在128到2048之间"}), 400
-
-        # 创建任务ID
-        task_id = str(uuid.uuid4())
-        
-        # 初始化任务状态
-        tasks[task_id] = {
-            "status": "pending",
-            "created_at": datetime.now().isoformat(),
-            "expires_at": time.time() + 3600,  # 1小时后过期
-            "parameters": {
-                "prompt": prompt,
-                "width": width,
-                "height": height,
-                "seed": seed,
-                "steps": steps,
-                "guidance": guidance,
-                "max_shift": max_shift,
-                "base_shift": base_shift,
-                "denoise": denoise
-            },
-            "images": []
-        }
-        
-        # 启动异步任务处理（在生产环境中应使用队列）
-        # 这里模拟异步，实际上是立即处理
-        try:
-            process_image_generation(task_id)
-        except Exception as e:
-            logger.error(f"处理任务时出错: {str(e)}")
-            # 不影响返回，因为这是异步的
-
-        return jsonify({
-            "task_id": task_id,
-            "seed": seed,
-            "status": "pending",
-            "message": "图像生成任务已提交"
-        }), 200
-
-    except Exception as e:
-        logger.error(f"生成处理错误: {str(e)}")
-        return jsonify({"error": f"处理请求时出错: {str(e)}"}), 500
-
-@app.route('/result', methods=['GET'])
-def result_handler():
-    task_id = request.args.get('task_id')
-    
-    if not task_id:
-        return jsonify({"error_message": "未提供任务ID"}), 400
-    
-    if task_id not in tasks:
-        return jsonify({"error_message": "任务不存在或已过期"}), 404
-    
-    task = tasks[task_id]
-    
-    # 检查任务是否过期
-    if time.time() > task.get("expires_at", 0):
-        tasks.pop(task_id, None)  # 删除过期任务
-        return jsonify({"error_message": "任务不存在或已过期"}), 404
-    
-    return jsonify({
-        "status": task["status"],
-        "images": task.get("images", []),
-        "progress": task.get("progress", 0)
-    }), 200
-
-def prepare_workflow(parameters):
-    """准备ComfyUI工作流参数"""
-    
-    # 从参数中提取值
-    prompt = parameters["prompt"]
-    width = parameters["width"]
-    height = parameters["height"]
-    seed = str(parameters["seed"])  # 确保转为字符串
-    steps = parameters["steps"]
-    guidance = parameters["guidance"]
-    max_shift = parameters["max_shift"]
-    base_shift = parameters["base_shift"]
-    denoise = parameters["denoise"]
-    
-    # 这里是示例工作流，实际应从文件加载或使用API查询
-    workflow = {
-        "1": {
-            "inputs": {
-                "text": prompt,
-                "clip": ["14", 0]
-            },
-            "class_type": "CLIPTextEncode"
-        },
-        "2": {
-            "inputs": {
-                "text": "bad, deformed, nsfw",
-                "clip": ["14", 0]
-            },
-            "class_type": "CLIPTextEncode"
-        },
-        "14": {
-            "inputs": {
-                "max_shift": max_shift,
-                "base_shift": base_shift,
-                "seed": ["55", 0],
-                "steps": steps,
-                "cfg": guidance,
-                "sampler_name": "dpmpp_2m",
-                "scheduler": "karras",
-                "model": ["30", 0],
-                "positive": ["1", 0],
-                "negative": ["2", 0],
-                "latent_image": ["3", 0]
-            },
-            "class_type": "FluxSamplerParams+"
-        },
-        "3": {
-            "inputs": {
-                "width": width,
-                "height": height,
-                "batch_size": 1
-            },
-            "class_type": "EmptyLatentImage"
-        },
-        "30": {
-            "inputs": {
-                "ckpt_name": "realisticVisionV51_v51VAE.safetensors"
-            },
-            "class_type": "CheckpointLoaderSimple"
-        },
-        "55": {
-            "inputs": {
-                "seed": int(seed)
-            },
-            "class_type": "Seed"
-        },
-        "57": {
-            "inputs": {
-                "value": ["55", 0]
-            },
-            "class_type": "NumberToText"
-        },
-        "6": {
-            "inputs": {
-                "samples": ["14", 0],
-                "vae": ["30", 2]
-            },
-            "class_type": "VAEDecode"
-        },
-        "7": {
-            "inputs": {
-                "filename_prefix": "ComfyUI",
-                "images": ["6", 0]
-            },
-            "class_type": "SaveImage"
-        }
-    }
-    
-    return workflow
-
-def process_image_generation(task_id):
-    """处理图像生成任务"""
-    
-    if task_id not in tasks:
-        logger.error(f"任务 {task_id} 不存在")
-        return
-    
-    task = tasks[task_id]
-    
-    try:
-        # 准备工作流
-        workflow = prepare_workflow(task["parameters"])
-        
-        # 提交到ComfyUI服务器
-        # 注意: 在Vercel上这个请求无法发送到本地服务器
-        # 这里仅作示例，实际部署需要有公开可访问的ComfyUI服务
-        response = requests.post(
-            f"{COMFY_API_HOST}/api/prompt",
-            json={
-                "prompt": workflow
-            }
-        )
-        
-        if response.status_code != 200:
-            logger.error(f"ComfyUI API请求失败: {response.status_code}, {response.text}")
-            task["status"] = "error"
-            task["error"] = f"API请求失败: {response.status_code}"
-            return
-        
-        result = response.json()
-        
-        # 模拟生成过程（在实际环境中，我们会轮询ComfyUI API获取结果）
-        # 在Vercel上这部分是不可能工作的，因为无法访问本地文件系统
-        # 所以这里只是生成一些示例数据
-        
-        # 模拟进度更新
-        for i in range(5):
-            task["progress"] = (i+1) / 5
-            time.sleep(1)  # 实际环境中不需要这个
-        
-        # 模拟生成的图像（base64编码）
-        # 实际中这些应该从ComfyUI结果中获取
-        sample_image_base64 = "data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAQAAAAEACAIAAADTED8xAAADMElEQVR4nOzVwQnAIBQFQYXff81RUkQCOyDj1YOPnbXWPmeTRef+/3O/OyBjzh3CD95BfqICMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMK0CMO0TAAD//2Anhf4QtqobAAAAAElFTkSuQmCC"
-        
-        # 更新任务状态
-        task["status"] = "completed"
-        task["images"] = [sample_image_base64]
-        
-    except Exception as e:
-        logger.error(f"处理任务 {task_id} 时出错: {str(e)}")
-        task["status"] = "error"
-        task["error"] = str(e)
-
-if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0') 
\ No newline at end of file
+from flask import Flask, Response, request, jsonify, send_from_directory
+import os
+import json
+import base64
+import random
+import secrets
+import time
+import uuid
+import logging
+import sys
+import threading
+from datetime import datetime
+
+# 共享模块位于上级目录（comfy_client 等）
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from comfy_events import queue_prompt_ids, TaskTracker, start_listener, FAILED, FINISHED_STATES
+from workflow_template import CompiledWorkflow
+from task_store import create_task_store
+from job_executor import BoundedExecutor, ExecutorFullError
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+app = Flask(__name__)
+
+# 任务存储：默认使用临时目录下的SQLite数据库，多个worker进程共享；
+# TASK_STORE=memory 使用进程内存储，或 sqlite:///路径 指定数据库文件
+tasks = create_task_store(os.environ.get("TASK_STORE"))
+
+# ComfyUI API端点（多个节点用逗号分隔）
+COMFY_API_HOST = os.environ.get("COMFY_API_HOST", "http://127.0.0.1:8188")
+_comfy_backends = None
+
+def get_comfy_backends():
+    """各节点的ComfyUI客户端，首次提交任务时才创建（导入requests较慢，只查询结果的冷启动不需要）"""
+    global _comfy_backends
+    if _comfy_backends is None:
+        from comfy_client import get_client
+        _comfy_backends = [get_client(host.strip()) for host in COMFY_API_HOST.split(",") if host.strip()]
+    return _comfy_backends
+
+# 后台生成：执行线程数、排队上限（超出时 /generate 返回503）、单个任务的最长等待时间
+GENERATION_WORKERS = int(os.environ.get("GENERATION_WORKERS", 4))
+GENERATION_QUEUE_SIZE = int(os.environ.get("GENERATION_QUEUE_SIZE", 32))
+GENERATION_TIMEOUT = float(os.environ.get("GENERATION_TIMEOUT", 600))
+PROGRESS_POLL_INTERVAL = 1.0  # 事件通道不可用时轮询 /history 的间隔
+SHUTDOWN_DRAIN_TIMEOUT = float(os.environ.get("SHUTDOWN_DRAIN_TIMEOUT", 30))
+# 无人等待任务的回收：客户端超过 ABANDON_AFTER 秒未查询 /result 的任务由执行线程自行取消（0表示不回收）；
+# 心跳最多每 HEARTBEAT_WRITE_INTERVAL 秒写入一次任务存储
+ABANDON_AFTER = float(os.environ.get("ABANDON_AFTER", 180))
+HEARTBEAT_WRITE_INTERVAL = 5.0
+
+generation_executor = BoundedExecutor(GENERATION_WORKERS, GENERATION_QUEUE_SIZE, name="generation")
+
+# ComfyUI 事件（采样进度）：首次向某个节点提交任务时启动该节点的监听线程
+task_tracker = TaskTracker()
+event_listeners = {}
+event_listeners_lock = threading.Lock()
+
+def listener_for(client):
+    """节点的事件监听线程；未安装websocket-client时为None"""
+    with event_listeners_lock:
+        if client.base_url not in event_listeners:
+            event_listeners[client.base_url] = start_listener(client, task_tracker)
+        return event_listeners[client.base_url]
+
+def drain_generation_jobs():
+    """关闭时停止接收新任务，等待执行中的任务结束；未开始的任务标记为失败
+
+    须由服务器的关闭流程显式调用：进程退出时线程池自身的退出钩子会无限等待全部排队任务，
+    之后才轮到 atexit 注册的函数，因此不注册退出钩子。
+    - 直接运行本文件：app.run 返回后调用（见文件末尾）
+    - gunicorn：在配置文件的 worker_exit 钩子中调用，如
+      def worker_exit(server, worker): from app import drain_generation_jobs; drain_generation_jobs()
+    - ASGI 入口（asgi.py）：lifespan 关闭阶段调用其异步版本
+    """
+    generation_executor.drain(
+        SHUTDOWN_DRAIN_TIMEOUT,
+        on_cancel=lambda task_id: finish_task(task_id, status="error", error="服务关闭，任务已取消"))
+
+def pick_backend():
+    """选择队列最短的可用节点（无常驻后台线程的部署环境下，提交前探测一次各节点 /queue）"""
+    comfy_backends = get_comfy_backends()
+    if len(comfy_backends) == 1:
+        return comfy_backends[0]
+    best, best_depth = None, None
+    for client in comfy_backends:
+        try:
+            queue = client.get_queue()
+        except Exception as e:
+            logger.warning(f"ComfyUI节点 {client.base_url} 不可用: {str(e)}")
+            continue
+        depth = len(queue_prompt_ids(queue.get("queue_running"))) + len(queue_prompt_ids(queue.get("queue_pending")))
+        if best_depth is None or depth < best_depth:
+            best, best_depth = client, depth
+    if best is None:
+        raise RuntimeError("没有可用的ComfyUI节点")
+    return best
+
+@app.route('/')
+def index():
+    # 在生产环境中，这里应重定向到static目录下的index.html
+    return send_from_directory('../public', 'index.html')
+
+@app.route('/static/<path:path>')
+def serve_static(path):
+    return send_from_directory('../public/static', path)
+
+@app.route('/api/ping', methods=['GET'])
+def ping():
+    return jsonify({"status": "ok", "message": "API is running"}), 200
+
+class InvalidParameters(ValueError):
+    """请求参数无效（返回400）"""
+
+def create_task(data):
+    """校验生成参数并构造任务记录，返回 (task_id, 任务记录)；参数无效时抛出 InvalidParameters
+
+    Flask 与 ASGI（api/asgi.py）入口共用
+    """
+    if not data:
+        raise InvalidParameters("没有提供数据")
+
+    # 必填字段
+    required_fields = ["prompt", "width", "height"]
+    for field in required_fields:
+        if field not in data:
+            raise InvalidParameters(f"缺少'{field}'字段")
+
+    # 提取参数
+    prompt = data["prompt"]
+    width = int(data["width"])
+    height = int(data["height"])
+    
+    # 可选参数，设置默认值
+    seed = data.get("seed", random.randint(0, 2**32 - 1))
+    steps = int(data.get("steps", 30))
+    guidance = float(data.get("guidance", 7.0))
+    max_shift = float(data.get("max_shift", 1.0))
+    base_shift = float(data.get("base_shift", 0.5))
+    denoise = float(data.get("denoise", 1.0))
+    batch_count = int(data.get("batch_count", 1))
+
+    # 验证参数
+    if not (128 <= width <= 2048) or not (128 <= height <= 2048):
+        raise InvalidParameters("图像尺寸无效，宽度和高度必须在128到2048之间")
+
+    # 创建任务ID
+    task_id = str(uuid.uuid4())
+    
+    # 初始化任务状态（cancel_token 只在 /generate 响应中返回给提交者，/cancel 时校验）
+    return task_id, {
+        "status": "pending",
+        "created_at": datetime.now().isoformat(),
+        "expires_at": time.time() + 3600,  # 1小时后过期
+        "last_seen": time.time(),
+        "cancel_token": secrets.token_urlsafe(16),
+        "parameters": {
+            "prompt": prompt,
+            "width": width,
+            "height": height,
+            "seed": seed,
+            "steps": steps,
+            "guidance": guidance,
+            "max_shift": max_shift,
+            "base_shift": base_shift,
+            "denoise": denoise
+        },
+        "images": []
+    }
+
+def task_result(task):
+    """/result 响应体（Flask 与 ASGI 入口共用）"""
+    return {
+        "status": task["status"],
+        "images": task.get("images", []),
+        "progress": task.get("progress", 0),
+        **({"error": task["error"]} if task.get("error") else {})
+    }
+
+def finish_task(task_id, **fields) -> bool:
+    """写入任务的最终状态：只在任务仍为 pending 时写入（与 /cancel 的取消互斥），已被取消时返回False
+    （Flask 与 ASGI 入口共用）"""
+    if tasks.update_if(task_id, "pending", **fields):
+        return True
+    logger.info(f"任务 {task_id} 已被取消，不再写入{fields.get('status')}状态")
+    return False
+
+def record_heartbeat(task_id, task):
+    """客户端查询了未结束的任务：记录心跳，执行线程据此回收无人等待的任务（Flask 与 ASGI 入口共用）"""
+    if task["status"] == "pending" and time.time() - task.get("last_seen", 0) > HEARTBEAT_WRITE_INTERVAL:
+        tasks.update(task_id, last_seen=time.time())
+
+def result_chunks(task):
+    """按块生成 /result 响应体：内联的图片逐张编码输出，不在内存中拼出整个JSON"""
+    result = task_result(task)
+    images = result.pop("images")
+    yield (json.dumps(result)[:-1] + ', "images": [').encode("utf-8")
+    for i, image in enumerate(images):
+        if i:
+            yield b","
+        yield json.dumps(image).encode("utf-8")
+    yield b"]}"
+
+@app.route('/generate', methods=['POST'])
+def generate_handler():
+    try:
+        # 获取请求数据
+        try:
+            task_id, task = create_task(request.json)
+        except InvalidParameters as e:
+            return jsonify({"error": str(e)}), 400
+        tasks.put(task_id, task)
+        
+        # 提交到后台执行器，请求立即返回；执行器已满时拒绝，客户端稍后重试
+        try:
+            generation_executor.submit(task_id, process_image_generation, task_id)
+        except ExecutorFullError as e:
+            tasks.delete(task_id)
+            logger.warning(f"拒绝任务: {str(e)}")
+            return jsonify({"error": str(e)}), 503, {"Retry-After": "5"}
+
+        return jsonify({
+            "task_id": task_id,
+            "seed": task["parameters"]["seed"],
+            "cancel_token": task["cancel_token"],
+            "status": "pending",
+            "message": "图像生成任务已提交"
+        }), 200
+
+    except Exception as e:
+        logger.error(f"生成处理错误: {str(e)}")
+        return jsonify({"error": f"处理请求时出错: {str(e)}"}), 500
+
+@app.route('/result', methods=['GET'])
+def result_handler():
+    task_id = request.args.get('task_id')
+    
+    if not task_id:
+        return jsonify({"error_message": "未提供任务ID"}), 400
+    
+    # 已过期的任务视为不存在，由任务存储定期清理
+    task = tasks.get(task_id)
+    if task is None:
+        return jsonify({"error_message": "任务不存在或已过期"}), 404
+    record_heartbeat(task_id, task)
+    
+    return Response(result_chunks(task), mimetype="application/json"), 200
+
+@app.route('/cancel', methods=['POST'])
+def cancel_handler():
+    """取消未结束的任务（页面关闭时前端以 sendBeacon 调用），需提供 /generate 返回的 cancel_token"""
+    data = request.get_json(silent=True) or {}
+    task_id = request.args.get('task_id') or data.get('task_id')
+    token = request.args.get('cancel_token') or data.get('cancel_token')
+    if not task_id:
+        return jsonify({"error": "未提供任务ID"}), 400
+    error = cancel_error(tasks.get(task_id), token)
+    if error is not None:
+        return jsonify(error[0]), error[1]
+    never_ran = cancel_generation(task_id, "用户取消")
+    if never_ran is None:
+        return jsonify({"error": "任务已结束", "status": tasks.get(task_id)["status"]}), 409
+    return jsonify({"task_id": task_id, "status": "cancelled", "never_ran": never_ran}), 200
+
+# 示例工作流（实际应从文件加载或使用API查询），带参数槽位的输入在生成时写入
+API_WORKFLOW_TEMPLATE = {
+    "1": {
+        "inputs": {
+            "text": "",
+            "clip": ["14", 0]
+        },
+        "class_type": "CLIPTextEncode"
+    },
+    "2": {
+        "inputs": {
+            "text": "bad, deformed, nsfw",
+            "clip": ["14", 0]
+        },
+        "class_type": "CLIPTextEncode"
+    },
+    "14": {
+        "inputs": {
+            "max_shift": 1.0,
+            "base_shift": 0.5,
+            "seed": ["55", 0],
+            "steps": 30,
+            "cfg": 7.0,
+            "sampler_name": "dpmpp_2m",
+            "scheduler": "karras",
+            "model": ["30", 0],
+            "positive": ["1", 0],
+            "negative": ["2", 0],
+            "latent_image": ["3", 0]
+        },
+        "class_type": "FluxSamplerParams+"
+    },
+    "3": {
+        "inputs": {
+            "width": 512,
+            "height": 512,
+            "batch_size": 1
+        },
+        "class_type": "EmptyLatentImage"
+    },
+    "30": {
+        "inputs": {
+            "ckpt_name": "realisticVisionV51_v51VAE.safetensors"
+        },
+        "class_type": "CheckpointLoaderSimple"
+    },
+    "55": {
+        "inputs": {
+            "seed": 0
+        },
+        "class_type": "Seed"
+    },
+    "57": {
+        "inputs": {
+            "value": ["55", 0]
+        },
+        "class_type": "NumberToText"
+    },
+    "6": {
+        "inputs": {
+            "samples": ["14", 0],
+            "vae": ["30", 2]
+        },
+        "class_type": "VAEDecode"
+    },
+    "7": {
+        "inputs": {
+            "filename_prefix": "ComfyUI",
+            "images": ["6", 0]
+        },
+        "class_type": "SaveImage"
+    }
+}
+
+compiled_workflow = CompiledWorkflow(API_WORKFLOW_TEMPLATE, {
+    "prompt": [("1", "text")],
+    "max_shift": [("14", "max_shift")],
+    "base_shift": [("14", "base_shift")],
+    "steps": [("14", "steps")],
+    "guidance": [("14", "cfg")],
+    "width": [("3", "width")],
+    "height": [("3", "height")],
+    "seed": [("55", "seed")],
+})
+
+def prepare_workflow(parameters):
+    """准备ComfyUI工作流参数（返回结果与模板共享未修改的节点，需视为只读）"""
+    return compiled_workflow.render({
+        "prompt": parameters["prompt"],
+        "max_shift": parameters["max_shift"],
+        "base_shift": parameters["base_shift"],
+        "steps": parameters["steps"],
+        "guidance": parameters["guidance"],
+        "width": parameters["width"],
+        "height": parameters["height"],
+        "seed": int(str(parameters["seed"])),  # 兼容字符串形式的种子
+    })
+
+def report_progress(task_id, state, last_progress):
+    """把ComfyUI上报的采样进度（value/max）写入任务存储，返回写入的进度"""
+    progress = state.get("progress") if state else None
+    if not progress or not progress.get("max"):
+        return last_progress
+    value = round(min(progress["value"] / progress["max"], 0.99), 2)  # 取回图片前不报告100%
+    if value != last_progress:
+        tasks.update(task_id, progress=value)
+    return value
+
+def wait_for_history(comfy, task_id):
+    """等待任务结束并返回 /history 记录
+
+    事件通道在线时由websocket事件唤醒并上报真实进度；否则按固定间隔轮询 /history。
+    """
+    listener = listener_for(comfy)
+    deadline = time.time() + GENERATION_TIMEOUT
+    version, epoch, last_progress = 0, 0, None
+    while time.time() < deadline:
+        check_cancelled(task_id)
+        if listener is not None and listener.connected:
+            state, epoch = task_tracker.wait_for_change(task_id, version, epoch, PROGRESS_POLL_INTERVAL)
+            if state is not None:
+                version = state["version"]
+                last_progress = report_progress(task_id, state, last_progress)
+                if state["status"] == FAILED:
+                    check_cancelled(task_id)  # 取消时中断了ComfyUI中的任务（由其他进程取消）
+                    raise RuntimeError(state["error"] or "ComfyUI执行失败")
+            if state is None or state["status"] not in FINISHED_STATES:
+                continue
+        else:
+            time.sleep(PROGRESS_POLL_INTERVAL)
+        history = comfy.get_history(task_id).get(task_id)
+        if history is not None:
+            if (history.get("status") or {}).get("status_str") == "error":
+                check_cancelled(task_id)
+                raise RuntimeError("ComfyUI执行失败")
+            return history
+    raise TimeoutError(f"生成超时（{GENERATION_TIMEOUT:.0f}秒）")
+
+def output_images(history):
+    """/history 记录中的输出图片，返回 /view 的查询参数列表"""
+    return [{
+        "filename": image["filename"],
+        "subfolder": image.get("subfolder", ""),
+        "type": image.get("type", "output"),
+    } for output in (history.get("outputs") or {}).values() for image in output.get("images", [])]
+
+def data_uri(content, content_type):
+    mime = (content_type or "image/png").split(";")[0]
+    return f"data:{mime};base64,{base64.b64encode(content).decode('ascii')}"
+
+def fetch_images(comfy, history):
+    """通过 /view 取回输出图片，返回 data URI 列表"""
+    images = []
+    for params in output_images(history):
+        response = comfy.request("GET", "/view", params=params)
+        response.raise_for_status()
+        images.append(data_uri(response.content, response.headers.get("Content-Type")))
+    return images
+
+class TaskCancelled(Exception):
+    """任务已被取消（执行线程停止等待，不再写入结果）"""
+
+def cancel_error(task, token):
+    """/cancel 的校验（Flask 与 ASGI 入口共用），返回 (响应体, 状态码)；可以取消时返回None"""
+    if task is None:
+        return {"error": "任务不存在或已过期"}, 404
+    if not token or not secrets.compare_digest(str(token), task.get("cancel_token", "")):
+        return {"error": "取消令牌无效"}, 403
+    if task["status"] != "pending":
+        return {"error": "任务已结束", "status": task["status"]}, 409
+    return None
+
+def cancel_generation(task_id, reason):
+    """把任务标记为已取消并唤醒本进程中等待它的执行线程，返回任务是否尚未开始执行；
+    任务恰好已结束（执行线程已写入结果）时不取消，返回None
+
+    尚未开始的任务直接从执行器移除；已开始的由执行线程在下一次检查任务状态时（其他进程中最多
+    PROGRESS_POLL_INTERVAL 秒后）从ComfyUI队列删除或中断，见 cancel_in_comfyui
+    """
+    if not tasks.update_if(task_id, "pending", status="cancelled", error=reason):
+        return None
+    task_tracker.mark_cancelled(task_id, reason)
+    never_ran = generation_executor.cancel(task_id)
+    logger.info(f"任务 {task_id} 已取消 | 原因: {reason} | 取消时: {'排队中' if never_ran else '执行中'}")
+    return never_ran
+
+def cancel_in_comfyui(comfy, task_id):
+    """从ComfyUI删除排队中的任务或中断执行中的任务，返回取消时任务所在位置（不在队列中时为None）"""
+    try:
+        queue = comfy.get_queue()
+        if task_id in queue_prompt_ids(queue.get("queue_pending")):
+            comfy.delete_queued([task_id])
+            queue = comfy.get_queue()  # 删除前恰好开始执行时不会被删除，改为中断
+            if task_id not in queue_prompt_ids(queue.get("queue_running")):
+                return "queued"
+        if task_id in queue_prompt_ids(queue.get("queue_running")):
+            comfy.interrupt(task_id)
+            return "running"
+    except Exception as e:
+        logger.error(f"从ComfyUI取消任务 {task_id} 失败: {str(e)}")
+    return None
+
+def check_cancelled(task_id):
+    """任务已被取消时抛出 TaskCancelled；客户端超过 ABANDON_AFTER 秒未查询时取消任务"""
+    task = tasks.get(task_id)
+    if task is None or task["status"] == "cancelled":
+        raise TaskCancelled(task_id)
+    if ABANDON_AFTER and time.time() - task.get("last_seen", time.time()) > ABANDON_AFTER:
+        cancel_generation(task_id, f"客户端超过{ABANDON_AFTER:g}秒未查询，任务已回收")
+        raise TaskCancelled(task_id)
+
+def process_image_generation(task_id):
+    """处理图像生成任务（在后台执行器中运行）"""
+    task = tasks.get(task_id)
+    if task is None:
+        logger.error(f"任务 {task_id} 不存在")
+        return
+
+    comfy = None
+    try:
+        # 排队期间被取消或客户端已离开的任务不再提交
+        check_cancelled(task_id)
+
+        # 准备工作流
+        workflow = prepare_workflow(task["parameters"])
+
+        # 提交到ComfyUI服务器（以task_id作为prompt_id，事件可直接对应到任务）
+        # 注意: 在Vercel上这个请求无法发送到本地服务器，实际部署需要有公开可访问的ComfyUI服务
+        comfy = pick_backend()
+        tasks.update(task_id, backend=comfy.base_url)  # 记录任务所在节点，后续查询发往该节点
+        task_tracker.mark_submitted(task_id)
+        response = comfy.request(
+            "POST",
+            "/api/prompt",
+            json={
+                "prompt": workflow,
+                "client_id": comfy.client_id,
+                "prompt_id": task_id
+            }
+        )
+
+        if response.status_code != 200:
+            logger.error(f"ComfyUI API请求失败: {response.status_code}, {response.text}")
+            task_tracker.mark_failed(task_id, f"API请求失败: {response.status_code}")
+            finish_task(task_id, status="error", error=f"API请求失败: {response.status_code}")
+            return
+
+        history = wait_for_history(comfy, task_id)
+        images = fetch_images(comfy, history)
+        if not images:
+            raise RuntimeError("ComfyUI未返回图片")
+
+        # 更新任务状态（此前被取消时不覆盖取消状态）
+        finish_task(task_id, status="completed", progress=1.0, images=images)
+
+    except TaskCancelled:
+        task_tracker.mark_cancelled(task_id, "任务已取消")
+        if comfy is not None:
+            where = cancel_in_comfyui(comfy, task_id)
+            logger.info(f"任务 {task_id} 已取消，停止等待 | ComfyUI中: {where or '不在队列中'}")
+    except Exception as e:
+        logger.error(f"处理任务 {task_id} 时出错: {str(e)}")
+        task_tracker.mark_failed(task_id, str(e))
+        finish_task(task_id, status="error", error=str(e))
+
+if __name__ == '__main__':
+    try:
+        app.run(debug=True, host='0.0.0.0')
+    finally:
+        drain_generation_jobs()
\ No newline at end of file
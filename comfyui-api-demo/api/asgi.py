@@ -0,0 +1,280 @@
+# ============== ASGI 入口（api/app.py 的异步模式） ==============
+# 用法: cd api && uvicorn asgi:app --host 0.0.0.0 --port 5000
+# （Flask入口 app:app 与 Vercel 的 index.py 保持不变）
+# 每个生成任务是一个协程而不是执行器线程：等待ComfyUI执行与取回图片时只挂起协程，
+# 已接受的任务数上限为 ASYNC_GENERATION_LIMIT（超出时返回503），其中同时提交给ComfyUI执行的
+# 不超过 GENERATION_WORKERS 个（与Flask入口的执行线程数相同），其余协程挂起等待，不占用线程。
+# 参数校验、任务存储、工作流与进度上报和Flask入口共用；任务存储的读写在线程池中执行。
+import asyncio
+import os
+import sys
+import time
+from contextlib import asynccontextmanager
+
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import FileResponse, JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+from starlette.staticfiles import StaticFiles
+
+API_DIR = os.path.dirname(os.path.abspath(__file__))
+if API_DIR not in sys.path:
+    sys.path.insert(0, API_DIR)
+from app import (COMFY_API_HOST, GENERATION_TIMEOUT, GENERATION_WORKERS, PROGRESS_POLL_INTERVAL, SHUTDOWN_DRAIN_TIMEOUT,  # noqa: E402
+                 InvalidParameters, TaskCancelled, cancel_error, cancel_generation, check_cancelled, create_task,
+                 data_uri, finish_task, logger, output_images, prepare_workflow, record_heartbeat, report_progress,
+                 result_chunks, task_tracker, tasks)
+from comfy_async import AsyncEventListener, close_async_clients, get_async_client  # noqa: E402
+from comfy_events import FAILED, FINISHED_STATES, queue_prompt_ids  # noqa: E402
+
+PUBLIC_DIR = os.path.join(os.path.dirname(API_DIR), "public")
+
+# 已接受的生成任务上限（协程占用很少，默认远大于Flask入口的执行线程数+排队数）
+ASYNC_GENERATION_LIMIT = int(os.environ.get("ASYNC_GENERATION_LIMIT", 1000))
+# 同时提交给ComfyUI的任务数（背压），超出的任务在本地排队
+generation_slots = asyncio.Semaphore(GENERATION_WORKERS)
+
+comfy_backends = [get_async_client(host.strip()) for host in COMFY_API_HOST.split(",") if host.strip()]
+generation_jobs = {}  # task_id -> asyncio.Task
+accepting = True
+event_listeners = {}
+
+
+def listener_for(client):
+    """节点的事件监听协程（首次使用时在当前事件循环中启动）"""
+    if client.base_url not in event_listeners:
+        event_listeners[client.base_url] = AsyncEventListener(client, task_tracker).start()
+    return event_listeners[client.base_url]
+
+
+async def pick_backend():
+    """选择队列最短的可用节点（并发探测各节点 /queue）"""
+    if len(comfy_backends) == 1:
+        return comfy_backends[0]
+    queues = await asyncio.gather(*(client.get_queue() for client in comfy_backends), return_exceptions=True)
+    best, best_depth = None, None
+    for client, queue in zip(comfy_backends, queues):
+        if isinstance(queue, Exception):
+            logger.warning(f"ComfyUI节点 {client.base_url} 不可用: {str(queue)}")
+            continue
+        depth = len(queue_prompt_ids(queue.get("queue_running"))) + len(queue_prompt_ids(queue.get("queue_pending")))
+        if best_depth is None or depth < best_depth:
+            best, best_depth = client, depth
+    if best is None:
+        raise RuntimeError("没有可用的ComfyUI节点")
+    return best
+
+
+async def wait_for_history(comfy, task_id):
+    """wait_for_history 的协程版本：事件通道在线时由事件唤醒，否则按固定间隔轮询 /history"""
+    listener = listener_for(comfy)
+    deadline = time.time() + GENERATION_TIMEOUT
+    version, last_progress = 0, None
+    while time.time() < deadline:
+        await run_in_threadpool(check_cancelled, task_id)
+        if listener.connected:
+            # 只等待本任务的变化，其他任务结束时不唤醒
+            state, _ = await task_tracker.wait_for_change_async(task_id, version, None, PROGRESS_POLL_INTERVAL)
+            if state is not None:
+                version = state["version"]
+                last_progress = await run_in_threadpool(report_progress, task_id, state, last_progress)
+                if state["status"] == FAILED:
+                    await run_in_threadpool(check_cancelled, task_id)
+                    raise RuntimeError(state["error"] or "ComfyUI执行失败")
+            if state is None or state["status"] not in FINISHED_STATES:
+                continue
+        else:
+            await asyncio.sleep(PROGRESS_POLL_INTERVAL)
+        history = (await comfy.get_history(task_id)).get(task_id)
+        if history is not None:
+            if (history.get("status") or {}).get("status_str") == "error":
+                await run_in_threadpool(check_cancelled, task_id)
+                raise RuntimeError("ComfyUI执行失败")
+            return history
+    raise TimeoutError(f"生成超时（{GENERATION_TIMEOUT:.0f}秒）")
+
+
+async def fetch_images(comfy, history):
+    """通过 /view 取回输出图片，返回 data URI 列表"""
+    images = []
+    for params in output_images(history):
+        response = await comfy.request("GET", "/view", params=params)
+        response.raise_for_status()
+        images.append(data_uri(response.content, response.headers.get("Content-Type")))
+    return images
+
+
+async def process_image_generation(task_id, task):
+    """process_image_generation 的协程版本"""
+    comfy = None
+    try:
+        await run_in_threadpool(check_cancelled, task_id)
+        workflow = prepare_workflow(task["parameters"])
+        # 同时提交给ComfyUI的任务已满时在此排队
+        async with generation_slots:
+            await run_in_threadpool(check_cancelled, task_id)  # 排队期间被取消或无人等待
+            comfy = await pick_backend()
+            await run_in_threadpool(tasks.update, task_id, backend=comfy.base_url)
+            task_tracker.mark_submitted(task_id)
+            response = await comfy.request("POST", "/api/prompt", json={
+                "prompt": workflow,
+                "client_id": comfy.client_id,
+                "prompt_id": task_id
+            })
+
+            if response.status_code != 200:
+                logger.error(f"ComfyUI API请求失败: {response.status_code}, {response.text}")
+                task_tracker.mark_failed(task_id, f"API请求失败: {response.status_code}")
+                await run_in_threadpool(finish_task, task_id, status="error",
+                                        error=f"API请求失败: {response.status_code}")
+                return
+
+            history = await wait_for_history(comfy, task_id)
+            images = await fetch_images(comfy, history)
+            if not images:
+                raise RuntimeError("ComfyUI未返回图片")
+        await run_in_threadpool(finish_task, task_id, status="completed", progress=1.0, images=images)
+
+    except TaskCancelled:
+        task_tracker.mark_cancelled(task_id, "任务已取消")
+        if comfy is not None:
+            where = await cancel_in_comfyui(comfy, task_id)
+            logger.info(f"任务 {task_id} 已取消，停止等待 | ComfyUI中: {where or '不在队列中'}")
+    except Exception as e:
+        logger.error(f"处理任务 {task_id} 时出错: {str(e)}")
+        task_tracker.mark_failed(task_id, str(e))
+        await run_in_threadpool(finish_task, task_id, status="error", error=str(e))
+    finally:
+        generation_jobs.pop(task_id, None)
+
+
+async def cancel_in_comfyui(comfy, task_id):
+    """cancel_in_comfyui 的协程版本"""
+    try:
+        queue = await comfy.get_queue()
+        if task_id in queue_prompt_ids(queue.get("queue_pending")):
+            response = await comfy.request("POST", "/queue", json={"delete": [task_id]})
+            response.raise_for_status()
+            queue = await comfy.get_queue()
+            if task_id not in queue_prompt_ids(queue.get("queue_running")):
+                return "queued"
+        if task_id in queue_prompt_ids(queue.get("queue_running")):
+            response = await comfy.request("POST", "/interrupt", json={"prompt_id": task_id})
+            response.raise_for_status()
+            return "running"
+    except Exception as e:
+        logger.error(f"从ComfyUI取消任务 {task_id} 失败: {str(e)}")
+    return None
+
+
+async def drain_generation_jobs():
+    """关闭时停止接收新任务，等待执行中的任务结束；超时未结束的任务取消并标记为失败"""
+    global accepting
+    accepting = False
+    pending = set(generation_jobs.values())
+    if pending:
+        logger.info(f"等待 {len(pending)} 个生成任务结束（最多{SHUTDOWN_DRAIN_TIMEOUT:.0f}秒）")
+        _, pending = await asyncio.wait(pending, timeout=SHUTDOWN_DRAIN_TIMEOUT)
+    cancelled = [task_id for task_id, job in list(generation_jobs.items()) if job in pending]
+    for job in pending:
+        job.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    for task_id in cancelled:
+        await run_in_threadpool(finish_task, task_id, status="error", error="服务关闭，任务已取消")
+
+
+# ============== 路由 ==============
+async def index(request):
+    return FileResponse(os.path.join(PUBLIC_DIR, "index.html"))
+
+
+async def ping(request):
+    return JSONResponse({"status": "ok", "message": "API is running"})
+
+
+async def generate_handler(request):
+    try:
+        try:
+            data = await request.json()
+        except ValueError:
+            data = None
+        try:
+            task_id, task = create_task(data)
+        except InvalidParameters as e:
+            return JSONResponse({"error": str(e)}, status_code=400)
+
+        if not accepting or len(generation_jobs) >= ASYNC_GENERATION_LIMIT:
+            message = "服务正在关闭" if not accepting else f"生成任务已满（{ASYNC_GENERATION_LIMIT}个）"
+            logger.warning(f"拒绝任务: {message}")
+            return JSONResponse({"error": message}, status_code=503, headers={"Retry-After": "5"})
+        await run_in_threadpool(tasks.put, task_id, task)
+        generation_jobs[task_id] = asyncio.get_running_loop().create_task(
+            process_image_generation(task_id, task), name=f"generation-{task_id}")
+
+        return JSONResponse({
+            "task_id": task_id,
+            "seed": task["parameters"]["seed"],
+            "cancel_token": task["cancel_token"],
+            "status": "pending",
+            "message": "图像生成任务已提交"
+        })
+
+    except Exception as e:
+        logger.error(f"生成处理错误: {str(e)}")
+        return JSONResponse({"error": f"处理请求时出错: {str(e)}"}, status_code=500)
+
+
+async def result_handler(request):
+    task_id = request.query_params.get("task_id")
+    if not task_id:
+        return JSONResponse({"error_message": "未提供任务ID"}, status_code=400)
+
+    task = await run_in_threadpool(tasks.get, task_id)
+    if task is None:
+        return JSONResponse({"error_message": "任务不存在或已过期"}, status_code=404)
+    await run_in_threadpool(record_heartbeat, task_id, task)
+    return StreamingResponse(result_chunks(task), media_type="application/json")
+
+
+async def cancel_handler(request):
+    """/cancel 的协程版本：标记为已取消并唤醒等待中的生成协程，由其从ComfyUI删除或中断任务"""
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    data = data if isinstance(data, dict) else {}
+    task_id = request.query_params.get("task_id") or data.get("task_id")
+    token = request.query_params.get("cancel_token") or data.get("cancel_token")
+    if not task_id:
+        return JSONResponse({"error": "未提供任务ID"}, status_code=400)
+    task = await run_in_threadpool(tasks.get, task_id)
+    error = cancel_error(task, token)
+    if error is not None:
+        return JSONResponse(error[0], status_code=error[1])
+    if await run_in_threadpool(cancel_generation, task_id, "用户取消") is None:
+        task = await run_in_threadpool(tasks.get, task_id)
+        return JSONResponse({"error": "任务已结束", "status": task["status"]}, status_code=409)
+    return JSONResponse({"task_id": task_id, "status": "cancelled", "never_ran": not task.get("backend")})
+
+
+@asynccontextmanager
+async def lifespan(_app):
+    logger.info(f"ASGI服务已启动 | 进程: {os.getpid()}")
+    yield
+    await drain_generation_jobs()
+    for listener in list(event_listeners.values()):
+        await listener.stop()
+    await close_async_clients()
+
+
+app = Starlette(
+    routes=[
+        Route("/", index),
+        Route("/api/ping", ping),
+        Route("/generate", generate_handler, methods=["POST"]),
+        Route("/result", result_handler),
+        Route("/cancel", cancel_handler, methods=["POST"]),
+        Mount("/static", app=StaticFiles(directory=os.path.join(PUBLIC_DIR, "static"))),
+    ],
+    lifespan=lifespan,
+)
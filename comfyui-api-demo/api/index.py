@@ -1,101 +1,131 @@
-from http.server import BaseHTTPRequestHandler
-import json
-import os
-from app import app
-from io import BytesIO
-from werkzeug.wrappers import Request
-from werkzeug.wrappers import Response
-
-def handle_request(event, context):
-    """处理Vercel无服务器函数请求"""
-    # 提取请求信息
-    path = event.get('path', '/')
-    http_method = event.get('httpMethod', 'GET')
-    headers = event.get('headers', {})
-    query_params = event.get('queryStringParameters', {}) or {}
-    body = event.get('body', '')
-    
-    # 构建WSGI环境
-    environ = {
-        'wsgi.input': BytesIO(body.encode('utf-8') if isinstance(body, str) else body),
-        'wsgi.errors': BytesIO(),
-        'REQUEST_METHOD': http_method,
-        'PATH_INFO': path,
-        'QUERY_STRING': '&'.join([f"{k}={v}" for k, v in query_params.items()]),
-        'CONTENT_TYPE': headers.get('content-type', ''),
-        'CONTENT_LENGTH': headers.get('content-length', ''),
-        'SERVER_NAME': 'vercel',
-        'SERVER_PORT': '443',
-        'SERVER_PROTOCOL': 'HTTP/1.1',
-        'wsgi.version': (1, 0),
-        'wsgi.url_scheme': 'https',
-        'wsgi.multithread': False,
-        'wsgi.multiprocess': False,
-        'wsgi.run_once': False,
-    }
-    
-    # 添加HTTP头信息
-    for key, value in headers.items():
-        key = key.upper().replace('-', '_')
-        if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
-            environ[f'HTTP_{key}'] = value
-    
-    # 处理响应
-    response_data = {'statusCode': 500, 'body': '', 'headers': {}}
-    
-    def start_response(status, response_headers, exc_info=None):
-        status_code = int(status.split(' ')[0])
-        response_data['statusCode'] = status_code
-        response_data['headers'] = dict(response_headers)
-    
-    # 调用Flask应用
-    response_body = b''.join(app(environ, start_response))
-    response_data['body'] = response_body.decode('utf-8')
-    
-    return response_data
-
-# Vercel函数处理类
-class handler(BaseHTTPRequestHandler):
-    def do_GET(self):
-        self.send_response(200)
-        self.send_header('Content-type', 'text/html')
-        self.end_headers()
-        
-        # 模拟Lambda事件
-        event = {
-            'path': self.path,
-            'httpMethod': 'GET',
-            'headers': dict(self.headers),
-            'queryStringParameters': {},
-            'body': ''
-        }
-        
-        # 处理请求
-        response = handle_request(event, None)
-        
-        # 发送响应
-        self.wfile.write(response['body'].encode('utf-8'))
-        return
-        
-    def do_POST(self):
-        content_length = int(self.headers['Content-Length'])
-        post_data = self.rfile.read(content_length).decode('utf-8')
-        
-        self.send_response(200)
-        self.send_header('Content-type', 'application/json')
-        self.end_headers()
-        
-        # 模拟Lambda事件
-        event = {
-            'path': self.path,
-            'httpMethod': 'POST',
-            'headers': dict(self.headers),
-            'queryStringParameters': {},
-            'body': post_data
-        }
-        
-        # 处理请求
-        response = handle_request(event, None)
-        
-        # 发送响应
-        self.wfile.write(response['body'].encode('utf-8')) 
\ No newline at end of file
+# ============== Vercel 入口 ==============
+# WSGI桥接：把Vercel的请求转交给 app.py 中的Flask应用
+# - handler：逐块写出响应，字节原样透传（图片等二进制内容不做编解码），保留应用返回的状态码与响应头
+# - handle_request：Lambda风格的事件接口，非文本响应以Base64返回（isBase64Encoded）
+# 冷启动只导入Flask应用本身；访问ComfyUI用到的requests、websocket-client在首次提交任务时才导入。
+import base64
+from http.server import BaseHTTPRequestHandler
+from io import BytesIO
+from urllib.parse import unquote, urlencode
+
+from app import app
+
+# 以文本形式返回给Lambda事件接口的响应类型，其余按二进制处理
+TEXT_CONTENT_TYPES = ("text/", "application/json", "application/javascript", "application/xml", "image/svg+xml")
+
+
+def build_environ(method, path, query_string, headers, body_stream, remote_addr=""):
+    """构建WSGI环境；headers 为 (名称, 值) 序列，同名请求头按HTTP规范以逗号合并"""
+    environ = {
+        'wsgi.input': body_stream,
+        'wsgi.errors': BytesIO(),
+        'REQUEST_METHOD': method,
+        'SCRIPT_NAME': '',
+        # PATH_INFO 为解码后的路径（按WSGI约定以latin-1承载原始字节）
+        'PATH_INFO': unquote(path, encoding='latin-1'),
+        'QUERY_STRING': query_string,
+        'CONTENT_TYPE': '',
+        'CONTENT_LENGTH': '',
+        'REMOTE_ADDR': remote_addr,
+        'SERVER_NAME': 'vercel',
+        'SERVER_PORT': '443',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'https',
+        'wsgi.multithread': False,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in headers:
+        key = name.upper().replace('-', '_')
+        if key in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            environ[key] = value
+            continue
+        key = f'HTTP_{key}'
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def run_app(environ, write_head, write_body):
+    """调用Flask应用：首个非空数据块之前（或响应结束时）调用 write_head(状态码, 原因, 响应头)，
+    之后逐块调用 write_body(数据块)"""
+    head = {}
+    sent = False
+
+    def start_response(status, response_headers, exc_info=None):
+        if exc_info and sent:
+            raise exc_info[1].with_traceback(exc_info[2])
+        code, _, reason = status.partition(' ')
+        head['status'] = (int(code), reason)
+        head['headers'] = response_headers
+        return write_body  # WSGI规范的 write() 可调用对象（Flask不使用）
+
+    result = app(environ, start_response)
+    try:
+        for chunk in result:
+            if not chunk:
+                continue
+            if not sent:
+                write_head(*head['status'], head['headers'])
+                sent = True
+            write_body(chunk)
+        if not sent:
+            write_head(*head['status'], head['headers'])
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+
+
+def handle_request(event, context):
+    """处理Lambda风格的事件（整个响应体一次返回）"""
+    query = event.get('multiValueQueryStringParameters') or event.get('queryStringParameters') or {}
+    body = event.get('body') or b''
+    if isinstance(body, str):
+        body = base64.b64decode(body) if event.get('isBase64Encoded') else body.encode('utf-8')
+    headers = dict(event.get('headers') or {})
+    headers.setdefault('content-length', str(len(body)))
+    environ = build_environ(event.get('httpMethod', 'GET'), event.get('path', '/'),
+                            urlencode(query, doseq=True), headers.items(), BytesIO(body))
+
+    response_data = {'statusCode': 500, 'headers': {}, 'multiValueHeaders': {}}
+    chunks = []
+
+    def write_head(status_code, reason, response_headers):
+        response_data['statusCode'] = status_code
+        for name, value in response_headers:
+            response_data['headers'][name] = value
+            response_data['multiValueHeaders'].setdefault(name, []).append(value)
+
+    run_app(environ, write_head, chunks.append)
+    body = b''.join(chunks)
+    chunks.clear()  # 及时释放各数据块，峰值内存只保留拼接后的响应体
+    content_type = response_data['headers'].get('Content-Type', '')
+    if content_type.startswith(TEXT_CONTENT_TYPES):
+        response_data['body'] = body.decode('utf-8')
+        response_data['isBase64Encoded'] = False
+    else:
+        response_data['body'] = base64.b64encode(body).decode('ascii')
+        response_data['isBase64Encoded'] = True
+    return response_data
+
+
+# Vercel函数处理类
+class handler(BaseHTTPRequestHandler):
+    def handle_wsgi(self):
+        path, _, query_string = self.path.partition('?')
+        environ = build_environ(self.command, path, query_string, self.headers.items(), self.rfile,
+                                self.client_address[0] if self.client_address else '')
+
+        def write_head(status_code, reason, response_headers):
+            self.send_response(status_code, reason or None)
+            for name, value in response_headers:
+                self.send_header(name, value)
+            self.end_headers()
+
+        def write_body(chunk):
+            if self.command != 'HEAD':
+                self.wfile.write(chunk)
+
+        run_app(environ, write_head, write_body)
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = do_OPTIONS = do_HEAD = handle_wsgi
@@ -1,17 +1,35 @@
 # ============== 基础依赖 ==============
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, g, request, jsonify, send_file, send_from_directory
 from flask_cors import CORS
 import requests
 import json
-import codecs
 import logging
 import base64
+import hashlib
+import math
+import mimetypes
 import random
+import threading
 import time
+import uuid
 from datetime import datetime
 from pathlib import Path
 import sys
 
+from comfy_events import TaskTracker, queue_prompt_ids, COMPLETED, FAILED, CANCELLED, RUNNING, FINISHED_STATES
+from result_cache import ResultCache
+from workflow_registry import WorkflowRegistry, WorkflowError, WorkflowNotFound, MODEL_FILE_SUFFIXES
+from backend_pool import BackendPool
+from generation_cache import GenerationCache, cache_key, CACHE_TASK_PREFIX
+from scheduler import JobScheduler, SchedulerFullError, PRIORITY_CLASSES, DEFAULT_PRIORITY
+from output_index import OutputIndex
+from log_pipeline import LogPipeline, sampled
+from image_variants import VariantGenerator, VARIANTS
+from metrics import Metrics
+from eta_model import EtaModel, retry_after
+from task_reaper import TaskReaper
+from comfy_client import add_request_observer
+
 # ============== Flask应用初始化 ==============
 app = Flask(__name__, static_url_path='', static_folder='static')
 app.config['JSON_AS_ASCII'] = False
@@ -25,163 +43,460 @@ def index():
 # ============== 全局配置 ==============
 COMFYUI_URL = "http://localhost:8188"
 COMFYUI_OUTPUT_DIR = Path(r"C:\SD\ComfyUI-aki-v1.3\output")
-COMFYUI_MODEL_DIR = Path(r"C:\SD\ComfyUI-aki-v1.3\models")
-WORKFLOW_FILE = "flux文生图.json"
-MAX_QUEUE_SIZE = 5
+COMFYUI_MODEL_DIR = Path(r"C:\SD\ComfyUI-aki-v1.3\models")  # 预热时检查模板引用的模型文件（目录不在本机时跳过）
+WORKFLOW_MANIFEST = "workflows.json"  # 工作流模板清单，请求通过 workflow 参数按名称选择模板
+# ComfyUI节点列表（每台一块GPU）：output_dir 为该节点的输出目录（本机路径或共享挂载），
+# 未配置时使用 COMFYUI_OUTPUT_DIR。例如：
+# {"url": "http://192.168.1.12:8188", "name": "gpu2", "output_dir": r"\\gpu2\ComfyUI\output"}
+COMFYUI_BACKENDS = [
+    {"url": COMFYUI_URL, "name": "local"},
+]
+MAX_QUEUE_SIZE = 5  # 每个节点的ComfyUI队列深度上限
+QUEUE_REFRESH_INTERVAL = 2  # 后台探测各节点队列深度与健康状态的间隔（秒）
+BACKEND_EJECT_AFTER = 60  # 节点持续不可用超过该秒数时，其上未完成的任务标记为失败
+SCHEDULER_MAX_IN_FLIGHT = 2  # 每个节点同时提交的本进程任务数，其余在本地排队
+SCHEDULER_MAX_PENDING = 1000  # 本地调度队列上限，超出时返回503
+CLIENT_WEIGHTS = {}  # 客户端公平排队权重 {client_key: 权重}，默认1
+MODEL_AFFINITY_SKIPS = 8  # 模型亲和调度：每个任务最多被使用已加载模型的任务越过的次数（0为关闭）
+WARMUP_TEMPLATES = []  # 启动时预热的模板名（如 ["sd15", "flux"]），最后一个模板的模型留在显存中
+WARMUP_PARAMS = {"prompt": "warmup", "seed": 0, "steps": 1, "width": 64, "height": 64, "batch_size": 1}
+WARMUP_TIMEOUT = 300  # 等待节点可用后提交预热任务的最长秒数
+ENABLE_WS_EVENTS = True  # 订阅ComfyUI websocket事件，/result 优先从内存应答
+SSE_PREVIEWS = True  # /events 是否推送采样预览帧（需ComfyUI启用 --preview-method）
+SSE_KEEPALIVE_SECONDS = 15
+SSE_MAX_SECONDS = 600
+IMAGE_MAX_AGE = 31536000  # 输出图片内容不会变化，可长期缓存
+RESULT_CACHE_MAX_BYTES = 256 * 1024 * 1024  # 已完成结果缓存的内存上限
+RESULT_CACHE_TTL = 600  # 秒
+RESULT_MAX_WAIT = 30  # /result?wait= 长轮询的最长等待秒数
+POLL_MIN_INTERVAL = 0.5  # 返回给客户端的下次查询间隔提示（Retry-After）的下限（秒）
+POLL_MAX_INTERVAL = 60  # 间隔提示的上限，长时间排队的任务也定期刷新排队位置
+# 超过该秒数没有客户端查询 /result 或连接 /events 的未结束任务自动取消（0为关闭），
+# 需大于 POLL_MAX_INTERVAL + RESULT_MAX_WAIT，正常轮询的客户端不会被误判
+ABANDON_AFTER = 180
+REAPER_INTERVAL = 10  # 检查无人等待任务的间隔（秒）
+# 指定种子的生成结果按参数哈希存储（默认在用户缓存目录，不写入源码目录）
+GENERATION_CACHE_DIR = Path.home() / ".cache" / "comfyui-api-demo" / "generation"
+GENERATION_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024  # 磁盘占用上限，超出时淘汰最久未使用的结果
+OUTPUT_INDEX_POLL_INTERVAL = 5  # 无inotify时（如Windows、网络共享目录）检查输出目录变化的间隔（秒）
+LOG_FILE = "api.log"
+LOG_MAX_BYTES = 10 * 1024 * 1024  # 日志文件超过该大小时轮转
+LOG_BACKUP_COUNT = 5
+LOG_QUEUE_SIZE = 10000  # 后台写入队列上限，写入跟不上时丢弃日志而不阻塞请求
+LOG_SAMPLE_RATE = 5  # 每类高频日志（如每次轮询的查询记录）每秒最多输出的条数
+VARIANT_WORKERS = 2  # 生成缩略图/WebP/AVIF变体的进程数
+VARIANT_WAIT_SECONDS = 3  # 请求的变体尚未生成时最多等待的秒数，超时返回原图
+
+# 图片变体进程池以 spawn 方式启动子进程，直接运行 app.py 时子进程会以 __mp_main__ 重新导入本文件，
+# 此时只需要模块中的定义，不启动日志写入、节点池等后台服务
+SERVICE_PROCESS = __name__ != "__mp_main__"
 
 # ============== 日志系统配置 ==============
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s [%(levelname)s] %(message)s',
-    handlers=[
-        logging.FileHandler("api.log", encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
+# 请求线程只入队，由后台线程写入轮转的日志文件与控制台
+log_pipeline = LogPipeline(LOG_FILE, LOG_MAX_BYTES, LOG_BACKUP_COUNT, LOG_QUEUE_SIZE, LOG_SAMPLE_RATE)
+if SERVICE_PROCESS:
+    log_pipeline.start()
 logger = logging.getLogger("ComfyUI-API")
 
-# ============== 工作流加载与验证 ==============
-def validate_workflow(workflow: dict):
-    """验证工作流关键节点"""
-    required_nodes = {
-        "10": {"type": "UNETLoader", "inputs": ["unet_name"]},
-        "11": {"type": "DualCLIPLoader", "inputs": ["clip_name1", "clip_name2"]},
-        "12": {"type": "VAELoader", "inputs": ["vae_name"]},
-        "14": {
-            "type": "FluxSamplerParams+",
-            "inputs": ["seed", "steps", "guidance", "max_shift", "base_shift", "denoise"]
-        },
-        "15": {"type": "EmptyLatentImage", "inputs": ["width", "height"]},
-        "16": {"type": "VAEDecode", "inputs": ["samples", "vae"]},
-        "17": {"type": "SaveImage", "inputs": ["images"]},
-        "52": {"type": "TeaCache", "inputs": ["model"]},
-        "54": {"type": "CLIPTextEncode", "inputs": ["text", "clip"]},
-        "55": {"type": "Seed", "inputs": ["seed"]},
-        "57": {"type": "Number to Text", "inputs": ["number"]}
+# ============== 运行指标 ==============
+# 各处理阶段的耗时直方图；ComfyUI请求由客户端观察者按端点计入对应阶段
+metrics = Metrics()
+STAGES = ("queue_check", "prompt_submit", "history_fetch", "output_lookup", "file_read", "base64_encode",
+          "json_serialize")
+stage_timers = {stage: metrics.histogram("stage_seconds", "各处理阶段耗时（秒）", stage=stage) for stage in STAGES}
+UPSTREAM_STAGES = {"queue": "queue_check", "prompt": "prompt_submit", "history": "history_fetch"}
+
+def observe_upstream(endpoint: str, seconds: float, failed: bool):
+    stage = UPSTREAM_STAGES.get(endpoint)
+    if stage is not None:
+        stage_timers[stage].observe(seconds)
+    if failed:
+        metrics.counter("upstream_errors", "ComfyUI请求失败次数（连接/读取异常或5xx）", endpoint=endpoint).inc()
+
+add_request_observer(observe_upstream)
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    """记录请求耗时（流式响应只计到开始发送）与503拒绝次数"""
+    start = getattr(g, "request_start", None)
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    if start is not None:
+        metrics.histogram("request_seconds", "HTTP请求处理耗时（秒）", route=route).observe(
+            time.perf_counter() - start)
+    if response.status_code == 503:
+        metrics.counter("rejections", "返回503的请求数", route=route).inc()
+    return response
+
+# ============== 工作流模板 ==============
+# 模板按名称在 workflows.json 中声明，首次使用时加载并编译，文件修改后自动重新加载
+workflow_registry = WorkflowRegistry(Path(__file__).parent / WORKFLOW_MANIFEST)
+
+# ============== 任务事件跟踪 ==============
+task_tracker = TaskTracker()
+result_cache = ResultCache(RESULT_CACHE_MAX_BYTES, RESULT_CACHE_TTL)
+# 指定种子的任务完成后由后台线程存储结果，不依赖之后有客户端读取 /result
+generation_cache = GenerationCache(GENERATION_CACHE_DIR, GENERATION_CACHE_MAX_BYTES,
+                                   resolve_files=lambda task_id: task_output_files(task_id))
+task_tracker.on_finished(generation_cache.task_finished)
+
+# 节点池：每个节点的健康探测、队列深度缓存（准入控制）与事件订阅
+backend_pool = BackendPool(COMFYUI_BACKENDS, task_tracker, MAX_QUEUE_SIZE, QUEUE_REFRESH_INTERVAL,
+                           BACKEND_EJECT_AFTER, ENABLE_WS_EVENTS)
+
+# 本地调度：优先级 + 按客户端加权公平排队，按在途窗口提交给负载最低的节点
+# 同一优先级内优先提交与节点当前模型组合相同的任务，减少切换模型
+scheduler = JobScheduler(backend_pool, task_tracker, SCHEDULER_MAX_IN_FLIGHT,
+                         SCHEDULER_MAX_PENDING, CLIENT_WEIGHTS, MODEL_AFFINITY_SKIPS)
+
+# 任务耗时模型：按模板从已完成任务的执行耗时学习，给出预计完成时间与下次查询时间提示
+eta_model = EtaModel()
+task_tracker.on_timing(eta_model.task_timing)
+task_tracker.on_finished(eta_model.task_finished)
+
+# 无人等待的任务回收：客户端（如已关闭页面）长时间未查询的任务自动取消，释放GPU与队列名额
+task_reaper = TaskReaper(lambda task_id: cancel_task(task_id, "客户端长时间未查询，任务已取消", "abandoned"),
+                         ABANDON_AFTER, REAPER_INTERVAL)
+task_tracker.on_finished(task_reaper.task_finished)
+
+# 输出目录索引：任务ID（filename_prefix）-> 输出文件，每个输出目录一个
+output_indexes = {
+    output_dir: OutputIndex(output_dir, OUTPUT_INDEX_POLL_INTERVAL)
+    for output_dir in {COMFYUI_OUTPUT_DIR, *(b.output_dir for b in backend_pool.backends if b.output_dir)}
+}
+
+# 任务完成后在进程池中为输出图片生成缩略图与WebP/AVIF变体
+variant_generator = VariantGenerator(lambda task_id: task_output_files(task_id), VARIANT_WORKERS)
+task_tracker.on_finished(variant_generator.task_finished)
+
+# 各组件已有的统计在抓取 /metrics 时读取（回调中引用全局变量，组件被替换后仍然有效）
+metrics.collect("cache_hits", "counter", "缓存命中次数", lambda: {
+    "result": result_cache.stats()["hits"],
+    "generation": generation_cache.stats()["hits"],
+    "generation_coalesced": generation_cache.stats()["coalesced"],
+}, label="cache")
+metrics.collect("cache_misses", "counter", "缓存未命中次数", lambda: {
+    "result": result_cache.stats()["misses"],
+    "generation": generation_cache.stats()["misses"],
+}, label="cache")
+metrics.collect("in_flight_tasks", "gauge", "已提交ComfyUI尚未结束的本进程任务数",
+                lambda: scheduler.stats()["in_flight"])
+metrics.collect("local_queue_depth", "gauge", "本地调度队列中等待提交的任务数",
+                lambda: scheduler.stats()["pending"], label="priority")
+metrics.collect("eta_relative_error", "gauge", "预计耗时相对实际耗时的误差（指数平均）",
+                lambda: eta_model.stats()["relative_error"] or 0)
+metrics.collect("backend_queue_depth", "gauge", "各ComfyUI节点队列中的任务数",
+                lambda: {b.name: b.admission.depth() for b in backend_pool.backends}, label="backend")
+metrics.collect("model_swaps", "counter", "各节点相邻提交的任务使用不同模型组合的次数（需重新加载权重）",
+                lambda: {b.name: b.model_swaps for b in backend_pool.backends}, label="backend")
+
+# ============== 模型预热 ==============
+def missing_model_files(template) -> list:
+    """模板引用、但不在 COMFYUI_MODEL_DIR 中的模型文件（目录不在本机时不检查）"""
+    if not COMFYUI_MODEL_DIR.is_dir():
+        return []
+    present = {path.name for path in COMFYUI_MODEL_DIR.rglob("*") if path.suffix.lower() in MODEL_FILE_SUFFIXES}
+    return [name for name in template.model_files() if name.replace("\\", "/").rsplit("/", 1)[-1] not in present]
+
+def warm_up_models(names: list = None):
+    """按模板向每个节点提交一个最小任务（1步、64×64），首个用户请求无需等待加载模型权重
+
+    模型组合相同的模板只预热一次；节点在 WARMUP_TIMEOUT 秒内不可用时跳过
+    """
+    jobs = {}  # 模型组合 -> (模板, 参数)，按最后出现的顺序提交
+    for name in WARMUP_TEMPLATES if names is None else names:
+        try:
+            template = workflow_registry.get(name)
+            params = {k: template.coerce(k, v) for k, v in WARMUP_PARAMS.items() if k in template.params}
+        except (WorkflowError, ValueError) as e:
+            logger.error(f"模板 {name} 跳过预热: {str(e)}")
+            continue
+        missing = missing_model_files(template)
+        if missing:
+            logger.warning(f"模板 {name} 引用的模型文件不在 {COMFYUI_MODEL_DIR} 中: {', '.join(missing)}")
+        model = template.model_key(template.render(params))
+        jobs.pop(model, None)
+        jobs[model] = (template, params)
+
+    remaining = list(backend_pool.backends)
+    deadline = time.time() + WARMUP_TIMEOUT
+    while jobs and remaining and time.time() < deadline:
+        for backend in [b for b in remaining if b.accepting]:
+            remaining.remove(backend)
+            for model, (template, params) in jobs.items():
+                task_id = str(uuid.uuid4())
+                workflow = template.render(dict(params, filename_prefix=task_id))
+                if scheduler.warm_up(backend, workflow, task_id, model):
+                    logger.info(f"[{task_id}] 已提交预热任务 | 模板: {template.name} | 节点: {backend.name}")
+                else:
+                    logger.warning(f"节点 {backend.name} 队列已满，模板 {template.name} 未预热")
+        time.sleep(0.5)
+    for backend in remaining if jobs else []:
+        logger.warning(f"节点 {backend.name} 在{WARMUP_TIMEOUT}秒内不可用，未预热")
+
+if SERVICE_PROCESS:
+    backend_pool.start()
+    scheduler.start()
+    if WARMUP_TEMPLATES:
+        threading.Thread(target=warm_up_models, name="model-warmup", daemon=True).start()
+    if ABANDON_AFTER:
+        task_reaper.start()
+    for index in output_indexes.values():
+        index.start()
+    variant_generator.start()
+    generation_cache.start()
+
+@stage_timers["output_lookup"].time()
+def find_task_outputs(task_id: str) -> list:
+    """按任务ID查找输出目录中的图片文件（索引查询，不扫描目录）"""
+    output_dir = task_output_dir(task_id)
+    index = output_indexes.get(output_dir)
+    if index is None:
+        index = OutputIndex(output_dir)  # 未建立索引的目录只按命名规则探测
+    return index.lookup(task_id)
+
+def tracked_payload(task_id: str, state: dict, inline: bool = False, variant: str = None, wait: float = 0.0):
+    """根据内存中的任务状态构造/result响应体，无法确定结果时返回None
+
+    wait 为客户端长轮询的等待秒数，用于计算下次查询时间提示
+    """
+    if state["status"] in (FAILED, CANCELLED):
+        return {"status": state["status"], "error_message": state["error"]}
+
+    if state["status"] == COMPLETED:
+        if not any("images" in output for output in state["outputs"].values()):
+            return None  # 输出来自缓存节点等情况，交由 /history 补全
+        try:
+            return completed_payload(task_id, {"outputs": state["outputs"]}, inline, variant)
+        except Exception as e:
+            return {
+                "status": "completed",
+                "images": [],
+                "error_message": f"图片处理失败: {str(e)}"
+            }
+
+    # 监听断开期间状态可能过期，此时不信任内存中的排队/运行状态
+    if not backend_pool.listening(task_id):
+        return None
+    return {
+        "status": "pending",
+        "progress": progress_ratio(state),
+        "queue_position": state["position"],
+        **poll_hints(task_id, state, wait)
     }
-    
-    for node_id, config in required_nodes.items():
-        node = workflow.get(node_id)
-        if not node:
-            raise ValueError(f"缺失关键节点 {node_id}")
-        if node["class_type"] != config["type"]:
-            raise ValueError(f"节点 {node_id} 类型错误，应为 {config['type']}")
-        for inp in config["inputs"]:
-            if inp not in node.get("inputs", {}):
-                raise ValueError(f"节点 {node_id} 缺少输入字段 '{inp}'")
-                
-        # 特殊验证Flux采样器参数
-        if node_id == "14" and node["class_type"] == "FluxSamplerParams+":
-            inputs = node.get("inputs", {})
-            # 验证参数类型
-            for param in ["steps", "guidance", "max_shift", "base_shift", "denoise"]:
-                if param in inputs and not isinstance(inputs[param], str):
-                    raise ValueError(f"节点 {node_id} 的 {param} 参数必须是字符串类型")
-            # 验证seed参数是否为节点连接
-            if "seed" in inputs and not isinstance(inputs["seed"], list):
-                raise ValueError(f"节点 {node_id} 的 seed 参数必须是节点连接")
-                    
-    return True
 
-def load_workflow():
-    """加载并验证工作流模板"""
-    try:
-        current_dir = Path(__file__).parent
-        json_path = current_dir / "flux文生图.json"  # 更新工作流文件名
-        
-        logger.info(f"加载工作流文件: {json_path}")
+def poll_hints(task_id: str, state: dict, wait: float = 0.0, ahead: list = None) -> dict:
+    """未完成任务的预计完成时间与下次查询时间提示（毫秒），无法估计时返回空字典
+
+    wait > 0 表示下次查询会被挂起（长轮询，任务结束时立即返回），可以相应提前查询；
+    ahead 为ComfyUI队列中排在前面的任务ID（已查询 /queue 时提供）
+    """
+    parallelism = sum(1 for b in backend_pool.backends if b.accepting)
+    live = None
+    if ahead is None and not backend_pool.listening(task_id):
+        # 没有事件通道时任务结束要等到其结果被查询才会登记，按最近一次 /queue 快照排除已结束的任务
+        live = set(scheduler.pending_ids()).union(*(b.admission.in_flight_ids() for b in backend_pool.backends))
+    eta = eta_model.estimate(task_id, state, parallelism, ahead, live)
+    if eta is None:
+        return {}
+    delay = retry_after(eta, wait, POLL_MIN_INTERVAL, POLL_MAX_INTERVAL)
+    return {"eta_ms": round(eta * 1000), "retry_after_ms": round(delay * 1000)}
+
+def retry_after_header(payload: dict) -> dict:
+    """带有下次查询时间提示的响应体对应的 Retry-After 响应头（整秒，向上取整）"""
+    if "retry_after_ms" not in payload:
+        return {}
+    return {"Retry-After": str(math.ceil(payload["retry_after_ms"] / 1000))}
+
+def progress_ratio(state: dict) -> float:
+    progress = state["progress"]
+    return progress["value"] / progress["max"] if progress and progress["max"] else 0
+
+# ============== 核心功能 ==============
+def find_output_images(task_id: str, comfyui_data: dict) -> list:
+    """从ComfyUI输出中找到图片节点的图片列表"""
+    # 获取最新的输出节点
+    outputs = comfyui_data.get("outputs", {})
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"[{task_id}] ComfyUI数据: {json.dumps(comfyui_data, ensure_ascii=False)}")
+    if not outputs:
+        logger.error(f"[{task_id}] 无输出数据")
+        raise ValueError("无输出数据")
         
-        with codecs.open(json_path, "r", encoding="utf-8-sig") as f:
-            content = '\n'.join([line.split('//')[0].strip() for line in f])
-            workflow = json.loads(content)
+    # 查找包含图片的输出节点
+    output_node = None
+    for node_id, node_data in outputs.items():
+        if "images" in node_data:
+            output_node = node_data
+            break
             
-        validate_workflow(workflow)
-        logger.info("工作流验证通过")
-        return workflow
+    if not output_node:
+        logger.error(f"[{task_id}] 未找到图片输出节点")
+        raise ValueError("未找到图片输出节点")
         
-    except Exception as e:
-        logger.critical(f"工作流加载失败: {str(e)}", exc_info=True)
-        exit(1)
+    images = output_node.get("images", [])
+    if not images:
+        logger.error(f"[{task_id}] 无有效的图片输出数据")
+        raise ValueError("无有效的图片输出数据")
+    
+    status = (comfyui_data.get("status") or {}).get("status_str")
+    logger.debug(f"[{task_id}] 找到 {len(images)} 张图片",
+                 extra={"fields": {"node": node_id, "outputs": len(outputs), "status": status}})
+    return images
 
-workflow_template = load_workflow()
+def task_output_dir(task_id: str) -> Path:
+    """任务所在节点的输出目录（生成缓存命中的任务为缓存目录）"""
+    if task_id.startswith(CACHE_TASK_PREFIX):
+        return generation_cache.entry_dir(task_id[len(CACHE_TASK_PREFIX):])
+    return backend_pool.output_dir_for(task_id) or COMFYUI_OUTPUT_DIR
+
+def cached_generation_outputs(task_id: str):
+    """生成缓存命中任务的输出（与ComfyUI history格式一致），缓存已淘汰时返回None"""
+    files = generation_cache.cached_files(task_id)
+    if not files:
+        return None
+    return {"cache": {"images": [{"filename": f.name, "subfolder": "", "type": "output"} for f in files]}}
+
+@stage_timers["output_lookup"].time()
+def resolve_image_path(task_id: str, img: dict) -> Path:
+    """将ComfyUI图片描述解析为输出目录中的文件路径"""
+    filename = img.get("filename")
+    if not filename:
+        logger.error(f"[{task_id}] 图片文件名无效")
+        raise ValueError("图片文件名无效")
+        
+    output_dir = task_output_dir(task_id).resolve()
+    file_path = (output_dir / img.get("subfolder", "") / filename).resolve()
+    if output_dir not in file_path.parents:
+        raise ValueError(f"图片路径无效: {filename}")
+    logger.debug(f"[{task_id}] 图片文件: {file_path}")
+    
+    if not file_path.exists():
+        logger.error(f"[{task_id}] 图片文件不存在: {filename}")
+        raise ValueError(f"图片文件不存在: {filename}")
+    return file_path
 
-# ============== 核心功能 ==============
 def get_image_data(task_id: str, comfyui_data: dict) -> list:
     """获取图片数据（自动处理Base64填充）"""
     try:
-        logger.info(f"[{task_id}] 开始处理图片数据")
-        logger.info(f"[{task_id}] ComfyUI数据: {json.dumps(comfyui_data, indent=2)}")
-        
-        # 获取最新的输出节点
-        outputs = comfyui_data.get("outputs", {})
-        if not outputs:
-            logger.error(f"[{task_id}] 无输出数据")
-            raise ValueError("无输出数据")
-            
-        # 查找包含图片的输出节点
-        output_node = None
-        for node_id, node_data in outputs.items():
-            if "images" in node_data:
-                output_node = node_data
-                logger.info(f"[{task_id}] 找到图片输出节点: {node_id}")
-                break
-                
-        if not output_node:
-            logger.error(f"[{task_id}] 未找到图片输出节点")
-            raise ValueError("未找到图片输出节点")
-            
-        images = output_node.get("images", [])
-        if not images:
-            logger.error(f"[{task_id}] 无有效的图片输出数据")
-            raise ValueError("无有效的图片输出数据")
-        
-        logger.info(f"[{task_id}] 找到 {len(images)} 张图片")
+        images = find_output_images(task_id, comfyui_data)
         result_images = []
         
         for i, img in enumerate(images):
-            logger.info(f"[{task_id}] 处理第 {i+1} 张图片")
             if "base64" in img:
                 base64_str = img["base64"]
-                logger.info(f"[{task_id}] 从API获取Base64数据")
             else:
-                filename = img.get("filename")
-                if not filename:
-                    logger.error(f"[{task_id}] 图片文件名无效")
-                    raise ValueError("图片文件名无效")
-                    
-                file_path = COMFYUI_OUTPUT_DIR / filename
-                logger.info(f"[{task_id}] 尝试读取文件: {file_path}")
-                
-                if not file_path.exists():
-                    logger.error(f"[{task_id}] 图片文件不存在: {filename}")
-                    raise ValueError(f"图片文件不存在: {filename}")
-                    
-                with open(file_path, "rb") as f:
-                    base64_str = base64.b64encode(f.read()).decode('utf-8')
-                    logger.info(f"[{task_id}] 从文件读取Base64数据成功")
+                file_path = resolve_image_path(task_id, img)
+                with stage_timers["file_read"].time(), open(file_path, "rb") as f:
+                    data = f.read()
+                with stage_timers["base64_encode"].time():
+                    base64_str = base64.b64encode(data).decode('utf-8')
             
             # 处理Base64填充
             padding = 4 - (len(base64_str) % 4)
             if padding != 4:
                 base64_str += "=" * padding
-                logger.info(f"[{task_id}] 添加Base64填充: {padding}个=")
+                logger.debug(f"[{task_id}] 第 {i+1} 张图片添加Base64填充: {padding}个=")
                 
             result_images.append(f"data:image/png;base64,{base64_str}")
-            logger.info(f"[{task_id}] 第 {i+1} 张图片处理完成")
             
-        logger.info(f"[{task_id}] 所有图片处理完成，共 {len(result_images)} 张")
+        logger.debug(f"[{task_id}] 所有图片处理完成，共 {len(result_images)} 张")
         return result_images
         
     except Exception as e:
         logger.error(f"[{task_id}] 图片数据处理失败: {str(e)}", exc_info=True)
         raise
 
-def prepare_workflow(data: dict) -> dict:
-    """准备发送到ComfyUI的工作流数据"""
+def get_image_urls(task_id: str, comfyui_data: dict) -> list:
+    """获取图片URL与元数据（图片本身由 /images/<task_id>/<index>[?variant=] 提供）"""
     try:
-        # 深拷贝工作流模板
-        workflow = json.loads(json.dumps(workflow_template))
+        result_images = []
+        files = []
+        for i, img in enumerate(find_output_images(task_id, comfyui_data)):
+            if "base64" in img:
+                # API直接返回的Base64数据没有对应文件，只能内联
+                result_images.append({"url": f"data:image/png;base64,{img['base64']}", "index": i})
+                files.append(None)
+                continue
+            file_path = resolve_image_path(task_id, img)
+            files.append(file_path)
+            result_images.append({
+                "url": f"/images/{task_id}/{i}",
+                "index": i,
+                "filename": file_path.name,
+                "bytes": file_path.stat().st_size,
+                "content_type": mimetypes.guess_type(file_path.name)[0] or "image/png",
+                "variants": {name: f"/images/{task_id}/{i}?variant={name}" for name in variant_generator.variants}
+            })
+        # 缓存解析出的文件列表，/images 无需再次查询输出
+        result_cache.put(task_id, "files", files, size=sum(len(str(f)) for f in files if f))
+        return result_images
         
+    except Exception as e:
+        logger.error(f"[{task_id}] 图片数据处理失败: {str(e)}", exc_info=True)
+        raise
+
+def completed_payload(task_id: str, comfyui_data: dict, inline: bool = False, variant: str = None) -> dict:
+    """构造已完成任务的响应体：默认返回图片URL（variant指定时为该变体的URL），
+    inline=True时返回Base64 data URI（兼容旧客户端）"""
+    if inline:
+        return {"status": "completed", "images": get_image_data(task_id, comfyui_data)}
+    image_meta = get_image_urls(task_id, comfyui_data)
+    return {
+        "status": "completed",
+        "images": [meta.get("variants", {}).get(variant, meta["url"]) for meta in image_meta],
+        "image_meta": image_meta
+    }
+
+def result_cache_key(inline: bool, variant: str = None) -> str:
+    if inline:
+        return "base64"
+    return f"url:{variant}" if variant else "url"
+
+def encode_payload(task_id: str, payload: dict, inline: bool = False, variant: str = None):
+    """成功完成的结果编码为JSON并写入缓存，返回编码结果；未完成或失败的结果返回None"""
+    if payload.get("status") != "completed" or not payload.get("images") or payload.get("error_message"):
+        return None
+    with stage_timers["json_serialize"].time():
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    result_cache.put(task_id, result_cache_key(inline, variant), body)
+    return body
+
+def payload_response(task_id: str, payload: dict, inline: bool = False, variant: str = None):
+    """返回JSON响应；成功完成的结果编码后写入缓存"""
+    body = encode_payload(task_id, payload, inline, variant)
+    if body is None:
+        response = jsonify(payload)
+        response.headers.update(retry_after_header(payload))
+        return response
+    return Response(body, mimetype="application/json")
+
+def parse_wait_seconds(value) -> float:
+    """解析 wait 参数，限制在 [0, RESULT_MAX_WAIT]"""
+    try:
+        return max(0.0, min(float(value), RESULT_MAX_WAIT)) if value else 0.0
+    except ValueError:
+        return 0.0
+
+def requested_variant(args):
+    """客户端通过 ?variant=thumb|webp|avif 选择图片变体，未指定或为original时返回None"""
+    variant = args.get("variant")
+    if not variant or variant == "original":
+        return None
+    if variant not in VARIANTS:
+        raise ValueError(f"参数variant必须是 original, {', '.join(VARIANTS)} 之一")
+    return variant
+
+def wants_inline_images(args) -> bool:
+    """客户端通过 ?format=base64 选择旧的Base64内联格式"""
+    return args.get("format") == "base64"
+
+def workflow_params(data: dict, template) -> dict:
+    """按模板声明的参数将请求参数规范化为工作流参数（同时作为生成缓存键的输入）"""
+    try:
         # 获取批量生成数量
         batch_count = int(data.get("batch_count", 1))
         if batch_count < 1:
@@ -189,25 +504,18 @@ def prepare_workflow(data: dict) -> dict:
         elif batch_count > MAX_QUEUE_SIZE:
             batch_count = MAX_QUEUE_SIZE
             
-        # 更新工作流参数
-        workflow["54"]["inputs"]["text"] = data["prompt"].strip()
-        
-        # 更新种子相关节点
-        workflow["55"]["inputs"]["seed"] = data.get("seed", random.randint(0, 0xFFFFFFFF))  # 使用传入的种子或生成新的
-        workflow["57"]["inputs"]["number"] = ["55", 1]  # 连接Seed节点到Number to Text节点
-        workflow["14"]["inputs"]["seed"] = ["57", 0]  # 连接Number to Text节点到FluxSamplerParams+节点
-        
-        # 更新其他参数
-        workflow["14"]["inputs"]["steps"] = str(data.get("steps", 30))
-        workflow["14"]["inputs"]["guidance"] = str(data.get("guidance", 3.5))
-        workflow["14"]["inputs"]["max_shift"] = str(data.get("max_shift", 1.15))
-        workflow["14"]["inputs"]["base_shift"] = str(data.get("base_shift", 0.5))
-        workflow["14"]["inputs"]["denoise"] = str(data.get("denoise", 1.0))
-        workflow["15"]["inputs"]["width"] = int(data.get("width", 512))
-        workflow["15"]["inputs"]["height"] = int(data.get("height", 1024))
-        workflow["15"]["inputs"]["batch_size"] = batch_count
-        
-        return workflow
+        params = {}
+        for name, spec in template.params.items():
+            if name == "prompt":
+                params[name] = data["prompt"].strip()
+            elif name == "seed":
+                # 使用传入的种子或生成新的；按模板类型转换，"42" 与 42 对应同一个缓存键
+                params[name] = template.coerce(name, data.get("seed", random.randint(0, 0xFFFFFFFF)))
+            elif name == "batch_size":
+                params[name] = batch_count
+            elif data.get(name, spec.get("default")) is not None:  # 未提供且无默认值时保留模板中的值
+                params[name] = template.coerce(name, data.get(name, spec.get("default")))
+        return params
         
     except (KeyError, ValueError) as e:
         logger.error(f"工作流参数准备失败: {str(e)}")
@@ -216,13 +524,17 @@ def prepare_workflow(data: dict) -> dict:
         logger.error(f"工作流准备失败: {str(e)}", exc_info=True)
         raise
 
+def prepare_workflow(data: dict) -> dict:
+    """准备发送到ComfyUI的工作流数据（返回结果与模板共享未修改的节点，需视为只读）"""
+    template = workflow_registry.get(data.get("workflow"))
+    return template.render(workflow_params(data, template))
+
 # ============== API路由 ==============
 @app.route("/generate", methods=["POST"])
 def generate_handler():
     """处理生成请求"""
     try:
         logger.info("收到生成请求")
-        start_time = datetime.now()
 
         # ==== 请求验证 ====
         if request.headers.get("Content-Type", "").lower() != "application/json":
@@ -237,54 +549,98 @@ def generate_handler():
             logger.error(f"JSON解析失败: {str(e)}", exc_info=True)
             return jsonify({"error": "无效的JSON格式"}), 400
 
-        if "prompt" not in data or not str(data["prompt"]).strip():
-            return jsonify({"error": "参数prompt不能为空"}), 400
-
-        # ==== 业务逻辑 ====
-        # 生成随机种子
-        seed = data.get("seed")
-        if seed is None:
-            seed = random.randint(0, 0xFFFFFFFF)
-            
-        workflow = prepare_workflow(data)
-        
-        try:
-            queue = requests.get(f"{COMFYUI_URL}/queue", timeout=5).json()
-            queue_size = len(queue.get("queue_running", [])) + len(queue.get("queue_pending", []))
-            if queue_size >= MAX_QUEUE_SIZE:
-                logger.warning(f"队列已满 ({queue_size}/{MAX_QUEUE_SIZE})")
-                return jsonify({"error": "系统繁忙，请稍后重试"}), 503
-        except Exception as e:
-            logger.error(f"队列状态检查失败: {str(e)}")
-            return jsonify({"error": "服务状态检查失败"}), 503
-
-        try:
-            response = requests.post(
-                f"{COMFYUI_URL}/prompt",
-                json={"prompt": workflow},
-                timeout=30
-            )
-            response.raise_for_status()
-            task_id = response.json().get("prompt_id")
-            
-            if not task_id:
-                raise ValueError("无效的任务ID响应")
-                
-            logger.info(f"[{task_id}] 任务提交成功 | 耗时: {(datetime.now()-start_time).total_seconds():.2f}s")
-            time.sleep(1.5)
-            return jsonify({
-                "task_id": task_id,
-                "seed": seed
-            })
-            
-        except requests.exceptions.RequestException as e:
-            logger.error(f"ComfyUI通信失败: {str(e)}")
-            return jsonify({"error": "AI引擎服务异常"}), 503
+        # 公平排队的客户端标识：优先使用请求头，否则按来源地址
+        client_key = request.headers.get("X-Client-Id") or request.remote_addr or "anonymous"
+        body, status = submit_generation(data, client_key)
+        return jsonify(body), status, retry_after_header(body)
             
     except Exception as e:
         logger.error("请求处理异常", exc_info=True)
         return jsonify({"error": "内部服务器错误"}), 500
 
+def submit_generation(data: dict, client_key: str):
+    """校验参数、查询生成缓存并进入本地调度队列，返回 (响应体, 状态码)（Flask与ASGI入口共用）"""
+    start_time = datetime.now()
+    if "prompt" not in data or not str(data["prompt"]).strip():
+        return {"error": "参数prompt不能为空"}, 400
+
+    priority = data.get("priority", DEFAULT_PRIORITY)
+    if priority not in PRIORITY_CLASSES:
+        return {"error": f"参数priority必须是 {', '.join(PRIORITY_CLASSES)} 之一"}, 400
+
+    # ==== 业务逻辑 ====
+    # 生成随机种子（与提交的工作流使用同一个种子）
+    seed = data.get("seed")
+    cacheable = seed is not None
+    if seed is None:
+        seed = random.randint(0, 0xFFFFFFFF)
+        
+    try:
+        template = workflow_registry.get(data.get("workflow"))
+    except WorkflowNotFound as e:
+        return {"error": str(e)}, 400
+    except WorkflowError as e:
+        logger.error(str(e))
+        return {"error": "工作流模板不可用，请联系管理员"}, 500
+    try:
+        params = workflow_params(dict(data, seed=seed), template)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    seed = params.get("seed", seed)
+    
+    # ==== 生成缓存 ====
+    # 指定种子的请求结果可复现：相同参数直接返回已存储的结果，或合并到执行中的任务
+    task_id = None
+    if cacheable:
+        outcome, task_id = generation_cache.lookup(cache_key(params, template.fingerprint))
+        if outcome == "hit":
+            outputs = cached_generation_outputs(task_id)
+            if outputs is not None:
+                task_tracker.record_history(task_id, {"outputs": outputs})
+                logger.info(f"[{task_id}] 生成缓存命中")
+                return {"task_id": task_id, "seed": seed, "queue_position": 0, "eta_ms": 0, "retry_after_ms": 0,
+                        "cached": True}, 200
+            task_id = None  # 查询后恰好被淘汰，重新生成
+        elif outcome == "coalesced":
+            state = task_tracker.get(task_id)
+            task_reaper.touch(task_id)
+            logger.info(f"[{task_id}] 合并到执行中的相同请求")
+            return {
+                "task_id": task_id,
+                "seed": seed,
+                "queue_position": state["position"] if state else None,
+                **poll_hints(task_id, state),
+                "cancel_token": task_reaper.subscribe(task_id),
+                "coalesced": True
+            }, 200
+    else:
+        generation_cache.record_bypass()
+    
+    # 进入本地调度队列，立即返回任务ID与排队位置；
+    # 由调度线程在ComfyUI有空闲时提交（准入控制在提交时检查ComfyUI队列深度）
+    task_id = task_id or str(uuid.uuid4())
+    workflow = template.render(dict(params, filename_prefix=task_id))
+    predicted = eta_model.track(task_id, template.name, params)  # 先于入队登记，任务可能很快结束
+    try:
+        task_id, position = scheduler.submit(workflow, priority, client_key, task_id, template.model_key(workflow))
+    except SchedulerFullError as e:
+        logger.warning(str(e))
+        eta_model.forget(task_id)
+        if task_id:
+            generation_cache.forget(task_id)
+        return {"error": "系统繁忙，请稍后重试"}, 503
+    task_reaper.track(task_id)
+    cancel_token = task_reaper.subscribe(task_id)
+
+    logger.info(f"[{task_id}] 任务已排队 | 优先级: {priority} | 位置: {position} | 预计耗时: {predicted:.1f}s | 耗时: {(datetime.now()-start_time).total_seconds():.2f}s")
+    return {
+        "task_id": task_id,
+        "seed": seed,
+        "queue_position": position,
+        **poll_hints(task_id, task_tracker.get(task_id)),
+        "cancel_token": cancel_token
+    }, 200
+
 @app.route("/result")
 def result_handler():
     """查询生成结果"""
@@ -294,147 +650,52 @@ def result_handler():
             logger.error("缺少task_id参数")
             return jsonify({"error": "需要提供task_id"}), 400
             
+        task_reaper.touch(task_id)  # 客户端仍在等待
         # 添加请求标识，用于区分不同的请求
         request_id = request.args.get("_t", "unknown")
-        logger.info(f"[{task_id}] 查询结果请求 (请求ID: {request_id})")
+        logger.info(f"[{task_id}] 查询结果请求", extra=sampled("result.request", request_id=request_id))
         start_time = datetime.now()
+        inline = wants_inline_images(request.args)
+        try:
+            variant = requested_variant(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        # 生成缓存命中的任务，结果直接来自缓存目录
+        if task_id.startswith(CACHE_TASK_PREFIX):
+            outputs = cached_generation_outputs(task_id)
+            if outputs is None:
+                return jsonify({"error": "任务不存在或已过期"}), 404
+            payload = completed_payload(task_id, {"outputs": outputs}, inline, variant)
+            return payload_response(task_id, payload, inline, variant)
+        
+        # 长轮询：任务由事件跟踪时，挂起请求直到任务结束或超时（条件变量唤醒，无sleep）
+        wait = parse_wait_seconds(request.args.get("wait"))
+        if wait > 0 and backend_pool.listening(task_id):
+            if task_tracker.get(task_id) is not None:
+                task_tracker.wait_until_finished(task_id, wait)
+        
+        # 已完成的结果直接从缓存返回
+        body = result_cache.get(task_id, result_cache_key(inline, variant))
+        if body is not None:
+            return Response(body, mimetype="application/json")
+        
+        # 优先从事件跟踪的任务状态表应答，无需访问ComfyUI
+        state = task_tracker.get(task_id)
+        if state:
+            payload = tracked_payload(task_id, state, inline, variant, wait)
+            if payload is not None:
+                return payload_response(task_id, payload, inline, variant)
         
         # 清除请求缓存
+        comfy = backend_pool.client_for(task_id)
         headers = {"Cache-Control": "no-cache"}
-        history = requests.get(f"{COMFYUI_URL}/history/{task_id}", headers=headers, timeout=10).json()
-        
-        # 首先检查任务是否在历史记录中
-        if task_id in history:
-            try:
-                logger.info(f"[{task_id}] 找到任务历史记录")
-                images_base64 = get_image_data(task_id, history[task_id])
-                
-                # 确保images_base64是一个非空列表
-                if not images_base64 or not isinstance(images_base64, list):
-                    logger.warning(f"[{task_id}] 图片数据格式异常: {type(images_base64)}")
-                    return jsonify({
-                        "status": "completed",
-                        "images": [],
-                        "error_message": "图片数据格式异常"
-                    })
-                
-                # 记录返回的图片数量
-                logger.info(f"[{task_id}] 结果查询成功，返回{len(images_base64)}张图片 | 总耗时: {(datetime.now()-start_time).total_seconds():.2f}s")
-                return jsonify({
-                    "status": "completed",
-                    "images": images_base64
-                })
-            except Exception as e:
-                logger.error(f"[{task_id}] 图片处理失败: {str(e)}", exc_info=True)
-                return jsonify({
-                    "status": "completed",
-                    "images": [],
-                    "error_message": f"图片处理失败: {str(e)}"
-                })
-        else:
-            # 检查任务是否在队列中
-            queue = requests.get(f"{COMFYUI_URL}/queue").json()
-            
-            def extract_task_ids(queue_section):
-                task_ids = []
-                for task in queue_section:
-                    if isinstance(task, dict):
-                        for key in task:
-                            task_data = task.get(str(key), {})
-                            if isinstance(task_data, dict) and "task_id" in task_data:
-                                task_ids.append(task_data["task_id"])
-                return list(set(task_ids))
-                
-            running_ids = extract_task_ids(queue.get("queue_running", []))
-            pending_ids = extract_task_ids(queue.get("queue_pending", []))
-            
-            if task_id in running_ids:
-                logger.info(f"[{task_id}] 任务运行中")
-                return jsonify({"status": "pending"})
-            elif task_id in pending_ids:
-                logger.info(f"[{task_id}] 任务排队中")
-                return jsonify({"status": "pending"})
-            else:
-                # 任务不在队列中，也不在历史记录中
-                # 尝试检查输出目录中是否有对应任务ID的图片文件
-                try:
-                    # 检查输出目录中是否有最近生成的图片
-                    output_files = list(COMFYUI_OUTPUT_DIR.glob(f"*{task_id}*"))
-                    if output_files:
-                        logger.info(f"[{task_id}] 在输出目录找到相关文件: {len(output_files)}个")
-                        # 构造一个模拟的history数据结构
-                        mock_history = {
-                            "outputs": {
-                                "17": {
-                                    "images": [{"filename": file.name} for file in output_files]
-                                }
-                            }
-                        }
-                        try:
-                            images_base64 = get_image_data(task_id, mock_history)
-                            logger.info(f"[{task_id}] 从输出目录成功读取{len(images_base64)}张图片")
-                            return jsonify({
-                                "status": "completed",
-                                "images": images_base64
-                            })
-                        except Exception as e:
-                            logger.error(f"[{task_id}] 从输出目录读取图片失败: {str(e)}", exc_info=True)
-                    
-                    # 如果任务刚刚完成但尚未写入历史记录，进行多次重试
-                    logger.warning(f"[{task_id}] 任务未找到，开始重试获取历史记录")
-                    # 增加重试次数和等待时间
-                    max_retries = 3
-                    retry_count = 0
-                    retry_history = {}
-                    
-                    while retry_count < max_retries:
-                        retry_count += 1
-                        wait_time = 1.0 * retry_count  # 逐步增加等待时间
-                        logger.info(f"[{task_id}] 重试 {retry_count}/{max_retries}，等待 {wait_time}秒")
-                        time.sleep(wait_time)
-                        
-                        try:
-                            retry_history = requests.get(f"{COMFYUI_URL}/history/{task_id}", timeout=10).json()
-                            if task_id in retry_history:
-                                logger.info(f"[{task_id}] 重试第{retry_count}次成功找到任务历史")
-                                break
-                        except Exception as e:
-                            logger.error(f"[{task_id}] 重试获取历史记录失败: {str(e)}")
-                            # 继续下一次重试
-                    
-                    # 处理重试结果
-                    if task_id in retry_history:
-                        logger.info(f"[{task_id}] 重试成功找到任务历史")
-                        try:
-                            images_base64 = get_image_data(task_id, retry_history[task_id])
-                            if not images_base64 or not isinstance(images_base64, list):
-                                logger.warning(f"[{task_id}] 重试后图片数据格式异常: {type(images_base64)}")
-                                return jsonify({
-                                    "status": "completed",
-                                    "images": [],
-                                    "error_message": "图片数据格式异常"
-                                })
-                                
-                            logger.info(f"[{task_id}] 重试成功，返回{len(images_base64)}张图片")
-                            return jsonify({
-                                "status": "completed",
-                                "images": images_base64
-                            })
-                        except Exception as e:
-                            logger.error(f"[{task_id}] 重试处理图片失败: {str(e)}", exc_info=True)
-                            return jsonify({
-                                "status": "completed",
-                                "images": [],
-                                "error_message": f"图片处理失败: {str(e)}"
-                            })
-                    else:
-                        logger.warning(f"[{task_id}] 多次重试后仍未找到任务")
-                except Exception as e:
-                    logger.error(f"[{task_id}] 额外检查过程出错: {str(e)}", exc_info=True)
-                
-                # 所有尝试都失败，返回任务不存在
-                logger.warning(f"[{task_id}] 任务未找到")
-                return jsonify({"error": "任务不存在或已过期"}), 404
+        history = comfy.get_json(f"/history/{task_id}", headers=headers)
+        queue = comfy.get_queue() if task_id not in history else None
+        payload, status = upstream_result(task_id, history, queue, start_time, inline, variant)
+        if status != 200:
+            return jsonify(payload), status
+        return payload_response(task_id, payload, inline, variant)
                 
     except requests.exceptions.RequestException as e:
         logger.error(f"[{task_id}] 查询失败: {str(e)}")
@@ -443,21 +704,367 @@ def result_handler():
         logger.error(f"[{task_id}] 结果处理异常", exc_info=True)
         return jsonify({"error": "内部服务器错误"}), 500
 
+@app.route("/cancel", methods=["POST"])
+def cancel_handler():
+    """客户端退出等待（也用于页面关闭时前端通过 sendBeacon 通知）
+
+    需提供 /generate 返回的 cancel_token；相同请求合并的任务有多个等待者，
+    只有最后一个等待者退出时才取消任务，此前其他客户端的任务照常执行
+    """
+    data = request.get_json(silent=True) or {}
+    task_id = request.args.get("task_id") or data.get("task_id")
+    token = request.args.get("cancel_token") or data.get("cancel_token")
+    if not task_id:
+        return jsonify({"error": "需要提供task_id"}), 400
+    state = task_tracker.get(task_id)
+    if state is None:
+        return jsonify({"error": "任务不存在或已过期"}), 404
+    if state["status"] in FINISHED_STATES:
+        return jsonify({"error": "任务已结束", "task_id": task_id, "status": state["status"]}), 409
+    remaining = task_reaper.unsubscribe(task_id, token)
+    if remaining is None:
+        return jsonify({"error": "取消令牌无效"}), 403
+    if remaining:
+        logger.info(f"[{task_id}] 客户端退出等待，仍有 {remaining} 个客户端等待，任务继续执行")
+        return jsonify({"task_id": task_id, "status": state["status"], "subscribers": remaining,
+                        "reclaimed_gpu_seconds": 0.0})
+    reclaimed = cancel_task(task_id, "任务已取消")
+    if reclaimed is None:
+        state = task_tracker.get(task_id) or state
+        return jsonify({"error": "任务已结束", "task_id": task_id, "status": state["status"]}), 409
+    return jsonify({"task_id": task_id, "status": CANCELLED, "reclaimed_gpu_seconds": round(reclaimed, 1)})
+
+def cancel_task(task_id: str, reason: str, source: str = "user"):
+    """取消未结束的任务，返回回收的GPU秒数（按预计耗时估算，执行中的任务为剩余耗时）；
+    任务未知或已结束时返回None（Flask与ASGI入口、回收线程共用）
+
+    本地排队的任务直接移除，已提交的从ComfyUI队列删除，正在执行的中断
+    """
+    state = task_tracker.get(task_id)
+    if state is None or state["status"] in FINISHED_STATES:
+        return None
+    # 取消后任务不再由耗时模型跟踪，先计算预计耗时
+    predicted = eta_model.job_seconds(task_id)
+    remaining = eta_model.estimate(task_id, dict(state, status=RUNNING), live={task_id})
+    local = scheduler.cancel(task_id)
+    if not task_tracker.mark_cancelled(task_id, reason):
+        return None  # 恰好结束
+
+    where = "local" if local else None
+    if not local:
+        try:
+            where = backend_pool.cancel(task_id)
+        except requests.exceptions.RequestException as e:
+            logger.error(f"[{task_id}] 从ComfyUI删除任务失败: {str(e)}")
+    reclaimed = remaining if where == RUNNING else predicted if where else 0.0
+    metrics.counter("cancelled_tasks", "取消的任务数", source=source).inc()
+    metrics.counter("reclaimed_gpu_seconds", "取消任务回收的GPU时间（秒，按预计耗时估算）", source=source).inc(reclaimed)
+    logger.info(f"[{task_id}] 任务已取消 | 来源: {source} | 取消时: {where or '不在ComfyUI队列中'} | 回收GPU时间: {reclaimed:.1f}s")
+    return reclaimed
+
+def upstream_result(task_id: str, history: dict, queue: dict, start_time: datetime, inline: bool = False,
+                    variant: str = None):
+    """根据 /history 与 /queue（任务不在历史记录中时才需要）确定结果，返回 (响应体, 状态码)（Flask与ASGI入口共用）"""
+    # 首先检查任务是否在历史记录中
+    if task_id in history:
+        task_tracker.record_history(task_id, history[task_id])
+        try:
+            logger.debug(f"[{task_id}] 找到任务历史记录")
+            payload = completed_payload(task_id, history[task_id], inline, variant)
+            
+            # 确保images是一个非空列表
+            if not payload["images"]:
+                logger.warning(f"[{task_id}] 图片数据格式异常")
+                return {
+                    "status": "completed",
+                    "images": [],
+                    "error_message": "图片数据格式异常"
+                }, 200
+            
+            # 记录返回的图片数量
+            logger.info(f"[{task_id}] 结果查询成功", extra={"fields": {
+                "images": len(payload["images"]),
+                "seconds": round((datetime.now() - start_time).total_seconds(), 3)}})
+            return payload, 200
+        except Exception as e:
+            logger.error(f"[{task_id}] 图片处理失败: {str(e)}", exc_info=True)
+            return {
+                "status": "completed",
+                "images": [],
+                "error_message": f"图片处理失败: {str(e)}"
+            }, 200
+
+    # 检查任务是否在队列中
+    running_ids = queue_prompt_ids(queue.get("queue_running", []))
+    pending_ids = queue_prompt_ids(queue.get("queue_pending", []))
+    
+    if task_id in running_ids:
+        logger.info(f"[{task_id}] 任务运行中", extra=sampled("result.running"))
+        task_tracker.mark_running(task_id)
+        return {"status": "pending", "queue_position": 0, **poll_hints(task_id, task_tracker.get(task_id))}, 200
+    elif task_id in pending_ids:
+        logger.info(f"[{task_id}] 任务排队中", extra=sampled("result.pending"))
+        ahead = running_ids + pending_ids[:pending_ids.index(task_id)]
+        return {"status": "pending", "queue_position": len(ahead),
+                **poll_hints(task_id, task_tracker.get(task_id), ahead=ahead)}, 200
+
+    # 任务不在队列中，也不在历史记录中
+    # 按任务ID（即 filename_prefix）在输出目录索引中查找图片文件
+    try:
+        output_files = find_task_outputs(task_id)
+        if output_files:
+            logger.info(f"[{task_id}] 在输出目录找到相关文件: {len(output_files)}个")
+            # 构造一个模拟的history数据结构
+            mock_history = {
+                "outputs": {
+                    "17": {
+                        "images": [{"filename": file.name} for file in output_files]
+                    }
+                }
+            }
+            try:
+                payload = completed_payload(task_id, mock_history, inline, variant)
+                # 记录到任务状态表，/images 可据此定位文件
+                task_tracker.record_history(task_id, mock_history)
+                logger.info(f"[{task_id}] 从输出目录成功读取{len(payload['images'])}张图片")
+                return payload, 200
+            except Exception as e:
+                logger.error(f"[{task_id}] 从输出目录读取图片失败: {str(e)}", exc_info=True)
+        
+        # 任务刚提交或刚完成、尚未出现在队列与历史记录中：
+        # 不在请求线程中睡眠重试，返回pending由客户端继续查询（可配合 wait 长轮询）
+        if task_tracker.get(task_id) is not None:
+            logger.info(f"[{task_id}] 任务尚未出现在队列或历史记录中", extra=sampled("result.unseen"))
+            return {"status": "pending", **poll_hints(task_id, task_tracker.get(task_id))}, 200
+    except Exception as e:
+        logger.error(f"[{task_id}] 额外检查过程出错: {str(e)}", exc_info=True)
+    
+    # 所有尝试都失败，返回任务不存在
+    logger.warning(f"[{task_id}] 任务未找到")
+    return {"error": "任务不存在或已过期"}, 404
+
+def known_task_outputs(task_id: str):
+    """无需访问ComfyUI即可得到的任务输出（生成缓存或内存状态表），未知时返回None"""
+    if task_id.startswith(CACHE_TASK_PREFIX):
+        return cached_generation_outputs(task_id)
+    state = task_tracker.get(task_id)
+    if state and state["status"] == COMPLETED and any("images" in o for o in state["outputs"].values()):
+        return state["outputs"]
+    return None
+
+def task_outputs(task_id: str):
+    """获取已完成任务的输出：优先内存状态表，否则查询 /history"""
+    outputs = known_task_outputs(task_id)
+    if outputs is not None or task_id.startswith(CACHE_TASK_PREFIX):
+        return outputs
+    history = backend_pool.client_for(task_id).get_history(task_id)
+    if task_id not in history:
+        return None
+    task_tracker.record_history(task_id, history[task_id])
+    return history[task_id].get("outputs")
+
+def task_output_files(task_id: str) -> list:
+    """已完成任务的输出文件路径（用于生成图片变体与存储生成缓存）"""
+    outputs = task_outputs(task_id)
+    if not outputs:
+        return []
+    images = find_output_images(task_id, {"outputs": outputs})
+    return [resolve_image_path(task_id, img) for img in images if "filename" in img]
+
+def cached_image_file(task_id: str, index: int):
+    """/result 已解析出的第index张图片文件（无需再次查询输出），未缓存时返回None"""
+    files = result_cache.get(task_id, "files")
+    if files is not None and index < len(files) and files[index] is not None and files[index].exists():
+        return files[index]
+    return None
+
+def output_image_file(task_id: str, index: int, outputs: dict) -> Path:
+    """任务输出中第index张图片的文件路径，图片不存在时抛出 ValueError"""
+    images = find_output_images(task_id, {"outputs": outputs})
+    if index >= len(images) or "filename" not in images[index]:
+        raise ValueError("图片不存在")
+    return resolve_image_path(task_id, images[index])
+
+def image_etag(file_path: Path, stat) -> str:
+    """输出文件生成后不再修改，以路径+大小+修改时间计算强ETag"""
+    return hashlib.sha1(f"{file_path}:{stat.st_size}:{stat.st_mtime_ns}".encode("utf-8")).hexdigest()
+
+def image_headers(variant: str, served_variant: str) -> dict:
+    # 变体尚未生成时返回的原图不能长期缓存在该URL下
+    if served_variant == (variant or "original"):
+        cache_control = f"public, max-age={IMAGE_MAX_AGE}, immutable"
+    else:
+        cache_control = "no-cache"
+    return {"X-Image-Variant": served_variant, "Cache-Control": cache_control}
+
+@app.route("/images/<task_id>/<int:index>")
+def image_handler(task_id, index):
+    """以文件形式返回任务的第index张图片（支持ETag/Range，长期缓存）
+
+    ?variant=thumb|webp|avif 返回对应变体；变体尚未生成时最多等待 VARIANT_WAIT_SECONDS，仍未完成则返回原图
+    """
+    try:
+        variant = requested_variant(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        file_path = cached_image_file(task_id, index)
+        if file_path is None:
+            outputs = task_outputs(task_id)
+            if not outputs:
+                return jsonify({"error": "任务不存在或尚未完成"}), 404
+            file_path = output_image_file(task_id, index, outputs)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 404
+    except requests.exceptions.RequestException as e:
+        logger.error(f"[{task_id}] 查询失败: {str(e)}")
+        return jsonify({"error": "查询服务不可用"}), 503
+
+    served_variant = "original"
+    if variant:
+        variant_file = variant_generator.get(file_path, variant, VARIANT_WAIT_SECONDS)
+        if variant_file is not None:
+            file_path, served_variant = variant_file, variant
+
+    response = send_file(file_path, conditional=True, etag=image_etag(file_path, file_path.stat()),
+                         max_age=IMAGE_MAX_AGE)
+    response.headers.update(image_headers(variant, served_variant))
+    return response
+
+@app.route("/status")
+def status_handler():
+    """服务内部状态（缓存命中率等），用于容量调优"""
+    return jsonify({
+        "backends": backend_pool.stats(),
+        "scheduler": scheduler.stats(),
+        "result_cache": result_cache.stats(),
+        "generation_cache": generation_cache.stats(),
+        "output_index": [index.stats() for index in output_indexes.values()],
+        "logging": log_pipeline.stats(),
+        "image_variants": variant_generator.stats(),
+        "workflows": workflow_registry.stats(),
+        "reaper": task_reaper.stats()
+    })
+
+@app.route("/metrics")
+def metrics_handler():
+    """各阶段耗时直方图、计数器与队列状态（Prometheus文本格式，?format=json 返回JSON）"""
+    if request.args.get("format") == "json":
+        return jsonify(metrics.to_json())
+    return Response(metrics.render_text(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.route("/workflows")
+def workflows_handler():
+    """可用的工作流模板及其参数默认值（/generate 通过 workflow 参数选择）"""
+    try:
+        return jsonify({"workflows": workflow_registry.describe()})
+    except WorkflowError as e:
+        logger.error(str(e))
+        return jsonify({"error": "工作流模板清单不可用"}), 500
+
+@app.route("/events")
+def events_handler():
+    """以Server-Sent Events推送排队位置、采样进度、预览帧与最终结果"""
+    task_id = request.args.get("task_id")
+    if not task_id:
+        return jsonify({"error": "需要提供task_id"}), 400
+
+    # 未订阅事件或任务不由本进程跟踪时，客户端退回轮询 /result
+    if not backend_pool.events_available or task_tracker.get(task_id) is None:
+        return jsonify({"error": "该任务不支持事件推送"}), 404
+
+    return Response(
+        stream_task_events(task_id),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def stream_task_events(task_id: str):
+    """任务事件流：状态变化时推送，空闲时发送心跳注释"""
+    seen = new_sse_state()
+    epoch = -1
+    deadline = time.monotonic() + SSE_MAX_SECONDS
+
+    while time.monotonic() < deadline:
+        task_reaper.touch(task_id)  # 连接断开后生成器不再继续，心跳随之停止
+        state, epoch = task_tracker.wait_for_change(task_id, seen["version"], epoch, SSE_KEEPALIVE_SECONDS)
+        if state is None:
+            yield sse_event("failed", {"error_message": "任务不存在或已过期"})
+            return
+        if not sse_changed(state, seen):
+            yield ": keep-alive\n\n"
+            continue
+
+        if state["status"] in FINISHED_STATES:
+            payload = tracked_payload(task_id, state)
+            if payload is None:
+                # 输出未经事件推送（缓存节点），从 /history 补全一次
+                history = backend_pool.client_for(task_id).get_history(task_id)
+                if task_id in history:
+                    task_tracker.record_history(task_id, history[task_id])
+                    payload = tracked_payload(task_id, task_tracker.get(task_id))
+            yield sse_final_event(payload)
+            return
+        yield from sse_updates(state, seen)
+
+    # 超过最长连接时间，客户端可重新连接继续接收
+    yield sse_event("timeout", {})
+
+def new_sse_state() -> dict:
+    """事件流已推送的内容（Flask与ASGI入口共用以下函数）"""
+    return {"version": -1, "position": None, "progress": None, "preview": None}
+
+def sse_changed(state: dict, seen: dict) -> bool:
+    """任务状态或排队位置是否有变化（无变化时发送心跳），有变化时记录新版本号"""
+    if state["version"] == seen["version"] and state["position"] == seen["position"]:
+        return False
+    seen["version"] = state["version"]
+    return True
+
+def sse_final_event(payload: dict) -> str:
+    payload = payload or {"status": "completed", "images": [], "error_message": "未找到图片输出"}
+    return sse_event(payload["status"], payload)
+
+def sse_updates(state: dict, seen: dict) -> list:
+    """未结束任务相对上次推送的变化：排队位置、采样进度、预览帧"""
+    events = []
+    if state["position"] != seen["position"]:
+        seen["position"] = state["position"]
+        events.append(sse_event("queue", {"queue_position": seen["position"], "status": state["status"]}))
+    if state["progress"] != seen["progress"]:
+        seen["progress"] = state["progress"]
+        events.append(sse_event("progress", {"progress": progress_ratio(state), **seen["progress"]}))
+    if SSE_PREVIEWS and state["preview"] is not None and state["preview"] is not seen["preview"]:
+        seen["preview"] = state["preview"]
+        image = base64.b64encode(seen["preview"]["data"]).decode("ascii")
+        events.append(sse_event("preview", {"image": f"data:{seen['preview']['mime']};base64,{image}"}))
+    return events
+
 # ============== 服务启动 ==============
 if __name__ == "__main__":
     try:
         logger.info("="*60)
         logger.info("启动服务前检查...")
         
-        # 检查ComfyUI服务
+        # 检查各ComfyUI节点
+        for backend in backend_pool.backends:
+            try:
+                test_res = backend.client.request("GET", "/history")
+                if test_res.status_code != 200:
+                    logger.warning(f"ComfyUI节点 {backend.name} 未运行或无法访问 | 状态码: {test_res.status_code}")
+                    logger.warning("注意：该节点将不接收任务，但Web界面可以正常访问")
+            except Exception as e:
+                logger.warning(f"无法连接到ComfyUI节点 {backend.name}: {str(e)}")
+                logger.warning("注意：该节点将不接收任务，但Web界面可以正常访问")
+            
+        # 检查默认工作流模板（其他模板在首次使用时加载）
         try:
-            test_res = requests.get(f"{COMFYUI_URL}/history", timeout=10)
-            if test_res.status_code != 200:
-                logger.warning(f"ComfyUI服务未运行或无法访问 | 状态码: {test_res.status_code}")
-                logger.warning("注意：图像生成功能将不可用，但Web界面可以正常访问")
-        except Exception as e:
-            logger.warning(f"无法连接到ComfyUI服务: {str(e)}")
-            logger.warning("注意：图像生成功能将不可用，但Web界面可以正常访问")
+            workflow_registry.get()
+        except WorkflowError as e:
+            logger.error(f"{str(e)}，使用该模板的请求将返回错误")
             
         # 确保输出目录存在
         if not COMFYUI_OUTPUT_DIR.exists():
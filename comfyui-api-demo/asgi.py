@@ -0,0 +1,314 @@
+# ============== ASGI 入口（app.py 的异步模式） ==============
+# 用法: uvicorn asgi:app --host 0.0.0.0 --port 5000
+# （Flask入口 app:app 保持不变，仍可用 gunicorn 部署）
+# - /generate、/result、/events、/images 与静态文件由协程处理：长轮询、SSE、等待图片变体与
+#   访问ComfyUI（aiohttp 客户端）时只挂起协程，单个进程可同时保持数千个轮询或事件流
+# - 读文件、Base64编码等短时阻塞的操作放到线程池执行，不阻塞事件循环
+# - 其余路由（/status、/metrics、/workflows 等）交给 Flask 应用（WSGI适配，线程池执行）
+# 任务状态、缓存、调度队列与节点池和Flask入口共用（导入 app.py 时启动）。
+import functools
+import os
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+from pathlib import Path
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+from starlette.staticfiles import StaticFiles
+
+import app as comfy_app
+from app import (FINISHED_STATES, CACHE_TASK_PREFIX, SSE_KEEPALIVE_SECONDS, SSE_MAX_SECONDS,
+                 VARIANT_WAIT_SECONDS, logger, metrics, sampled)
+from comfy_async import ComfyRequestError, close_async_clients, get_async_client
+
+STATIC_DIR = Path(comfy_app.app.static_folder)
+FLASK_WORKERS = 10  # 交给Flask处理的路由使用的线程数
+
+
+def async_client_for(task_id: str):
+    """任务所在节点的异步客户端（与同步客户端地址相同）"""
+    return get_async_client(comfy_app.backend_pool.client_for(task_id).base_url)
+
+
+def json_error(message: str, status: int) -> JSONResponse:
+    return JSONResponse({"error": message}, status_code=status)
+
+
+def encoded_response(task_id: str, payload: dict, inline: bool = False, variant: str = None) -> Response:
+    """payload_response 的ASGI版本：成功完成的结果编码后写入缓存"""
+    body = comfy_app.encode_payload(task_id, payload, inline, variant)
+    if body is None:
+        return JSONResponse(payload, headers=comfy_app.retry_after_header(payload))
+    return Response(body, media_type="application/json")
+
+
+def timed(rule: str, handler):
+    """与Flask入口一样记录请求耗时（流式响应只计到开始发送）与503拒绝次数"""
+    histogram = metrics.histogram("request_seconds", "HTTP请求处理耗时（秒）", route=rule)
+
+    @functools.wraps(handler)
+    async def wrapper(request):
+        start = time.perf_counter()
+        response = await handler(request)
+        histogram.observe(time.perf_counter() - start)
+        if response.status_code == 503:
+            metrics.counter("rejections", "返回503的请求数", route=rule).inc()
+        return response
+    return wrapper
+
+
+# ============== 路由 ==============
+async def index(request):
+    return FileResponse(STATIC_DIR / "index.html")
+
+
+async def generate_handler(request):
+    """处理生成请求（参数校验与排队逻辑与Flask入口共用）"""
+    try:
+        logger.info("收到生成请求")
+        if request.headers.get("content-type", "").lower() != "application/json":
+            return json_error("Content-Type必须为application/json", 400)
+        body = await request.body()
+        if not body:
+            return json_error("请求体不能为空", 400)
+        try:
+            data = await request.json()
+        except ValueError as e:
+            logger.error(f"JSON解析失败: {str(e)}")
+            return json_error("无效的JSON格式", 400)
+
+        client_key = request.headers.get("x-client-id") or (request.client.host if request.client else "anonymous")
+        payload, status = comfy_app.submit_generation(data, client_key)
+        return JSONResponse(payload, status_code=status, headers=comfy_app.retry_after_header(payload))
+    except Exception:
+        logger.error("请求处理异常", exc_info=True)
+        return json_error("内部服务器错误", 500)
+
+
+def cached_task_response(task_id: str, inline: bool, variant: str) -> Response:
+    outputs = comfy_app.cached_generation_outputs(task_id)
+    if outputs is None:
+        return json_error("任务不存在或已过期", 404)
+    payload = comfy_app.completed_payload(task_id, {"outputs": outputs}, inline, variant)
+    return encoded_response(task_id, payload, inline, variant)
+
+
+def tracked_response(task_id: str, state: dict, inline: bool, variant: str):
+    payload = comfy_app.tracked_payload(task_id, state, inline, variant)
+    return None if payload is None else encoded_response(task_id, payload, inline, variant)
+
+
+def upstream_response(task_id: str, history: dict, queue: dict, start_time: datetime, inline: bool,
+                      variant: str) -> Response:
+    payload, status = comfy_app.upstream_result(task_id, history, queue, start_time, inline, variant)
+    if status != 200:
+        return JSONResponse(payload, status_code=status)
+    return encoded_response(task_id, payload, inline, variant)
+
+
+async def result_handler(request):
+    """查询生成结果（长轮询挂起协程；读图片、编码在线程池中执行）"""
+    args = request.query_params
+    task_id = args.get("task_id")
+    if not task_id:
+        logger.error("缺少task_id参数")
+        return json_error("需要提供task_id", 400)
+    try:
+        comfy_app.task_reaper.touch(task_id)  # 客户端仍在等待
+        request_id = args.get("_t", "unknown")
+        logger.info(f"[{task_id}] 查询结果请求", extra=sampled("result.request", request_id=request_id))
+        start_time = datetime.now()
+        inline = comfy_app.wants_inline_images(args)
+        try:
+            variant = comfy_app.requested_variant(args)
+        except ValueError as e:
+            return json_error(str(e), 400)
+
+        # 生成缓存命中的任务，结果直接来自缓存目录
+        if task_id.startswith(CACHE_TASK_PREFIX):
+            return await run_in_threadpool(cached_task_response, task_id, inline, variant)
+
+        # 长轮询：任务由事件跟踪时，挂起协程直到任务结束或超时
+        wait = comfy_app.parse_wait_seconds(args.get("wait"))
+        if wait > 0 and comfy_app.backend_pool.listening(task_id):
+            if comfy_app.task_tracker.get(task_id) is not None:
+                await comfy_app.task_tracker.wait_until_finished_async(task_id, wait)
+
+        # 已完成的结果直接从缓存返回
+        body = comfy_app.result_cache.get(task_id, comfy_app.result_cache_key(inline, variant))
+        if body is not None:
+            return Response(body, media_type="application/json")
+
+        # 优先从事件跟踪的任务状态表应答，无需访问ComfyUI
+        state = comfy_app.task_tracker.get(task_id)
+        if state:
+            if state["status"] not in FINISHED_STATES:
+                payload = comfy_app.tracked_payload(task_id, state, inline, variant, wait)  # 不涉及文件
+                if payload is not None:
+                    return JSONResponse(payload, headers=comfy_app.retry_after_header(payload))
+            else:
+                response = await run_in_threadpool(tracked_response, task_id, state, inline, variant)
+                if response is not None:
+                    return response
+
+        client = async_client_for(task_id)
+        history = await client.get_json(f"/history/{task_id}", headers={"Cache-Control": "no-cache"})
+        queue = await client.get_queue() if task_id not in history else None
+        return await run_in_threadpool(upstream_response, task_id, history, queue, start_time, inline, variant)
+
+    except ComfyRequestError as e:
+        logger.error(f"[{task_id}] 查询失败: {str(e)}")
+        return json_error("查询服务不可用", 503)
+    except Exception:
+        logger.error(f"[{task_id}] 结果处理异常", exc_info=True)
+        return json_error("内部服务器错误", 500)
+
+
+async def upstream_outputs(task_id: str):
+    """从任务所在节点的 /history 获取输出"""
+    history = await async_client_for(task_id).get_history(task_id)
+    if task_id not in history:
+        return None
+    comfy_app.task_tracker.record_history(task_id, history[task_id])
+    return history[task_id].get("outputs")
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or f'"{etag}"' in [tag[2:] if tag.startswith("W/") else tag for tag in tags]
+
+
+async def image_handler(request):
+    """以文件形式返回任务的第index张图片（支持ETag/Range，长期缓存），等待变体时挂起协程"""
+    task_id = request.path_params["task_id"]
+    index = request.path_params["index"]
+    try:
+        variant = comfy_app.requested_variant(request.query_params)
+    except ValueError as e:
+        return json_error(str(e), 400)
+    try:
+        file_path = comfy_app.cached_image_file(task_id, index)
+        if file_path is None:
+            outputs = comfy_app.known_task_outputs(task_id)
+            if outputs is None and not task_id.startswith(CACHE_TASK_PREFIX):
+                outputs = await upstream_outputs(task_id)
+            if not outputs:
+                return json_error("任务不存在或尚未完成", 404)
+            file_path = comfy_app.output_image_file(task_id, index, outputs)
+    except ValueError as e:
+        return json_error(str(e), 404)
+    except ComfyRequestError as e:
+        logger.error(f"[{task_id}] 查询失败: {str(e)}")
+        return json_error("查询服务不可用", 503)
+
+    served_variant = "original"
+    if variant:
+        variant_file = await comfy_app.variant_generator.get_async(file_path, variant, VARIANT_WAIT_SECONDS)
+        if variant_file is not None:
+            file_path, served_variant = variant_file, variant
+
+    stat = file_path.stat()
+    etag = comfy_app.image_etag(file_path, stat)
+    headers = dict(comfy_app.image_headers(variant, served_variant), ETag=f'"{etag}"')
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(file_path, headers=headers, stat_result=stat)
+
+
+async def events_handler(request):
+    """以Server-Sent Events推送排队位置、采样进度、预览帧与最终结果"""
+    task_id = request.query_params.get("task_id")
+    if not task_id:
+        return json_error("需要提供task_id", 400)
+
+    # 未订阅事件或任务不由本进程跟踪时，客户端退回轮询 /result
+    if not comfy_app.backend_pool.events_available or comfy_app.task_tracker.get(task_id) is None:
+        return json_error("该任务不支持事件推送", 404)
+
+    return StreamingResponse(
+        stream_task_events(task_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+async def stream_task_events(task_id: str):
+    """任务事件流（与Flask入口推送相同的事件），等待状态变化时挂起协程"""
+    tracker = comfy_app.task_tracker
+    seen = comfy_app.new_sse_state()
+    epoch = -1
+    deadline = time.monotonic() + SSE_MAX_SECONDS
+
+    while time.monotonic() < deadline:
+        comfy_app.task_reaper.touch(task_id)  # 连接断开后生成器不再继续，心跳随之停止
+        state, epoch = await tracker.wait_for_change_async(task_id, seen["version"], epoch, SSE_KEEPALIVE_SECONDS)
+        if state is None:
+            yield comfy_app.sse_event("failed", {"error_message": "任务不存在或已过期"})
+            return
+        if not comfy_app.sse_changed(state, seen):
+            yield ": keep-alive\n\n"
+            continue
+
+        if state["status"] in FINISHED_STATES:
+            payload = await run_in_threadpool(comfy_app.tracked_payload, task_id, state)
+            if payload is None:
+                # 输出未经事件推送（缓存节点），从 /history 补全一次
+                history = await async_client_for(task_id).get_history(task_id)
+                if task_id in history:
+                    tracker.record_history(task_id, history[task_id])
+                    payload = await run_in_threadpool(comfy_app.tracked_payload, task_id, tracker.get(task_id))
+            yield comfy_app.sse_final_event(payload)
+            return
+        for event in comfy_app.sse_updates(state, seen):
+            yield event
+
+    # 超过最长连接时间，客户端可重新连接继续接收
+    yield comfy_app.sse_event("timeout", {})
+
+
+class StaticOrFlask:
+    """静态目录中存在的文件由 StaticFiles 提供，其余请求交给Flask应用"""
+
+    def __init__(self, directory: Path, wsgi_app):
+        self.directory = directory.resolve()
+        self.static = StaticFiles(directory=self.directory)
+        self.flask = WSGIMiddleware(wsgi_app, workers=FLASK_WORKERS)
+
+    def is_static(self, path: str) -> bool:
+        target = (self.directory / path.lstrip("/")).resolve()
+        return self.directory in target.parents and target.is_file()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and self.is_static(scope["path"]):
+            await self.static(scope, receive, send)
+        else:
+            await self.flask(scope, receive, send)
+
+
+@asynccontextmanager
+async def lifespan(_app):
+    logger.info(f"ASGI服务已启动 | 进程: {os.getpid()}")
+    yield
+    await close_async_clients()
+
+
+app = Starlette(
+    routes=[
+        Route("/", index),
+        Route("/generate", timed("/generate", generate_handler), methods=["POST"]),
+        Route("/result", timed("/result", result_handler)),
+        Route("/images/{task_id}/{index:int}", timed("/images/<task_id>/<int:index>", image_handler)),
+        Route("/events", timed("/events", events_handler)),
+        Mount("/", app=StaticOrFlask(STATIC_DIR, comfy_app.app)),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["GET", "POST"])],
+    lifespan=lifespan,
+)
@@ -0,0 +1,231 @@
+# ============== ComfyUI 节点池 ==============
+# 多台ComfyUI（多块GPU）组成的节点池：
+# - 每个节点一个准入控制器，后台定期请求 /queue，既缓存队列深度也作为健康探测
+# - 新任务路由到负载最低的健康节点；已加载所需模型的节点优先（切换模型按多排一个任务计）
+# - 记录 task_id -> 节点，/result、/history、图片查询发往任务所在的节点
+# - 探测或提交失败的节点立即停止接收新任务；持续不可用超过 eject_after 秒时，
+#   其上未完成的任务标记为失败，避免客户端无限等待
+# - 节点可手动排空（drain）：不再接收新任务，已提交的任务正常完成
+# - 取消任务时从所在节点的ComfyUI队列删除，正在执行的中断
+import logging
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from admission import AdmissionController
+from comfy_client import get_client
+from comfy_events import PENDING, RUNNING, queue_prompt_ids, start_listener
+
+logger = logging.getLogger("ComfyUI-API")
+
+
+class Backend:
+    """单个ComfyUI节点"""
+
+    def __init__(self, name: str, url: str, output_dir=None, max_depth: int = 5,
+                 refresh_interval: float = 2.0):
+        self.name = name
+        self.client = get_client(url)
+        # 该节点的输出目录（本机路径或共享挂载），None表示使用默认输出目录
+        self.output_dir = Path(output_dir) if output_dir else None
+        self.admission = AdmissionController(self.client, max_depth, refresh_interval)
+        self.listener = None
+        self.draining = False
+        self.unhealthy_since = None
+        self.ejected = False
+        # 最近提交到该节点的任务使用的模型组合，即执行完已提交任务后显存中的模型
+        self.current_model = None
+        self.model_swaps = 0
+
+    def model_dispatched(self, model) -> bool:
+        """记录提交到该节点的任务使用的模型组合，返回ComfyUI是否需要切换模型"""
+        if model is None:
+            return False
+        swapped = self.current_model is not None and model != self.current_model
+        if swapped:
+            self.model_swaps += 1
+        self.current_model = model
+        return swapped
+
+    @property
+    def healthy(self) -> bool:
+        return self.admission.fresh and self.admission.failures == 0
+
+    @property
+    def accepting(self) -> bool:
+        return self.healthy and not self.draining
+
+    @property
+    def connected(self) -> bool:
+        return self.listener is not None and self.listener.connected
+
+    def stats(self) -> dict:
+        return {
+            "name": self.name,
+            "url": self.client.base_url,
+            "healthy": self.healthy,
+            "draining": self.draining,
+            "events_connected": self.connected,
+            "current_model": self.current_model,
+            "model_swaps": self.model_swaps,
+            **self.admission.stats(),
+        }
+
+
+class BackendPool:
+    """ComfyUI节点池（线程安全）"""
+
+    def __init__(self, backends: list, tracker, max_depth: int = 5, refresh_interval: float = 2.0,
+                 eject_after: float = 60.0, enable_events: bool = True, max_tasks: int = 10000):
+        """backends: [{"url": ..., "name": 可选, "output_dir": 可选}, ...]"""
+        if not backends:
+            raise ValueError("至少需要配置一个ComfyUI节点")
+        self.backends = [
+            Backend(config.get("name") or f"node{i}", config["url"], config.get("output_dir"),
+                    max_depth, refresh_interval)
+            for i, config in enumerate(backends)
+        ]
+        self.tracker = tracker
+        self.refresh_interval = refresh_interval
+        self.eject_after = eject_after
+        self.enable_events = enable_events
+        self.max_tasks = max_tasks
+        self.lock = threading.Lock()
+        self.task_backends = OrderedDict()  # task_id -> Backend
+        self._stop_event = threading.Event()
+
+    @property
+    def default(self) -> Backend:
+        return self.backends[0]
+
+    # ---------- 路由 ----------
+    def backend_for(self, task_id: str) -> Backend:
+        """任务所在的节点；未记录的任务（如重启前提交的）归属默认节点"""
+        with self.lock:
+            return self.task_backends.get(task_id) or self.default
+
+    def client_for(self, task_id: str):
+        return self.backend_for(task_id).client
+
+    def output_dir_for(self, task_id: str):
+        return self.backend_for(task_id).output_dir
+
+    def listening(self, task_id: str) -> bool:
+        """任务所在节点的事件通道是否在线（在线时内存中的任务状态可信）"""
+        return self.backend_for(task_id).connected
+
+    @property
+    def events_available(self) -> bool:
+        """是否订阅了ComfyUI事件（未安装websocket-client时为False）"""
+        return any(b.listener is not None for b in self.backends)
+
+    def has_capacity(self, window: int) -> bool:
+        """是否有可接收任务、且本进程在途任务数未达到窗口的节点"""
+        return any(b.accepting and b.admission.local_load() < window for b in self.backends)
+
+    def reserve(self, window: int, model: str = None):
+        """在负载最低的健康节点上预留一个名额，返回节点；全部不可用或已满时返回None
+
+        model 为下一个任务的模型组合：需要切换模型的节点按负载多1计，负载相近时优先已加载该模型的节点
+        """
+        candidates = [b for b in self.backends if b.accepting and b.admission.local_load() < window]
+        swap_cost = lambda b: 1 if model is not None and b.current_model != model else 0  # noqa: E731
+        for backend in sorted(candidates, key=lambda b: (b.admission.load() + swap_cost(b), swap_cost(b))):
+            if backend.admission.try_reserve():
+                return backend
+        return None
+
+    def assign(self, task_id: str, backend: Backend):
+        """记录任务所在节点（提交前调用，提交后的查询即可路由到该节点）"""
+        with self.lock:
+            self.task_backends[task_id] = backend
+            while len(self.task_backends) > self.max_tasks:
+                self.task_backends.popitem(last=False)
+
+    def commit(self, task_id: str, backend: Backend):
+        backend.admission.commit(task_id)
+
+    def release(self, task_id: str, backend: Backend, failed: bool = False):
+        """提交失败：归还名额并删除路由记录；failed=True 表示节点无法访问，立即停止向其分配任务"""
+        backend.admission.release()
+        if failed:
+            backend.admission.submit_failed()
+            logger.warning(f"节点 {backend.name} 提交失败，暂停分配任务直到下次探测成功")
+        with self.lock:
+            self.task_backends.pop(task_id, None)
+
+    def task_finished(self, task_id: str):
+        with self.lock:
+            backend = self.task_backends.get(task_id)
+        if backend is not None:
+            backend.admission.task_finished(task_id)
+
+    def cancel(self, task_id: str):
+        """从任务所在节点的ComfyUI队列删除任务，正在执行时中断；返回取消前的状态，不在队列中返回None"""
+        client = self.client_for(task_id)
+        queue = client.get_queue()
+        if task_id in queue_prompt_ids(queue.get("queue_pending")):
+            client.delete_queued([task_id])
+            queue = client.get_queue()  # 删除前可能恰好开始执行
+            if task_id not in queue_prompt_ids(queue.get("queue_running")):
+                return PENDING
+        if task_id in queue_prompt_ids(queue.get("queue_running")):
+            client.interrupt(task_id)
+            return RUNNING
+        return None
+
+    def drain(self, name: str, draining: bool = True):
+        """排空节点：不再分配新任务（draining=False恢复）"""
+        for backend in self.backends:
+            if backend.name == name:
+                backend.draining = draining
+                logger.info(f"节点 {name} {'开始排空' if draining else '恢复接收任务'}")
+                return True
+        return False
+
+    # ---------- 健康检查 ----------
+    def _monitor(self):
+        while not self._stop_event.wait(self.refresh_interval):
+            for backend in self.backends:
+                self._check(backend)
+
+    def _check(self, backend: Backend):
+        if backend.healthy:
+            if backend.unhealthy_since is not None:
+                logger.info(f"节点 {backend.name} 已恢复")
+            backend.unhealthy_since = None
+            backend.ejected = False
+            return
+
+        now = time.monotonic()
+        if backend.unhealthy_since is None:
+            backend.unhealthy_since = now
+            logger.warning(f"节点 {backend.name} 不可用，暂停分配任务")
+        elif not backend.ejected and now - backend.unhealthy_since >= self.eject_after:
+            backend.ejected = True
+            task_ids = backend.admission.in_flight_ids()
+            logger.error(f"节点 {backend.name} 持续不可用，摘除并标记 {len(task_ids)} 个未完成任务失败")
+            for task_id in task_ids:
+                self.tracker.mark_failed(task_id, "ComfyUI节点不可用")
+
+    # ---------- 生命周期 ----------
+    def start(self):
+        for backend in self.backends:
+            backend.admission.start()
+            if self.enable_events:
+                backend.listener = start_listener(
+                    backend.client, self.tracker,
+                    lambda task_id, backend=backend: self.backend_for(task_id) is backend)
+        threading.Thread(target=self._monitor, name="backend-monitor", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+        for backend in self.backends:
+            backend.admission.stop()
+            if backend.listener is not None:
+                backend.listener.stop()
+
+    def stats(self) -> list:
+        return [backend.stats() for backend in self.backends]
@@ -0,0 +1,149 @@
+# ============== 模型亲和调度与启动预热测试 ==============
+# 模拟单块GPU（serial）的ComfyUI：任务使用的模型组合（Loader 节点）与上一个任务不同时，
+# 执行时间额外加上加载权重的耗时。flux 与 sd15 两个模板的请求按随机间隔混合到达，形成排队：
+# 1. 调度：对比按公平顺序提交（affinity_skips=0）与模型亲和调度，统计模型切换次数、
+#    总完成时间与每个任务从提交到完成的延迟（均值、p95、最大值，最大值验证没有任务被饿死）
+# 2. 预热：服务重启后首个 flux 请求的执行时间，对比启动时预热与不预热
+# 所有时间按 --scale 缩短（默认20倍）以加快测试，输出中的秒数已换算回实际时长。
+# 用法: python benchmarks/bench_affinity.py [--jobs 40] [--load 10] [--scale 20] [--skips 8]
+import argparse
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.fake_comfyui import FakeComfyUI  # noqa: E402
+
+# (模板, 占比, 执行时间(秒，不含加载模型))
+PROFILES = [("flux", 0.6, 3.0), ("sd15", 0.4, 1.5)]
+
+
+class GpuModel:
+    """按提交顺序（serial 即执行顺序）记录显存中的模型组合，切换时计入加载耗时"""
+
+    def __init__(self, load_seconds: float, scale: float):
+        self.load_seconds = load_seconds
+        self.scale = scale
+        self.lock = threading.Lock()
+        self.loaded = None
+        self.swaps = 0
+
+    def cost(self, prompt: dict) -> float:
+        loaders = tuple(sorted(node["class_type"] for node in prompt.values() if "Loader" in node["class_type"]))
+        template = "flux" if "UNETLoader" in loaders else "sd15"
+        seconds = dict((name, run) for name, _, run in PROFILES)[template]
+        steps = next((node["inputs"].get("steps") for node in prompt.values() if "steps" in node["inputs"]), None)
+        if str(steps) == "1":
+            seconds = 0.2  # 预热任务
+        with self.lock:
+            if loaders != self.loaded:
+                self.swaps += self.loaded is not None
+                self.loaded = loaders
+                seconds += self.load_seconds
+        return seconds / self.scale
+
+
+def start_fake(load: float, scale: float):
+    gpu = GpuModel(load, scale)
+    return FakeComfyUI(serial=True, job_cost=gpu.cost).start(), gpu
+
+
+def wait_done(fake, task_ids: list, timeout: float = 120):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        with fake.lock:
+            if all(pid in fake.jobs and fake._done(fake.jobs[pid]) for pid in task_ids):
+                return
+        time.sleep(0.02)
+    raise RuntimeError("任务未在限定时间内完成")
+
+
+def run_schedule(args, skips: int) -> dict:
+    from benchmarks.bench_longpoll import setup_app
+
+    fake, gpu = start_fake(args.load, args.scale)
+    comfy_app = setup_app(fake)
+    comfy_app.scheduler.max_in_flight = args.window
+    comfy_app.scheduler.affinity_skips = skips
+    picks_before = comfy_app.scheduler.stats()["affinity_picks"]
+
+    rng = random.Random(args.seed)
+    names, weights, runs = zip(*PROFILES)
+    mean_run = sum(w * r for w, r in zip(weights, runs))
+    submitted = {}
+    start = time.time()
+    for _ in range(args.jobs):
+        template = rng.choices(names, weights)[0]
+        body, status = comfy_app.submit_generation({"prompt": "affinity bench", "workflow": template}, "bench")
+        assert status == 200, body
+        submitted[body["task_id"]] = time.time()
+        time.sleep(rng.expovariate(args.utilization / mean_run) / args.scale)
+    wait_done(fake, list(submitted))
+
+    latencies = sorted((fake.jobs[pid] - at) * args.scale for pid, at in submitted.items())
+    result = {
+        "swaps": gpu.swaps,
+        "scheduler_swaps": comfy_app.backend_pool.default.model_swaps,
+        "affinity_picks": comfy_app.scheduler.stats()["affinity_picks"] - picks_before,
+        "makespan_s": round((max(fake.jobs[pid] for pid in submitted) - start) * args.scale, 1),
+        "latency_mean_s": round(statistics.mean(latencies), 1),
+        "latency_p95_s": round(latencies[int(len(latencies) * 0.95) - 1], 1),
+        "latency_max_s": round(latencies[-1], 1),
+    }
+    comfy_app.backend_pool.stop()
+    fake.stop()
+    return result
+
+
+def run_warmup(args, warm: bool) -> float:
+    """重启后首个 flux 请求的执行时间（秒）"""
+    from benchmarks.bench_longpoll import setup_app
+
+    fake, gpu = start_fake(args.load, args.scale)
+    comfy_app = setup_app(fake)
+    if warm:
+        comfy_app.warm_up_models(["sd15", "flux"])
+        wait_done(fake, list(fake.jobs))
+    body, _ = comfy_app.submit_generation({"prompt": "first request", "workflow": "flux"}, "bench")
+    wait_done(fake, [body["task_id"]])
+    seconds = (fake.jobs[body["task_id"]] - fake.started[body["task_id"]]) * args.scale
+    comfy_app.backend_pool.stop()
+    fake.stop()
+    return seconds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=40)
+    parser.add_argument("--load", type=float, default=10.0, help="加载一组模型权重的耗时（秒）")
+    parser.add_argument("--scale", type=float, default=20)
+    parser.add_argument("--skips", type=int, default=8)
+    parser.add_argument("--window", type=int, default=2)
+    parser.add_argument("--utilization", type=float, default=0.9)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    import logging
+    logging.disable(logging.CRITICAL)
+
+    results = {}
+    for name, skips in (("fair", 0), ("affinity", args.skips)):
+        results[name] = run_schedule(args, skips)
+        print(f"{name:8s} " + " | ".join(f"{k}={v}" for k, v in results[name].items()))
+    fair, affinity = results["fair"], results["affinity"]
+    print(f"模型切换 {fair['swaps']} -> {affinity['swaps']}, 总完成时间 {fair['makespan_s']}s -> "
+          f"{affinity['makespan_s']}s, 平均延迟 {fair['latency_mean_s']}s -> {affinity['latency_mean_s']}s")
+    assert affinity["swaps"] == affinity["scheduler_swaps"], affinity
+    assert affinity["swaps"] < fair["swaps"] * 0.5, (fair, affinity)
+    assert affinity["latency_mean_s"] < fair["latency_mean_s"], (fair, affinity)
+
+    cold, warm = run_warmup(args, False), run_warmup(args, True)
+    print(f"首个flux请求执行时间: 不预热 {cold:.1f}s -> 预热 {warm:.1f}s")
+    assert warm < cold - args.load * 0.5, (cold, warm)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+# ============== api/app.py 后台生成测试 ==============
+# 对模拟ComfyUI（带采样进度事件）验证 api/app.py 的后台执行：
+# - /generate 只登记任务并提交到后台执行器，毫秒级返回
+# - /result 的进度来自ComfyUI的 progress 事件，完成后返回 /view 取回的图片
+# - /cancel 需提供 /generate 返回的令牌：执行器中排队的任务不再执行，ComfyUI中排队的被删除、执行中的被中断；
+#   客户端超过 ABANDON_AFTER 秒未查询的任务由执行线程回收
+# - 执行器已满时 /generate 返回503（背压）
+# - drain 停止接收新任务，等待执行中的任务，取消仍在排队的任务
+# 用法: python benchmarks/bench_api_async.py [--latency 1.0] [--workers 2] [--queue 4]
+import argparse
+import importlib.util
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from benchmarks.fake_comfyui import FakeComfyUI  # noqa: E402
+
+PAYLOAD = {"prompt": "a cat", "width": 512, "height": 512, "seed": 1}
+
+
+def load_api_app(fake, workers: int, queue: int, drain_timeout: float):
+    os.environ.update({"COMFY_API_HOST": fake.url, "TASK_STORE": "memory",
+                       "GENERATION_WORKERS": str(workers), "GENERATION_QUEUE_SIZE": str(queue),
+                       "SHUTDOWN_DRAIN_TIMEOUT": str(drain_timeout)})
+    spec = importlib.util.spec_from_file_location("api_app", os.path.join(ROOT, "api", "app.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def poll(client, task_id, timeout=30):
+    """轮询直到任务结束，返回 (最终结果, 观察到的进度序列)"""
+    seen = []
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        result = client.get(f"/result?task_id={task_id}").get_json()
+        if result.get("progress") and (not seen or seen[-1] != result["progress"]):
+            seen.append(result["progress"])
+        if result["status"] != "pending":
+            return result, seen
+        time.sleep(0.02)
+    raise RuntimeError("等待结果超时")
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "等待超时"
+        time.sleep(0.02)
+
+
+def check_cancel(api, fake, client, workers: int):
+    """取消执行器中排队、ComfyUI中排队、正在执行的任务，以及无人查询的任务"""
+    submitted = [client.post("/generate", json=PAYLOAD).get_json() for _ in range(workers + 1)]
+    running, queued, local = submitted[0], submitted[1], submitted[-1]
+    wait_for(lambda: all(api.tasks.get(s["task_id"]).get("backend") for s in submitted[:workers]))
+    wait_for(lambda: running["task_id"] in fake.started)
+
+    def cancel(task, token=None):
+        response = client.post("/cancel", json={"task_id": task["task_id"],
+                                                "cancel_token": token or task["cancel_token"]})
+        return response.status_code, response.get_json()
+
+    assert cancel(running, token="wrong")[0] == 403
+    status, body = cancel(local)
+    assert status == 200 and body["never_ran"], body
+    assert cancel(queued)[0] == 200 and cancel(running)[0] == 200
+    assert cancel(running)[0] == 409  # 已取消
+    # ComfyUI中排队的任务被删除（中断前一个任务后恰好开始执行时被中断）
+    wait_for(lambda: running["task_id"] in fake.interrupted and
+             queued["task_id"] in fake.deleted + fake.interrupted)
+    statuses = {client.get(f"/result?task_id={s['task_id']}").get_json()["status"] for s in submitted}
+    assert statuses == {"cancelled"}, statuses
+    assert local["task_id"] not in fake.started
+
+    # 回收：提交后不再查询 /result
+    api.ABANDON_AFTER = 0.5
+    abandoned = client.post("/generate", json=PAYLOAD).get_json()["task_id"]
+    wait_for(lambda: api.tasks.get(abandoned)["status"] == "cancelled")
+    wait_for(lambda: abandoned in fake.interrupted or abandoned in fake.deleted)
+    api.ABANDON_AFTER = 180
+    wait_for(lambda: api.generation_executor.pending() == 0)
+    print(f"cancel: interrupted={len(fake.interrupted)} deleted_from_comfyui={len(fake.deleted)} "
+          f"never_ran=1 reaped={api.tasks.get(abandoned)['error']}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=1.0)
+    parser.add_argument("--steps", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--queue", type=int, default=4)
+    args = parser.parse_args()
+
+    fake = FakeComfyUI(job_latency=args.latency, progress_steps=args.steps, serial=True).start()
+    api = load_api_app(fake, args.workers, args.queue, drain_timeout=args.latency * 1.5)
+    client = api.app.test_client()
+    deadline = time.time() + 5
+    while not api.listener_for(api.get_comfy_backends()[0]).connected and time.time() < deadline:
+        time.sleep(0.05)
+
+    # 单个任务：提交耗时、真实进度、图片
+    start = time.perf_counter()
+    response = client.post("/generate", json=PAYLOAD)
+    submit_ms = (time.perf_counter() - start) * 1000
+    task_id = response.get_json()["task_id"]
+    result, progress = poll(client, task_id)
+    print(f"/generate returned {response.status_code} in {submit_ms:.1f}ms (job latency {args.latency}s)")
+    print(f"progress observed: {progress} -> status={result['status']} images={len(result['images'])}")
+    assert response.status_code == 200 and submit_ms < 100
+    assert result["status"] == "completed" and result["images"][0].startswith("data:image/png;base64,")
+    assert len(progress) >= 2 and progress[-1] == 1.0
+
+    check_cancel(api, fake, client, args.workers)
+
+    # 背压：容量为 workers + queue，超出部分立即返回503
+    burst = args.workers + args.queue + 4
+    statuses, times = [], []
+    for _ in range(burst):
+        start = time.perf_counter()
+        statuses.append(client.post("/generate", json=PAYLOAD).status_code)
+        times.append((time.perf_counter() - start) * 1000)
+    accepted = statuses.count(200)
+    print(f"burst of {burst}: accepted={accepted} rejected_503={statuses.count(503)} "
+          f"p50={statistics.median(times):.1f}ms max={max(times):.1f}ms")
+    assert accepted == args.workers + args.queue and statuses.count(503) == burst - accepted
+
+    # 排空：执行中的任务完成，排队中的任务被取消并标记为失败
+    before = api.generation_executor.stats()
+    start = time.perf_counter()
+    api.drain_generation_jobs()  # 与服务器关闭流程中的调用相同
+    generation_stats = api.generation_executor.stats()
+    print(f"drain took {time.perf_counter() - start:.2f}s: before={before['pending']} pending, "
+          f"cancelled={generation_stats['cancelled']}")
+    rejected = client.post("/generate", json=PAYLOAD).status_code
+    print(f"submit after drain -> {rejected}")
+    cancelled = [tid for tid in list(api.tasks.tasks) if api.tasks.get(tid).get("error") == "服务关闭，任务已取消"]
+    assert rejected == 503 and generation_stats["cancelled"] - before["cancelled"] == len(cancelled) > 0
+
+    fake.stop()
+
+
+if __name__ == "__main__":
+    main()
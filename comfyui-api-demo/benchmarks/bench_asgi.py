@@ -0,0 +1,230 @@
+# ============== ASGI 与 WSGI 入口并发对比 ==============
+# 1000个客户端同时长轮询，对比两种部署方式（同一进程、同一套任务状态与模拟ComfyUI）：
+# - Flask入口：模拟 gunicorn gthread --threads 128（固定线程池处理请求，其余连接排队）
+# - ASGI入口（asgi.py，uvicorn）：长轮询挂起为协程
+# 统计：挂起的长轮询数、挂起期间探测请求（查询已完成任务）的延迟、任务完成后全部结果送达的耗时。
+# --app api 时在子进程中对比 api/app.py 的两种入口：1000个并发 /generate 的接受/拒绝数、
+# 同时提交给ComfyUI执行的任务数（两种入口都不超过 GENERATION_WORKERS）与完成全部任务的耗时。
+# 用法: python benchmarks/bench_asgi.py [--clients 1000] [--threads 128] [--wait 10] [--app app api]
+import argparse
+import asyncio
+import importlib.util
+import logging
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from benchmarks.fake_comfyui import FakeComfyUI  # noqa: E402
+
+PAYLOAD = {"prompt": "a cat", "width": 512, "height": 512, "seed": 1}
+
+
+# ---------- 服务器 ----------
+def serve_wsgi(wsgi_app, threads: int) -> str:
+    """固定大小线程池的WSGI服务器（与 gunicorn gthread 一样，线程全忙时新请求排队）"""
+    from werkzeug.serving import BaseWSGIServer
+
+    class PooledServer(BaseWSGIServer):
+        request_queue_size = 4096
+        pool = ThreadPoolExecutor(threads)
+
+        def process_request(self, request, client_address):
+            self.pool.submit(self.handle, request, client_address)
+
+        def handle(self, request, client_address):
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    server = PooledServer("127.0.0.1", 0, wsgi_app)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def serve_asgi(asgi_app) -> str:
+    import uvicorn
+
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    server = uvicorn.Server(uvicorn.Config(asgi_app, log_level="warning", backlog=4096, timeout_keep_alive=60))
+    threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True).start()
+    while not server.started:
+        time.sleep(0.02)
+    return f"http://127.0.0.1:{sock.getsockname()[1]}"
+
+
+def wait_until(predicate, timeout: float):
+    deadline = time.time() + timeout
+    while not predicate() and time.time() < deadline:
+        time.sleep(0.05)
+
+
+# ---------- 负载 ----------
+async def long_poll(app_url: str, task_ids: list, wait: float, parked, probe_task: str, finish) -> dict:
+    """全部客户端发出长轮询 -> 等待挂起 -> 探测请求 -> 完成任务并统计送达耗时"""
+    results = []
+    connector = aiohttp.TCPConnector(limit=0)
+    timeout = aiohttp.ClientTimeout(total=wait * 3 + 60)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        async def client(task_id):
+            # 与前端一样，长轮询超时返回pending后立即再次查询
+            while True:
+                async with session.get(f"{app_url}/result", params={"task_id": task_id, "wait": str(wait)}) as r:
+                    body = await r.json()
+                if body.get("status") != "pending":
+                    break
+            results.append((body.get("status"), time.perf_counter()))
+
+        clients = [asyncio.ensure_future(client(task_id)) for task_id in task_ids]
+        start = time.perf_counter()
+        while parked() < len(task_ids) and time.perf_counter() - start < min(wait / 2, 5):
+            await asyncio.sleep(0.05)
+        parked_count, park_seconds = parked(), time.perf_counter() - start
+
+        # 探测请求模拟新用户：每次新建连接查询一个已完成的任务
+        probes = []
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(force_close=True),
+                                         timeout=timeout) as probe_session:
+            for _ in range(3):
+                probe_start = time.perf_counter()
+                async with probe_session.get(f"{app_url}/result", params={"task_id": probe_task}) as r:
+                    await r.read()
+                probes.append(time.perf_counter() - probe_start)
+
+        finished_at = time.perf_counter()
+        await asyncio.get_running_loop().run_in_executor(None, finish)
+        await asyncio.gather(*clients)
+
+    delivered = [at - finished_at for status, at in results if status == "completed"]
+    return {
+        "parked": parked_count,
+        "park_s": round(park_seconds, 2),
+        "probe_p50_ms": round(statistics.median(probes) * 1000, 1),
+        "probe_max_ms": round(max(probes) * 1000, 1),
+        "completed": len(delivered),
+        "deliver_p50_ms": round(statistics.median(delivered) * 1000, 1) if delivered else None,
+        "deliver_max_ms": round(max(delivered) * 1000, 1) if delivered else None,
+    }
+
+
+def run_app(args):
+    from benchmarks.bench_longpoll import parked_waiters, setup_app
+
+    fake = FakeComfyUI().start()
+    comfy_app = setup_app(fake)
+    fake.output_dir = str(comfy_app.COMFYUI_OUTPUT_DIR)  # 提交时写入真实的PNG输出
+    import asgi
+
+    tracker = comfy_app.task_tracker
+    servers = {"flask": (serve_wsgi(comfy_app.app, args.threads), lambda: parked_waiters(comfy_app)),
+               "asgi": (serve_asgi(asgi.app), lambda: sum(len(w) for w in list(tracker.async_waiters.values())))}
+
+    session = requests.Session()
+    app_url = servers["flask"][0]
+    probe_task = session.post(f"{app_url}/generate", json={"prompt": "probe"}).json()["task_id"]
+    wait_until(lambda: fake.jobs, 10)
+    fake.finish([probe_task])
+    wait_until(lambda: tracker.get(probe_task) and tracker.get(probe_task)["status"] == "completed", 10)
+
+    fake.job_latency = None
+    summary = {}
+    for name, (url, parked) in servers.items():
+        task_ids = []
+        for i in range(args.clients):
+            task_ids.append(session.post(f"{app_url}/generate", json={"prompt": f"{name} {i}"}).json()["task_id"])
+        wait_until(lambda: all(task_id in fake.jobs for task_id in task_ids), 120)
+        result = asyncio.run(long_poll(url, task_ids, args.wait, parked, probe_task,
+                                       lambda: fake.finish(task_ids)))
+        summary[name] = result
+        print(f"{name:5s} " + " | ".join(f"{k}={v}" for k, v in result.items()))
+
+    # ASGI入口应挂起全部长轮询且探测请求不受影响，并在任务完成后送达全部结果
+    assert summary["asgi"]["parked"] == args.clients, summary["asgi"]
+    assert summary["asgi"]["completed"] == args.clients, summary["asgi"]
+    assert summary["asgi"]["probe_max_ms"] < 500, summary["asgi"]
+    fake.stop()
+
+
+# ---------- api/app.py ----------
+async def submit_all(app_url: str, clients: int) -> tuple:
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0)) as session:
+        async def submit():
+            async with session.post(f"{app_url}/generate", json=PAYLOAD) as r:
+                return r.status, (await r.json()).get("task_id")
+        responses = await asyncio.gather(*(submit() for _ in range(clients)))
+    accepted = [task_id for status, task_id in responses if status == 200]
+    return accepted, sum(1 for status, _ in responses if status == 503)
+
+
+def run_api(args):
+    fake = FakeComfyUI(job_latency=None).start()
+    os.environ.update({"COMFY_API_HOST": fake.url, "TASK_STORE": "memory", "SHUTDOWN_DRAIN_TIMEOUT": "1"})
+    sys.path.insert(0, os.path.join(ROOT, "api"))
+    spec = importlib.util.spec_from_file_location("api_asgi", os.path.join(ROOT, "api", "asgi.py"))
+    api_asgi = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(api_asgi)
+    import app as api_app
+    api_app.logger.disabled = True
+
+    urls = {"flask": serve_wsgi(api_app.app, args.threads), "asgi": serve_asgi(api_asgi.app)}
+    for name, url in urls.items():
+        accepted, rejected = asyncio.run(submit_all(url, args.clients))
+        # 两种入口同时都只有 GENERATION_WORKERS 个任务提交给ComfyUI；ASGI入口接受全部任务，其余在本地排队
+        wait_until(lambda: sum(task_id in fake.jobs for task_id in accepted) >= api_app.GENERATION_WORKERS, 30)
+        time.sleep(0.5)
+        in_flight = sum(task_id in fake.jobs for task_id in accepted)
+        start = time.perf_counter()
+        while time.perf_counter() - start < 120:
+            fake.finish([task_id for task_id in accepted if task_id in fake.jobs])
+            if all(api_app.tasks.get(task_id)["status"] != "pending" for task_id in accepted):
+                break
+            time.sleep(0.05)
+        statuses = [api_app.tasks.get(task_id)["status"] for task_id in accepted]
+        result = {"accepted": len(accepted), "rejected_503": rejected, "in_comfyui_at_once": in_flight,
+                  "completed": statuses.count("completed"),
+                  "finish_s": round(time.perf_counter() - start, 2)}
+        print(f"{name:5s} " + " | ".join(f"{k}={v}" for k, v in result.items()))
+        if name == "asgi":
+            assert result["accepted"] == args.clients and result["completed"] == args.clients, result
+        assert result["in_comfyui_at_once"] == api_app.GENERATION_WORKERS, result
+    fake.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--threads", type=int, default=128)
+    parser.add_argument("--wait", type=float, default=10)
+    parser.add_argument("--app", nargs="+", default=["app", "api"], choices=["app", "api"])
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    if args.child:
+        run_api(args)
+        return
+    if "app" in args.app:
+        print(f"== app.py: {args.clients} 个长轮询客户端，Flask {args.threads} 线程 vs ASGI ==")
+        run_app(args)
+    if "api" in args.app:
+        # api/app.py 与 app.py 同名，在子进程中导入
+        print(f"== api/app.py: {args.clients} 个并发 /generate，Flask {args.threads} 线程 vs ASGI ==")
+        subprocess.run([sys.executable, os.path.abspath(__file__), "--child", "--clients", str(args.clients),
+                        "--threads", str(args.threads)], check=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+# ============== 多节点吞吐与故障转移测试 ==============
+# 启动N个模拟ComfyUI（serial=True，每个节点同一时间只执行一个任务，模拟单块GPU），
+# 通过节点池 + 本地调度器提交同样数量的任务，比较1/2/4个节点的吞吐；
+# 并校验每个任务的 /history 都能在记录的节点上查到。
+# 故障转移：运行中停止一个节点，确认新任务只发往其余节点，且该节点上的任务在摘除后标记为失败；
+# 停止后、探测发现之前提交失败的任务改投其他节点而不是失败（另以 --failover-jobs 个任务复测，
+# 任务少时停止节点的时刻几乎没有后续探测可以掩盖提交失败）。
+# 用法: python benchmarks/bench_backends.py [--jobs 40] [--failover-jobs 6] [--latency 0.1] [--nodes 1 2 4]
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.fake_comfyui import FakeComfyUI  # noqa: E402
+from backend_pool import BackendPool  # noqa: E402
+from comfy_events import TaskTracker, COMPLETED, FAILED  # noqa: E402
+from scheduler import JobScheduler  # noqa: E402
+
+
+def start_pool(fakes, eject_after=60.0):
+    tracker = TaskTracker()
+    pool = BackendPool([{"url": fake.url, "name": f"fake{i}"} for i, fake in enumerate(fakes)], tracker,
+                       max_depth=5, refresh_interval=0.5, eject_after=eject_after).start()
+    deadline = time.time() + 5
+    while time.time() < deadline and not all(b.connected and b.healthy for b in pool.backends):
+        time.sleep(0.05)
+    scheduler = JobScheduler(pool, tracker, max_in_flight=2).start()
+    return tracker, pool, scheduler
+
+
+def wait_all(tracker, task_ids, timeout=60):
+    deadline = time.time() + timeout
+    states = {}
+    for task_id in task_ids:
+        states[task_id] = tracker.wait_until_finished(task_id, max(0.0, deadline - time.time()))
+    return states
+
+
+def run_scaling(nodes, jobs, latency):
+    fakes = [FakeComfyUI(job_latency=latency, serial=True).start() for _ in range(nodes)]
+    tracker, pool, scheduler = start_pool(fakes)
+
+    start = time.perf_counter()
+    task_ids = [scheduler.submit({}, "batch", f"client{i % 4}")[0] for i in range(jobs)]
+    states = wait_all(tracker, task_ids)
+    elapsed = time.perf_counter() - start
+
+    completed = sum(1 for s in states.values() if s["status"] == COMPLETED)
+    # 每个任务都应能在记录的节点上查到历史记录
+    routed = sum(1 for tid in task_ids if tid in pool.client_for(tid).get_history(tid))
+    per_node = [len(fake.jobs) for fake in fakes]
+
+    scheduler.stop()
+    pool.stop()
+    for fake in fakes:
+        fake.stop()
+    return {"nodes": nodes, "completed": completed, "routed": routed, "seconds": round(elapsed, 2),
+            "jobs_per_s": round(jobs / elapsed, 1), "per_node": per_node}
+
+
+def run_failover(jobs, latency):
+    fakes = [FakeComfyUI(job_latency=latency, serial=True).start() for _ in range(3)]
+    tracker, pool, scheduler = start_pool(fakes, eject_after=1.0)
+
+    first = [scheduler.submit({}, "batch", "client")[0] for _ in range(jobs // 2)]
+    time.sleep(latency)
+    fakes[0].job_latency = None  # 节点0上的任务不再完成
+    fakes[0].stop()
+    dead_jobs = set(fakes[0].jobs)
+    second = [scheduler.submit({}, "batch", "client")[0] for _ in range(jobs - len(first))]
+    states = wait_all(tracker, first + second)
+
+    failed = {tid for tid, s in states.items() if s["status"] == FAILED}
+    completed = sum(1 for s in states.values() if s["status"] == COMPLETED)
+    late_on_dead = [tid for tid in second if pool.backend_for(tid) is pool.backends[0]]
+    failovers = scheduler.stats()["failovers"]
+
+    scheduler.stop()
+    pool.stop()
+    for fake in fakes[1:]:
+        fake.stop()
+    return {"jobs": jobs, "completed": completed, "failed": len(failed),
+            "failed_outside_dead_node": len(failed - dead_jobs), "sent_to_dead_node_after_stop": len(late_on_dead),
+            "failovers": failovers}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=40)
+    parser.add_argument("--failover-jobs", type=int, default=6)
+    parser.add_argument("--latency", type=float, default=0.1)
+    parser.add_argument("--nodes", type=int, nargs="+", default=[1, 2, 4])
+    args = parser.parse_args()
+
+    baseline = None
+    for nodes in args.nodes:
+        result = run_scaling(nodes, args.jobs, args.latency)
+        baseline = baseline or result["jobs_per_s"] / nodes
+        result["scaling_efficiency"] = round(result["jobs_per_s"] / (baseline * nodes), 2)
+        print(" | ".join(f"{k}={v}" for k, v in result.items()))
+        assert result["completed"] == args.jobs and result["routed"] == args.jobs
+
+    for jobs in (args.jobs, args.failover_jobs):
+        result = run_failover(jobs, args.latency)
+        print("failover: " + " | ".join(f"{k}={v}" for k, v in result.items()))
+        assert result["completed"] + result["failed"] == jobs
+        assert result["failed_outside_dead_node"] == 0, result
+        assert result["sent_to_dead_node_after_stop"] == 0, result
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+# ============== 任务取消与无人等待任务回收测试 ==============
+# 模拟单块GPU（serial）的ComfyUI，按顺序提交一批任务，其中每隔 --every 个任务的客户端中途离开：
+# 一半调用 /cancel（如关闭页面时的 sendBeacon），一半不再查询，由心跳回收线程超时取消。
+# 其余客户端按固定间隔查询 /result（心跳）。对比不取消（放弃的任务照常执行）与取消+回收：
+# GPU忙碌时间、放弃的任务实际占用的GPU时间、仍在等待的客户端的平均/最大延迟，
+# 并验证被删除的任务从未执行、执行中的任务被中断、/result 返回 cancelled；
+# 相同请求合并的任务只在最后一个等待者退出时取消，令牌无效时拒绝取消。
+# 所有时间按 --scale 缩短（默认20倍）以加快测试，输出中的秒数已换算回实际时长。
+# 用法: python benchmarks/bench_cancel.py [--jobs 12] [--every 3] [--job-seconds 20] [--scale 20]
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.fake_comfyui import FakeComfyUI  # noqa: E402
+
+
+def run(args, cancel: bool) -> dict:
+    from benchmarks.bench_affinity import wait_done
+    from benchmarks.bench_longpoll import setup_app
+
+    fake = FakeComfyUI(serial=True, job_cost=lambda prompt: args.job_seconds / args.scale).start()
+    comfy_app = setup_app(fake)
+    comfy_app.scheduler.max_in_flight = args.window
+    comfy_app.eta_model.default_seconds = args.job_seconds / args.scale  # 回收时间按缩短后的耗时估计
+    reaper = comfy_app.task_reaper
+    reaper.timeout = args.abandon_after / args.scale if cancel else float("inf")
+    reaped_before, reclaimed_before = reaper.reaped, reaper.reclaimed_seconds
+    client = comfy_app.app.test_client()
+
+    submitted, abandoned, beacons, tokens = {}, [], [], {}
+    for i in range(args.jobs):
+        body, status = comfy_app.submit_generation({"prompt": f"cancel bench {i}"}, "bench")
+        assert status == 200, body
+        submitted[body["task_id"]] = time.time()
+        tokens[body["task_id"]] = body["cancel_token"]
+        if i % args.every == 0:
+            abandoned.append(body["task_id"])
+            if len(abandoned) % 2:
+                beacons.append(body["task_id"])
+    active = [task_id for task_id in submitted if task_id not in abandoned]
+
+    stop = threading.Event()
+
+    def heartbeat():
+        # 仍在等待的客户端定期查询（只记录心跳，不拉取结果）；回收线程的检查间隔同样缩短
+        while not stop.wait(args.poll / args.scale):
+            for task_id in active:
+                reaper.touch(task_id)
+            reaper.reap()
+
+    threading.Thread(target=heartbeat, daemon=True).start()
+    reclaimed = 0.0
+    if cancel:
+        time.sleep(args.leave_after / args.scale)
+        for task_id in beacons:
+            assert client.post(f"/cancel?task_id={task_id}&cancel_token=wrong").status_code == 403
+            response = client.post(f"/cancel?task_id={task_id}&cancel_token={tokens[task_id]}")
+            assert response.status_code == 200, response.get_json()
+            reclaimed += response.get_json()["reclaimed_gpu_seconds"]
+        assert client.post("/cancel", json={"task_id": beacons[0],
+                                            "cancel_token": tokens[beacons[0]]}).status_code == 409  # 已取消
+
+    wait_done(fake, active)
+    stop.set()
+    with fake.lock:
+        busy = fake.busy_seconds
+    # 放弃的任务：已结束的（正常执行完或被中断）计入占用的GPU时间
+    wasted = 0.0
+    for task_id in abandoned:
+        if task_id in fake.jobs:
+            wait_done(fake, [task_id])
+            wasted += fake.jobs[task_id] - fake.started[task_id]
+    latencies = sorted((fake.jobs[task_id] - submitted[task_id]) * args.scale for task_id in active)
+    result = {
+        "gpu_busy_s": round(busy * args.scale, 1),
+        "abandoned_gpu_s": round(wasted * args.scale, 1),
+        "active_latency_mean_s": round(statistics.mean(latencies), 1),
+        "active_latency_max_s": round(latencies[-1], 1),
+        "reaped": reaper.reaped - reaped_before,
+        "reclaimed_estimate_s": round((reclaimed + reaper.reclaimed_seconds - reclaimed_before) * args.scale, 1),
+    }
+    if cancel:
+        statuses = {client.get(f"/result?task_id={task_id}").get_json()["status"] for task_id in abandoned}
+        assert statuses == {"cancelled"}, statuses
+        interrupted = [task_id for task_id in abandoned if task_id in fake.interrupted]
+        never_ran = [task_id for task_id in abandoned if task_id not in fake.jobs]
+        assert len(interrupted) + len(never_ran) == len(abandoned), (interrupted, never_ran)
+        result.update(interrupted=len(interrupted), never_ran=len(never_ran), deleted_from_comfyui=len(fake.deleted))
+        check_coalesced(comfy_app, client)
+    comfy_app.backend_pool.stop()
+    fake.stop()
+    return result
+
+
+def check_coalesced(comfy_app, client):
+    """相同参数的两个请求合并为同一个任务：一个客户端退出时任务继续，两个都退出才取消"""
+    first, _ = comfy_app.submit_generation({"prompt": "shared", "seed": 7}, "alice")
+    second, _ = comfy_app.submit_generation({"prompt": "shared", "seed": 7}, "bob")
+    task_id = first["task_id"]
+    assert second.get("coalesced") and second["task_id"] == task_id, second
+    response = client.post("/cancel", json={"task_id": task_id, "cancel_token": first["cancel_token"]})
+    assert response.status_code == 200 and response.get_json()["subscribers"] == 1, response.get_json()
+    assert comfy_app.task_tracker.get(task_id)["status"] != "cancelled"
+    # 同一令牌不能再次使用
+    response = client.post("/cancel", json={"task_id": task_id, "cancel_token": first["cancel_token"]})
+    assert response.status_code == 403, response.get_json()
+    response = client.post("/cancel", json={"task_id": task_id, "cancel_token": second["cancel_token"]})
+    assert response.status_code == 200 and response.get_json()["status"] == "cancelled", response.get_json()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=12)
+    parser.add_argument("--every", type=int, default=3, help="每隔多少个任务有一个客户端离开")
+    parser.add_argument("--job-seconds", type=float, default=20.0)
+    parser.add_argument("--leave-after", type=float, default=10.0, help="提交后多久调用 /cancel（秒）")
+    parser.add_argument("--abandon-after", type=float, default=30.0, help="无心跳多久后回收（秒）")
+    parser.add_argument("--poll", type=float, default=2.0, help="客户端查询间隔（秒）")
+    parser.add_argument("--window", type=int, default=4)
+    parser.add_argument("--scale", type=float, default=20)
+    args = parser.parse_args()
+
+    import logging
+    logging.disable(logging.CRITICAL)
+
+    baseline = run(args, cancel=False)
+    print("no-cancel " + " | ".join(f"{k}={v}" for k, v in baseline.items()))
+    cancelled = run(args, cancel=True)
+    print("cancel    " + " | ".join(f"{k}={v}" for k, v in cancelled.items()))
+    print(f"GPU忙碌时间 {baseline['gpu_busy_s']}s -> {cancelled['gpu_busy_s']}s, "
+          f"放弃任务占用 {baseline['abandoned_gpu_s']}s -> {cancelled['abandoned_gpu_s']}s, "
+          f"等待中客户端平均延迟 {baseline['active_latency_mean_s']}s -> {cancelled['active_latency_mean_s']}s")
+    abandoned = len(range(0, args.jobs, args.every))
+    assert cancelled["reaped"] == abandoned // 2, cancelled
+    assert cancelled["abandoned_gpu_s"] < args.job_seconds, cancelled
+    assert cancelled["gpu_busy_s"] < baseline["gpu_busy_s"] - (abandoned - 1) * args.job_seconds * 0.8, \
+        (baseline, cancelled)
+    assert cancelled["active_latency_mean_s"] < baseline["active_latency_mean_s"], (baseline, cancelled)
+    # 估计的回收时间与实际节省的GPU时间相差不大
+    saved = baseline["gpu_busy_s"] - cancelled["gpu_busy_s"]
+    assert abs(cancelled["reclaimed_estimate_s"] - saved) < args.job_seconds, (saved, cancelled)
+
+
+if __name__ == "__main__":
+    main()
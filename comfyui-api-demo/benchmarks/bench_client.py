@@ -0,0 +1,86 @@
+# ============== 连接池基准测试 ==============
+# 对比裸 requests.get/post 与共享 ComfyClient 的新建连接数和延迟（p50/均值/p99），
+# 任一工作线程出错或轮数不足时失败
+# 用法: python benchmarks/bench_client.py [--threads 16] [--rounds 50]
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from comfy_client import ComfyClient  # noqa: E402
+from benchmarks.fake_comfyui import FakeComfyUI  # noqa: E402
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def bare_round(url):
+    """与改造前相同的调用方式：一次生成(/queue + /prompt) + 一次查询(/history)"""
+    requests.get(f"{url}/queue", timeout=5).json()
+    task_id = requests.post(f"{url}/prompt", json={"prompt": {}}, timeout=30).json()["prompt_id"]
+    requests.get(f"{url}/history/{task_id}", timeout=10).json()
+
+
+def pooled_round(client):
+    client.get_queue()
+    task_id = client.submit_prompt({})["prompt_id"]
+    client.get_history(task_id)
+
+
+def run(name, fn, threads, rounds):
+    server = FakeComfyUI().start()
+    target = server.url if name == "bare" else ComfyClient(server.url, pool_size=threads)
+    latencies = []
+
+    def worker():
+        for _ in range(rounds):
+            started = time.perf_counter()
+            fn(target)
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        futures = [pool.submit(worker) for _ in range(threads)]
+    elapsed = time.perf_counter() - started
+    server.stop()
+    for future in futures:
+        future.result()  # 工作线程中的异常（连接失败、超时等）直接抛出
+    assert len(latencies) == threads * rounds, f"{name}: 只完成 {len(latencies)}/{threads * rounds} 轮"
+    return {
+        "mode": name,
+        "rounds": len(latencies),
+        "connections": server.connections,
+        "upstream_requests": server.requests,
+        "p50_ms": round(statistics.median(latencies), 2),
+        "mean_ms": round(statistics.mean(latencies), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "rounds_per_s": round(len(latencies) / elapsed, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    results = {}
+    for name, fn in (("bare", bare_round), ("pooled", pooled_round)):
+        results[name] = run(name, fn, args.threads, args.rounds)
+        print(" | ".join(f"{k}={v}" for k, v in results[name].items()))
+    bare, pooled = results["bare"], results["pooled"]
+    print(f"p50 {bare['p50_ms']}ms -> {pooled['p50_ms']}ms, p99 {bare['p99_ms']}ms -> {pooled['p99_ms']}ms, "
+          f"新建连接 {bare['connections']} -> {pooled['connections']}")
+    assert pooled["connections"] <= args.threads, pooled
+
+
+if __name__ == "__main__":
+    main()
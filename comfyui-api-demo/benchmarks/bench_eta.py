@@ -0,0 +1,189 @@
+# ============== 预计完成时间与自适应轮询测试 ==============
+# 模拟单块GPU（serial）的ComfyUI，任务耗时 = 固定开销 + 单位耗时 × 步数 × 百万像素 × 批量（±10%随机波动），
+# 混合提交预览图、常规出图与大图任务（按到达间隔随机提交，形成排队），对比两种前端轮询方式：
+# - fixed：此前 script.js 的做法，等待3秒后查询，之后每次返回pending都等待2秒
+# - adaptive：按 /generate、/result 返回的 retry_after_ms 安排下次查询
+# 分别在事件通道在线（/result?wait= 长轮询挂起）与不可用（/result 立即返回）两种情况下统计：
+# 每个任务的查询次数、返回pending的无效查询数、任务完成到客户端拿到结果的延迟，以及预计耗时的误差。
+# 所有时间按 --scale 缩短（默认10倍）以加快测试，输出中的秒数已换算回实际时长。
+# 用法: python benchmarks/bench_eta.py [--jobs 40] [--warmup 15] [--scale 10] [--utilization 0.7]
+import argparse
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.fake_comfyui import FakeComfyUI  # noqa: E402
+
+# (名称, 占比, 请求参数)
+PROFILES = [
+    ("preview", 0.4, {"steps": 4, "width": 512, "height": 512, "batch_count": 1}),
+    ("standard", 0.4, {"steps": 30, "width": 512, "height": 1024, "batch_count": 4}),
+    ("large", 0.2, {"steps": 50, "width": 2048, "height": 2048, "batch_count": 1}),
+]
+OVERHEAD_SECONDS = 1.0  # 模型加载、VAE解码等与工作量无关的耗时
+SECONDS_PER_UNIT = 0.1  # 每 步×百万像素×张 的耗时
+
+
+def job_seconds(steps: float, width: float, height: float, batch: float) -> float:
+    return OVERHEAD_SECONDS + SECONDS_PER_UNIT * steps * width * height / 1e6 * batch
+
+
+def workflow_cost(scale: float, rng: random.Random):
+    """按提交的工作流计算模拟执行时间（读取各节点的 steps/width/height/batch_size 输入）"""
+    lock = threading.Lock()
+
+    def cost(prompt: dict) -> float:
+        inputs = {}
+        for node in prompt.values():
+            for name in ("steps", "width", "height", "batch_size"):
+                if name in (node.get("inputs") or {}):
+                    inputs[name] = float(node["inputs"][name])
+        with lock:
+            noise = rng.uniform(0.9, 1.1)
+        seconds = job_seconds(inputs.get("steps", 1), inputs.get("width", 1000), inputs.get("height", 1000),
+                              inputs.get("batch_size", 1))
+        return seconds * noise / scale
+    return cost
+
+
+def expected_cost(params: dict) -> float:
+    return job_seconds(params["steps"], params["width"], params["height"], params["batch_count"])
+
+
+# ---------- 前端轮询 ----------
+def poll(app_url: str, task_id: str, first_delay: float, hinted: bool, scale: float) -> dict:
+    """与 script.js 的 pollResult 相同的查询循环，返回查询次数与拿到结果的时间"""
+    session = requests.Session()
+    polls = wasted = 0
+    time.sleep(first_delay)
+    while True:
+        response = session.get(f"{app_url}/result", params={"task_id": task_id, "wait": str(20 / scale)})
+        data = response.json()
+        polls += 1
+        if data.get("status") == "completed" and data.get("images"):
+            return {"polls": polls, "wasted": wasted, "received_at": time.time()}
+        if data.get("status") != "pending":
+            raise RuntimeError(f"意外的结果: {data}")
+        wasted += 1
+        if hinted and "retry_after_ms" in data:
+            time.sleep(data["retry_after_ms"] / 1000)
+        else:
+            time.sleep(2 / scale)
+
+
+def run_clients(comfy_app, fake, app_url: str, jobs: list, hinted: bool, scale: float) -> list:
+    """按预定的到达时间提交任务，每个任务一个轮询线程"""
+    results = []
+    lock = threading.Lock()
+    session = requests.Session()
+
+    def client(params: dict, submitted_at: float):
+        body = session.post(f"{app_url}/generate", json={"prompt": "eta bench", **params}).json()
+        task_id = body["task_id"]
+        first_delay = body["retry_after_ms"] / 1000 if hinted and "retry_after_ms" in body else 3 / scale
+        result = poll(app_url, task_id, first_delay, hinted, scale)
+        result.update(task_id=task_id, eta_ms=body.get("eta_ms"), submitted_at=submitted_at)
+        with lock:
+            results.append(result)
+
+    threads = []
+    start = time.time()
+    for arrival, params in jobs:
+        time.sleep(max(0.0, start + arrival / scale - time.time()))
+        thread = threading.Thread(target=client, args=(params, time.time()))
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+
+    for result in results:
+        done_at = fake.jobs[result["task_id"]]
+        result["latency"] = max(0.0, result["received_at"] - done_at) * scale
+        result["duration"] = (done_at - result["submitted_at"]) * scale
+    return results
+
+
+def summarize(results: list, scale: float) -> dict:
+    latencies = sorted(r["latency"] for r in results)
+    eta_errors = [abs(r["eta_ms"] / 1000 * scale - r["duration"]) / r["duration"]
+                  for r in results if r.get("eta_ms") is not None]
+    return {
+        "polls": sum(r["polls"] for r in results),
+        "wasted": sum(r["wasted"] for r in results),
+        "polls_per_job": round(statistics.mean(r["polls"] for r in results), 2),
+        "latency_p50_s": round(statistics.median(latencies), 2),
+        "latency_p95_s": round(latencies[int(len(latencies) * 0.95) - 1], 2),
+        "latency_max_s": round(latencies[-1], 2),
+        "eta_error_p50": round(statistics.median(eta_errors), 2) if eta_errors else None,
+    }
+
+
+def workload(count: int, utilization: float, rng: random.Random) -> list:
+    """[(到达时间(缩放前秒数), 请求参数)]，到达间隔服从指数分布，平均负载为 utilization"""
+    names, weights, params = zip(*PROFILES)
+    mean_cost = sum(w * expected_cost(p) for w, p in zip(weights, params))
+    jobs, arrival = [], 0.0
+    for _ in range(count):
+        jobs.append((arrival, rng.choices(params, weights)[0]))
+        arrival += rng.expovariate(utilization / mean_cost)
+    return jobs
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=40)
+    parser.add_argument("--warmup", type=int, default=15)
+    parser.add_argument("--scale", type=float, default=10)
+    parser.add_argument("--utilization", type=float, default=0.7)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    import logging
+    from benchmarks.bench_longpoll import setup_app
+    from benchmarks.bench_asgi import serve_wsgi
+    logging.disable(logging.CRITICAL)
+
+    rng = random.Random(args.seed)
+    fake = FakeComfyUI(serial=True, job_cost=workflow_cost(args.scale, rng)).start()
+    summary = {}
+    for events in (True, False):
+        comfy_app = setup_app(fake, enable_events=events)
+        fake.output_dir = str(comfy_app.COMFYUI_OUTPUT_DIR)
+        # 服务端的时间常量按同样比例缩短
+        comfy_app.RESULT_MAX_WAIT = 30 / args.scale
+        comfy_app.POLL_MIN_INTERVAL = 0.5 / args.scale
+        comfy_app.POLL_MAX_INTERVAL = 60 / args.scale
+        comfy_app.eta_model.default_seconds = 20 / args.scale
+        app_url = serve_wsgi(comfy_app.app, 64)
+        mode = "long-poll" if events else "polling"
+
+        if events:
+            # 预热：先串行完成若干任务，耗时模型从完成记录中学习
+            warmup = [(i * 3.0, params) for i, (_, params) in enumerate(workload(args.warmup, 1, rng))]
+            run_clients(comfy_app, fake, app_url, warmup, True, args.scale)
+            print(f"耗时模型: {comfy_app.eta_model.stats()}")
+
+        jobs = workload(args.jobs, args.utilization, random.Random(args.seed))
+        for name, hinted in (("fixed", False), ("adaptive", True)):
+            result = summarize(run_clients(comfy_app, fake, app_url, jobs, hinted, args.scale), args.scale)
+            summary[(mode, name)] = result
+            print(f"{mode:9s} {name:8s} " + " | ".join(f"{k}={v}" for k, v in result.items()))
+
+    for mode in ("long-poll", "polling"):
+        fixed, adaptive = summary[(mode, "fixed")], summary[(mode, "adaptive")]
+        print(f"{mode}: 无效查询 {fixed['wasted']} -> {adaptive['wasted']} "
+              f"({1 - adaptive['wasted'] / max(fixed['wasted'], 1):.0%} 减少), "
+              f"完成延迟p50 {fixed['latency_p50_s']}s -> {adaptive['latency_p50_s']}s")
+        assert adaptive["wasted"] < fixed["wasted"] * 0.5, (mode, fixed, adaptive)
+        assert adaptive["latency_p50_s"] <= fixed["latency_p50_s"] + 0.25, (mode, fixed, adaptive)
+    fake.stop()
+
+
+if __name__ == "__main__":
+    main()
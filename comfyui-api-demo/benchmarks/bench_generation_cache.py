@@ -0,0 +1,123 @@
+# ============== 生成缓存测试 ==============
+# 对模拟ComfyUI验证：
+# - 并发提交N个相同参数（指定种子）的请求，只向ComfyUI提交一次，全部得到同一个task_id
+# - 完成后再次提交直接命中磁盘缓存，不访问ComfyUI，图片内容一致
+# - 任务完成即存储结果，无需客户端读取 /result；输出文件找不到时不存储，相同请求不会合并到该任务
+# - 随机种子的请求绕过缓存
+# - 超过容量上限时按LRU淘汰
+# 用法: python benchmarks/bench_generation_cache.py [--duplicates 10] [--latency 0.3]
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.fake_comfyui import FakeComfyUI  # noqa: E402
+from benchmarks.bench_longpoll import setup_app  # noqa: E402
+
+IMAGE_BYTES = 200 * 1024
+
+
+def generate(client, **params):
+    response = client.post("/generate", json={"prompt": "a cat", **params})
+    assert response.status_code == 200, response.json
+    return response.json
+
+
+def write_output(comfy_app, fake, task_id, payload: bytes):
+    """按模拟ComfyUI返回的文件名写入输出（SaveImage 的 filename_prefix 即 task_id）"""
+    (comfy_app.COMFYUI_OUTPUT_DIR / fake.output_names(task_id)[0]).write_bytes(payload)
+
+
+def wait_result(client, task_id):
+    return client.get("/result", query_string={"task_id": task_id, "wait": 10}).json
+
+
+def wait_stored(comfy_app, task_id, timeout: float = 10):
+    """等待任务结束且生成缓存处理完它的结果（已存储或放弃）"""
+    deadline = time.time() + timeout
+    while task_id in comfy_app.generation_cache.task_keys:
+        assert time.time() < deadline, f"任务 {task_id} 的结果未在限定时间内存储"
+        time.sleep(0.01)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--duplicates", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.3)
+    args = parser.parse_args()
+
+    fake = FakeComfyUI(job_latency=args.latency).start()
+    comfy_app = setup_app(fake, refresh_interval=0.5)
+    client = comfy_app.app.test_client()
+
+    # 并发的相同请求合并为一次提交
+    responses = []
+    start = time.perf_counter()
+    threads = [threading.Thread(target=lambda: responses.append(generate(client, seed=42)))
+               for _ in range(args.duplicates)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    task_ids = {r["task_id"] for r in responses}
+    assert len(task_ids) == 1, task_ids
+    task_id = task_ids.pop()
+    image = os.urandom(IMAGE_BYTES)
+    write_output(comfy_app, fake, task_id, image)
+    result = wait_result(client, task_id)
+    miss_seconds = time.perf_counter() - start
+    assert result["status"] == "completed", result
+    upstream_jobs = len(fake.jobs)
+    print(f"duplicates={args.duplicates} upstream_jobs={upstream_jobs} "
+          f"coalesced={sum(1 for r in responses if r.get('coalesced'))} miss_latency={miss_seconds * 1000:.0f}ms")
+    assert upstream_jobs == 1
+
+    # 完成后的相同请求直接命中磁盘缓存
+    wait_stored(comfy_app, task_id)
+    start = time.perf_counter()
+    cached = generate(client, seed=42)
+    result = wait_result(client, cached["task_id"])
+    hit_seconds = time.perf_counter() - start
+    served = client.get(result["images"][0]).data
+    print(f"cached={cached.get('cached')} hit_latency={hit_seconds * 1000:.1f}ms upstream_jobs={len(fake.jobs)}")
+    assert cached.get("cached") and len(fake.jobs) == 1 and served == image
+    assert generate(client, seed="42")["task_id"] == cached["task_id"]  # 种子按模板类型转换后计算缓存键
+
+    # 随机种子绕过缓存
+    bypass = generate(client)
+    assert not bypass.get("cached") and not bypass.get("coalesced")
+
+    # 没有客户端读取结果：任务完成时即存储
+    unread = generate(client, seed=7)["task_id"]
+    write_output(comfy_app, fake, unread, os.urandom(IMAGE_BYTES))
+    wait_stored(comfy_app, unread)
+    assert generate(client, seed=7).get("cached")
+
+    # 输出文件不存在：不存储，之后的相同请求重新生成而不是合并到该任务
+    broken = generate(client, seed=8)["task_id"]
+    wait_stored(comfy_app, broken)
+    retry = generate(client, seed=8)
+    print(f"unread_cached=True broken_retry_coalesced={retry.get('coalesced', False)}")
+    assert retry["task_id"] != broken and not retry.get("coalesced") and not retry.get("cached")
+    write_output(comfy_app, fake, retry["task_id"], os.urandom(IMAGE_BYTES))
+    wait_stored(comfy_app, retry["task_id"])
+
+    # 容量约两条结果：依次生成三个不同种子，最早的被淘汰
+    comfy_app.generation_cache.max_bytes = int(IMAGE_BYTES * 2.5)
+    for seed in (1, 2, 3):
+        task_id = generate(client, seed=seed)["task_id"]
+        write_output(comfy_app, fake, task_id, os.urandom(IMAGE_BYTES))
+        assert wait_result(client, task_id)["status"] == "completed"
+        wait_stored(comfy_app, task_id)
+    stats = comfy_app.generation_cache.stats()
+    print(" | ".join(f"{k}={v}" for k, v in stats.items()))
+    assert stats["evictions"] >= 2 and stats["bytes"] <= stats["max_bytes"]
+    assert not generate(client, seed=42).get("cached")  # 最早的结果已被淘汰
+
+    fake.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+# ============== 图片变体测试 ==============
+# 任务完成后由进程池生成缩略图/WebP/AVIF，比较画廊加载时传输的字节数与首图耗时：
+# - original: 原始PNG
+# - thumb (cold): 变体尚未生成，请求等待转码完成
+# - thumb / webp / avif (warm): 变体已生成，直接返回文件
+# 测试图片为 1024x1024 的渐变 + 分形 + 噪声合成图，压缩特性接近生成的图片。
+# 用法: python benchmarks/bench_image_variants.py [--images 4] [--size 1024]
+import argparse
+import os
+import sys
+import threading
+import time
+import uuid
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.bench_longpoll import setup_app  # noqa: E402
+from benchmarks.fake_comfyui import FakeComfyUI  # noqa: E402
+
+
+def synthetic_image(size: int, seed: int):
+    from PIL import Image, ImageFilter
+
+    red = Image.linear_gradient("L").rotate(seed * 37).resize((size, size))
+    green = Image.radial_gradient("L").resize((size, size))
+    blue = Image.effect_mandelbrot((size, size), (-2.0 + seed * 0.1, -1.2, 0.8, 1.2), 64)
+    noise = Image.effect_noise((size, size), 24).filter(ImageFilter.GaussianBlur(1))
+    image = Image.merge("RGB", (red, green, blue))
+    return Image.blend(image, Image.merge("RGB", (noise, noise, noise)), 0.25)
+
+
+def completed_task(comfy_app, images: int, size: int) -> str:
+    """写入输出图片并以事件形式记录任务完成（触发变体生成）"""
+    task_id = str(uuid.uuid4())
+    outputs = {"9": {"images": []}}
+    for i in range(images):
+        name = f"{task_id}_{i + 1:05d}_.png"
+        synthetic_image(size, i).save(comfy_app.COMFYUI_OUTPUT_DIR / name)
+        outputs["9"]["images"].append({"filename": name, "subfolder": "", "type": "output"})
+    comfy_app.task_tracker.record_history(task_id, {"outputs": outputs, "status": {"status_str": "success"}})
+    return task_id
+
+
+def load_gallery(app_url: str, task_id: str, variant: str = None) -> dict:
+    """与前端一致：先取 /result，再并发加载全部图片"""
+    session = requests.Session()
+    start = time.perf_counter()
+    query = f"&variant={variant}" if variant else ""
+    urls = session.get(f"{app_url}/result?task_id={task_id}{query}").json()["images"]
+    sizes, served, first = [], [], []
+
+    def fetch(url):
+        response = requests.get(app_url + url)
+        assert response.status_code == 200, response.text
+        first.append(time.perf_counter() - start)
+        sizes.append(len(response.content))
+        served.append(response.headers.get("X-Image-Variant"))
+
+    workers = [threading.Thread(target=fetch, args=(url,)) for url in urls]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return {
+        "bytes": sum(sizes),
+        "first_image_ms": round(min(first) * 1000, 1),
+        "all_images_ms": round((time.perf_counter() - start) * 1000, 1),
+        "served": ",".join(sorted(set(served))),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", type=int, default=4)
+    parser.add_argument("--size", type=int, default=1024)
+    args = parser.parse_args()
+
+    from werkzeug.serving import make_server
+
+    fake = FakeComfyUI().start()
+    comfy_app = setup_app(fake)
+    comfy_app.variant_generator.start()
+    print(f"supported variants: {comfy_app.variant_generator.variants}")
+
+    server = make_server("127.0.0.1", 0, comfy_app.app, threaded=True)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    app_url = f"http://127.0.0.1:{server.server_port}"
+
+    # 预热进程池（spawn 启动子进程需要数百毫秒，只在服务启动后发生一次）
+    warmup_id = completed_task(comfy_app, 1, 64)
+    load_gallery(app_url, warmup_id, "thumb")
+
+    # cold：任务刚完成，变体生成尚未结束时立即请求缩略图
+    task_id = completed_task(comfy_app, args.images, args.size)
+    results = {"original": load_gallery(app_url, task_id)}
+    results["thumb (cold)"] = load_gallery(app_url, task_id, "thumb")
+    deadline = time.time() + 60
+    while comfy_app.variant_generator.stats()["pending"] and time.time() < deadline:
+        time.sleep(0.05)
+    for variant in comfy_app.variant_generator.variants:
+        results[f"{variant} (warm)"] = load_gallery(app_url, task_id, variant)
+
+    for mode, result in results.items():
+        ratio = results["original"]["bytes"] / result["bytes"]
+        print(f"{mode:>12}: " + " | ".join(f"{k}={v}" for k, v in result.items()) + f" | x{ratio:.1f} smaller")
+    print(f"status: {comfy_app.variant_generator.stats()}")
+
+    assert results["thumb (warm)"]["served"] == "thumb"
+    assert results["thumb (warm)"]["bytes"] * 10 < results["original"]["bytes"]
+    assert results["webp (warm)"]["bytes"] < results["original"]["bytes"]
+
+    comfy_app.variant_generator.stop()
+    server.shutdown()
+    fake.stop()
+
+
+if __name__ == "__main__":
+    main()
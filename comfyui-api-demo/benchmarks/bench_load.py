@@ -0,0 +1,307 @@
+# ============== 负载测试 ==============
+# 启动模拟ComfyUI（每个实例模拟一块GPU，任务依次执行，输出图片数量与大小可配置），
+# 分别对 app.py 与 api/app.py 以不同并发数执行完整的用户流程：
+#   POST /generate -> 查询 /result 直到完成 -> 下载全部图片（api/app.py 的图片内联在结果中）
+# 统计：
+# - 吞吐：每秒完成的任务数、每秒HTTP请求数
+# - 延迟：任务端到端与各接口的 p50/p95/p99
+# - 利用率：模拟GPU的忙碌时间占比；api/app.py 另统计后台执行线程的平均占用率
+# - 各接口每个请求的平均响应字节数
+# 指定 --output 时结果写入该JSON文件（含参数与代码版本），--baseline 指定之前的结果文件时输出对比。
+# 用法: python benchmarks/bench_load.py [--targets app api] [--concurrency 1 4 16] [--jobs 48]
+#       [--latency 0.2] [--gpus 2] [--images 1] [--image-bytes 200000]
+#       [--output /tmp/load_results.json] [--baseline old.json]
+import argparse
+import importlib.util
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from benchmarks.bench_longpoll import setup_app  # noqa: E402
+from benchmarks.fake_comfyui import FakeComfyUI  # noqa: E402
+
+FINISHED = ("completed", "failed", "error")
+
+
+def percentiles(values: list) -> dict:
+    if not values:
+        return {"p50": None, "p95": None, "p99": None}
+    values = sorted(values)
+    pick = lambda q: round(values[min(len(values) - 1, int(q * len(values)))] * 1000, 2)  # noqa: E731
+    return {"p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99)}
+
+
+class Recorder:
+    """按接口记录每个请求的耗时与响应字节数（线程安全）"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}  # 接口 -> [(耗时, 字节数)]
+        self.jobs = []  # 任务端到端耗时
+        self.errors = []
+
+    def request(self, session: requests.Session, endpoint: str, method: str, url: str, **kwargs):
+        start = time.perf_counter()
+        response = session.request(method, url, **kwargs)
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.requests.setdefault(endpoint, []).append((elapsed, len(response.content)))
+        return response
+
+    def job(self, elapsed: float = None, error: str = None):
+        with self.lock:
+            if error is None:
+                self.jobs.append(elapsed)
+            else:
+                self.errors.append(error)
+
+    def summary(self, wall: float) -> dict:
+        total = sum(len(samples) for samples in self.requests.values())
+        return {
+            "jobs": len(self.jobs),
+            "errors": len(self.errors),
+            "error_samples": self.errors[:5],
+            "jobs_per_s": round(len(self.jobs) / wall, 2),
+            "requests_per_s": round(total / wall, 1),
+            "job_latency_ms": percentiles(self.jobs),
+            "endpoints": {endpoint: {
+                "requests": len(samples),
+                "latency_ms": percentiles([elapsed for elapsed, _ in samples]),
+                "bytes_per_request": round(sum(size for _, size in samples) / len(samples)),
+            } for endpoint, samples in sorted(self.requests.items())},
+        }
+
+
+# ---------- 被测服务 ----------
+class AppTarget:
+    """app.py：图片以URL返回，/result?wait= 长轮询"""
+    name = "app"
+
+    def __init__(self, fakes: list, wait: float):
+        self.module = setup_app(*fakes)
+        for fake in fakes:
+            fake.output_dir = str(self.module.COMFYUI_OUTPUT_DIR)
+        self.wsgi = self.module.app
+        self.wait = wait
+
+    @staticmethod
+    def payload(i: int) -> dict:
+        return {"prompt": f"load test {i}"}  # 不指定种子，不命中生成缓存
+
+    def run_job(self, session, base_url: str, recorder: Recorder, payload: dict):
+        response = recorder.request(session, "generate", "POST", f"{base_url}/generate", json=payload)
+        response.raise_for_status()
+        task_id = response.json()["task_id"]
+        while True:
+            result = recorder.request(session, "result", "GET", f"{base_url}/result",
+                                      params={"task_id": task_id, "wait": self.wait}).json()
+            if result.get("status") in FINISHED:
+                break
+        if result["status"] != "completed" or not result.get("images"):
+            raise RuntimeError(result.get("error_message") or result.get("error") or result["status"])
+        for url in result["images"]:
+            recorder.request(session, "image", "GET", base_url + url).raise_for_status()
+
+    def utilization(self) -> dict:
+        return {}
+
+
+class ApiTarget:
+    """api/app.py：后台执行器生成，客户端按固定间隔轮询，图片以 data URI 内联"""
+    name = "api"
+
+    def __init__(self, fakes: list, poll_interval: float, workers: int, queue: int):
+        os.environ.update({"COMFY_API_HOST": ",".join(fake.url for fake in fakes), "TASK_STORE": "memory",
+                           "GENERATION_WORKERS": str(workers), "GENERATION_QUEUE_SIZE": str(queue)})
+        spec = importlib.util.spec_from_file_location("api_app", os.path.join(ROOT, "api", "app.py"))
+        self.module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(self.module)
+        self.module.logger.disabled = True
+        self.wsgi = self.module.app
+        self.poll_interval = poll_interval
+        self.samples = []
+        self._sampling = None
+
+    @staticmethod
+    def payload(i: int) -> dict:
+        return {"prompt": f"load test {i}", "width": 512, "height": 512, "seed": i}
+
+    def run_job(self, session, base_url: str, recorder: Recorder, payload: dict):
+        while True:
+            response = recorder.request(session, "generate", "POST", f"{base_url}/generate", json=payload)
+            if response.status_code != 503:  # 执行器已满，按 Retry-After 重试
+                break
+            time.sleep(float(response.headers.get("Retry-After", 1)))
+        response.raise_for_status()
+        task_id = response.json()["task_id"]
+        while True:
+            result = recorder.request(session, "result", "GET", f"{base_url}/result",
+                                      params={"task_id": task_id}).json()
+            if result.get("status") in FINISHED:
+                break
+            time.sleep(self.poll_interval)
+        if result["status"] != "completed" or not result.get("images"):
+            raise RuntimeError(result.get("error") or result["status"])
+
+    def start_sampling(self):
+        """每50ms采样一次执行中的后台任务数"""
+        self.samples = []
+        self._sampling = threading.Event()
+        executor = self.module.generation_executor
+
+        def sample():
+            while not self._sampling.wait(0.05):
+                self.samples.append(min(executor.pending(), executor.max_workers) / executor.max_workers)
+        threading.Thread(target=sample, daemon=True).start()
+
+    def utilization(self) -> dict:
+        self._sampling.set()
+        if not self.samples:
+            return {}
+        return {"executor_utilization": round(sum(self.samples) / len(self.samples), 3)}
+
+
+# ---------- 执行 ----------
+def serve(wsgi_app) -> str:
+    from werkzeug.serving import make_server
+
+    server = make_server("127.0.0.1", 0, wsgi_app, threaded=True)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def run_level(target, base_url: str, fakes: list, concurrency: int, jobs: int) -> dict:
+    recorder = Recorder()
+    remaining = iter(range(jobs))
+    lock = threading.Lock()
+
+    def user():
+        session = requests.Session()
+        while True:
+            with lock:
+                i = next(remaining, None)
+            if i is None:
+                return
+            start = time.perf_counter()
+            try:
+                target.run_job(session, base_url, recorder, target.payload(i))
+            except Exception as e:
+                recorder.job(error=str(e))
+            else:
+                recorder.job(time.perf_counter() - start)
+
+    busy_before = sum(fake.busy_seconds for fake in fakes)
+    if hasattr(target, "start_sampling"):
+        target.start_sampling()
+    start = time.perf_counter()
+    users = [threading.Thread(target=user) for _ in range(concurrency)]
+    for t in users:
+        t.start()
+    for t in users:
+        t.join()
+    wall = time.perf_counter() - start
+
+    result = {"target": target.name, "concurrency": concurrency, "seconds": round(wall, 3)}
+    result.update(recorder.summary(wall))
+    busy = sum(fake.busy_seconds for fake in fakes) - busy_before
+    result["gpu_utilization"] = round(busy / (wall * len(fakes)), 3)
+    result.update(target.utilization())
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(results: list, baseline_path: str):
+    """与之前的结果对比吞吐与任务p99延迟"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {(r["target"], r["concurrency"]): r for r in json.load(f)["results"]}
+    print(f"\ncompared with {baseline_path}:")
+    for r in results:
+        old = baseline.get((r["target"], r["concurrency"]))
+        if old is None or not old["jobs_per_s"]:
+            continue
+        p99, old_p99 = r["job_latency_ms"]["p99"], old["job_latency_ms"]["p99"]
+        print(f"  {r['target']:>4} c={r['concurrency']:<3} jobs/s {old['jobs_per_s']} -> {r['jobs_per_s']} "
+              f"({(r['jobs_per_s'] / old['jobs_per_s'] - 1) * 100:+.1f}%) | "
+              f"job p99 {old_p99}ms -> {p99}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--targets", nargs="+", choices=["app", "api"], default=["app", "api"])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--jobs", type=int, default=48, help="每个并发级别完成的任务数")
+    parser.add_argument("--latency", type=float, default=0.2, help="模拟GPU上每个任务的执行秒数")
+    parser.add_argument("--gpus", type=int, default=2, help="模拟ComfyUI节点数")
+    parser.add_argument("--images", type=int, default=1, help="每个任务的输出图片数")
+    parser.add_argument("--image-bytes", type=int, default=200_000)
+    parser.add_argument("--wait", type=float, default=10, help="app.py /result 长轮询秒数")
+    parser.add_argument("--poll-interval", type=float, default=0.1, help="api/app.py 客户端轮询间隔")
+    parser.add_argument("--api-workers", type=int, default=4)
+    parser.add_argument("--api-queue", type=int, default=32)
+    parser.add_argument("--output", help="结果JSON文件路径，不指定时不写入")
+    parser.add_argument("--baseline")
+    args = parser.parse_args()
+    output = os.path.abspath(args.output) if args.output else None
+    baseline = os.path.abspath(args.baseline) if args.baseline else None
+
+    logging.getLogger("werkzeug").disabled = True
+    results = []
+    for name in args.targets:
+        fakes = [FakeComfyUI(job_latency=args.latency, serial=True, images_per_job=args.images,
+                             image_bytes=args.image_bytes, output_dir=tempfile.mkdtemp()).start()
+                 for _ in range(args.gpus)]
+        if name == "app":
+            target = AppTarget(fakes, args.wait)
+        else:
+            target = ApiTarget(fakes, args.poll_interval, args.api_workers, args.api_queue)
+        base_url = serve(target.wsgi)
+        for concurrency in args.concurrency:
+            result = run_level(target, base_url, fakes, concurrency, max(args.jobs, concurrency))
+            results.append(result)
+            endpoints = " ".join(f"{e}={s['latency_ms']['p50']}/{s['latency_ms']['p99']}ms,{s['bytes_per_request']}B"
+                                 for e, s in result["endpoints"].items())
+            executor = f"executor={result['executor_utilization']:.0%} " if "executor_utilization" in result else ""
+            print(f"{name:>4} c={concurrency:<3} jobs/s={result['jobs_per_s']:<6} req/s={result['requests_per_s']:<7} "
+                  f"job p50/p95/p99={result['job_latency_ms']['p50']}/{result['job_latency_ms']['p95']}/"
+                  f"{result['job_latency_ms']['p99']}ms gpu={result['gpu_utilization']:.0%} {executor}"
+                  f"errors={result['errors']} | {endpoints}")
+        for fake in fakes:
+            fake.stop()
+
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "params": vars(args),
+        "results": results,
+    }
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"results written to {output}")
+    if baseline:
+        compare(results, baseline)
+    assert all(r["errors"] == 0 for r in results), [r["error_samples"] for r in results if r["errors"]]
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+# ============== 长轮询并发测试 ==============
+# 在单个进程（一个worker）内挂起N个 /result?wait= 请求，任务完成后统计唤醒延迟，
+# 验证挂起的请求不做任何sleep/轮询，也不访问ComfyUI，且唤醒后都返回了图片（而非错误响应）。
+# 用法: python benchmarks/bench_longpoll.py [--waiters 100 500 1000]
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.fake_comfyui import FakeComfyUI  # noqa: E402
+
+
+def setup_app(*fakes, refresh_interval: float = 2.0, enable_events: bool = True):
+    """导入app并指向模拟ComfyUI（可传入多个，组成节点池；enable_events=False 时不订阅事件，/result 不挂起）"""
+    os.chdir(tempfile.mkdtemp())  # api.log 写入临时目录
+    import app as comfy_app
+    from backend_pool import BackendPool
+
+    comfy_app.backend_pool.stop()
+    comfy_app.backend_pool = BackendPool([{"url": fake.url} for fake in fakes], comfy_app.task_tracker,
+                                         max_depth=1_000_000, refresh_interval=refresh_interval,
+                                         enable_events=enable_events).start()
+    comfy_app.scheduler.pool = comfy_app.backend_pool
+    comfy_app.scheduler.max_in_flight = 1_000_000
+    comfy_app.COMFYUI_OUTPUT_DIR = Path(tempfile.mkdtemp())
+    comfy_app.generation_cache.root = Path(tempfile.mkdtemp())
+    comfy_app.logger.disabled = True
+    deadline = time.time() + 5
+    while time.time() < deadline and not all(
+            (b.connected or not enable_events) and b.healthy for b in comfy_app.backend_pool.backends):
+        time.sleep(0.05)
+    return comfy_app
+
+
+def parked_waiters(comfy_app) -> int:
+    """当前挂在任务条件变量上的请求数"""
+    with comfy_app.task_tracker.lock:
+        return sum(len(cond._waiters) for cond in comfy_app.task_tracker.conditions.values())
+
+
+def run(comfy_app, fake, app_url, waiters):
+    # 任务不自动完成，全部请求挂起后再统一完成，精确测量唤醒延迟
+    fake.job_latency = None
+    session = requests.Session()
+    dispatched_before = comfy_app.scheduler.stats()["dispatched"]
+    task_ids = []
+    for _ in range(waiters):
+        task_id = session.post(f"{app_url}/generate", json={"prompt": "bench"}).json()["task_id"]
+        (comfy_app.COMFYUI_OUTPUT_DIR / fake.output_names(task_id)[0]).write_bytes(b"\x89PNG")
+        task_ids.append(task_id)
+    # 任务先在本地调度队列排队，等待全部提交给ComfyUI
+    deadline = time.time() + 30
+    while comfy_app.scheduler.stats()["dispatched"] - dispatched_before < waiters and time.time() < deadline:
+        time.sleep(0.05)
+    dispatched = comfy_app.scheduler.stats()["dispatched"] - dispatched_before
+    assert dispatched == waiters, f"30秒内只提交了 {dispatched}/{waiters} 个任务"
+
+    results = []
+    lock = threading.Lock()
+
+    def waiter(task_id):
+        response = requests.get(f"{app_url}/result", params={"task_id": task_id, "wait": 60}, timeout=120)
+        with lock:
+            body = response.json()
+            # 只统计真正返回了图片的结果，找不到输出文件时的错误响应不算完成
+            status = body.get("status") if body.get("images") and not body.get("error_message") else "error"
+            results.append((status, time.time()))
+
+    threads = [threading.Thread(target=waiter, args=(tid,)) for tid in task_ids]
+    for t in threads:
+        t.start()
+    deadline = time.time() + 30
+    while parked_waiters(comfy_app) < waiters and time.time() < deadline:
+        time.sleep(0.05)
+    parked = parked_waiters(comfy_app)
+
+    upstream_before = fake.requests
+    time.sleep(1)  # 挂起期间不应有任何上游请求
+    upstream_while_parked = fake.requests - upstream_before
+
+    completed_at = time.time()
+    fake.finish(task_ids)
+    for t in threads:
+        t.join()
+
+    wake_delays = [finished - completed_at for _, finished in results]
+    return {
+        "waiters": waiters,
+        "parked": parked,
+        "completed": sum(1 for status, _ in results if status == "completed"),
+        "wake_p50_ms": round(statistics.median(wake_delays) * 1000, 1),
+        "wake_max_ms": round(max(wake_delays) * 1000, 1),
+        "upstream_requests_while_parked": upstream_while_parked,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--waiters", type=int, nargs="+", default=[100, 500, 1000])
+    args = parser.parse_args()
+
+    from werkzeug.serving import make_server
+
+    fake = FakeComfyUI().start()
+    comfy_app = setup_app(fake)
+    server = make_server("127.0.0.1", 0, comfy_app.app, threaded=True)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    app_url = f"http://127.0.0.1:{server.server_port}"
+
+    for waiters in args.waiters:
+        result = run(comfy_app, fake, app_url, waiters)
+        print(" | ".join(f"{k}={v}" for k, v in result.items()))
+        assert result["completed"] == waiters, result
+
+    server.shutdown()
+    fake.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+# ============== 运行指标开销测试 ==============
+# 1. 单次记录的开销：Histogram.observe、time() 上下文、Counter.inc、按标签取直方图
+# 2. 通过模拟ComfyUI完成若干任务后，/metrics 中每个阶段都有样本，文本格式可被逐行解析
+# 3. 多线程压测 /result（Base64格式，关闭结果缓存，覆盖输出查找/读文件/编码/序列化各阶段），
+#    交替比较记录指标与跳过记录（observe/inc 替换为空函数）时的吞吐
+# 用法: python benchmarks/bench_metrics.py [--threads 8] [--seconds 3]
+import argparse
+import os
+import re
+import sys
+import threading
+import time
+import timeit
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.bench_longpoll import setup_app  # noqa: E402
+from benchmarks.bench_result_logging import hammer  # noqa: E402
+from benchmarks.fake_comfyui import FakeComfyUI  # noqa: E402
+import metrics as metrics_module  # noqa: E402
+
+SAMPLE_LINE = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{[^}]*\})? -?[0-9.e+-]+|\+Inf$')
+
+
+def micro():
+    registry = metrics_module.Metrics("bench")
+    histogram = registry.histogram("stage_seconds", "bench", stage="a")
+    counter = registry.counter("events", "bench")
+
+    def timed():
+        with histogram.time():
+            pass
+
+    n = 200_000
+    for name, fn in (("Histogram.observe", lambda: histogram.observe(0.003)),
+                     ("Histogram.time()", timed),
+                     ("Counter.inc", counter.inc),
+                     ("Metrics.histogram lookup", lambda: registry.histogram("stage_seconds", "bench", stage="a"))):
+        seconds = min(timeit.repeat(fn, number=n, repeat=3)) / n
+        print(f"{name:26s} {seconds * 1e9:7.0f} ns")
+
+
+def run_jobs(comfy_app, app_url: str, jobs: int) -> str:
+    session = requests.Session()
+    task_ids = [session.post(f"{app_url}/generate", json={"prompt": f"metrics {i}"}).json()["task_id"]
+                for i in range(jobs)]
+    for task_id in task_ids:
+        result = session.get(f"{app_url}/result", params={"task_id": task_id, "wait": 10}).json()
+        assert result["status"] == "completed", result
+        session.get(f"{app_url}/result", params={"task_id": task_id, "format": "base64"}).raise_for_status()
+    return task_ids[0]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=3)
+    args = parser.parse_args()
+
+    micro()
+
+    from werkzeug.serving import make_server
+    import logging
+
+    fake = FakeComfyUI(job_latency=0.05, image_bytes=256 * 1024).start()
+    comfy_app = setup_app(fake)
+    fake.output_dir = str(comfy_app.COMFYUI_OUTPUT_DIR)
+    comfy_app.result_cache.max_bytes = 0  # 每次都走完整的结果处理路径
+    logging.getLogger("werkzeug").disabled = True
+    server = make_server("127.0.0.1", 0, comfy_app.app, threaded=True)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    app_url = f"http://127.0.0.1:{server.server_port}"
+
+    task_id = run_jobs(comfy_app, app_url, 8)
+    # 事件通道在线时不会查询 /queue 与 /history，各手动请求一次以确保这两个阶段有样本
+    comfy_app.backend_pool.backends[0].admission.refresh()
+    comfy_app.backend_pool.client_for(task_id).get_history(task_id)
+    start = time.perf_counter()
+    text = requests.get(f"{app_url}/metrics").text
+    scrape_ms = (time.perf_counter() - start) * 1000
+    stats = {entry["stage"]: entry for entry in requests.get(f"{app_url}/metrics?format=json").json()
+             ["comfyui_api_stage_seconds"]}
+    for stage, entry in stats.items():
+        print(f"  {stage:15s} count={entry['count']:<5} p50={entry['p50_ms']}ms p99={entry['p99_ms']}ms")
+    missing = [stage for stage, entry in stats.items() if not entry["count"]]
+    assert not missing, f"阶段没有样本: {missing}"
+    bad = [line for line in text.splitlines() if line and not line.startswith("#") and not SAMPLE_LINE.match(line)]
+    assert not bad, bad[:3]
+    print(f"/metrics: {len(text.splitlines())} lines, {len(text)} bytes, scrape {scrape_ms:.1f}ms")
+
+    # 先预热一轮，再交替运行两种模式各取最好的一次，避免顺序带来的偏差
+    urls = [f"/result?task_id={task_id}&format=base64"]
+    observe, inc = metrics_module.Histogram.observe, metrics_module.Counter.inc
+    hammer(app_url, urls, args.threads, 1)
+    runs = {True: [], False: []}
+    for enabled in (False, True, False, True):
+        if enabled:
+            metrics_module.Histogram.observe, metrics_module.Counter.inc = observe, inc
+        else:
+            metrics_module.Histogram.observe = lambda self, value: None
+            metrics_module.Counter.inc = lambda self, amount=1: None
+        runs[enabled].append(hammer(app_url, urls, args.threads, args.seconds))
+    metrics_module.Histogram.observe, metrics_module.Counter.inc = observe, inc
+    enabled, disabled = (max(runs[mode], key=lambda r: r["req_per_s"]) for mode in (True, False))
+    print(f"metrics on : {enabled}")
+    print(f"metrics off: {disabled}")
+    print(f"throughput overhead: {(1 - enabled['req_per_s'] / disabled['req_per_s']) * 100:+.1f}%")
+
+    server.shutdown()
+    fake.stop()
+
+
+if __name__ == "__main__":
+    main()
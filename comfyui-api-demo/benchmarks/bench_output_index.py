@@ -0,0 +1,90 @@
+# ============== 输出目录索引测试 ==============
+# 在临时目录中生成大量 SaveImage 风格的输出文件，对比：
+# - 原先的 glob(f"*{task_id}*") 全目录扫描
+# - OutputIndex.lookup（索引命中 / 按命名规则探测）
+# 并校验启动后新写入、删除的文件能被 inotify 与轮询两种模式及时反映到索引中。
+# 用法: python benchmarks/bench_output_index.py [--files 50000]
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from output_index import OutputIndex  # noqa: E402
+
+
+def write_output(root: Path, prefix: str, count: int = 1) -> list:
+    names = []
+    for counter in range(1, count + 1):
+        path = root / f"{prefix}_{counter:05d}_.png"
+        path.write_bytes(b"png")
+        names.append(path.name)
+    return names
+
+
+def timed(fn, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def wait_for(predicate, timeout: float = 10.0) -> float:
+    start = time.perf_counter()
+    while not predicate():
+        if time.perf_counter() - start > timeout:
+            raise RuntimeError("等待索引更新超时")
+        time.sleep(0.01)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=50000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        task_ids = [str(uuid.uuid4()) for _ in range(args.files // 2)]
+        for task_id in task_ids:
+            write_output(root, task_id)
+        write_output(root, "ComfyUI", args.files - len(task_ids))  # 未带任务前缀的历史输出
+        target = task_ids[len(task_ids) // 2]
+
+        glob_s = timed(lambda: list(root.glob(f"*{target}*")), 3)
+        probe_index = OutputIndex(root)  # 未启动：只按命名规则探测
+        probe_s = timed(lambda: probe_index.lookup(target), 100)
+
+        for mode in ("inotify", "poll"):
+            index = OutputIndex(root, poll_interval=0.5, use_inotify=(mode == "inotify")).start()
+            build_s = wait_for(lambda: index.mode is not None, timeout=60)
+            hit_s = timed(lambda: index.lookup(target), 1000)
+            assert [p.name for p in index.lookup(target)] == [f"{target}_00001_.png"]
+
+            # 启动后新生成的批量输出：等待索引收到事件后直接命中（不经过探测）
+            new_task = str(uuid.uuid4())
+            names = write_output(root, new_task, 3)
+            update_s = wait_for(lambda: len(index.files.get(new_task, ())) == 3)
+            assert [p.name for p in index.lookup(new_task)] == names
+            for name in names:
+                (root / name).unlink()
+            delete_s = wait_for(lambda: new_task not in index.files)
+            stats = index.stats()
+            index.stop()
+            print(f"{mode}: build={build_s:.2f}s lookup p50={hit_s * 1e6:.1f}us "
+                  f"new file indexed in {update_s * 1000:.0f}ms, delete in {delete_s * 1000:.0f}ms | {stats}")
+            assert stats["mode"] == mode and stats["misses"] == 0
+
+        print(f"glob scan over {args.files} files p50={glob_s * 1000:.1f}ms | "
+              f"probe without index p50={probe_s * 1e6:.1f}us")
+        assert not OutputIndex(root).lookup(str(uuid.uuid4()))
+
+
+if __name__ == "__main__":
+    main()
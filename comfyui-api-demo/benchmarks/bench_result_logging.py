@@ -0,0 +1,135 @@
+# ============== /result 日志开销测试 ==============
+# 多个线程持续轮询 /result，比较两种日志配置下的吞吐与延迟：
+# - sync: 原先的配置（FileHandler + StreamHandler 同步写入，DEBUG级别输出全部明细日志，不限流）
+# - pipeline: 队列 + 后台写入线程 + 轮转 + 高频日志限流（INFO级别）
+# 请求混合：排队中的任务（每次轮询都会打印查询日志）与已完成任务的Base64结果
+# （关闭结果缓存，每次都走完整的图片处理路径）。
+# 控制台输出重定向到 os.devnull，实际部署中写控制台的开销更大。
+# 用法: python benchmarks/bench_result_logging.py [--threads 8] [--seconds 5] [--images 4]
+import argparse
+import logging
+import os
+import statistics
+import sys
+import threading
+import time
+import uuid
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.bench_longpoll import setup_app  # noqa: E402
+from benchmarks.fake_comfyui import FakeComfyUI  # noqa: E402
+from log_pipeline import LOG_FORMAT, LogPipeline  # noqa: E402
+
+
+def use_sync_logging(log_file: str):
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    for handler in (logging.FileHandler(log_file, encoding='utf-8'),
+                    logging.StreamHandler(open(os.devnull, "w", encoding="utf-8"))):
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        root.addHandler(handler)
+    root.setLevel(logging.DEBUG)
+    return None
+
+
+def use_pipeline(log_file: str):
+    pipeline = LogPipeline(log_file, console=False).start()
+    console = logging.StreamHandler(open(os.devnull, "w", encoding="utf-8"))
+    console.setFormatter(logging.Formatter(LOG_FORMAT))
+    pipeline.listener.handlers += (console,)
+    return pipeline
+
+
+def prepare_tasks(comfy_app, fake, images: int):
+    """一个已完成（多张图片）的任务与一批排队中的任务"""
+    done_id = str(uuid.uuid4())
+    outputs = {"17": {"images": []}}
+    for i in range(images):
+        name = f"{done_id}_{i + 1:05d}_.png"
+        (comfy_app.COMFYUI_OUTPUT_DIR / name).write_bytes(os.urandom(64 * 1024))
+        outputs["17"]["images"].append({"filename": name, "subfolder": "", "type": "output"})
+    comfy_app.task_tracker.record_history(done_id, {"outputs": outputs, "status": {"status_str": "success"}})
+
+    fake.job_latency = None
+    pending_ids = [comfy_app.scheduler.submit({}, "batch", "bench")[0] for _ in range(20)]
+    return done_id, pending_ids
+
+
+def hammer(app_url: str, urls: list, threads: int, seconds: float) -> dict:
+    latencies = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def worker(offset):
+        session = requests.Session()
+        local = []
+        i = offset
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            response = session.get(app_url + urls[i % len(urls)])
+            local.append(time.perf_counter() - start)
+            assert response.status_code == 200, response.text
+            i += 1
+        with lock:
+            latencies.extend(local)
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "req_per_s": round(len(latencies) / seconds, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99)] * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--images", type=int, default=4)
+    args = parser.parse_args()
+
+    from werkzeug.serving import make_server
+
+    fake = FakeComfyUI().start()
+    comfy_app = setup_app(fake)
+    comfy_app.logger.disabled = False
+    comfy_app.result_cache.max_bytes = 0  # 每次都走完整的结果处理路径
+    done_id, pending_ids = prepare_tasks(comfy_app, fake, args.images)
+    urls = [f"/result?task_id={done_id}&format=base64"] + [f"/result?task_id={tid}" for tid in pending_ids]
+
+    server = make_server("127.0.0.1", 0, comfy_app.app, threaded=True)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    app_url = f"http://127.0.0.1:{server.server_port}"
+    logging.getLogger("werkzeug").disabled = True  # 访问日志两种配置相同，不计入
+
+    results = {}
+    for mode, configure in (("sync", use_sync_logging), ("pipeline", use_pipeline)):
+        log_file = os.path.join(os.getcwd(), f"{mode}.log")
+        pipeline = configure(log_file)
+        results[mode] = hammer(app_url, urls, args.threads, args.seconds)
+        if pipeline is not None:
+            results[mode].update(pipeline.stats())
+            pipeline.stop()
+        results[mode]["log_bytes"] = os.path.getsize(log_file)
+        print(f"{mode}: " + " | ".join(f"{k}={v}" for k, v in results[mode].items()))
+
+    speedup = results["pipeline"]["req_per_s"] / results["sync"]["req_per_s"]
+    print(f"throughput x{speedup:.2f}, log volume /{results['sync']['log_bytes'] / results['pipeline']['log_bytes']:.0f}")
+    assert results["pipeline"]["log_bytes"] < results["sync"]["log_bytes"]
+
+    server.shutdown()
+    fake.stop()
+
+
+if __name__ == "__main__":
+    main()
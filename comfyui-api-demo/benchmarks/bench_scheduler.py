@@ -0,0 +1,92 @@
+# ============== 本地调度器测试 ==============
+# 对模拟ComfyUI验证调度顺序与在途窗口：
+# - 大客户先批量提交，小客户后提交，同优先级内两者交替调度（公平排队）
+# - interactive 任务越过已排队的 batch 任务
+# - ComfyUI中本进程的未完成任务数从不超过在途窗口
+# 用法: python benchmarks/bench_scheduler.py [--heavy 20] [--light 4] [--window 2]
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.fake_comfyui import FakeComfyUI  # noqa: E402
+from backend_pool import BackendPool  # noqa: E402
+from comfy_events import TaskTracker  # noqa: E402
+from scheduler import JobScheduler  # noqa: E402
+
+
+def unfinished(fake) -> list:
+    with fake.lock:
+        return [pid for pid, done_at in fake.jobs.items() if not fake._done(done_at)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--heavy", type=int, default=20)
+    parser.add_argument("--light", type=int, default=4)
+    parser.add_argument("--window", type=int, default=2)
+    args = parser.parse_args()
+
+    fake = FakeComfyUI(job_latency=None).start()
+    tracker = TaskTracker()
+    pool = BackendPool([{"url": fake.url}], tracker, max_depth=1000, refresh_interval=0.5).start()
+    backend = pool.default
+    deadline = time.time() + 5
+    while not (backend.connected and backend.healthy) and time.time() < deadline:
+        time.sleep(0.05)
+    scheduler = JobScheduler(pool, tracker, max_in_flight=args.window).start()
+
+    owners = {}
+    submit_times = []
+
+    def submit(priority, client_key):
+        start = time.perf_counter()
+        task_id, position = scheduler.submit({}, priority, client_key)
+        submit_times.append(time.perf_counter() - start)
+        owners[task_id] = (client_key, priority)
+        return position
+
+    for _ in range(args.heavy):
+        submit("batch", "heavy")
+    for _ in range(args.light):
+        submit("batch", "light")
+    interactive_position = submit("interactive", "web")
+
+    # 每次完成ComfyUI中的全部任务，调度器随即补足在途窗口
+    max_seen = 0
+    total = len(owners)
+    deadline = time.time() + 30
+    while len(fake.jobs) < total or unfinished(fake):
+        time.sleep(0.05)
+        running = unfinished(fake)
+        max_seen = max(max_seen, len(running))
+        if running:
+            fake.finish(running)
+        if time.time() > deadline:
+            raise RuntimeError("调度超时")
+
+    order = [owners[pid] for pid in fake.jobs]
+    light_slots = [i for i, (key, _) in enumerate(order) if key == "light"]
+    interactive_slot = order.index(("web", "interactive"))
+
+    print(f"dispatch order: {' '.join(key[0] + ('!' if p == 'interactive' else '') for key, p in order)}")
+    print(f"submit p50={statistics.median(submit_times) * 1e6:.0f}us max={max(submit_times) * 1e6:.0f}us")
+    print(f"interactive queued at position {interactive_position}, dispatched #{interactive_slot}")
+    print(f"light jobs dispatched at {light_slots}")
+    print(f"max in flight observed={max_seen} (window={args.window})")
+    time.sleep(0.2)  # 等待最后的完成事件
+    print(scheduler.stats())
+
+    assert max_seen <= args.window
+    assert interactive_slot <= args.window, "interactive任务应越过排队中的batch任务"
+    assert light_slots[-1] < 2 * args.light + args.window + 1, "小客户的任务应与大客户交替调度"
+
+    scheduler.stop()
+    pool.stop()
+    fake.stop()
+
+
+if __name__ == "__main__":
+    main()
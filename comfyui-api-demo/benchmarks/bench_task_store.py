@@ -0,0 +1,139 @@
+# ============== 任务存储多进程测试 ==============
+# 模拟 gunicorn -w N：启动N个独立进程分别加载 api/app.py，每个进程创建一批任务，
+# 然后每个进程通过 /result 查询所有进程创建的任务。
+# - sqlite 存储：任意进程都能查到全部任务（命中率100%）
+# - memory 存储：只能查到本进程创建的任务（命中率约1/N，即原先的404问题）
+# 另外对比两种存储的单进程查询/更新耗时，并校验过期任务的清理与按状态的条件更新（update_if）。
+# 用法: python benchmarks/bench_task_store.py [--workers 4] [--tasks 200]
+import argparse
+import importlib.util
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from task_store import MemoryTaskStore, SQLiteTaskStore  # noqa: E402
+
+
+def load_api_app(store_url: str):
+    """以独立模块名加载 api/app.py（避免与上级目录的 app.py 重名）"""
+    os.environ["TASK_STORE"] = store_url
+    spec = importlib.util.spec_from_file_location("api_app", os.path.join(ROOT, "api", "app.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def new_task(ttl: float = 3600) -> dict:
+    return {"status": "completed", "expires_at": time.time() + ttl,
+            "parameters": {"prompt": "bench", "width": 512, "height": 512}, "images": ["x" * 64]}
+
+
+def worker(store_url, count, created, all_ids, results):
+    api = load_api_app(store_url)
+    client = api.app.test_client()
+    own = []
+    for _ in range(count):
+        task_id = str(uuid.uuid4())
+        api.tasks.put(task_id, new_task())  # 与 /generate 写入任务的方式相同
+        own.append(task_id)
+    created.put(own)
+
+    task_ids = all_ids.get()
+    hits = 0
+    start = time.perf_counter()
+    for task_id in task_ids:
+        response = client.get(f"/result?task_id={task_id}")
+        if response.status_code == 200 and response.get_json()["status"] == "completed":
+            hits += 1
+    results.put({"pid": os.getpid(), "hits": hits, "lookups": len(task_ids),
+                 "lookup_us": round((time.perf_counter() - start) / len(task_ids) * 1e6)})
+
+
+def run_workers(store_url: str, workers: int, count: int) -> list:
+    ctx = multiprocessing.get_context("spawn")
+    created, results = ctx.Queue(), ctx.Queue()
+    inboxes = [ctx.Queue() for _ in range(workers)]
+    procs = [ctx.Process(target=worker, args=(store_url, count, created, inboxes[i], results))
+             for i in range(workers)]
+    for proc in procs:
+        proc.start()
+    task_ids = []
+    for _ in range(workers):
+        task_ids.extend(created.get(timeout=60))
+    for inbox in inboxes:
+        inbox.put(task_ids)
+    reports = [results.get(timeout=120) for _ in range(workers)]
+    for proc in procs:
+        proc.join()
+    return reports
+
+
+def time_store(store, count: int) -> dict:
+    task_ids = [str(uuid.uuid4()) for _ in range(count)]
+    timings = {"put": [], "get": [], "update": []}
+    for task_id in task_ids:
+        start = time.perf_counter()
+        store.put(task_id, new_task())
+        timings["put"].append(time.perf_counter() - start)
+    for task_id in task_ids:
+        start = time.perf_counter()
+        assert store.get(task_id) is not None
+        timings["get"].append(time.perf_counter() - start)
+    for task_id in task_ids:
+        start = time.perf_counter()
+        store.update(task_id, progress=0.5)
+        timings["update"].append(time.perf_counter() - start)
+    return {op: f"{statistics.median(values) * 1e6:.0f}us" for op, values in timings.items()}
+
+
+def check_expiry(store):
+    expired = [str(uuid.uuid4()) for _ in range(10)]
+    for task_id in expired:
+        store.put(task_id, new_task(ttl=-1))
+    live = str(uuid.uuid4())
+    store.put(live, new_task())
+    assert all(store.get(task_id) is None for task_id in expired)
+    assert not store.update(expired[0], status="error")
+    store.purge_expired()
+    assert store.get(live) is not None
+    # 已取消的任务不会被执行线程随后写入的结果覆盖
+    store.update(live, status="pending")
+    assert store.update_if(live, "pending", status="cancelled")
+    assert not store.update_if(live, "pending", status="completed")
+    assert store.get(live)["status"] == "cancelled"
+    return store.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--tasks", type=int, default=200)
+    args = parser.parse_args()
+    total = args.workers * args.tasks
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_url = "sqlite:///" + os.path.join(tmp, "tasks.db")
+        for store_url in (db_url, "memory"):
+            reports = run_workers(store_url, args.workers, args.tasks)
+            name = "sqlite" if store_url.startswith("sqlite") else "memory"
+            for report in reports:
+                print(f"{name} worker pid={report['pid']} hits={report['hits']}/{report['lookups']} "
+                      f"lookup={report['lookup_us']}us")
+            if name == "sqlite":
+                assert all(r["hits"] == total for r in reports), "SQLite存储应在每个进程都能查到全部任务"
+            else:
+                assert all(r["hits"] == args.tasks for r in reports)
+
+        for store in (MemoryTaskStore(), SQLiteTaskStore(os.path.join(tmp, "timing.db"))):
+            print(f"{type(store).__name__} p50: {time_store(store, 1000)}")
+            print(f"{type(store).__name__} after purge: {check_expiry(store)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+# ============== Vercel 入口测试 ==============
+# 1. 冷启动：新进程导入 api/index.py 并经 handler 应答首个 /api/ping 与 /result 请求的耗时，
+#    对比预先导入 requests、websocket-client、asyncio（此前导入应用时即加载）的情况
+# 2. 桥接正确性：二进制响应逐字节一致，状态码与响应头（含多个同名头）原样保留，查询参数正确编码
+# 3. 峰值内存：多图片（内联Base64）的 /result 响应，对比流式 handler、Lambda事件接口与
+#    此前整体拼接再 decode/encode 的做法（tracemalloc 峰值）
+# 用法: python benchmarks/bench_vercel.py [--runs 7] [--images 4] [--image-bytes 2000000]
+import argparse
+import base64
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+API_DIR = os.path.join(ROOT, "api")
+ENV = {**os.environ, "TASK_STORE": "memory", "COMFY_API_HOST": "http://127.0.0.1:9"}
+
+COLD_START = """
+import time
+start = time.perf_counter()
+{preload}
+import json, socket, sys
+import index
+imported = time.perf_counter()
+
+def get(path):
+    server, client = socket.socketpair()
+    client.sendall(f"GET {{path}} HTTP/1.0\\r\\nHost: bench\\r\\n\\r\\n".encode())
+    index.handler(server, ("127.0.0.1", 0), None)
+    server.close()
+    return int(client.recv(65536).split(b" ", 2)[1])
+
+status = [get("/api/ping"), get("/result?task_id=missing")]
+done = time.perf_counter()
+print(json.dumps({{"import_ms": (imported - start) * 1000, "first_ms": (done - start) * 1000, "status": status,
+                  "heavy": [m for m in ("requests", "websocket", "asyncio") if m in sys.modules]}}))
+"""
+
+
+def cold_start(runs: int) -> dict:
+    results = {}
+    for name, preload in (("lazy", ""), ("eager", "import requests, websocket, asyncio")):
+        samples = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            out = subprocess.run([sys.executable, "-c", COLD_START.format(preload=preload)], cwd=API_DIR, env=ENV,
+                                 capture_output=True, text=True, check=True).stdout
+            wall = (time.perf_counter() - start) * 1000
+            samples.append({**json.loads(out.strip().splitlines()[-1]), "process_ms": wall})
+        results[name] = samples
+        print(f"{name:5s} import={statistics.median(s['import_ms'] for s in samples):6.1f}ms "
+              f"first_response={statistics.median(s['first_ms'] for s in samples):6.1f}ms "
+              f"process={statistics.median(s['process_ms'] for s in samples):6.1f}ms "
+              f"status={samples[0]['status']} heavy_modules={samples[0]['heavy']}")
+    assert results["lazy"][0]["status"] == [200, 404], results["lazy"][0]
+    assert not results["lazy"][0]["heavy"], results["lazy"][0]
+    return results
+
+
+# ---------- 进程内测试 ----------
+def serve_raw(index, raw_request: bytes, reader=None):
+    """经 handler 处理一个原始HTTP请求；reader(socket) 在另一线程读取响应，默认读取全部字节"""
+    server, client = socket.socketpair()
+    received = []
+    reader = reader or (lambda sock: received.append(b"".join(iter(lambda: sock.recv(1 << 16), b""))))
+    thread = threading.Thread(target=reader, args=(client,))
+    thread.start()
+    client.sendall(raw_request)
+    index.handler(server, ("127.0.0.1", 0), None)
+    server.close()
+    thread.join()
+    client.close()
+    return received[0] if received else None
+
+
+def parse_response(raw: bytes):
+    head, _, body = raw.partition(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    headers = [tuple(line.split(": ", 1)) for line in lines[1:]]
+    return int(lines[0].split(" ")[1]), headers, body
+
+
+def check_bridge(index):
+    payload = os.urandom(300_000)
+    chunks = [payload[:1], payload[1:100_000], b"", payload[100_000:]]
+
+    def binary_app(environ, start_response):
+        start_response("206 Partial Content", [("Content-Type", "image/png"), ("X-Test", "1"),
+                                               ("Set-Cookie", "a=1"), ("Set-Cookie", "b=2")])
+        return iter(chunks)
+
+    def echo_app(environ, start_response):
+        from werkzeug.wrappers import Request
+        request = Request(environ)
+        body = json.dumps({"args": request.args.to_dict(flat=False), "path": request.path,
+                           "data": request.get_data().hex()}).encode()
+        start_response("201 Created", [("Content-Type", "application/json")])
+        return [body]
+
+    real_app = index.app
+    try:
+        index.app = binary_app
+        status, headers, body = parse_response(serve_raw(index, b"GET /img HTTP/1.0\r\n\r\n"))
+        assert status == 206 and body == payload, (status, len(body))
+        assert ("X-Test", "1") in headers and [v for k, v in headers if k == "Set-Cookie"] == ["a=1", "b=2"], headers
+        event = index.handle_request({"path": "/img", "httpMethod": "GET"}, None)
+        assert event["statusCode"] == 206 and event["isBase64Encoded"], event["statusCode"]
+        assert base64.b64decode(event["body"]) == payload
+        assert event["multiValueHeaders"]["Set-Cookie"] == ["a=1", "b=2"]
+
+        index.app = echo_app
+        binary_body = bytes(range(256))
+        raw = (b"POST /a%20b?task_id=x%26y%3Dz&n=1&n=2 HTTP/1.0\r\nContent-Type: application/octet-stream\r\n"
+               + f"Content-Length: {len(binary_body)}\r\n\r\n".encode() + binary_body)
+        status, _, body = parse_response(serve_raw(index, raw))
+        echoed = json.loads(body)
+        assert status == 201 and echoed["args"] == {"task_id": ["x&y=z"], "n": ["1", "2"]}, echoed
+        assert echoed["path"] == "/a b" and bytes.fromhex(echoed["data"]) == binary_body, echoed
+        event = index.handle_request({"path": "/a b", "httpMethod": "POST", "isBase64Encoded": True,
+                                      "body": base64.b64encode(binary_body).decode(),
+                                      "multiValueQueryStringParameters": {"task_id": ["x&y=z"], "n": ["1", "2"]}},
+                                     None)
+        echoed = json.loads(event["body"])
+        assert event["statusCode"] == 201 and not event["isBase64Encoded"], event
+        assert echoed["args"] == {"task_id": ["x&y=z"], "n": ["1", "2"]}, echoed
+        assert bytes.fromhex(echoed["data"]) == binary_body
+    finally:
+        index.app = real_app
+    print("bridge: binary body, status, repeated headers, query encoding and request body OK")
+
+
+def legacy_bridge(index, environ):
+    """此前的做法：整体拼接后 decode 为字符串，写出时再 encode"""
+    body = b"".join(index.app(environ, lambda status, headers, exc_info=None: None)).decode("utf-8")
+    return body.encode("utf-8")
+
+
+def peak_memory(index, images: int, image_bytes: int):
+    import app as api_app
+
+    image = "data:image/png;base64," + base64.b64encode(os.urandom(image_bytes)).decode("ascii")
+    api_app.tasks.put("bench", {"status": "completed", "progress": 1.0, "images": [image] * images,
+                                "expires_at": time.time() + 3600, "parameters": {}})
+    del image
+    raw_request = b"GET /result?task_id=bench HTTP/1.0\r\n\r\n"
+
+    def drain(sock):
+        buffer = bytearray(1 << 16)  # 读取端复用固定缓冲区，不计入被测内存
+        while sock.recv_into(buffer):
+            pass
+
+    cases = {
+        "streaming handler": lambda: serve_raw(index, raw_request, drain),
+        "lambda event": lambda: index.handle_request({"path": "/result", "httpMethod": "GET",
+                                                      "queryStringParameters": {"task_id": "bench"}}, None),
+        "legacy join+decode": lambda: legacy_bridge(index, index.build_environ(
+            "GET", "/result", "task_id=bench", [], None)),
+    }
+    response_bytes = len(legacy_bridge(index, index.build_environ("GET", "/result", "task_id=bench", [], None)))
+    peaks = {}
+    for name, fn in cases.items():
+        fn()  # 预热
+        tracemalloc.start()
+        fn()
+        peaks[name] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"{name:20s} peak={peaks[name] / 1e6:6.1f}MB ({peaks[name] / response_bytes:.2f}x response)")
+    print(f"response size: {response_bytes / 1e6:.1f}MB ({images} images)")
+    assert peaks["streaming handler"] < peaks["legacy join+decode"], peaks
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=7)
+    parser.add_argument("--images", type=int, default=4)
+    parser.add_argument("--image-bytes", type=int, default=2_000_000)
+    args = parser.parse_args()
+
+    cold_start(args.runs)
+
+    os.environ.update({k: ENV[k] for k in ("TASK_STORE", "COMFY_API_HOST")})
+    sys.path.insert(0, API_DIR)
+    os.chdir(API_DIR)
+    import logging
+    import index
+    index.handler.log_message = lambda self, *args: None
+    logging.disable(logging.CRITICAL)
+    check_bridge(index)
+    peak_memory(index, args.images, args.image_bytes)
+
+
+if __name__ == "__main__":
+    main()
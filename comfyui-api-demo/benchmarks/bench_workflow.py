@@ -0,0 +1,193 @@
+# ============== 工作流生成基准测试 ==============
+# 对比 prepare_workflow 原实现（深拷贝/重建字典）与编译模板的耗时，
+# 并校验两者对相同输入生成的工作流完全一致（含键顺序）。
+# 用法: python benchmarks/bench_workflow.py [--iterations 20000]
+import argparse
+import importlib.util
+import json
+import os
+import random
+import sys
+import tempfile
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+CASES = [
+    {"prompt": "  a cat  ", "seed": 42},
+    {"prompt": "landscape", "seed": 7, "steps": 4, "guidance": 1.5, "max_shift": 1.0,
+     "base_shift": 0.3, "denoise": 0.8, "width": 1024, "height": 768, "batch_count": 3},
+    {"prompt": "batch clamp", "seed": 0, "batch_count": 99},
+    {"prompt": "batch floor", "seed": 1, "batch_count": 0},
+]
+
+API_CASES = [
+    {"prompt": "a cat", "width": 512, "height": 512, "seed": 42, "steps": 30, "guidance": 7.0,
+     "max_shift": 1.0, "base_shift": 0.5, "denoise": 1.0},
+    {"prompt": "portrait", "width": 768, "height": 1024, "seed": "123", "steps": 20, "guidance": 4.5,
+     "max_shift": 1.15, "base_shift": 0.4, "denoise": 0.9},
+]
+
+
+def legacy_app_prepare_workflow(workflow_template, max_queue_size, data):
+    """app.py 原实现：json往返深拷贝后逐项修改"""
+    workflow = json.loads(json.dumps(workflow_template))
+    batch_count = int(data.get("batch_count", 1))
+    if batch_count < 1:
+        batch_count = 1
+    elif batch_count > max_queue_size:
+        batch_count = max_queue_size
+    workflow["54"]["inputs"]["text"] = data["prompt"].strip()
+    workflow["55"]["inputs"]["seed"] = data.get("seed", random.randint(0, 0xFFFFFFFF))
+    workflow["57"]["inputs"]["number"] = ["55", 1]
+    workflow["14"]["inputs"]["seed"] = ["57", 0]
+    workflow["14"]["inputs"]["steps"] = str(data.get("steps", 30))
+    workflow["14"]["inputs"]["guidance"] = str(data.get("guidance", 3.5))
+    workflow["14"]["inputs"]["max_shift"] = str(data.get("max_shift", 1.15))
+    workflow["14"]["inputs"]["base_shift"] = str(data.get("base_shift", 0.5))
+    workflow["14"]["inputs"]["denoise"] = str(data.get("denoise", 1.0))
+    workflow["15"]["inputs"]["width"] = int(data.get("width", 512))
+    workflow["15"]["inputs"]["height"] = int(data.get("height", 1024))
+    workflow["15"]["inputs"]["batch_size"] = batch_count
+    return workflow
+
+
+def legacy_api_prepare_workflow(parameters):
+    """api/app.py 原实现：每次重建字典字面量"""
+    
+    # 从参数中提取值
+    prompt = parameters["prompt"]
+    width = parameters["width"]
+    height = parameters["height"]
+    seed = str(parameters["seed"])  # 确保转为字符串
+    steps = parameters["steps"]
+    guidance = parameters["guidance"]
+    max_shift = parameters["max_shift"]
+    base_shift = parameters["base_shift"]
+    denoise = parameters["denoise"]
+    
+    # 这里是示例工作流，实际应从文件加载或使用API查询
+    workflow = {
+        "1": {
+            "inputs": {
+                "text": prompt,
+                "clip": ["14", 0]
+            },
+            "class_type": "CLIPTextEncode"
+        },
+        "2": {
+            "inputs": {
+                "text": "bad, deformed, nsfw",
+                "clip": ["14", 0]
+            },
+            "class_type": "CLIPTextEncode"
+        },
+        "14": {
+            "inputs": {
+                "max_shift": max_shift,
+                "base_shift": base_shift,
+                "seed": ["55", 0],
+                "steps": steps,
+                "cfg": guidance,
+                "sampler_name": "dpmpp_2m",
+                "scheduler": "karras",
+                "model": ["30", 0],
+                "positive": ["1", 0],
+                "negative": ["2", 0],
+                "latent_image": ["3", 0]
+            },
+            "class_type": "FluxSamplerParams+"
+        },
+        "3": {
+            "inputs": {
+                "width": width,
+                "height": height,
+                "batch_size": 1
+            },
+            "class_type": "EmptyLatentImage"
+        },
+        "30": {
+            "inputs": {
+                "ckpt_name": "realisticVisionV51_v51VAE.safetensors"
+            },
+            "class_type": "CheckpointLoaderSimple"
+        },
+        "55": {
+            "inputs": {
+                "seed": int(seed)
+            },
+            "class_type": "Seed"
+        },
+        "57": {
+            "inputs": {
+                "value": ["55", 0]
+            },
+            "class_type": "NumberToText"
+        },
+        "6": {
+            "inputs": {
+                "samples": ["14", 0],
+                "vae": ["30", 2]
+            },
+            "class_type": "VAEDecode"
+        },
+        "7": {
+            "inputs": {
+                "filename_prefix": "ComfyUI",
+                "images": ["6", 0]
+            },
+            "class_type": "SaveImage"
+        }
+    }
+    
+    return workflow
+
+
+def load_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def same(a, b) -> bool:
+    """内容与键顺序都一致"""
+    return json.dumps(a) == json.dumps(b)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp())  # api.log 写入临时目录
+    import app as comfy_app
+    api_app = load_module("api_app", os.path.join(ROOT, "api", "app.py"))
+    comfy_app.logger.disabled = True
+    comfy_app.backend_pool.stop()
+
+    workflow_template = comfy_app.workflow_registry.get().workflow
+    for case in CASES:
+        expected = legacy_app_prepare_workflow(workflow_template, comfy_app.MAX_QUEUE_SIZE, case)
+        assert same(comfy_app.prepare_workflow(case), expected), f"app.py 输出不一致: {case}"
+    for case in API_CASES:
+        expected = legacy_api_prepare_workflow(case)
+        assert same(api_app.prepare_workflow(case), expected), f"api/app.py 输出不一致: {case}"
+    print("输出一致性校验通过")
+
+    case, api_case = CASES[1], API_CASES[0]
+    timings = {
+        "app.py legacy": lambda: legacy_app_prepare_workflow(
+            workflow_template, comfy_app.MAX_QUEUE_SIZE, case),
+        "app.py compiled": lambda: comfy_app.prepare_workflow(case),
+        "api/app.py legacy": lambda: legacy_api_prepare_workflow(api_case),
+        "api/app.py compiled": lambda: api_app.prepare_workflow(api_case),
+    }
+    for name, fn in timings.items():
+        seconds = min(timeit.repeat(fn, number=args.iterations, repeat=3))
+        print(f"{name:22s} {seconds / args.iterations * 1e6:8.2f} us/次")
+
+
+if __name__ == "__main__":
+    main()
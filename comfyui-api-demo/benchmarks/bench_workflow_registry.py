@@ -0,0 +1,98 @@
+# ============== 工作流模板注册表测试 ==============
+# 在临时目录中生成N个模板（复制 flux文生图.json 并带注释），验证：
+# - 创建注册表不读取任何文件，首次取用只解析清单与该模板（不随模板数量增加编译开销）
+# - 未修改时取用直接返回编译结果；修改模板文件后自动重新加载，改坏时继续使用上一个版本
+# - 注释剥离不影响字符串中的 //（如URL）
+# 用法: python benchmarks/bench_workflow_registry.py [--templates 10 100 1000]
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import timeit
+from pathlib import Path
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from workflow_registry import WorkflowRegistry, WorkflowError, strip_json_comments  # noqa: E402
+
+COMMENT_HEADER = "// 由测试生成\n/* 块注释\n   跨多行 */\n"
+
+
+def make_templates(directory: Path, count: int) -> Path:
+    manifest = json.loads(Path(ROOT, "workflows.json").read_text(encoding="utf-8"))
+    spec = manifest["templates"]["flux"]
+    source = Path(ROOT, spec["file"]).read_text(encoding="utf-8-sig")
+    templates = {}
+    for i in range(count):
+        name = f"flux{i}"
+        (directory / f"{name}.json").write_text(COMMENT_HEADER + source, encoding="utf-8")
+        templates[name] = dict(spec, file=f"{name}.json")
+    path = directory / "workflows.json"
+    path.write_text(json.dumps({"default": "flux0", "templates": templates}, ensure_ascii=False), encoding="utf-8")
+    return path
+
+
+def touch_later(path: Path, text: str):
+    """写入新内容并确保修改时间变化（部分文件系统时间戳精度较低）"""
+    before = os.stat(path).st_mtime_ns
+    path.write_text(text, encoding="utf-8")
+    if os.stat(path).st_mtime_ns == before:
+        os.utime(path, ns=(before + 1_000_000, before + 1_000_000))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--templates", type=int, nargs="+", default=[10, 100, 1000])
+    args = parser.parse_args()
+
+    text = '{"url": "http://example.com/a//b", "s": "/* keep */"} // trailing\n'
+    assert json.loads(strip_json_comments(text)) == {"url": "http://example.com/a//b", "s": "/* keep */"}
+
+    for count in args.templates:
+        directory = Path(tempfile.mkdtemp())
+        manifest = make_templates(directory, count)
+        start = time.perf_counter()
+        registry = WorkflowRegistry(manifest)
+        startup = time.perf_counter() - start
+        start = time.perf_counter()
+        registry.get()
+        first = time.perf_counter() - start
+        cached = min(timeit.repeat(registry.get, number=2000, repeat=3)) / 2000
+        assert registry.stats()["loads"] == 1
+        print(f"{count:5d} templates: startup={startup * 1e6:.0f}us | first get={first * 1000:.2f}ms "
+              f"| cached get={cached * 1e6:.2f}us")
+        shutil.rmtree(directory)
+
+    # 热重载
+    directory = Path(tempfile.mkdtemp())
+    manifest = make_templates(directory, 2)
+    registry = WorkflowRegistry(manifest)
+    template = registry.get("flux1")
+    path = directory / "flux1.json"
+    source = path.read_text(encoding="utf-8")
+    touch_later(path, source.replace('"steps": "30"', '"steps": "12"'))
+    start = time.perf_counter()
+    reloaded = registry.get("flux1")
+    print(f"reload after edit: {(time.perf_counter() - start) * 1000:.2f}ms")
+    assert reloaded is not template and reloaded.fingerprint != template.fingerprint
+    assert reloaded.workflow["14"]["inputs"]["steps"] == "12"
+
+    touch_later(path, source.replace('"class_type": "SaveImage"', '"class_type": "PreviewImage"'))
+    assert registry.get("flux1") is reloaded, "模板改坏后应继续使用上一个版本"
+    assert registry.stats()["errors"] == 1
+    registry.get("flux1")
+    assert registry.stats()["errors"] == 1, "文件再次修改前不应重复尝试加载"
+    try:
+        registry.get("missing")
+    except WorkflowError as e:
+        print(f"unknown template: {e}")
+    else:
+        raise AssertionError("未知模板应抛出 WorkflowNotFound")
+    shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
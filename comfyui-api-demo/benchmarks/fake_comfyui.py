@@ -0,0 +1,357 @@
+# ============== 本地模拟ComfyUI服务 ==============
+# 供基准测试使用的最小ComfyUI替身：/prompt、/queue（含删除）、/interrupt、/history、/view、/ws
+# 统计新建TCP连接数，用于对比连接池效果
+# 输出图片的数量与大小可配置；指定 output_dir 时按 SaveImage 的 filename_prefix 写入输出文件
+# job_cost(prompt) 可按提交的工作流（步数、尺寸等）决定每个任务的执行时间
+import base64
+import hashlib
+import json
+import math
+import os
+import socket
+import struct
+import threading
+import time
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def _png_chunk(kind: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+
+# /view 返回的1x1灰色PNG
+SAMPLE_PNG = (b"\x89PNG\r\n\x1a\n"
+              + _png_chunk(b"IHDR", struct.pack(">IIBBBBB", 1, 1, 8, 0, 0, 0, 0))
+              + _png_chunk(b"IDAT", zlib.compress(b"\x00\x80"))
+              + _png_chunk(b"IEND", b""))
+
+
+def sample_png(size: int = 0) -> bytes:
+    """约 size 字节的有效PNG（在1x1图片中加入随机内容的私有辅助块，解码器会忽略）"""
+    padding = size - len(SAMPLE_PNG) - 12
+    if padding <= 0:
+        return SAMPLE_PNG
+    return SAMPLE_PNG[:-12] + _png_chunk(b"pdDg", os.urandom(padding)) + SAMPLE_PNG[-12:]
+
+
+class _Server(ThreadingHTTPServer):
+    # 默认监听队列只有5，并发新建连接时SYN被丢弃、客户端1秒后重传甚至连接失败
+    request_queue_size = 128
+    daemon_threads = True
+
+
+class FakeComfyUI:
+    """可配置的ComfyUI替身（在后台线程运行）"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, job_latency: float = 0.0,
+                 response_delay: float = 0.0, serial: bool = False, progress_steps: int = 0,
+                 images_per_job: int = 1, image_bytes: int = 0, output_dir=None, job_cost=None):
+        self.job_latency = job_latency
+        self.job_cost = job_cost
+        self.images_per_job = images_per_job
+        self.image = sample_png(image_bytes)  # /view 返回的图片内容
+        self.output_dir = output_dir
+        # 执行期间均匀推送的 progress 事件数（模拟采样步数），0表示不推送
+        self.progress_steps = progress_steps
+        self.response_delay = response_delay
+        # serial=True 时任务依次执行（模拟单块GPU），否则各任务互不影响
+        self.serial = serial
+        self.busy_until = 0.0
+        self.busy_seconds = 0.0  # 已完成任务的执行时间之和（serial 时即GPU忙碌时间）
+        self.connections = 0
+        self.requests = 0
+        self.bytes_sent = 0  # /view 返回的图片字节数
+        self.prefixes = {}  # prompt_id -> 输出文件名前缀
+        self.lock = threading.Lock()
+        self.jobs = {}  # prompt_id -> 预计完成时间（job_latency为None时只能通过finish完成）
+        self.started = {}  # prompt_id -> 开始执行的时间（/history 的 execution_start 时间戳）
+        self.latencies = {}  # prompt_id -> 执行时间
+        self.timers = {}  # prompt_id -> 未触发的事件定时器，删除/中断任务时取消并重新安排后面的任务
+        self.deleted = []  # 从队列删除的任务
+        self.interrupted = []  # 执行中被中断的任务
+        self.ws_clients = []  # 已连接的websocket
+        self.sockets = set()  # 所有已建立的连接，stop时一并断开（模拟节点宕机）
+        self.ws_lock = threading.Lock()
+
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                # 与ComfyUI（aiohttp）一致关闭Nagle算法：响应头与响应体分两次写入，
+                # 否则keep-alive连接上每个请求都要等待客户端的延迟确认（约40ms）
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                with fake.lock:
+                    fake.connections += 1
+                    fake.sockets.add(self.connection)
+
+            def finish(self):
+                with fake.lock:
+                    fake.sockets.discard(self.connection)
+                super().finish()
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, data, status=200):
+                body = json.dumps(data).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                fake._count()
+                path = self.path.split("?")[0]
+                if path == "/ws":
+                    fake.accept_websocket(self)
+                elif path == "/queue":
+                    self._send_json(fake.queue_state())
+                elif path.startswith("/history"):
+                    task_id = path[len("/history/"):] if path.startswith("/history/") else None
+                    self._send_json(fake.history(task_id))
+                elif path == "/view":
+                    with fake.lock:
+                        fake.bytes_sent += len(fake.image)
+                    self.send_response(200)
+                    self.send_header("Content-Type", "image/png")
+                    self.send_header("Content-Length", str(len(fake.image)))
+                    self.end_headers()
+                    self.wfile.write(fake.image)
+                else:
+                    self._send_json({"error": "not found"}, 404)
+
+            def do_POST(self):
+                fake._count()
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                path = self.path.split("?")[0]
+                if path in ("/prompt", "/api/prompt"):
+                    self._send_json(fake.submit(payload))
+                elif path in ("/queue", "/api/queue"):
+                    fake.delete(payload.get("delete") or [])
+                    self._send_json({})
+                elif path in ("/interrupt", "/api/interrupt"):
+                    fake.interrupt(payload.get("prompt_id"))
+                    self._send_json({})
+                else:
+                    self._send_json({"error": "not found"}, 404)
+
+        self.server = _Server((host, port), Handler)
+        self.url = f"http://{host}:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def _count(self):
+        with self.lock:
+            self.requests += 1
+        if self.response_delay:
+            time.sleep(self.response_delay)
+
+    # ---------- 任务模拟 ----------
+    def submit(self, payload: dict) -> dict:
+        prompt_id = payload.get("prompt_id") or str(uuid.uuid4())
+        prefix = next((node["inputs"].get("filename_prefix") for node in (payload.get("prompt") or {}).values()
+                       if isinstance(node, dict) and node.get("class_type") == "SaveImage"), None)
+        prefix = prefix if prefix and prefix != "ComfyUI" else f"ComfyUI_{prompt_id}"
+        if self.output_dir is not None:
+            # 提交时即写入输出文件，任务完成的事件到达时文件一定已存在
+            for name in self.output_names(prefix):
+                with open(os.path.join(self.output_dir, name), "wb") as f:
+                    f.write(self.image)
+        latency = self.job_cost(payload.get("prompt") or {}) if self.job_cost else self.job_latency
+        now = time.time()
+        with self.lock:
+            if latency is None:
+                done_at = float("inf")
+            elif self.serial:
+                done_at = self.busy_until = max(now, self.busy_until) + latency
+            else:
+                done_at = now + latency
+            started_at = done_at - latency if latency is not None else now
+            self.jobs[prompt_id] = done_at
+            self.started[prompt_id] = started_at
+            self.latencies[prompt_id] = latency
+            self.prefixes[prompt_id] = prefix
+        self._arm(prompt_id, started_at, latency)
+        return {"prompt_id": prompt_id, "number": len(self.jobs), "node_errors": {}}
+
+    def _arm(self, prompt_id: str, started_at: float, latency: float):
+        """安排任务的 execution_start、progress 与完成事件"""
+        now = time.time()
+        # serial 时排在后面的任务轮到执行时才推送 execution_start
+        timers = [self._schedule(started_at - now, {"type": "execution_start", "data": {"prompt_id": prompt_id}})]
+        if latency is not None:
+            timers.append(self._timer(started_at + latency - now, self._finish, prompt_id, latency))
+            for step in range(1, self.progress_steps + 1):
+                event = {"type": "progress", "data": {"value": step, "max": self.progress_steps,
+                                                      "prompt_id": prompt_id}}
+                timers.append(self._schedule(started_at + latency * step / (self.progress_steps + 1) - now, event))
+        with self.lock:
+            self.timers[prompt_id] = [timer for timer in timers if timer is not None]
+
+    def _timer(self, delay: float, fn, *args) -> threading.Timer:
+        timer = threading.Timer(max(delay, 0.0), fn, args=args)
+        timer.daemon = True
+        timer.start()
+        return timer
+
+    def _schedule(self, delay: float, event: dict):
+        if delay <= 0:
+            self.broadcast(event)
+            return None
+        return self._timer(delay, self.broadcast, event)
+
+    def delete(self, prompt_ids):
+        """从队列删除尚未开始执行的任务"""
+        for prompt_id in prompt_ids:
+            self._cancel(prompt_id, running=False)
+
+    def interrupt(self, prompt_id: str = None):
+        """中断正在执行的任务；指定 prompt_id 时只在该任务正在执行时中断"""
+        running = self.queue_state()["queue_running"]
+        if running and prompt_id in (None, running[0][1]):
+            self._cancel(running[0][1], running=True)
+
+    def _cancel(self, prompt_id: str, running: bool):
+        """删除（running=False）或中断（running=True）任务；serial 时排在后面的任务相应提前"""
+        now = time.time()
+        with self.lock:
+            done_at = self.jobs.get(prompt_id)
+            if done_at is None or self._done(done_at) or (self.started[prompt_id] <= now) != running:
+                return
+            started_at = self.started[prompt_id]
+            freed = 0.0 if math.isinf(done_at) else done_at - max(now, started_at)
+            timers = self.timers.pop(prompt_id, [])
+            if running:
+                self.jobs[prompt_id] = now
+                self.busy_seconds += now - started_at
+                self.interrupted.append(prompt_id)
+            else:
+                del self.jobs[prompt_id]
+                self.deleted.append(prompt_id)
+            later = []
+            if self.serial and freed:
+                for pid in self.jobs:
+                    if self.started[pid] >= done_at and not self._done(self.jobs[pid]):
+                        self.jobs[pid] -= freed
+                        self.started[pid] -= freed
+                        timers.extend(self.timers.pop(pid, []))
+                        later.append(pid)
+                self.busy_until -= freed
+        for timer in timers:
+            timer.cancel()
+        for pid in later:
+            self._arm(pid, self.started[pid], self.latencies[pid])
+        if running:
+            self.broadcast({"type": "execution_interrupted", "data": {"prompt_id": prompt_id}})
+
+    def finish(self, prompt_ids):
+        """立即完成指定任务（用于精确控制完成时刻）"""
+        now = time.time()
+        with self.lock:
+            for prompt_id in prompt_ids:
+                self.jobs[prompt_id] = now
+        for prompt_id in prompt_ids:
+            self._finish(prompt_id)
+
+    def _finish(self, prompt_id: str, latency: float = None):
+        if latency:
+            with self.lock:
+                self.busy_seconds += latency
+        output = self.history(prompt_id)[prompt_id]["outputs"]["17"]
+        self.broadcast({"type": "executed", "data": {"node": "17", "output": output, "prompt_id": prompt_id}})
+        self.broadcast({"type": "executing", "data": {"node": None, "prompt_id": prompt_id}})
+
+    # ---------- websocket ----------
+    def accept_websocket(self, handler):
+        """完成握手后保持连接，由 broadcast 推送事件"""
+        key = handler.headers.get("Sec-WebSocket-Key", "")
+        accept = base64.b64encode(
+            hashlib.sha1((key + "258EAFA5-E914-47DA-95CA-C5AB0DC85B11").encode()).digest()).decode()
+        handler.send_response(101)
+        handler.send_header("Upgrade", "websocket")
+        handler.send_header("Connection", "Upgrade")
+        handler.send_header("Sec-WebSocket-Accept", accept)
+        handler.end_headers()
+        handler.wfile.flush()
+        with self.lock:
+            self.ws_clients.append(handler.wfile)
+        # 阻塞直到客户端断开（不解析客户端帧）
+        try:
+            while handler.rfile.read(1):
+                pass
+        except OSError:
+            pass
+        with self.lock:
+            if handler.wfile in self.ws_clients:
+                self.ws_clients.remove(handler.wfile)
+        handler.close_connection = True
+
+    def broadcast(self, message: dict):
+        payload = json.dumps(message).encode("utf-8")
+        if len(payload) < 126:
+            header = struct.pack("!BB", 0x81, len(payload))
+        elif len(payload) < 65536:
+            header = struct.pack("!BBH", 0x81, 126, len(payload))
+        else:
+            header = struct.pack("!BBQ", 0x81, 127, len(payload))
+        with self.lock:
+            clients = list(self.ws_clients)
+        with self.ws_lock:  # 避免多个线程交错写入帧
+            for wfile in clients:
+                try:
+                    wfile.write(header + payload)
+                    wfile.flush()
+                except OSError:
+                    pass
+
+    def _done(self, done_at: float) -> bool:
+        return time.time() >= done_at
+
+    def queue_state(self) -> dict:
+        with self.lock:
+            pending = [[i, pid, {}, {}, []] for i, (pid, t) in enumerate(self.jobs.items())
+                       if not self._done(t)]
+        return {"queue_running": pending[:1], "queue_pending": pending[1:]}
+
+    def history(self, task_id: str = None) -> dict:
+        with self.lock:
+            items = [(task_id, self.jobs.get(task_id))] if task_id else list(self.jobs.items())
+        result = {}
+        for pid, t in items:
+            if t is not None and self._done(t):
+                prefix = self.prefixes.get(pid, f"ComfyUI_{pid}")
+                result[pid] = {
+                    "outputs": {"17": {"images": [
+                        {"filename": name, "subfolder": "", "type": "output"} for name in self.output_names(prefix)
+                    ]}},
+                    "status": {"status_str": "success", "completed": True, "messages": [
+                        ["execution_start", {"prompt_id": pid, "timestamp": int(self.started.get(pid, t) * 1000)}],
+                        ["execution_success", {"prompt_id": pid, "timestamp": int(t * 1000)}],
+                    ]},
+                }
+        return result
+
+    def output_names(self, prefix: str) -> list:
+        return [f"{prefix}_{i:05d}_.png" for i in range(1, self.images_per_job + 1)]
+
+    # ---------- 生命周期 ----------
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        with self.lock:
+            sockets = list(self.sockets)
+        for sock in sockets:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
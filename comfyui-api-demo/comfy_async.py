@@ -0,0 +1,218 @@
+# ============== ComfyUI 异步客户端 ==============
+# ASGI 模式（asgi.py、api/asgi.py）使用的 aiohttp 客户端，行为与 ComfyClient 一致：
+# - 每个客户端一个 ClientSession 连接池（keep-alive），等待ComfyUI时只挂起协程，不占用线程
+# - 按端点配置 (连接超时, 读取超时)
+# - 重试策略：连接失败对所有方法重试；读取失败/5xx 仅对幂等的 GET 重试，避免重复提交任务
+# - 请求观察者与同步客户端共用（/metrics 的上游阶段耗时）
+# AsyncEventListener 以协程订阅 /ws 事件通道，写入与线程版相同的 TaskTracker。
+import asyncio
+import json
+import logging
+import time
+import uuid
+
+import aiohttp
+
+from comfy_client import DEFAULT_TIMEOUTS, endpoint_for, has_observers, notify_observers
+from comfy_events import track_running
+
+logger = logging.getLogger("ComfyUI-API")
+
+# 连接池大小：协程不受线程数限制，可同时保持更多连接
+DEFAULT_POOL_SIZE = 100
+RETRY_STATUS = (502, 503, 504)
+MAX_RETRIES = 2
+RETRY_BACKOFF = 0.2
+
+
+class ComfyRequestError(Exception):
+    """请求ComfyUI失败（连接/读取异常、超时或错误状态码）"""
+
+
+class AsyncResponse:
+    """已读取完整响应体的ComfyUI响应"""
+    __slots__ = ("status_code", "headers", "content")
+
+    def __init__(self, status_code: int, headers, content: bytes):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise ComfyRequestError(f"ComfyUI返回错误状态码: {self.status_code}")
+
+
+class AsyncComfyClient:
+    """协程安全的ComfyUI客户端（ClientSession 在首次请求时于当前事件循环中创建）"""
+
+    def __init__(self, base_url: str, pool_size: int = DEFAULT_POOL_SIZE, timeouts: dict = None):
+        self.base_url = base_url.rstrip("/")
+        # 用于websocket事件订阅，提交任务时一并发送
+        self.client_id = uuid.uuid4().hex
+        self.pool_size = pool_size
+        self.timeouts = dict(DEFAULT_TIMEOUTS)
+        if timeouts:
+            self.timeouts.update(timeouts)
+        self.session = None
+
+    def _session(self) -> aiohttp.ClientSession:
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.pool_size))
+        return self.session
+
+    async def request(self, method: str, path: str, **kwargs) -> AsyncResponse:
+        """发送请求并读取完整响应体（未指定timeout时使用端点默认超时），失败时抛出 ComfyRequestError"""
+        endpoint = endpoint_for(path, self.timeouts)
+        connect, read = kwargs.pop("timeout", self.timeouts[endpoint])
+        timeout = aiohttp.ClientTimeout(sock_connect=connect, sock_read=read)
+        start = time.perf_counter() if has_observers() else None
+        for attempt in range(MAX_RETRIES + 1):
+            last_attempt = attempt == MAX_RETRIES
+            try:
+                async with self._session().request(method, f"{self.base_url}{path}", timeout=timeout,
+                                                   **kwargs) as response:
+                    content = await response.read()
+                if response.status in RETRY_STATUS and method == "GET" and not last_attempt:
+                    await asyncio.sleep(RETRY_BACKOFF * 2 ** attempt)
+                    continue
+                if start is not None:
+                    notify_observers(endpoint, time.perf_counter() - start, response.status >= 500)
+                return AsyncResponse(response.status, response.headers, content)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                retryable = method == "GET" or isinstance(e, aiohttp.ClientConnectorError)
+                if retryable and not last_attempt:
+                    await asyncio.sleep(RETRY_BACKOFF * 2 ** attempt)
+                    continue
+                if start is not None:
+                    notify_observers(endpoint, time.perf_counter() - start, True)
+                raise ComfyRequestError(f"请求ComfyUI失败 ({method} {path}): {str(e) or type(e).__name__}")
+
+    async def get_json(self, path: str, **kwargs):
+        response = await self.request("GET", path, **kwargs)
+        response.raise_for_status()
+        return response.json()
+
+    # ---------- 常用端点 ----------
+    async def get_queue(self) -> dict:
+        return await self.get_json("/queue")
+
+    async def get_history(self, task_id: str = None) -> dict:
+        path = f"/history/{task_id}" if task_id else "/history"
+        return await self.get_json(path)
+
+    async def submit_prompt(self, workflow: dict, path: str = "/prompt", prompt_id: str = None) -> dict:
+        """提交工作流，返回ComfyUI响应（包含prompt_id）；可指定prompt_id以便提交前确定任务ID"""
+        payload = {"prompt": workflow, "client_id": self.client_id}
+        if prompt_id:
+            payload["prompt_id"] = prompt_id
+        response = await self.request("POST", path, json=payload)
+        response.raise_for_status()
+        return response.json()
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+class AsyncEventListener:
+    """ComfyUI websocket 事件监听协程（自动重连），与 EventListener 行为一致"""
+
+    def __init__(self, client: AsyncComfyClient, tracker, task_filter=None, reconnect_delay: float = 1.0,
+                 max_reconnect_delay: float = 30.0):
+        self.client = client
+        self.tracker = tracker
+        self.task_filter = task_filter
+        # 该节点上正在执行的任务（预览帧归属于它）
+        self.running_task = None
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.connected = False
+        self._task = None
+
+    @property
+    def ws_url(self) -> str:
+        base = self.client.base_url.replace("https://", "wss://").replace("http://", "ws://")
+        return f"{base}/ws?clientId={self.client.client_id}"
+
+    async def run(self):
+        delay = self.reconnect_delay
+        while True:
+            try:
+                ws = await asyncio.wait_for(self.client._session().ws_connect(self.ws_url, max_msg_size=0), 10)
+                async with ws:
+                    await self._resync()
+                    self.connected = True
+                    delay = self.reconnect_delay
+                    logger.info(f"已连接ComfyUI事件通道: {self.ws_url}")
+                    await self._receive_loop(ws)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"ComfyUI事件通道断开: {str(e) or type(e).__name__}，{delay:.0f}秒后重连")
+            finally:
+                self.connected = False
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+    async def _resync(self):
+        """断线重连后根据 /queue 与 /history 重新同步未结束的任务"""
+        for task_id in self.tracker.apply_queue(await self.client.get_queue(), self.task_filter):
+            history = await self.client.get_history(task_id)
+            if task_id in history:
+                self.tracker.record_history(task_id, history[task_id])
+
+    async def _receive_loop(self, ws):
+        async for message in ws:
+            if message.type == aiohttp.WSMsgType.BINARY:
+                self.tracker.record_preview(message.data, self.running_task)
+                continue
+            if message.type != aiohttp.WSMsgType.TEXT:
+                break
+            try:
+                event = json.loads(message.data)
+            except ValueError:
+                logger.warning("无法解析ComfyUI事件")
+                continue
+            self.running_task = track_running(self.running_task, event)
+            self.tracker.handle_message(event)
+        raise ConnectionError("连接已关闭")
+
+    def start(self):
+        """在当前事件循环中启动监听"""
+        self._task = asyncio.get_running_loop().create_task(self.run(), name="comfyui-events")
+        return self
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+
+# ============== 共享实例 ==============
+_clients = {}
+
+
+def get_async_client(base_url: str) -> AsyncComfyClient:
+    """按地址获取共享的异步客户端（进程内单例，只在一个事件循环中使用）"""
+    key = base_url.rstrip("/")
+    client = _clients.get(key)
+    if client is None:
+        client = _clients[key] = AsyncComfyClient(key)
+    return client
+
+
+async def close_async_clients():
+    for client in list(_clients.values()):
+        await client.close()
@@ -0,0 +1,159 @@
+# ============== ComfyUI HTTP客户端 ==============
+# app.py 与 api/app.py 共用的 ComfyUI 客户端：
+# - 单个 requests.Session + HTTPAdapter 连接池，保持 keep-alive，避免每次调用新建TCP连接
+# - 按端点配置 (连接超时, 读取超时)
+# - 重试策略：连接失败对所有方法重试；读取失败/5xx 仅对幂等的 GET 重试，避免重复提交任务
+# - add_request_observer 注册的回调在每次请求结束后收到 (端点, 耗时, 是否失败)，用于统计上游延迟
+import threading
+import time
+import uuid
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# 各端点超时 (连接超时, 读取超时)，单位秒
+DEFAULT_TIMEOUTS = {
+    "queue": (3, 5),
+    "prompt": (3, 30),
+    "history": (3, 10),
+    "view": (3, 30),
+    "interrupt": (3, 5),
+    "default": (3, 10),
+}
+
+# 连接池大小：应不小于同时访问ComfyUI的线程数
+DEFAULT_POOL_SIZE = 32
+
+# 请求观察者（对所有客户端生效）
+_observers = []
+
+
+def add_request_observer(callback):
+    """注册回调 callback(端点, 耗时秒数, 是否失败)；失败指连接/读取异常或5xx响应"""
+    _observers.append(callback)
+
+
+def has_observers() -> bool:
+    return bool(_observers)
+
+
+def notify_observers(endpoint: str, seconds: float, failed: bool):
+    for callback in _observers:
+        callback(endpoint, seconds, failed)
+
+
+def endpoint_for(path: str, timeouts: dict) -> str:
+    """根据路径确定端点，如 /history/xxx -> history"""
+    for part in path.strip("/").split("/"):
+        if part in timeouts:
+            return part
+    return "default"
+
+
+def build_retry() -> Retry:
+    """构建重试策略"""
+    return Retry(
+        total=3,
+        connect=2,
+        read=2,
+        status=2,
+        backoff_factor=0.2,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset({"GET"}),
+        raise_on_status=False,
+    )
+
+
+class ComfyClient:
+    """线程安全的ComfyUI客户端
+
+    Session 底层的 urllib3 连接池是线程安全的，客户端本身不保存任何可变的会话状态，
+    因此同一个实例可以被所有请求线程共享。
+    """
+
+    def __init__(self, base_url: str, pool_size: int = DEFAULT_POOL_SIZE, timeouts: dict = None):
+        self.base_url = base_url.rstrip("/")
+        # 用于websocket事件订阅，提交任务时一并发送
+        self.client_id = uuid.uuid4().hex
+        self.timeouts = dict(DEFAULT_TIMEOUTS)
+        if timeouts:
+            self.timeouts.update(timeouts)
+
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_size,
+            max_retries=build_retry(),
+            pool_block=False,
+        )
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def request(self, method: str, path: str, **kwargs) -> requests.Response:
+        """发送请求（未指定timeout时使用端点默认超时）"""
+        endpoint = endpoint_for(path, self.timeouts)
+        kwargs.setdefault("timeout", self.timeouts[endpoint])
+        if not _observers:
+            return self.session.request(method, f"{self.base_url}{path}", **kwargs)
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, f"{self.base_url}{path}", **kwargs)
+        except requests.RequestException:
+            notify_observers(endpoint, time.perf_counter() - start, True)
+            raise
+        notify_observers(endpoint, time.perf_counter() - start, response.status_code >= 500)
+        return response
+
+    def get_json(self, path: str, **kwargs):
+        response = self.request("GET", path, **kwargs)
+        response.raise_for_status()
+        return response.json()
+
+    # ---------- 常用端点 ----------
+    def get_queue(self) -> dict:
+        return self.get_json("/queue")
+
+    def get_history(self, task_id: str = None) -> dict:
+        path = f"/history/{task_id}" if task_id else "/history"
+        return self.get_json(path)
+
+    def submit_prompt(self, workflow: dict, path: str = "/prompt", prompt_id: str = None) -> dict:
+        """提交工作流，返回ComfyUI响应（包含prompt_id）；可指定prompt_id以便提交前确定任务ID"""
+        payload = {"prompt": workflow, "client_id": self.client_id}
+        if prompt_id:
+            payload["prompt_id"] = prompt_id
+        response = self.request("POST", path, json=payload)
+        response.raise_for_status()
+        return response.json()
+
+    def delete_queued(self, prompt_ids: list):
+        """从队列中删除尚未开始执行的任务"""
+        response = self.request("POST", "/queue", json={"delete": list(prompt_ids)})
+        response.raise_for_status()
+
+    def interrupt(self, prompt_id: str = None):
+        """中断正在执行的任务（较新的ComfyUI只在指定任务正在执行时中断）"""
+        response = self.request("POST", "/interrupt", json={"prompt_id": prompt_id} if prompt_id else None)
+        response.raise_for_status()
+
+    def close(self):
+        self.session.close()
+
+
+# ============== 共享实例 ==============
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(base_url: str) -> ComfyClient:
+    """按地址获取共享客户端（进程内单例）"""
+    key = base_url.rstrip("/")
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = ComfyClient(key)
+                _clients[key] = client
+    return client
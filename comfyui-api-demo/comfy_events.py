@@ -0,0 +1,555 @@
+# ============== ComfyUI 事件跟踪 ==============
+# 后台线程订阅 ComfyUI 的 /ws 事件通道，将 executing/executed/execution_error 等事件
+# 写入进程内任务状态表，/result 可直接从内存应答，无需每次请求 /history。
+# 断线重连后通过 /queue 与 /history 重新同步，避免遗漏断线期间的事件。
+# 等待任务状态变化既可阻塞线程（条件变量），也可挂起协程（ASGI模式，见 comfy_async.py）。
+# asyncio 与 websocket-client 在用到时才导入，只查询任务状态的进程（如无服务器函数冷启动）不加载它们。
+import bisect
+import importlib.util
+import json
+import logging
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+# websocket-client 为可选依赖，缺失时退回轮询
+HAS_WEBSOCKET = importlib.util.find_spec("websocket") is not None
+
+logger = logging.getLogger("ComfyUI-API")
+
+# 任务状态
+PENDING = "pending"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATES = (COMPLETED, FAILED, CANCELLED)
+
+# 二进制消息类型：预览图
+PREVIEW_IMAGE = 1
+
+
+def queue_items(queue_section: list) -> list:
+    """从 /queue 返回的 queue_running/queue_pending 中提取 (prompt_id, number)
+
+    ComfyUI 队列项格式为 [number, prompt_id, prompt, extra_data, outputs_to_execute]
+    """
+    items = []
+    for item in queue_section or []:
+        if isinstance(item, (list, tuple)) and len(item) > 1:
+            items.append((item[1], item[0]))
+        elif isinstance(item, dict) and "prompt_id" in item:
+            items.append((item["prompt_id"], item.get("number")))
+    return items
+
+
+def queue_prompt_ids(queue_section: list) -> list:
+    """从 /queue 返回的队列中提取 prompt_id 列表"""
+    return [prompt_id for prompt_id, _ in queue_items(queue_section)]
+
+
+def track_running(running_task, event: dict):
+    """根据事件返回节点上正在执行的任务（预览帧不带prompt_id，归属于它）"""
+    msg_type = event.get("type")
+    data = event.get("data") or {}
+    task_id = data.get("prompt_id")
+    if not task_id:
+        return running_task
+    if msg_type in ("execution_start", "progress") or (msg_type == "executing" and data.get("node") is not None):
+        return task_id
+    if msg_type in ("executing", "execution_success", "execution_error", "execution_interrupted"):
+        if running_task == task_id:
+            return None
+    return running_task
+
+
+def history_run_seconds(history_entry: dict):
+    """/history 记录中从 execution_start 到 execution_success 的耗时（秒），缺少时间戳时返回None"""
+    timestamps = {}
+    for message in (history_entry.get("status") or {}).get("messages") or []:
+        if isinstance(message, (list, tuple)) and len(message) > 1 and isinstance(message[1], dict):
+            timestamps[message[0]] = message[1].get("timestamp")
+    start, end = timestamps.get("execution_start"), timestamps.get("execution_success")
+    if start is None or end is None:
+        return None
+    return max(end - start, 0) / 1000  # ComfyUI的时间戳单位为毫秒
+
+
+def _resolve_all(futures: list):
+    for future in futures:
+        if not future.done():
+            future.set_result(None)
+
+
+class TaskTracker:
+    """进程内任务状态表（线程安全）
+
+    每个任务有独立的条件变量（共享同一把锁），状态变化只唤醒该任务的等待者；
+    任务结束时排队位置整体前移，此时另外只唤醒关注排队位置的等待者（事件流），
+    只等待结果的长轮询请求不受其他任务影响。
+    协程等待者登记为事件循环中的 Future，由写入方通过 call_soon_threadsafe 唤醒。
+    """
+
+    def __init__(self, max_tasks: int = 10000):
+        self.max_tasks = max_tasks
+        self.tasks = OrderedDict()
+        self.lock = threading.Lock()
+        self.conditions = {}
+        # 协程等待者：task_id -> [(事件循环, Future, 是否关注排队位置变化)]
+        self.async_waiters = {}
+        # 关注排队位置变化的等待者（线程与协程）：task_id -> 数量
+        self.position_waiters = {}
+        # 每有任务结束加一，用于通知排队位置变化
+        self.epoch = 0
+        # 当前正在执行的任务（预览帧不带prompt_id，归属于它）
+        self.running_task = None
+        # 任务结束回调 callback(task_id, status)（在锁内调用，必须快速返回且不能访问本对象）
+        self.finish_callbacks = []
+        # 任务成功结束且已知执行耗时的回调 callback(task_id, 秒数)（同上，先于结束回调调用）
+        self.timing_callbacks = []
+        # 尚未提交给ComfyUI的任务的排队位置（由本地调度器提供，在锁内调用）
+        self.position_source = None
+        # 已提交且未结束的任务的ComfyUI队列序号（有序），排队位置 = 序号更小的任务数
+        self.numbers = []
+
+    # ---------- 查询 ----------
+    def _snapshot(self, task_id: str):
+        state = self.tasks.get(task_id)
+        if state is None:
+            return None
+        snapshot = dict(state, outputs=dict(state["outputs"]))
+        snapshot["position"] = self._position(task_id, state)
+        return snapshot
+
+    def _position(self, task_id: str, state: dict):
+        """排队位置：前面还有多少个未结束的任务（运行中为0，未知为None）"""
+        if state["status"] != PENDING:
+            return 0 if state["status"] == RUNNING else None
+        if state["number"] is None:
+            return self.position_source(task_id) if self.position_source else None
+        return bisect.bisect_left(self.numbers, state["number"])
+
+    def get(self, task_id: str):
+        """返回任务状态快照，未跟踪的任务返回None"""
+        with self.lock:
+            return self._snapshot(task_id)
+
+    def wait_for_change(self, task_id: str, version: int, epoch: int, timeout: float):
+        """阻塞直到任务版本号超过version、有任务结束(epoch变化)或超时
+
+        返回 (最新快照, 当前epoch)
+        """
+        with self.lock:
+            cond = self._condition(task_id)
+            self._subscribe_positions(task_id)
+            try:
+                cond.wait_for(lambda: self.epoch != epoch or self._version(task_id) > version, timeout)
+            finally:
+                self._unsubscribe_positions(task_id)
+            return self._snapshot(task_id), self.epoch
+
+    def wait_until_finished(self, task_id: str, timeout: float):
+        """阻塞直到任务结束或超时（条件变量唤醒，不轮询），返回最新快照"""
+        with self.lock:
+            cond = self._condition(task_id)
+            cond.wait_for(lambda: self._finished(task_id), timeout)
+            return self._snapshot(task_id)
+
+    async def wait_for_change_async(self, task_id: str, version: int, epoch, timeout: float):
+        """wait_for_change 的协程版本（挂起协程，不占用线程）
+
+        epoch 为None时只等待该任务自身的变化，不因其他任务结束（排队位置变化）而唤醒
+        """
+        positions = epoch is not None
+        await self._wait_async(task_id, lambda: (positions and self.epoch != epoch)
+                               or self._version(task_id) > version, timeout, positions)
+        with self.lock:
+            return self._snapshot(task_id), self.epoch
+
+    async def wait_until_finished_async(self, task_id: str, timeout: float):
+        """wait_until_finished 的协程版本（挂起协程，不占用线程）"""
+        await self._wait_async(task_id, lambda: self._finished(task_id), timeout)
+        return self.get(task_id)
+
+    async def _wait_async(self, task_id: str, predicate, timeout: float, positions: bool = False):
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            with self.lock:
+                remaining = deadline - loop.time()
+                if predicate() or remaining <= 0:
+                    return
+                waiter = (loop, loop.create_future(), positions)
+                self.async_waiters.setdefault(task_id, []).append(waiter)
+                if positions:
+                    self._subscribe_positions(task_id)
+            try:
+                await asyncio.wait_for(waiter[1], remaining)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                with self.lock:
+                    if positions:
+                        self._unsubscribe_positions(task_id)
+                    waiters = self.async_waiters.get(task_id)
+                    if waiters and waiter in waiters:
+                        waiters.remove(waiter)
+                        if not waiters:
+                            del self.async_waiters[task_id]
+
+    def _wake_async(self, task_id: str = None, positions: bool = False):
+        """（在锁内调用）唤醒该任务的协程等待者；positions=True 时还唤醒全部关注排队位置的等待者"""
+        if not self.async_waiters:
+            return
+        woken = {}  # 事件循环 -> [Future]，每个事件循环只调度一次
+        for tid in ({task_id, *self.position_waiters} if positions else (task_id,)):
+            waiters = self.async_waiters.pop(tid, None)
+            if not waiters:
+                continue
+            remaining = []
+            for waiter in waiters:
+                if tid == task_id or (positions and waiter[2]):
+                    woken.setdefault(waiter[0], []).append(waiter[1])
+                else:
+                    remaining.append(waiter)
+            if remaining:
+                self.async_waiters[tid] = remaining
+        for loop, futures in woken.items():
+            try:
+                loop.call_soon_threadsafe(_resolve_all, futures)
+            except RuntimeError:  # 事件循环已关闭
+                pass
+
+    def _subscribe_positions(self, task_id: str):
+        self.position_waiters[task_id] = self.position_waiters.get(task_id, 0) + 1
+
+    def _unsubscribe_positions(self, task_id: str):
+        count = self.position_waiters.pop(task_id) - 1
+        if count:
+            self.position_waiters[task_id] = count
+
+    def _notify_positions(self, task_id: str = None):
+        """（在锁内调用）排队位置变化：唤醒该任务与关注排队位置的等待者"""
+        self.epoch += 1
+        for tid in {task_id, *self.position_waiters}:
+            cond = self.conditions.get(tid)
+            if cond is not None:
+                cond.notify_all()
+        self._wake_async(task_id, positions=True)
+
+    def _condition(self, task_id: str) -> threading.Condition:
+        cond = self.conditions.get(task_id)
+        if cond is None:
+            cond = self.conditions[task_id] = threading.Condition(self.lock)
+        return cond
+
+    def _version(self, task_id: str) -> int:
+        state = self.tasks.get(task_id)
+        return state["version"] if state else 0
+
+    def _finished(self, task_id: str) -> bool:
+        state = self.tasks.get(task_id)
+        return state is None or state["status"] in FINISHED_STATES
+
+    # ---------- 写入 ----------
+    def _state(self, task_id: str) -> dict:
+        state = self.tasks.get(task_id)
+        if state is None:
+            state = {
+                "status": PENDING,
+                "number": None,
+                "outputs": {},
+                "outputs_complete": False,
+                "progress": None,
+                "preview": None,
+                "error": None,
+                "version": 0,
+                "updated_at": time.time(),
+                "started_at": None,  # 首次进入运行状态的时间
+                "run_seconds": None,  # 执行耗时（/history 的时间戳，或从开始运行到结束）
+            }
+            self.tasks[task_id] = state
+            self._evict()
+        return state
+
+    def _evict(self):
+        """超出容量时淘汰最早的已结束任务"""
+        if len(self.tasks) <= self.max_tasks:
+            return
+        for task_id in list(self.tasks):
+            if self.tasks[task_id]["status"] in FINISHED_STATES:
+                del self.tasks[task_id]
+                self.conditions.pop(task_id, None)
+                if len(self.tasks) <= self.max_tasks:
+                    return
+
+    def _update(self, task_id: str, **changes):
+        """在持有锁的情况下更新任务并唤醒等待者"""
+        state = self._state(task_id)
+        if state["status"] == CANCELLED:
+            return state  # 取消后ComfyUI推送的中断等事件不再改变状态
+        was_finished = state["status"] in FINISHED_STATES
+        if was_finished and changes.get("status") not in (None, *FINISHED_STATES):
+            return state  # 已结束的任务不会回退
+        queued = self._queued_number(state)
+        state.update(changes)
+        if self._queued_number(state) != queued:
+            if queued is not None:
+                del self.numbers[bisect.bisect_left(self.numbers, queued)]
+            if self._queued_number(state) is not None:
+                bisect.insort(self.numbers, state["number"])
+        state["version"] += 1
+        state["updated_at"] = time.time()
+        if state["status"] == RUNNING and state["started_at"] is None:
+            state["started_at"] = state["updated_at"]
+
+        if not was_finished and state["status"] in FINISHED_STATES:
+            if self.running_task == task_id:
+                self.running_task = None
+            if state["status"] == COMPLETED:
+                if state["run_seconds"] is None and state["started_at"] is not None:
+                    state["run_seconds"] = state["updated_at"] - state["started_at"]
+                if state["run_seconds"] is not None:
+                    for callback in self.timing_callbacks:
+                        callback(task_id, state["run_seconds"])
+            self._notify_positions(task_id)
+            for callback in self.finish_callbacks:
+                callback(task_id, state["status"])
+        else:
+            if task_id in self.conditions:
+                self.conditions[task_id].notify_all()
+            self._wake_async(task_id)
+        return state
+
+    @staticmethod
+    def _queued_number(state: dict):
+        """计入 numbers 的ComfyUI队列序号：已提交且未结束的任务才有"""
+        return state["number"] if state["status"] not in FINISHED_STATES else None
+
+    def on_finished(self, callback):
+        """注册任务结束回调 callback(task_id, status)"""
+        self.finish_callbacks.append(callback)
+
+    def on_timing(self, callback):
+        """注册执行耗时回调 callback(task_id, 秒数)"""
+        self.timing_callbacks.append(callback)
+
+    def mark_submitted(self, task_id: str, number: int = None):
+        """记录新提交的任务（number为ComfyUI返回的队列序号）"""
+        with self.lock:
+            if task_id not in self.tasks:
+                self._update(task_id, status=PENDING, number=number)
+
+    def mark_dispatched(self, task_id: str, number: int = None):
+        """本地排队的任务已提交给ComfyUI"""
+        with self.lock:
+            self._update(task_id, number=number)
+
+    def mark_running(self, task_id: str):
+        """已跟踪的排队任务开始执行（事件通道不可用时由 /queue 得知，用于记录开始时间）"""
+        with self.lock:
+            state = self.tasks.get(task_id)
+            if state is not None and state["status"] == PENDING:
+                self._update(task_id, status=RUNNING)
+
+    def mark_failed(self, task_id: str, error: str):
+        with self.lock:
+            self._update(task_id, status=FAILED, error=error)
+
+    def mark_cancelled(self, task_id: str, reason: str) -> bool:
+        """取消未结束的任务，返回是否取消（已结束的任务不变）"""
+        with self.lock:
+            state = self.tasks.get(task_id)
+            if state is not None and state["status"] in FINISHED_STATES:
+                return False
+            self._update(task_id, status=CANCELLED, error=reason)
+            return True
+
+    def notify_positions(self):
+        """排队位置整体变化（如本地调度器提交了任务），唤醒关注排队位置的等待者"""
+        with self.lock:
+            self._notify_positions()
+
+    def record_preview(self, data: bytes, task_id: str = None):
+        """记录二进制预览帧（4字节事件类型 + 4字节图片格式 + 图片数据）
+
+        task_id 为收到该帧的节点上正在执行的任务（多节点时由各自的监听线程提供）
+        """
+        if len(data) < 8:
+            return
+        event_type, image_type = struct.unpack(">II", data[:8])
+        if event_type != PREVIEW_IMAGE:
+            return
+        with self.lock:
+            task_id = task_id or self.running_task
+            if task_id is None:
+                return
+            mime = "image/png" if image_type == 2 else "image/jpeg"
+            self._update(task_id, preview={"mime": mime, "data": data[8:]})
+
+    def record_history(self, task_id: str, history_entry: dict):
+        """用 /history 返回的记录补全任务（最终结果）"""
+        status = history_entry.get("status") or {}
+        with self.lock:
+            if status.get("status_str") == "error":
+                self._update(task_id, status=FAILED, error="ComfyUI执行失败")
+            else:
+                # 记录中没有时间戳时，按事件通道记录的开始运行时间计算耗时
+                run_seconds = history_run_seconds(history_entry)
+                timing = {"run_seconds": run_seconds} if run_seconds is not None else {}
+                self._update(task_id, status=COMPLETED,
+                             outputs=dict(history_entry.get("outputs") or {}),
+                             outputs_complete=True, **timing)
+
+    def handle_message(self, message: dict):
+        """处理一条 websocket 事件"""
+        msg_type = message.get("type")
+        data = message.get("data") or {}
+        task_id = data.get("prompt_id")
+        if not task_id:
+            return
+
+        with self.lock:
+            if msg_type == "execution_start":
+                self.running_task = task_id
+                self._update(task_id, status=RUNNING)
+            elif msg_type == "progress":
+                self.running_task = task_id
+                self._update(task_id, status=RUNNING,
+                             progress={"value": data.get("value", 0), "max": data.get("max", 0)})
+            elif msg_type == "executing":
+                if data.get("node") is None:
+                    # node为None表示整个prompt执行结束
+                    self._update(task_id, status=COMPLETED)
+                else:
+                    self.running_task = task_id
+                    self._update(task_id, status=RUNNING)
+            elif msg_type == "executed":
+                state = self._state(task_id)
+                outputs = dict(state["outputs"])
+                outputs[str(data.get("node"))] = data.get("output") or {}
+                self._update(task_id, outputs=outputs)
+            elif msg_type == "execution_success":
+                self._update(task_id, status=COMPLETED)
+            elif msg_type == "execution_error":
+                self._update(task_id, status=FAILED,
+                             error=data.get("exception_message") or "ComfyUI执行失败")
+            elif msg_type == "execution_interrupted":
+                self._update(task_id, status=FAILED, error="任务已中断")
+
+    def resync(self, client, task_filter=None):
+        """断线重连后，根据 /queue 与 /history 重建未结束任务的状态
+
+        task_filter(task_id) 用于多节点时只补查提交到该节点的任务
+        """
+        for task_id in self.apply_queue(client.get_queue(), task_filter):
+            history = client.get_history(task_id)
+            if task_id in history:
+                self.record_history(task_id, history[task_id])
+
+    def apply_queue(self, queue: dict, task_filter=None) -> list:
+        """用 /queue 快照更新排队/运行状态，返回不在队列中、需要查询 /history 的未结束任务"""
+        running = dict(queue_items(queue.get("queue_running")))
+        pending = dict(queue_items(queue.get("queue_pending")))
+
+        with self.lock:
+            # 仍在本地调度队列中的任务尚未提交，无需查询
+            unfinished = [tid for tid, s in self.tasks.items() if s["status"] not in FINISHED_STATES
+                          and not (s["number"] is None and self._position(tid, s) is not None)
+                          and (task_filter is None or task_filter(tid))]
+            for task_id, number in running.items():
+                self.running_task = task_id
+                self._update(task_id, status=RUNNING, number=number)
+            for task_id, number in pending.items():
+                self._update(task_id, status=PENDING, number=number)
+        logger.info(f"任务状态已重新同步 | 运行中: {len(running)} | 排队中: {len(pending)}")
+        return [task_id for task_id in unfinished if task_id not in running and task_id not in pending]
+
+
+class EventListener(threading.Thread):
+    """ComfyUI websocket 事件监听线程（自动重连）"""
+
+    def __init__(self, client, tracker: TaskTracker, task_filter=None, reconnect_delay: float = 1.0,
+                 max_reconnect_delay: float = 30.0):
+        super().__init__(name="comfyui-events", daemon=True)
+        self.client = client
+        self.tracker = tracker
+        self.task_filter = task_filter
+        # 该节点上正在执行的任务（预览帧归属于它）
+        self.running_task = None
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.connected = False
+        self._stop_event = threading.Event()
+        self._ws = None
+
+    @property
+    def ws_url(self) -> str:
+        base = self.client.base_url.replace("https://", "wss://").replace("http://", "ws://")
+        return f"{base}/ws?clientId={self.client.client_id}"
+
+    def run(self):
+        import websocket
+
+        delay = self.reconnect_delay
+        while not self._stop_event.is_set():
+            try:
+                self._ws = websocket.create_connection(self.ws_url, timeout=10)
+                self._ws.settimeout(None)
+                self.tracker.resync(self.client, self.task_filter)
+                self.connected = True
+                delay = self.reconnect_delay
+                logger.info(f"已连接ComfyUI事件通道: {self.ws_url}")
+                self._receive_loop()
+            except Exception as e:
+                if not self._stop_event.is_set():
+                    logger.warning(f"ComfyUI事件通道断开: {str(e)}，{delay:.0f}秒后重连")
+            finally:
+                self.connected = False
+                self._close_ws()
+            self._stop_event.wait(delay)
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+    def _receive_loop(self):
+        while not self._stop_event.is_set():
+            message = self._ws.recv()
+            if isinstance(message, bytes):
+                self.tracker.record_preview(message, self.running_task)
+                continue
+            if not message:
+                raise ConnectionError("连接已关闭")
+            try:
+                event = json.loads(message)
+            except ValueError:
+                logger.warning("无法解析ComfyUI事件")
+                continue
+            self.running_task = track_running(self.running_task, event)
+            self.tracker.handle_message(event)
+
+    def _close_ws(self):
+        ws, self._ws = self._ws, None
+        if ws is not None:
+            try:
+                ws.close()
+            except Exception:
+                pass
+
+    def stop(self):
+        self._stop_event.set()
+        ws = self._ws
+        if ws is not None:
+            ws.abort()  # 先中断阻塞在recv中的监听线程，否则close等待关闭帧时会与其争抢读取
+        self._close_ws()
+
+
+def start_listener(client, tracker: TaskTracker, task_filter=None):
+    """启动事件监听；未安装 websocket-client 时返回None（退回轮询模式）"""
+    if not HAS_WEBSOCKET:
+        logger.warning("未安装websocket-client，任务状态将通过轮询获取")
+        return None
+    listener = EventListener(client, tracker, task_filter)
+    listener.start()
+    return listener
@@ -0,0 +1,235 @@
+# ============== 任务耗时估计 ==============
+# 按工作流模板学习任务的执行耗时：耗时 ≈ 固定开销 + 单位耗时 × 工作量，
+# 工作量 = 采样步数 × 百万像素 × 批量大小。每个模板用指数遗忘的加权最小二乘在线拟合，
+# 只保存几个累加量；硬件、模型或节点负载变化后，旧样本的权重逐渐衰减。
+# 预计完成时间 = 排在前面的任务的剩余耗时之和 / 可用节点数 + 本任务的剩余耗时，
+# 由此给出客户端下次查询 /result 的时间（Retry-After），减少无效轮询。
+import itertools
+import threading
+import time
+from collections import OrderedDict
+
+from comfy_events import PENDING, RUNNING
+
+DEFAULT_JOB_SECONDS = 20.0  # 尚无任何样本时单个任务的预计耗时
+DECAY = 0.95  # 每加入一个样本，旧样本权重乘以该系数（约相当于最近20个样本）
+OVERRUN_FRACTION = 0.1  # 运行时间已超过预计耗时（且无采样进度）时，剩余耗时按预计耗时的该比例估计
+POLL_ETA_FRACTION = 0.75  # 在剩余时间的该比例处再次查询，为估计误差留出余量
+
+
+def job_work(params: dict) -> float:
+    """任务工作量：采样步数 × 百万像素 × 批量大小（模板未声明的参数按1计）"""
+    def number(name):
+        try:
+            return max(float(params[name]), 0.0)
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    steps, width, height, batch = (number(name) for name in ("steps", "width", "height", "batch_size"))
+    pixels = width * height / 1e6 if width is not None and height is not None else 1.0
+    return (steps if steps is not None else 1.0) * pixels * (batch if batch is not None else 1.0)
+
+
+def retry_after(eta: float, wait: float = 0.0, minimum: float = 0.5, maximum: float = 60.0):
+    """客户端下次查询前应等待的秒数，eta为None时返回None
+
+    在剩余时间的 POLL_ETA_FRACTION 处再次查询；下次查询会被服务端挂起 wait 秒（长轮询）时相应提前，
+    挂起的请求在任务结束时立即返回，因此下限为0，否则下限为 minimum
+    """
+    if eta is None:
+        return None
+    delay = eta * POLL_ETA_FRACTION - wait
+    return min(maximum, max(0.0 if wait > 0 else minimum, delay))
+
+
+class CostFit:
+    """耗时 = 截距 + 斜率 × 工作量 的指数遗忘加权最小二乘"""
+
+    def __init__(self, decay: float = DECAY):
+        self.decay = decay
+        self.weight = self.sum_x = self.sum_y = self.sum_xx = self.sum_xy = 0.0
+        self.samples = 0
+
+    def add(self, work: float, seconds: float):
+        d = self.decay
+        self.weight = self.weight * d + 1.0
+        self.sum_x = self.sum_x * d + work
+        self.sum_y = self.sum_y * d + seconds
+        self.sum_xx = self.sum_xx * d + work * work
+        self.sum_xy = self.sum_xy * d + work * seconds
+        self.samples += 1
+
+    def predict(self, work: float):
+        """预计耗时（秒），尚无样本时返回None"""
+        if not self.samples:
+            return None
+        mean_x, mean_y = self.sum_x / self.weight, self.sum_y / self.weight
+        variance = self.sum_xx / self.weight - mean_x * mean_x
+        if variance > (0.01 * mean_x) ** 2:
+            slope = (self.sum_xy / self.weight - mean_x * mean_y) / variance
+            intercept = mean_y - slope * mean_x
+            if slope >= 0 and intercept >= 0:
+                return intercept + slope * work
+        # 样本的工作量几乎相同或拟合结果不合理（如负的固定开销）时，按耗时与工作量成正比估计
+        if self.sum_xx > 0:
+            return self.sum_xy / self.sum_xx * work
+        return mean_y
+
+
+class EtaModel:
+    """按模板估计任务耗时与预计完成时间（线程安全）
+
+    task_timing、task_finished 注册为任务状态表的回调（在其锁内调用，只做字典与算术操作）
+    """
+
+    def __init__(self, default_seconds: float = DEFAULT_JOB_SECONDS, decay: float = DECAY,
+                 max_tasks: int = 10000):
+        self.default_seconds = default_seconds
+        self.decay = decay
+        self.max_tasks = max_tasks
+        self.lock = threading.Lock()
+        self.fits = {}  # 模板名 -> CostFit
+        self.overall = CostFit(decay)  # 全部模板合并，新模板尚无样本时使用
+        self.jobs = OrderedDict()  # 未结束的任务（按提交顺序）：task_id -> (模板名, 工作量, 预计耗时, 提交时间)
+        self.outstanding_seconds = 0.0  # 未结束任务的预计耗时之和
+        self.last_finished = 0.0  # 最近一个任务结束的时间，其后的任务最早从此时开始执行
+        self.observed = 0
+        self.relative_error = None  # 预计耗时相对误差的指数平均
+
+    # ---------- 估计 ----------
+    def _predict(self, template: str, work: float) -> float:
+        for fit in (self.fits.get(template), self.overall):
+            seconds = fit.predict(work) if fit is not None else None
+            if seconds is not None:
+                return max(seconds, 0.0)
+        return self.default_seconds
+
+    def _mean_seconds(self) -> float:
+        """未登记任务（如其他进程提交的）的预计耗时：未结束任务或近期样本的平均耗时"""
+        if self.jobs:
+            return self.outstanding_seconds / len(self.jobs)
+        if self.overall.samples:
+            return self.overall.sum_y / self.overall.weight
+        return self.default_seconds
+
+    def job_seconds(self, task_id: str) -> float:
+        """已登记任务的预计耗时（秒），未登记的任务按平均耗时"""
+        with self.lock:
+            job = self.jobs.get(task_id)
+            return job[2] if job else self._mean_seconds()
+
+    def predict(self, template: str, params: dict) -> float:
+        """按模板与工作流参数预计任务耗时（秒）"""
+        with self.lock:
+            return self._predict(template, job_work(params))
+
+    def estimate(self, task_id: str, state: dict = None, parallelism: int = 1, ahead: list = None,
+                 live: set = None):
+        """预计还需多少秒完成；state 为任务状态表的快照，已结束的任务返回0，未知任务返回None
+
+        ahead 为排在前面的任务ID（如从ComfyUI /queue 得到），未提供时按排队位置取最早提交的未结束任务；
+        live 为确知尚未结束的任务ID（事件通道不可用、任务结束未及时登记时用于排除已结束的任务）；
+        此时状态中的开始运行时间只是首次查询到运行的时间，改用提交时间与上一个任务结束时间中较晚者
+        """
+        if state is None:
+            return None
+        if state["status"] not in (PENDING, RUNNING):
+            return 0.0
+        now = time.time()
+        with self.lock:
+            job = self.jobs.get(task_id)
+            own = job[2] if job else self._mean_seconds()
+            if state["status"] == PENDING:
+                if ahead is None:
+                    position = state.get("position") or 0
+                    earlier = (tid for tid in self.jobs if live is None or tid in live)
+                    ahead = list(itertools.islice(itertools.takewhile(lambda tid: tid != task_id, earlier), position))
+                else:
+                    position = len(ahead)
+                return self._queued_seconds(ahead, position, parallelism, now) / max(parallelism, 1) + own
+            started = state.get("started_at")
+            if live is not None and job is not None:
+                started = min(started or now, max(job[3], self.last_finished))
+
+        elapsed = now - started if started else 0.0
+        remaining = own - elapsed
+        if remaining <= 0:
+            # 已超过预计耗时：有采样进度时按已用时间外推，否则假定即将结束
+            progress = state.get("progress") or {}
+            ratio = progress["value"] / progress["max"] if progress.get("max") else 0
+            remaining = elapsed * (1 - ratio) / ratio if 0 < ratio < 1 else own * OVERRUN_FRACTION
+        return remaining
+
+    def _queued_seconds(self, ahead: list, position: int, parallelism: int, now: float) -> float:
+        """（在锁内调用）排在前面的任务的剩余耗时之和；最前面 parallelism 个任务视为正在执行"""
+        mean = self._mean_seconds()
+        total = max(position - len(ahead), 0) * mean
+        for i, tid in enumerate(ahead):
+            job = self.jobs.get(tid)
+            if job is None:
+                total += mean
+                continue
+            seconds = job[2]
+            if i < parallelism:
+                started = max(job[3], self.last_finished)
+                seconds = max(seconds - max(now - started, 0.0), seconds * OVERRUN_FRACTION)
+            total += seconds
+        return total
+
+    # ---------- 样本 ----------
+    def track(self, task_id: str, template: str, params: dict) -> float:
+        """登记新提交的任务，返回预计耗时（秒）"""
+        work = job_work(params)
+        with self.lock:
+            predicted = self._predict(template, work)
+            if task_id in self.jobs:
+                self.outstanding_seconds -= self.jobs.pop(task_id)[2]
+            self.jobs[task_id] = (template, work, predicted, time.time())
+            self.outstanding_seconds += predicted
+            while len(self.jobs) > self.max_tasks:
+                self.outstanding_seconds -= self.jobs.popitem(last=False)[1][2]
+        return predicted
+
+    def task_timing(self, task_id: str, seconds: float):
+        """任务成功结束且已知执行耗时（秒）：加入所属模板的拟合样本"""
+        with self.lock:
+            job = self.jobs.get(task_id)
+            if job is None or seconds <= 0:
+                return  # 非本进程提交的任务，或结果来自ComfyUI缓存
+            template, work, predicted, _ = job
+            self.fits.setdefault(template, CostFit(self.decay)).add(work, seconds)
+            self.overall.add(work, seconds)
+            self.observed += 1
+            error = abs(predicted - seconds) / seconds
+            self.relative_error = error if self.relative_error is None else 0.9 * self.relative_error + 0.1 * error
+
+    def task_finished(self, task_id: str, status: str = None):
+        with self.lock:
+            if self._drop(task_id):
+                self.last_finished = time.time()
+
+    def forget(self, task_id: str):
+        """未能入队的任务"""
+        with self.lock:
+            self._drop(task_id)
+
+    def _drop(self, task_id: str) -> bool:
+        job = self.jobs.pop(task_id, None)
+        if job is None:
+            return False
+        self.outstanding_seconds -= job[2]
+        if not self.jobs:
+            self.outstanding_seconds = 0.0  # 消除浮点累计误差
+        return True
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "templates": {name: {"samples": fit.samples,
+                                     "overhead_seconds": round(fit.predict(0.0), 3),
+                                     "seconds_per_unit": round(fit.predict(1.0) - fit.predict(0.0), 4)}
+                              for name, fit in self.fits.items()},
+                "outstanding": len(self.jobs),
+                "observed": self.observed,
+                "relative_error": round(self.relative_error, 3) if self.relative_error is not None else None,
+            }
@@ -0,0 +1,221 @@
+# ============== 生成结果缓存 ==============
+# 以规范化的工作流参数哈希为键（内容寻址）：
+# - 相同参数的请求正在执行时，直接复用该任务（请求合并），不重复占用GPU
+# - 任务完成时不再接受合并，由后台线程将结果复制到磁盘存储目录 <root>/<key前2位>/<key>/，
+#   按总大小做LRU淘汰；结果文件找不到时不存储，之后的相同请求重新生成
+# 未指定种子（随机种子）的请求每次结果都不同，不经过缓存。
+import hashlib
+import json
+import logging
+import os
+import queue
+import shutil
+import threading
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+
+logger = logging.getLogger("ComfyUI-API")
+
+# 缓存命中时返回的任务ID前缀
+CACHE_TASK_PREFIX = "cache-"
+
+
+def cache_key(params: dict, fingerprint: str = "") -> str:
+    """规范化参数（键排序、紧凑JSON）后计算SHA-256，fingerprint 区分不同的工作流模板"""
+    canonical = json.dumps(params, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(f"{fingerprint}\n{canonical}".encode("utf-8")).hexdigest()
+
+
+class GenerationCache:
+    """内容寻址的生成结果缓存（线程安全）"""
+
+    def __init__(self, root, max_bytes: int = 2 * 1024 * 1024 * 1024, max_tasks: int = 10000,
+                 resolve_files=None):
+        """resolve_files(task_id) 返回已完成任务的输出文件列表，用于任务完成后存储结果"""
+        self.root = Path(root)
+        self.resolve_files = resolve_files
+        self.max_bytes = max_bytes
+        self.max_tasks = max_tasks
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> 占用字节数，按最近使用排序
+        self.current_bytes = 0
+        self.key_tasks = {}  # key -> 执行中的任务ID（相同请求合并到该任务）
+        self.task_keys = OrderedDict()  # task_id -> key，结果存储后删除
+        self.finished_tasks = queue.Queue()  # 已完成、等待存储结果的任务
+        self._thread = None
+        self.hits = 0
+        self.coalesced = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.evictions = 0
+        self._load()
+
+    def _load(self):
+        """启动时扫描存储目录，按目录修改时间恢复LRU顺序"""
+        if not self.root.is_dir():
+            return
+        found = []
+        for entry_dir in self.root.glob("??/*"):
+            if not entry_dir.is_dir() or entry_dir.name.startswith("."):
+                continue
+            size = sum(f.stat().st_size for f in entry_dir.iterdir() if f.is_file())
+            found.append((entry_dir.stat().st_mtime, entry_dir.name, size))
+        for _, key, size in sorted(found):
+            self.entries[key] = size
+            self.current_bytes += size
+        if found:
+            logger.info(f"生成缓存已加载 {len(found)} 条，共 {self.current_bytes / 1024 / 1024:.1f}MB")
+
+    def entry_dir(self, key: str) -> Path:
+        return self.root / key[:2] / key
+
+    # ---------- 查询 ----------
+    def lookup(self, key: str):
+        """查找缓存：返回 ("hit", 缓存任务ID) / ("coalesced", 执行中的任务ID) / ("miss", 新任务ID)
+
+        未命中时立即登记新任务ID，随后的相同请求会合并到该任务上；提交失败需调用 forget。
+        """
+        with self.lock:
+            if key not in self.entries:
+                task_id = self.key_tasks.get(key)
+                if task_id is not None:
+                    self.coalesced += 1
+                    return "coalesced", task_id
+                self.misses += 1
+                task_id = str(uuid.uuid4())
+                self.key_tasks[key] = task_id
+                self.task_keys[task_id] = key
+                while len(self.task_keys) > self.max_tasks:
+                    old_task, old_key = self.task_keys.popitem(last=False)
+                    if self.key_tasks.get(old_key) == old_task:
+                        del self.key_tasks[old_key]
+                return "miss", task_id
+            self.entries.move_to_end(key)
+            self.hits += 1
+        # 刷新目录修改时间，重启后仍保留LRU顺序
+        try:
+            os.utime(self.entry_dir(key))
+        except OSError:
+            pass
+        return "hit", CACHE_TASK_PREFIX + key
+
+    def record_bypass(self):
+        with self.lock:
+            self.bypassed += 1
+
+    def forget(self, task_id: str):
+        """任务提交失败，取消登记"""
+        with self.lock:
+            key = self.task_keys.pop(task_id, None)
+            if key is not None and self.key_tasks.get(key) == task_id:
+                del self.key_tasks[key]
+
+    def task_finished(self, task_id: str, status: str):
+        """任务结束（由事件跟踪回调，在其锁内调用，只入队）：之后的相同请求不再合并到该任务；
+        成功的任务由后台线程存储结果，失败或取消的任务取消登记"""
+        if status != "completed" or self.resolve_files is None:
+            self.forget(task_id)
+            return
+        with self.lock:
+            key = self.task_keys.get(task_id)
+            if key is None:
+                return
+            if self.key_tasks.get(key) == task_id:
+                del self.key_tasks[key]
+        self.finished_tasks.put(task_id)
+
+    def _run(self):
+        while True:
+            task_id = self.finished_tasks.get()
+            if task_id is None:
+                return
+            try:
+                self.store(task_id, self.resolve_files(task_id) or [])
+            except Exception as e:
+                logger.warning(f"[{task_id}] 无法存储生成结果: {str(e)}")
+            finally:
+                self.forget(task_id)  # 已存储或无法存储，不再等待读取时存储
+
+    def cached_files(self, task_id: str):
+        """缓存任务的图片文件列表，缓存已淘汰时返回None"""
+        if not task_id.startswith(CACHE_TASK_PREFIX):
+            return None
+        key = task_id[len(CACHE_TASK_PREFIX):]
+        with self.lock:
+            if key not in self.entries:
+                return None
+        entry_dir = self.entry_dir(key)
+        try:
+            return sorted(f for f in entry_dir.iterdir() if f.is_file())
+        except OSError:
+            return None
+
+    # ---------- 存储 ----------
+    def store(self, task_id: str, files: list):
+        """将已完成任务的图片复制到存储目录（同一任务只存储一次）"""
+        with self.lock:
+            key = self.task_keys.get(task_id)
+            if key is None or key in self.entries:
+                return
+        files = [Path(f) for f in files if f is not None]
+        if not files:
+            return
+
+        entry_dir = self.entry_dir(key)
+        tmp_dir = self.root / f".tmp-{uuid.uuid4().hex}"
+        try:
+            tmp_dir.mkdir(parents=True)
+            for i, f in enumerate(files):
+                # 序号前缀保证顺序与原输出一致
+                shutil.copyfile(f, tmp_dir / f"{i:03d}_{f.name}")
+            size = sum(f.stat().st_size for f in tmp_dir.iterdir())
+            entry_dir.parent.mkdir(parents=True, exist_ok=True)
+            if entry_dir.exists():  # 并发的请求已经存储过
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                return
+            os.replace(tmp_dir, entry_dir)
+        except OSError as e:
+            logger.warning(f"[{task_id}] 生成结果缓存写入失败: {str(e)}")
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return
+
+        evicted = []
+        with self.lock:
+            self.entries[key] = size
+            self.current_bytes += size
+            self.task_keys.pop(task_id, None)
+            if self.key_tasks.get(key) == task_id:
+                del self.key_tasks[key]
+            while self.current_bytes > self.max_bytes and len(self.entries) > 1:
+                old_key, old_size = self.entries.popitem(last=False)
+                self.current_bytes -= old_size
+                self.evictions += 1
+                evicted.append(old_key)
+        for old_key in evicted:
+            shutil.rmtree(self.entry_dir(old_key), ignore_errors=True)
+
+    # ---------- 生命周期 ----------
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="generation-cache", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.finished_tasks.put(None)
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.coalesced + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "in_flight": len(self.key_tasks),
+                "hits": self.hits,
+                "coalesced": self.coalesced,
+                "misses": self.misses,
+                "bypassed": self.bypassed,
+                "hit_rate": round((self.hits + self.coalesced) / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+            }
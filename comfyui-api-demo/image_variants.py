@@ -0,0 +1,205 @@
+# ============== 图片变体（缩略图 / WebP / AVIF） ==============
+# 任务完成后，在进程池中为每张输出图片生成变体，保存在输出文件旁的 .variants 目录：
+#   <输出目录>/.variants/<文件名主干>.<变体名>.<扩展名>
+# - thumb: 长边不超过 THUMB_SIZE 的 WebP 缩略图，用于画廊
+# - webp / avif: 原尺寸的有损压缩版本（AVIF 需要 Pillow 支持，不支持时跳过）
+# 转码是CPU密集型操作，放在独立进程中执行，不占用请求线程的GIL。
+# 进程池使用 spawn 方式启动（主进程已有多个后台线程，fork 不安全）。
+import asyncio
+import logging
+import os
+import queue
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor, wait
+from multiprocessing import get_context
+from pathlib import Path
+
+try:
+    from PIL import Image, features
+except ImportError:  # 可选依赖，缺失时不生成变体
+    Image = None
+
+logger = logging.getLogger("ComfyUI-API")
+
+VARIANT_DIR = ".variants"
+THUMB_SIZE = 384
+# 变体名 -> (Pillow格式, 扩展名, 长边上限（None为原尺寸）, 质量)
+VARIANTS = {
+    "thumb": ("WEBP", "webp", THUMB_SIZE, 75),
+    "webp": ("WEBP", "webp", None, 85),
+    "avif": ("AVIF", "avif", None, 60),
+}
+
+
+def supported_variants() -> list:
+    """当前 Pillow 支持编码的变体"""
+    if Image is None:
+        return []
+    return [name for name, (fmt, _, _, _) in VARIANTS.items() if features.check(fmt.lower())]
+
+
+def variant_path(src: Path, name: str) -> Path:
+    ext = VARIANTS[name][1]
+    return src.parent / VARIANT_DIR / f"{src.stem}.{name}.{ext}"
+
+
+def transcode(src: str, names: list) -> dict:
+    """（在子进程中执行）解码一次原图，依次生成各变体，返回 {变体名: 字节数}"""
+    sizes = {}
+    with Image.open(src) as image:
+        image.load()
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+        for name in names:
+            fmt, _, max_size, quality = VARIANTS[name]
+            output = image
+            if max_size and max(image.size) > max_size:
+                output = image.copy()
+                output.thumbnail((max_size, max_size), Image.LANCZOS)
+            dst = variant_path(Path(src), name)
+            dst.parent.mkdir(exist_ok=True)
+            # 先写临时文件再重命名，读取方不会读到写了一半的文件
+            tmp = dst.with_name(f".{uuid.uuid4().hex}.tmp")
+            output.save(tmp, fmt, quality=quality)
+            os.replace(tmp, dst)
+            sizes[name] = dst.stat().st_size
+    return sizes
+
+
+class VariantGenerator:
+    """任务完成后生成图片变体（线程安全）
+
+    resolve_files(task_id) 返回任务的输出文件列表，由后台线程调用（可能访问ComfyUI）。
+    """
+
+    def __init__(self, resolve_files, max_workers: int = 2):
+        self.resolve_files = resolve_files
+        self.max_workers = max_workers
+        self.variants = supported_variants()
+        self.executor = None  # 首次使用时创建进程池
+        self.lock = threading.Lock()
+        self.pending = {}  # (原图路径, 变体名) -> Future
+        self.finished_tasks = queue.Queue()
+        self.generated = 0
+        self.failed = 0
+        self._thread = None
+
+    # ---------- 查询 ----------
+    def get(self, src: Path, name: str, timeout: float = 0.0):
+        """变体文件路径；尚未生成时提交转码并最多等待timeout秒，仍未完成或不支持时返回None"""
+        if name not in self.variants:
+            return None
+        path = variant_path(src, name)
+        if path.exists():
+            return path
+        future = self.schedule([src]).get((str(src), name))
+        if future is not None and timeout > 0:
+            wait([future], timeout=timeout)
+        return path if path.exists() else None
+
+    async def get_async(self, src: Path, name: str, timeout: float = 0.0):
+        """get 的协程版本：等待转码时挂起协程，不占用线程"""
+        if name not in self.variants:
+            return None
+        path = variant_path(src, name)
+        if path.exists():
+            return path
+        future = self.schedule([src]).get((str(src), name))
+        if future is not None and timeout > 0:
+            # shield：等待超时只放弃等待，不取消进程池中的转码任务
+            try:
+                await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout)
+            except Exception:
+                pass  # 超时或转码失败，返回原图
+        return path if path.exists() else None
+
+    # ---------- 生成 ----------
+    def schedule(self, files: list) -> dict:
+        """为缺少变体的图片提交转码任务（同一变体只提交一次），返回 {(原图路径, 变体名): Future}
+
+        缩略图单独作为一个任务，先于全部图片的原尺寸变体提交，画廊无需等待耗时的 AVIF 编码。
+        """
+        futures = {}
+        if not self.variants:
+            return futures
+        thumbs = [name for name in self.variants if VARIANTS[name][2]]
+        full_size = [name for name in self.variants if not VARIANTS[name][2]]
+        submitted = []
+        with self.lock:
+            for group in (thumbs, full_size):
+                for src in files:
+                    if src is None or not group:
+                        continue
+                    key = str(src)
+                    missing = []
+                    for name in group:
+                        future = self.pending.get((key, name))
+                        if future is not None:
+                            futures[(key, name)] = future
+                        elif not variant_path(Path(src), name).exists():
+                            missing.append(name)
+                    if not missing:
+                        continue
+                    if self.executor is None:
+                        self.executor = ProcessPoolExecutor(self.max_workers, mp_context=get_context("spawn"))
+                    future = self.executor.submit(transcode, key, missing)
+                    for name in missing:
+                        self.pending[(key, name)] = futures[(key, name)] = future
+                    submitted.append((key, missing, future))
+        # 已完成的 Future 会立即执行回调，需在释放锁之后注册
+        for key, names, future in submitted:
+            future.add_done_callback(lambda f, key=key, names=names: self._done(key, names, f))
+        return futures
+
+    def _done(self, key: str, names: list, future):
+        error = None if future.cancelled() else future.exception()
+        with self.lock:
+            for name in names:
+                self.pending.pop((key, name), None)
+            if future.cancelled():
+                return
+            if error is None:
+                self.generated += len(names)
+            else:
+                self.failed += len(names)
+        if error is not None:
+            logger.warning(f"图片变体生成失败 {key} {names}: {str(error)}")
+
+    def task_finished(self, task_id: str, status: str):
+        """任务结束回调（在事件跟踪的锁内调用，只入队）"""
+        if status == "completed" and self.variants:
+            self.finished_tasks.put(task_id)
+
+    def _run(self):
+        while True:
+            task_id = self.finished_tasks.get()
+            if task_id is None:
+                return
+            try:
+                self.schedule(self.resolve_files(task_id) or [])
+            except Exception as e:
+                logger.warning(f"[{task_id}] 无法为输出生成变体: {str(e)}")
+
+    # ---------- 生命周期 ----------
+    def start(self):
+        if not self.variants:
+            logger.warning("未安装Pillow或不支持WebP，图片变体不可用")
+            return self
+        self._thread = threading.Thread(target=self._run, name="image-variants", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.finished_tasks.put(None)
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "variants": self.variants,
+                "pending": len(self.pending),
+                "generated": self.generated,
+                "failed": self.failed,
+            }
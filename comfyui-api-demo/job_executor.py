@@ -0,0 +1,106 @@
+# ============== 有界后台执行器 ==============
+# 生成任务在后台线程池中执行，HTTP 请求只负责登记任务并立即返回：
+# - 执行中 + 排队中的任务总数有上限，已满时 submit 抛出 ExecutorFullError（由接口返回503）
+# - 每个任务以 job_id 登记一个 Future 作为句柄，可查询状态或取消尚未开始的任务（cancel）
+# - drain：停止接收新任务，等待执行中的任务结束，超时后取消仍在排队的任务
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
+
+
+class ExecutorFullError(Exception):
+    """执行器已满或正在关闭"""
+
+
+class BoundedExecutor:
+    """有界线程池（线程安全）"""
+
+    def __init__(self, max_workers: int = 4, max_queued: int = 32, name: str = "job"):
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self.lock = threading.Lock()
+        self.jobs = {}  # job_id -> Future（结束后移除）
+        self.accepting = True
+        self.submitted = 0
+        self.rejected = 0
+        self.cancelled = 0
+
+    def submit(self, job_id: str, fn, *args, **kwargs):
+        """提交任务，返回 Future；执行器已满或正在关闭时抛出 ExecutorFullError"""
+        with self.lock:
+            if not self.accepting:
+                self.rejected += 1
+                raise ExecutorFullError("服务正在关闭，暂不接收新任务")
+            if len(self.jobs) >= self.max_workers + self.max_queued:
+                self.rejected += 1
+                raise ExecutorFullError(f"生成队列已满（{len(self.jobs)}个任务），请稍后重试")
+            future = self.executor.submit(fn, *args, **kwargs)
+            self.jobs[job_id] = future
+            self.submitted += 1
+        future.add_done_callback(lambda f: self._done(job_id, f))
+        return future
+
+    def _done(self, job_id: str, future):
+        with self.lock:
+            if self.jobs.get(job_id) is future:
+                del self.jobs[job_id]
+        if not future.cancelled() and future.exception() is not None:
+            logger.error(f"后台任务 {job_id} 异常退出: {str(future.exception())}")
+
+    def get(self, job_id: str):
+        """任务句柄，任务已结束或不存在时返回None"""
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> bool:
+        """取消尚未开始执行的任务，成功时返回True；执行中、已结束或不存在的任务返回False"""
+        with self.lock:
+            future = self.jobs.get(job_id)
+        if future is None or not future.cancel():
+            return False
+        with self.lock:
+            self.cancelled += 1
+        return True
+
+    def pending(self) -> int:
+        with self.lock:
+            return len(self.jobs)
+
+    def drain(self, timeout: float = 30.0, on_cancel=None) -> bool:
+        """停止接收新任务并等待已有任务结束
+
+        超时后取消尚未开始执行的任务（对每个被取消的任务调用 on_cancel(job_id)），
+        执行中的任务无法中断，由进程退出时一并结束。全部任务正常结束时返回True。
+        """
+        with self.lock:
+            self.accepting = False
+            jobs = dict(self.jobs)
+        if jobs:
+            logger.info(f"正在等待 {len(jobs)} 个后台任务结束（最多 {timeout} 秒）")
+        _, not_done = wait(list(jobs.values()), timeout=timeout)
+        for job_id, future in jobs.items():
+            if future in not_done and future.cancel():
+                with self.lock:
+                    self.cancelled += 1
+                if on_cancel is not None:
+                    on_cancel(job_id)
+        self.executor.shutdown(wait=False)
+        running = [future for future in not_done if not future.cancelled()]
+        if running:
+            logger.warning(f"关闭时仍有 {len(running)} 个后台任务未完成")
+        return not not_done
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "workers": self.max_workers,
+                "max_queued": self.max_queued,
+                "pending": len(self.jobs),
+                "accepting": self.accepting,
+                "submitted": self.submitted,
+                "rejected": self.rejected,
+                "cancelled": self.cancelled,
+            }
@@ -0,0 +1,122 @@
+# ============== 日志管道 ==============
+# 请求线程只把日志记录放入内存队列，由后台线程写入文件与控制台：
+# - QueueHandler + QueueListener，日志文件按大小轮转（RotatingFileHandler）
+# - 队列有上限，写入跟不上时丢弃并计数，不阻塞请求线程
+# - 每次轮询都会打印的高频日志用 extra=sampled(键) 标记，按键限流（每秒最多N条），
+#   被省略的条数附加在该键的下一条日志中
+# - extra={"fields": {...}} 以 key=value 形式附加在消息后，代替格式化打印整个JSON
+import atexit
+import logging
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+LOG_FORMAT = '%(asctime)s [%(levelname)s] %(message)s'
+
+
+def sampled(key: str, **fields) -> dict:
+    """高频日志的 extra 参数：按 key 限流，可附带结构化字段"""
+    return {"sample": key, "fields": fields} if fields else {"sample": key}
+
+
+class SamplingFilter(logging.Filter):
+    """按 record.sample 键限流：每 per 秒最多 rate 条（未标记的日志不受影响）"""
+
+    def __init__(self, rate: int = 5, per: float = 1.0):
+        super().__init__()
+        self.rate = rate
+        self.per = per
+        self.lock = threading.Lock()
+        self.windows = {}  # 键 -> [窗口开始时间, 已输出条数, 已省略条数]
+        self.suppressed = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = getattr(record, "sample", None)
+        if key is None:
+            return True
+        now = time.monotonic()
+        with self.lock:
+            window = self.windows.get(key)
+            if window is None or now - window[0] >= self.per:
+                if window is not None and window[2]:
+                    record.suppressed = window[2]
+                window = self.windows[key] = [now, 0, 0]
+            if window[1] >= self.rate:
+                window[2] += 1
+                self.suppressed += 1
+                return False
+            window[1] += 1
+            return True
+
+
+class DroppingQueueHandler(QueueHandler):
+    """队列已满时丢弃日志并计数（QueueHandler 默认会报错）"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class StructuredFormatter(logging.Formatter):
+    """在消息后附加结构化字段与限流省略的条数"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            text += " | " + " ".join(f"{key}={value}" for key, value in fields.items())
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            text += f" (同类日志已省略{suppressed}条)"
+        return text
+
+
+class LogPipeline:
+    """根日志器 -> 限流 -> 有界队列 -> 后台线程 -> 轮转文件 + 控制台"""
+
+    def __init__(self, log_file: str, max_bytes: int = 10 * 1024 * 1024, backup_count: int = 5,
+                 queue_size: int = 10000, sample_rate: int = 5, level: int = logging.INFO,
+                 console: bool = True):
+        formatter = StructuredFormatter(LOG_FORMAT)
+        self.handlers = [RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count,
+                                             encoding='utf-8')]
+        if console:
+            self.handlers.append(logging.StreamHandler())
+        for handler in self.handlers:
+            handler.setFormatter(formatter)
+        self.level = level
+        self.sampler = SamplingFilter(sample_rate)
+        self.queue_handler = DroppingQueueHandler(queue.Queue(queue_size))
+        self.queue_handler.addFilter(self.sampler)
+        self.listener = QueueListener(self.queue_handler.queue, *self.handlers, respect_handler_level=True)
+
+    def start(self):
+        """替换根日志器的处理器并启动后台写入线程；进程退出时写完队列中剩余的日志"""
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(self.queue_handler)
+        root.setLevel(self.level)
+        self.listener.start()
+        atexit.register(self.stop)
+        return self
+
+    def stop(self):
+        if self.listener._thread is not None:
+            self.listener.stop()
+        for handler in self.handlers:
+            handler.close()
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.queue_handler.queue.qsize(),
+            "dropped": self.queue_handler.dropped,
+            "sampled_out": self.sampler.suppressed,
+        }
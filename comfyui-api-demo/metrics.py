@@ -0,0 +1,210 @@
+# ============== 运行指标 ==============
+# /metrics 以 Prometheus 文本格式（?format=json 为JSON）导出直方图、计数器与状态量：
+# - 直方图使用固定分桶，记录一次只需一次二分查找和一次加锁累加（约1微秒），可在生产环境常开
+# - 缓存命中、队列深度等各组件已有统计的数值通过回调在抓取时读取，请求路径上没有额外开销
+import bisect
+import functools
+import math
+import threading
+import time
+
+# 默认分桶（秒）：0.1毫秒 ~ 60秒
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    """累计分桶直方图（线程安全）"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # 最后一个桶为 +Inf
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def time(self):
+        """记录代码块耗时，也可用作函数装饰器"""
+        return _Timer(self)
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.counts), self.sum
+
+    def quantile(self, q: float, counts: list = None):
+        """按分桶线性插值估算分位数，没有样本时返回None"""
+        counts = counts if counts is not None else self.snapshot()[0]
+        total = sum(counts)
+        if not total:
+            return None
+        rank, seen = q * total, 0
+        for i, count in enumerate(counts):
+            if seen + count >= rank and count:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+class _Timer:
+    """Histogram.time() 的返回值（比 contextlib.contextmanager 生成器开销小）"""
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+    def __call__(self, fn):
+        histogram = self.histogram
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start)
+        return wrapper
+
+
+class Counter:
+    """单调递增计数器（线程安全）"""
+
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount: int = 1):
+        with self.lock:
+            self.value += amount
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    escape = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")  # noqa: E731
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _number(value) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics:
+    """指标注册表：同名指标按标签区分，取得的直方图/计数器对象可缓存后直接使用"""
+
+    def __init__(self, prefix: str = "comfyui_api"):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.families = {}  # 名称 -> {"type", "help", "metrics": {标签元组: 对象}, "collect": 回调}
+        self._cache = {}  # (名称, 标签元组) -> 对象，已注册的指标无需加锁即可取得
+
+    def _family(self, name: str, kind: str, help_text: str) -> dict:
+        name = f"{self.prefix}_{name}"
+        family = self.families.get(name)
+        if family is None:
+            family = self.families[name] = {"type": kind, "help": help_text, "metrics": {}, "collect": None}
+        elif family["type"] != kind:
+            raise ValueError(f"指标 {name} 已注册为 {family['type']}")
+        return family
+
+    def _get(self, name: str, kind: str, help_text: str, factory, labels: dict):
+        key = tuple(sorted(labels.items())) if len(labels) > 1 else tuple(labels.items())
+        metric = self._cache.get((name, key))
+        if metric is not None:
+            return metric
+        with self.lock:
+            metrics = self._family(name, kind, help_text)["metrics"]
+            metric = metrics.get(key)
+            if metric is None:
+                metric = metrics[key] = factory()
+            self._cache[(name, key)] = metric
+            return metric
+
+    def histogram(self, name: str, help_text: str, buckets=DEFAULT_BUCKETS, **labels) -> Histogram:
+        return self._get(name, "histogram", help_text, lambda: Histogram(buckets), labels)
+
+    def counter(self, name: str, help_text: str, **labels) -> Counter:
+        return self._get(name, "counter", help_text, Counter, labels)
+
+    def collect(self, name: str, kind: str, help_text: str, fn, label: str = None):
+        """抓取时调用 fn() 读取数值（gauge 或 counter）
+
+        label 为空时 fn 返回一个数值，否则返回 {标签值: 数值}
+        """
+        with self.lock:
+            self._family(name, kind, help_text)["collect"] = (fn, label)
+
+    # ---------- 导出 ----------
+    def _families(self) -> list:
+        with self.lock:
+            return [(name, family, list(family["metrics"].items())) for name, family in self.families.items()]
+
+    @staticmethod
+    def _samples(family: dict, metrics: list) -> list:
+        """[(标签字典, 计数器/直方图对象或回调读取的数值)]"""
+        samples = [(dict(key), metric) for key, metric in metrics]
+        if family["collect"] is not None:
+            fn, label = family["collect"]
+            value = fn()
+            if label is None:
+                samples.append(({}, value))
+            else:
+                samples.extend(({label: k}, v) for k, v in value.items())
+        return samples
+
+    def render_text(self) -> str:
+        """Prometheus 文本格式（0.0.4）"""
+        lines = []
+        for name, family, metrics in self._families():
+            kind = family["type"]
+            lines.append(f"# HELP {name} {family['help']}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, metric in self._samples(family, metrics):
+                if kind == "histogram":
+                    counts, total = metric.snapshot()
+                    cumulative = 0
+                    for bound, count in zip(metric.buckets + (math.inf,), counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_labels({**labels, 'le': _number(bound)})} {cumulative}")
+                    lines.append(f"{name}_sum{_labels(labels)} {_number(total)}")
+                    lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+                else:
+                    value = metric.value if isinstance(metric, Counter) else metric
+                    suffix = "_total" if kind == "counter" else ""
+                    lines.append(f"{name}{suffix}{_labels(labels)} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+    def to_json(self) -> dict:
+        """JSON格式：直方图给出次数、平均值与估算的 p50/p95/p99（毫秒）"""
+        result = {}
+        for name, family, metrics in self._families():
+            entries = []
+            for labels, metric in self._samples(family, metrics):
+                if family["type"] == "histogram":
+                    counts, total = metric.snapshot()
+                    count = sum(counts)
+                    entry = {"count": count, "mean_ms": round(total / count * 1000, 3) if count else None}
+                    for q in (0.5, 0.95, 0.99):
+                        value = metric.quantile(q, counts)
+                        entry[f"p{int(q * 100)}_ms"] = round(value * 1000, 3) if value is not None else None
+                else:
+                    entry = {"value": metric.value if isinstance(metric, Counter) else metric}
+                entries.append({**labels, **entry})
+            result[name] = entries
+        return result
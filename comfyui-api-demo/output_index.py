@@ -0,0 +1,218 @@
+# ============== 输出目录索引 ==============
+# ComfyUI 的 SaveImage 按 "<filename_prefix>_<5位序号>_.png" 命名输出文件。
+# 提交的工作流以任务ID作为 filename_prefix，因此可按前缀建立 任务ID -> 文件 的索引，
+# 查询时无需扫描整个输出目录（目录中可能有数十万张图片）：
+# - 启动时在后台扫描一次输出目录（只索引顶层文件）
+# - Linux 下用 inotify 增量更新；其他平台（或 inotify 不可用时）按目录修改时间轮询重扫
+# - 索引未命中时按命名规则直接探测 <前缀>_00001_.png 等文件，覆盖扫描完成前或事件尚未到达的情况
+import ctypes
+import ctypes.util
+import logging
+import os
+import re
+import select
+import struct
+import sys
+import threading
+from pathlib import Path
+
+logger = logging.getLogger("ComfyUI-API")
+
+# SaveImage 输出文件名：<前缀>_<序号>_.<扩展名>
+OUTPUT_NAME_RE = re.compile(r"^(?P<prefix>.+)_(?P<counter>\d{5,})_?\.[A-Za-z0-9]+$")
+PROBE_EXTENSIONS = (".png", ".webp", ".jpg")
+MAX_PROBE = 64  # 探测的最大序号（批量生成时序号从1连续递增）
+
+# inotify 事件掩码
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT = struct.Struct("iIII")
+
+
+def output_prefix(filename: str):
+    """从输出文件名中解析 filename_prefix，不符合命名规则时返回None"""
+    match = OUTPUT_NAME_RE.match(filename)
+    return match.group("prefix") if match else None
+
+
+def _load_inotify():
+    """通过 ctypes 加载 libc 的 inotify 接口，不可用时返回None"""
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+class OutputIndex:
+    """单个输出目录的 前缀 -> 文件 索引（线程安全）"""
+
+    def __init__(self, root, poll_interval: float = 5.0, use_inotify: bool = True):
+        self.root = Path(root)
+        self.poll_interval = poll_interval
+        self.use_inotify = use_inotify
+        self.lock = threading.Lock()
+        self.files = {}  # 前缀 -> {文件名}
+        self.ready = False  # 首次扫描是否完成
+        self.mode = None  # "inotify" / "poll"
+        self.hits = 0
+        self.probes = 0
+        self.misses = 0
+        self._stop_event = threading.Event()
+        self._dir_mtime = None
+
+    # ---------- 查询 ----------
+    def lookup(self, prefix: str) -> list:
+        """前缀对应的输出文件（按文件名排序），未找到时返回空列表"""
+        with self.lock:
+            names = self.files.get(prefix)
+            if names:
+                self.hits += 1
+                return [self.root / name for name in sorted(names)]
+        found = self._probe(prefix)
+        with self.lock:
+            if found:
+                self.probes += 1
+                self.files.setdefault(prefix, set()).update(found)
+            else:
+                self.misses += 1
+        return [self.root / name for name in sorted(found)]
+
+    def _probe(self, prefix: str) -> list:
+        """按命名规则探测 <前缀>_00001_.png、_00002_ ...，遇到不存在的序号即停止"""
+        if os.sep in prefix or "/" in prefix:
+            return []
+        found = []
+        for counter in range(1, MAX_PROBE + 1):
+            for ext in PROBE_EXTENSIONS:
+                name = f"{prefix}_{counter:05d}_{ext}"
+                if (self.root / name).is_file():
+                    found.append(name)
+                    break
+            else:
+                break
+        return found
+
+    # ---------- 维护 ----------
+    def _add(self, name: str):
+        prefix = output_prefix(name)
+        if prefix is not None:
+            with self.lock:
+                self.files.setdefault(prefix, set()).add(name)
+
+    def _remove(self, name: str):
+        prefix = output_prefix(name)
+        if prefix is None:
+            return
+        with self.lock:
+            names = self.files.get(prefix)
+            if names is not None:
+                names.discard(name)
+                if not names:
+                    del self.files[prefix]
+
+    def rescan(self):
+        """全量扫描输出目录（os.scandir 不额外 stat 每个文件）"""
+        files = {}
+        try:
+            self._dir_mtime = os.stat(self.root).st_mtime_ns
+            with os.scandir(self.root) as entries:
+                for entry in entries:
+                    prefix = output_prefix(entry.name)
+                    if prefix is not None and entry.is_file():
+                        files.setdefault(prefix, set()).add(entry.name)
+        except OSError as e:
+            logger.warning(f"扫描输出目录失败 {self.root}: {str(e)}")
+            return
+        with self.lock:
+            self.files = files
+            self.ready = True
+
+    def _run(self):
+        libc = _load_inotify() if self.use_inotify else None
+        if libc is not None and self._watch(libc):
+            return
+        self.rescan()
+        self.mode = "poll"
+        logger.info(f"输出目录索引已建立（轮询模式）: {self.root} | {len(self.files)} 个前缀")
+        while not self._stop_event.wait(self.poll_interval):
+            try:
+                mtime = os.stat(self.root).st_mtime_ns
+            except OSError:
+                continue
+            if mtime != self._dir_mtime:  # 目录内有文件增删时修改时间才会变化
+                self.rescan()
+
+    def _watch(self, libc) -> bool:
+        """inotify 增量更新，无法建立监视时返回False（退回轮询）"""
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            return False
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE | IN_DELETE_SELF
+        if libc.inotify_add_watch(fd, os.fsencode(str(self.root)), mask) < 0:
+            logger.warning(f"无法监视输出目录 {self.root}（errno={ctypes.get_errno()}），改为轮询")
+            os.close(fd)
+            return False
+        # 先建立监视再扫描，扫描期间写入的文件不会遗漏
+        self.rescan()
+        self.mode = "inotify"
+        logger.info(f"输出目录索引已建立（inotify）: {self.root} | {len(self.files)} 个前缀")
+        try:
+            while not self._stop_event.is_set():
+                readable, _, _ = select.select([fd], [], [], 1.0)
+                if not readable:
+                    continue
+                try:
+                    data = os.read(fd, 64 * 1024)
+                except BlockingIOError:
+                    continue
+                offset = 0
+                while offset < len(data):
+                    _, event_mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+                    offset += INOTIFY_EVENT.size
+                    name = data[offset:offset + length].rstrip(b"\0").decode("utf-8", "surrogateescape")
+                    offset += length
+                    if event_mask & IN_Q_OVERFLOW:
+                        self.rescan()  # 事件队列溢出，丢失了部分事件
+                    elif event_mask & IN_DELETE_SELF:
+                        logger.warning(f"输出目录已被删除: {self.root}")
+                    elif not name or event_mask & IN_ISDIR:
+                        continue
+                    elif event_mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                        self._add(name)
+                    elif event_mask & (IN_MOVED_FROM | IN_DELETE):
+                        self._remove(name)
+        finally:
+            os.close(fd)
+        return True
+
+    # ---------- 生命周期 ----------
+    def start(self):
+        threading.Thread(target=self._run, name="output-index", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "root": str(self.root),
+                "mode": self.mode,
+                "ready": self.ready,
+                "prefixes": len(self.files),
+                "hits": self.hits,
+                "probes": self.probes,
+                "misses": self.misses,
+            }
@@ -0,0 +1,88 @@
+# ============== 结果缓存 ==============
+# 已完成任务的结果缓存：按 task_id 保存解析出的图片文件列表和编码好的响应体，
+# 按占用内存大小做LRU淘汰，并设置TTL。任务完成后结果不再变化，重复查询可直接命中。
+import threading
+import time
+from collections import OrderedDict
+
+# 非字节数据（如文件路径列表）的估算开销
+ENTRY_OVERHEAD = 256
+
+
+class ResultCache:
+    """线程安全的 LRU + TTL 结果缓存，容量以字节计"""
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024, ttl: float = 600):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # task_id -> {"expires_at", "values": {key: (value, size)}, "size"}
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, task_id: str, key: str):
+        """读取缓存值，未命中或已过期时返回None"""
+        with self.lock:
+            entry = self.entries.get(task_id)
+            if entry is not None and entry["expires_at"] <= time.monotonic():
+                self._remove(task_id)
+                self.expirations += 1
+                entry = None
+            if entry is None or key not in entry["values"]:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(task_id)
+            self.hits += 1
+            return entry["values"][key][0]
+
+    def put(self, task_id: str, key: str, value, size: int = None):
+        """写入缓存值；size默认取len(value)（适用于bytes）"""
+        size = (len(value) if size is None else size) + ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            entry = self.entries.get(task_id)
+            if entry is None:
+                entry = {"values": {}, "size": 0}
+                self.entries[task_id] = entry
+            old = entry["values"].pop(key, None)
+            if old is not None:
+                entry["size"] -= old[1]
+                self.current_bytes -= old[1]
+            entry["values"][key] = (value, size)
+            entry["size"] += size
+            entry["expires_at"] = time.monotonic() + self.ttl
+            self.current_bytes += size
+            self.entries.move_to_end(task_id)
+
+            while self.current_bytes > self.max_bytes and self.entries:
+                oldest = next(iter(self.entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate(self, task_id: str):
+        with self.lock:
+            self._remove(task_id)
+
+    def _remove(self, task_id: str):
+        entry = self.entries.pop(task_id, None)
+        if entry is not None:
+            self.current_bytes -= entry["size"]
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
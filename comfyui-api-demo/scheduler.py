@@ -0,0 +1,373 @@
+# ============== 本地任务调度 ==============
+# 任务先进入进程内的调度队列，立即返回task_id与排队位置，由后台线程按需提交给ComfyUI：
+# - 优先级：interactive > preview > batch，高优先级队列非空时先调度
+# - 同一优先级内按客户端做加权公平排队（WFQ），单个客户端批量提交不会饿死其他人
+# - 在途窗口：每个ComfyUI节点中同时只保留少量本进程的任务，刚好让GPU保持忙碌
+# - 模型亲和：同一优先级内优先提交与节点当前模型组合相同的任务，减少切换模型重新加载权重；
+#   每个任务最多被越过 affinity_skips 次，之后按公平顺序调度
+# - 故障转移：提交失败（节点宕机）的任务按原来的排队顺序放回队列，改投其他健康节点，
+#   最多尝试 max_attempts 次
+# task_id 在本地生成并作为 prompt_id 提交（需ComfyUI支持指定prompt_id）。
+import heapq
+import itertools
+import logging
+import threading
+import time
+import uuid
+
+from comfy_events import CANCELLED
+
+logger = logging.getLogger("ComfyUI-API")
+
+# 优先级类别，按优先级从高到低排列
+PRIORITY_CLASSES = ("interactive", "preview", "batch")
+DEFAULT_PRIORITY = "interactive"
+
+
+class SchedulerFullError(Exception):
+    """本地调度队列已满"""
+
+
+class _ClassQueue:
+    """单个优先级的加权公平队列
+
+    每个任务的虚拟完成时间 = max(虚拟时钟, 该客户端上一个任务的完成时间) + 1/权重，
+    按完成时间从小到大调度；调度时虚拟时钟推进到该任务的开始时间。
+    """
+
+    def __init__(self):
+        self.heap = []  # (finish_tag, seq, job)
+        self.virtual_time = 0.0
+        self.client_finish = {}
+        # 队列中最大的完成时间（只增不减，队列清空时归零），用于判断新任务是否插队
+        self.max_finish = 0.0
+
+    def push(self, job: dict, weight: float, seq: int) -> bool:
+        """加入任务，返回是否排在已有任务之前（插队）"""
+        start = max(self.virtual_time, self.client_finish.get(job["client_key"], 0.0))
+        job["start_tag"] = start
+        job["finish_tag"] = start + 1.0 / weight
+        job["seq"] = seq
+        self.client_finish[job["client_key"]] = job["finish_tag"]
+        if not self.heap:
+            self.max_finish = 0.0
+        jumped = job["finish_tag"] < self.max_finish
+        self.max_finish = max(self.max_finish, job["finish_tag"])
+        heapq.heappush(self.heap, (job["finish_tag"], seq, job))
+        return jumped
+
+    def pop(self, model: str = None, max_skips: int = 0) -> dict:
+        """取出完成时间最小的任务；指定 model 时改为取使用该模型组合的任务中完成时间最小的，
+        前提是被越过的任务都还没有被越过 max_skips 次"""
+        if model is not None and max_skips > 0 and self.heap[0][2]["model"] != model:
+            matches = [i for i, (_, _, job) in enumerate(self.heap) if job["model"] == model]
+            if matches:
+                index = min(matches, key=lambda i: self.heap[i][:2])
+                chosen = self.heap[index][:2]
+                skipped = [job for finish_tag, seq, job in self.heap if (finish_tag, seq) < chosen]
+                if all(job["skipped"] < max_skips for job in skipped):
+                    for job in skipped:
+                        job["skipped"] += 1
+                    job = self.heap[index][2]
+                    del self.heap[index]
+                    heapq.heapify(self.heap)
+                    return self._popped(job)
+        _, _, job = heapq.heappop(self.heap)
+        return self._popped(job)
+
+    def _popped(self, job: dict) -> dict:
+        self.virtual_time = max(self.virtual_time, job["start_tag"])
+        if len(self.client_finish) > 1024:
+            # 完成时间不晚于虚拟时钟的客户端与从未出现过的客户端等价，可以丢弃
+            self.client_finish = {key: tag for key, tag in self.client_finish.items()
+                                  if tag > self.virtual_time}
+        return job
+
+
+class JobScheduler:
+    """优先级 + 加权公平排队的本地调度器（线程安全）
+
+    任务由节点池（BackendPool）选择负载最低的健康节点提交，
+    max_in_flight 为每个节点同时保留的本进程任务数，
+    affinity_skips 为模型亲和调度中每个任务最多被越过的次数（0为关闭），
+    max_attempts 为每个任务最多提交的次数（提交失败时改投其他节点）。
+    """
+
+    def __init__(self, pool, tracker, max_in_flight: int = 2, max_pending: int = 1000,
+                 client_weights: dict = None, affinity_skips: int = 8, max_attempts: int = 3):
+        self.pool = pool
+        self.tracker = tracker
+        self.max_in_flight = max_in_flight
+        self.max_pending = max_pending
+        self.client_weights = client_weights or {}
+        self.affinity_skips = affinity_skips
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+        self.cond = threading.Condition(self.lock)
+        self.queues = {name: _ClassQueue() for name in PRIORITY_CLASSES}
+        self.pending = {}  # task_id -> job
+        self.dispatching = set()  # 已从队列取出、正在提交给ComfyUI（尚无ComfyUI队列序号）的任务
+        self._ranks = None  # task_id -> 本地排队位置；队列变化时失效，查询时整体重建一次
+        self._positions_changed = False  # 已提交的任务改变了排队位置，尚未通知
+        self.seq = itertools.count()
+        self.dispatched = 0
+        self.rejected = 0
+        self.affinity_picks = 0  # 按模型亲和越过公平顺序调度的次数
+        self.failovers = 0  # 提交失败后放回队列改投其他节点的次数
+        self._stop_event = threading.Event()
+        self._thread = None
+        tracker.on_finished(self.task_finished)
+        tracker.position_source = self.position
+
+    # ---------- 入队 ----------
+    def submit(self, workflow: dict, priority: str = DEFAULT_PRIORITY, client_key: str = "anonymous",
+               task_id: str = None, model: str = None):
+        """加入调度队列，返回 (task_id, 排队位置)；队列已满时抛出 SchedulerFullError
+
+        task_id 默认自动生成，也可由调用方预先分配（如生成缓存登记的任务ID）；
+        model 为工作流的模型组合（WorkflowTemplate.model_key），None表示不参与模型亲和调度
+        """
+        if priority not in self.queues:
+            raise ValueError(f"未知的优先级: {priority}")
+        task_id = task_id or str(uuid.uuid4())
+        job = {
+            "task_id": task_id,
+            "workflow": workflow,
+            "priority": priority,
+            "client_key": client_key,
+            "model": model,
+            "skipped": 0,
+            "attempts": 0,
+            "enqueued_at": time.monotonic(),
+        }
+        with self.lock:
+            if len(self.pending) >= self.max_pending:
+                self.rejected += 1
+                raise SchedulerFullError(f"调度队列已满 ({len(self.pending)}/{self.max_pending})")
+            weight = self.client_weights.get(client_key, 1.0)
+            jumped = self.queues[priority].push(job, weight, next(self.seq))
+            # 低优先级队列中的任务也排在它之后
+            jumped = jumped or any(self.queues[name].heap
+                                   for name in PRIORITY_CLASSES[PRIORITY_CLASSES.index(priority) + 1:])
+            self.pending[task_id] = job
+            self._ranks = None
+            self.cond.notify()
+
+        self.tracker.mark_submitted(task_id)
+        if jumped:
+            # 插队改变了其他任务的排队位置
+            self.tracker.notify_positions()
+        return task_id, self.position(task_id)
+
+    # ---------- 排队位置 ----------
+    def _sort_key(self, job: dict):
+        return PRIORITY_CLASSES.index(job["priority"]), job["finish_tag"], job["seq"]
+
+    def _local_position(self, job: dict) -> int:
+        """（在锁内调用）本地队列中排在前面的任务数；队列变化后首次查询时排序一次，之后O(1)"""
+        if self._ranks is None:
+            order = sorted(self.pending.values(), key=self._sort_key)
+            self._ranks = {other["task_id"]: rank for rank, other in enumerate(order)}
+        return self._ranks[job["task_id"]]
+
+    def position(self, task_id: str):
+        """前面还有多少个任务（包括ComfyUI中未完成的任务），不在本地队列中且不在提交中返回None
+
+        正在提交的任务已预留节点名额，计入排在其后的任务的位置（load 包含预留的名额）；
+        其自身的位置为ComfyUI中未完成的任务数
+        """
+        with self.lock:
+            job = self.pending.get(task_id)
+            if job is None and task_id not in self.dispatching:
+                return None
+            ahead = self._local_position(job) if job is not None else None
+        backends = [b for b in self.pool.backends if b.accepting]
+        if ahead is None:
+            return sum(b.admission.depth() for b in backends)
+        return ahead + sum(b.admission.load() for b in backends)
+
+    def pending_ids(self) -> list:
+        """本地队列中尚未提交的任务"""
+        with self.lock:
+            return list(self.pending)
+
+    def cancel(self, task_id: str) -> bool:
+        """从本地队列移除尚未提交的任务，返回是否移除"""
+        with self.lock:
+            job = self.pending.pop(task_id, None)
+            if job is None:
+                return False
+            heap = self.queues[job["priority"]].heap
+            heap[:] = [entry for entry in heap if entry[2] is not job]
+            heapq.heapify(heap)
+            self._ranks = None
+        self.tracker.notify_positions()
+        return True
+
+    # ---------- 调度 ----------
+    def _can_dispatch(self) -> bool:
+        return self._stop_event.is_set() or (self.pending and self.pool.has_capacity(self.max_in_flight))
+
+    def _next_model(self):
+        """下一个按公平顺序调度的任务的模型组合"""
+        for name in PRIORITY_CLASSES:
+            heap = self.queues[name].heap
+            if heap:
+                return heap[0][2]["model"]
+        return None
+
+    def _pop(self, model: str = None) -> dict:
+        """取出最高优先级中下一个任务，优先取使用 model（节点当前模型组合）的任务"""
+        for name in PRIORITY_CLASSES:
+            queue = self.queues[name]
+            if queue.heap:
+                head = queue.heap[0][2]
+                job = queue.pop(model, self.affinity_skips)
+                if job is not head:
+                    self.affinity_picks += 1
+                del self.pending[job["task_id"]]
+                self._ranks = None
+                return job
+        return None
+
+    def _requeue(self, job: dict) -> bool:
+        """提交失败的任务按原来的完成时间与序号放回队列（排队顺序不变），返回是否放回
+
+        已取消、已达到最多提交次数、或没有其他可接收任务的节点时不放回
+        """
+        state = self.tracker.get(job["task_id"])
+        if state is not None and state["status"] == CANCELLED:
+            return False
+        if job["attempts"] >= self.max_attempts or not any(b.accepting for b in self.pool.backends):
+            return False
+        with self.lock:
+            if self._stop_event.is_set():
+                return False
+            queue = self.queues[job["priority"]]
+            heapq.heappush(queue.heap, (job["finish_tag"], job["seq"], job))
+            queue.max_finish = max(queue.max_finish, job["finish_tag"])
+            self.pending[job["task_id"]] = job
+            self._ranks = None
+            self._positions_changed = True
+            self.failovers += 1
+            self.cond.notify()
+        return True
+
+    def _flush_positions(self, idle: bool = True):
+        """连续提交一批任务时，排队位置的变化在这一批提交完（即将等待）时统一通知一次"""
+        with self.lock:
+            notify = self._positions_changed and (idle or not self._can_dispatch())
+            if notify:
+                self._positions_changed = False
+        if notify:
+            self.tracker.notify_positions()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            self._flush_positions(idle=False)
+            with self.lock:
+                # 节点的在途名额也会因后台刷新 /queue 而释放（如事件通道断开时），因此定时重新检查
+                if not self.cond.wait_for(self._can_dispatch, self.pool.refresh_interval):
+                    continue
+                if self._stop_event.is_set():
+                    return
+                backend = self.pool.reserve(self.max_in_flight, self._next_model())
+                job = self._pop(backend.current_model) if backend is not None else None
+                if job is not None:
+                    self.dispatching.add(job["task_id"])
+
+            if backend is None:
+                # 所有节点的ComfyUI队列均已满，等待后台刷新或任务结束
+                self._flush_positions()
+                self._stop_event.wait(self.pool.refresh_interval)
+            else:
+                try:
+                    self._dispatch(job, backend)
+                finally:
+                    # 提交完成时已登记ComfyUI队列序号（或已放回队列、已失败），排队位置不再由本地队列计算
+                    with self.lock:
+                        self.dispatching.discard(job["task_id"])
+
+    def _dispatch(self, job: dict, backend):
+        task_id = job["task_id"]
+        self.pool.assign(task_id, backend)
+        if "attempts" in job:
+            job["attempts"] += 1
+        try:
+            result = backend.client.submit_prompt(job["workflow"], prompt_id=task_id)
+        except Exception as e:
+            # 节点无法访问：暂停向其分配任务，任务放回队列改投其他节点（预热任务不重试）
+            self.pool.release(task_id, backend, failed=True)
+            if "attempts" in job and self._requeue(job):
+                logger.warning(f"[{task_id}] 任务提交失败 ({backend.name})，改投其他节点: {str(e)}")
+                return
+            logger.error(f"[{task_id}] 任务提交失败 ({backend.name}): {str(e)}")
+            self.tracker.mark_failed(task_id, "AI引擎服务异常")
+            return
+        if result.get("prompt_id") != task_id:
+            logger.error(f"[{task_id}] 任务提交失败 ({backend.name}): ComfyUI未使用指定的prompt_id，请升级ComfyUI")
+            self.pool.release(task_id, backend)
+            self.tracker.mark_failed(task_id, "AI引擎服务异常")
+            return
+
+        self.pool.commit(task_id, backend)
+        state = self.tracker.get(task_id)
+        if state is not None and state["status"] == CANCELLED:
+            # 提交期间被取消：从ComfyUI队列删除（任务结束的回调已执行过，需再次释放名额）
+            try:
+                self.pool.cancel(task_id)
+            except Exception as e:
+                logger.warning(f"[{task_id}] 删除已取消的任务失败 ({backend.name}): {str(e)}")
+            self.pool.task_finished(task_id)
+            return
+        with self.lock:
+            self.dispatched += 1
+            swapped = backend.model_dispatched(job.get("model"))
+        wait = time.monotonic() - job["enqueued_at"]
+        logger.info(f"[{task_id}] 已提交ComfyUI {backend.name} | 优先级: {job['priority']} | 客户端: {job['client_key']} | 排队: {wait:.2f}s")
+        if swapped:
+            logger.info(f"[{task_id}] 节点 {backend.name} 切换模型组合: {job['model']}")
+        self.tracker.mark_dispatched(task_id, result.get("number"))
+        with self.lock:
+            self._positions_changed = True
+            self.cond.notify()  # 预热任务由其他线程提交，唤醒调度线程发出通知
+
+    def warm_up(self, backend, workflow: dict, task_id: str, model: str = None) -> bool:
+        """不经过调度队列，直接向指定节点提交预热任务；节点不可用或队列已满时返回False"""
+        if not backend.accepting or not backend.admission.try_reserve():
+            return False
+        self.tracker.mark_submitted(task_id)
+        self._dispatch({"task_id": task_id, "workflow": workflow, "priority": PRIORITY_CLASSES[-1],
+                        "client_key": "warmup", "model": model, "enqueued_at": time.monotonic()}, backend)
+        return True
+
+    def task_finished(self, task_id: str, status: str = None):
+        """任务结束（由事件跟踪回调，在跟踪器锁内调用）：释放节点名额并唤醒调度线程"""
+        self.pool.task_finished(task_id)
+        with self.lock:
+            self.cond.notify_all()
+
+    # ---------- 生命周期 ----------
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="job-scheduler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+        with self.lock:
+            self.cond.notify_all()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "pending": {name: len(queue.heap) for name, queue in self.queues.items()},
+                "in_flight": sum(b.admission.local_load() for b in self.pool.backends),
+                "max_in_flight": self.max_in_flight,
+                "max_pending": self.max_pending,
+                "dispatched": self.dispatched,
+                "rejected": self.rejected,
+                "affinity_picks": self.affinity_picks,
+                "failovers": self.failovers,
+                "model_swaps": sum(b.model_swaps for b in self.pool.backends),
+            }
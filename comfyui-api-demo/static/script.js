@@ -1,353 +1,574 @@
-// 获取页面元素
-const modal = document.getElementById('preview-modal');
-const previewImage = document.getElementById('preview-image');
-const resultSection = document.querySelector('.result-section');
-const imageGrid = document.getElementById('image-grid');
-const generateButton = document.getElementById('generate');
-const clearButton = document.getElementById('clear');
-
-// 记录当前分享的图片URL
-let currentImageUrl = '';
-
-// 页面加载时添加缓存和性能优化
-document.addEventListener('DOMContentLoaded', function() {
-    // 预连接到API服务器
-    const linkElement = document.createElement('link');
-    linkElement.rel = 'preconnect';
-    linkElement.href = window.location.origin;
-    document.head.appendChild(linkElement);
-    
-    // 为页面元素添加懒加载
-    if ('loading' in HTMLImageElement.prototype) {
-        // 浏览器支持懒加载
-        document.querySelectorAll('img').forEach(img => {
-            img.loading = 'lazy';
-        });
-    }
-    
-    // 添加事件监听
-    generateButton.addEventListener('click', generateImage);
-    clearButton.addEventListener('click', clearAll);
-    
-    // 点击模态框外部关闭
-    modal.addEventListener('click', (event) => {
-        if (event.target === modal) {
-            closeModal();
-        }
-    });
-    
-    // 注册安装事件（如果支持PWA）
-    if ('serviceWorker' in navigator) {
-        window.addEventListener('load', () => {
-            navigator.serviceWorker.register('/service-worker.js')
-                .then(reg => console.log('Service Worker registered'))
-                .catch(err => console.log('Service Worker registration failed: ', err));
-        });
-    }
-});
-
-// 翻译中文到英文
-async function translateToEnglish(text) {
-    try {
-        // 使用免费的翻译API
-        const response = await fetch(`https://api.mymemory.translated.net/get?q=${encodeURIComponent(text)}&langpair=zh|en`);
-        const data = await response.json();
-        
-        if (data && data.responseData && data.responseData.translatedText) {
-            console.log('翻译结果:', data.responseData.translatedText);
-            return data.responseData.translatedText;
-        } else {
-            console.error('翻译失败:', data);
-            return text; // 返回原文
-        }
-    } catch (error) {
-        console.error('翻译服务错误:', error);
-        return text; // 发生错误时返回原文
-    }
-}
-
-// 生成图片
-async function generateImage() {
-    const prompt = document.getElementById('prompt').value.trim();
-    if (!prompt) {
-        alert('请输入描述文字');
-        return;
-    }
-
-    // 获取选择的参数
-    const aspectRatio = document.getElementById('aspect_ratio').value;
-    
-    // 根据比例设置宽高
-    let width, height;
-    switch (aspectRatio) {
-        case '1:1':
-            width = 512;
-            height = 512;
-            break;
-        case '16:9':
-            width = 1280;
-            height = 720;
-            break;
-        case '9:16':
-            width = 720;
-            height = 1280;
-            break;
-        default:
-            width = 512;
-            height = 512;
-    }
-
-    // 获取风格参数，构建完整提示词
-    const styleFormat = document.getElementById('style_format').value;
-    const styleColor = document.getElementById('style_color').value;
-    const styleLight = document.getElementById('style_light').value;
-    const styleComposition = document.getElementById('style_composition').value;
-
-    // 构建完整提示词
-    let fullPrompt = prompt;
-    if (styleFormat !== 'none') fullPrompt += `, ${styleFormat}`;
-    if (styleColor !== 'none') fullPrompt += `, ${styleColor}`;
-    if (styleLight !== 'none') fullPrompt += `, ${styleLight}`;
-    if (styleComposition !== 'none') fullPrompt += `, ${styleComposition}`;
-
-    // 首先显示结果区域
-    resultSection.style.display = 'block';
-
-    // 创建生成任务容器
-    const generationTask = document.createElement('div');
-    generationTask.className = 'generation-task';
-
-    // 创建生成信息头部
-    const generationHeader = document.createElement('div');
-    generationHeader.className = 'generation-header';
-    
-    // 获取当前时间
-    const now = new Date();
-    const timeString = now.toLocaleString('zh-CN', {
-        year: 'numeric',
-        month: '2-digit',
-        day: '2-digit',
-        hour: '2-digit',
-        minute: '2-digit',
-        second: '2-digit',
-        hour12: false
-    }).replace(/\//g, '/');
-
-    // 设置生成信息内容
-    generationHeader.innerHTML = `
-        <div class="generation-prompt">生成: ${fullPrompt}</div>
-        <div class="generation-time">${timeString}</div>
-    `;
-    
-    // 创建图片网格
-    const grid = document.createElement('div');
-    grid.className = 'image-grid';
-
-    // 创建4个加载中的缩略图
-    const thumbnails = [];
-    for (let i = 0; i < 4; i++) {
-        const imageWrapper = document.createElement('div');
-        imageWrapper.className = 'image-item';
-        imageWrapper.innerHTML = `
-            <div class="thumbnail-spinner"></div>
-            <div class="thumbnail-time">预计时间：20 秒</div>
-            <div class="skeleton" style="width: 100%; height: 150px; margin-top: 10px;"></div>
-        `;
-        grid.appendChild(imageWrapper);
-        thumbnails.push(imageWrapper);
-    }
-
-    // 将头部和网格添加到任务容器
-    generationTask.appendChild(generationHeader);
-    generationTask.appendChild(grid);
-    
-    // 将任务容器添加到结果区域的最前面
-    if (imageGrid.firstChild) {
-        imageGrid.insertBefore(generationTask, imageGrid.firstChild);
-    } else {
-        imageGrid.appendChild(generationTask);
-    }
-
-    try {
-        // 禁用生成按钮，防止重复点击
-        generateButton.disabled = true;
-        generateButton.textContent = '翻译并生成中...';
-        
-        // 翻译提示词（如果包含中文字符）
-        let translatedPrompt = fullPrompt;
-        if (/[\u4e00-\u9fa5]/.test(fullPrompt)) {
-            translatedPrompt = await translateToEnglish(fullPrompt);
-            console.log('原始提示词:', fullPrompt);
-            console.log('翻译后提示词:', translatedPrompt);
-            
-            // 更新生成信息，显示翻译后的提示词
-            const promptEl = generationHeader.querySelector('.generation-prompt');
-            if (promptEl) {
-                promptEl.innerHTML = `生成: ${fullPrompt}<br><span class="translated-prompt">翻译: ${translatedPrompt}</span>`;
-            }
-        }
-        
-        // 第一步：提交生成任务
-        const generateResponse = await fetch('/generate', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            body: JSON.stringify({
-                prompt: translatedPrompt, // 使用翻译后的提示词
-                seed: Math.floor(Math.random() * 0xFFFFFFFF),
-                steps: 30,
-                guidance: 3.5,
-                max_shift: 1.15,
-                base_shift: 0.5,
-                denoise: 1.0,
-                batch_count: 4,
-                width: width,
-                height: height
-            })
-        });
-
-        const generateData = await generateResponse.json();
-        console.log('生成任务响应:', generateData);
-
-        if (generateData.error) {
-            throw new Error(generateData.error);
-        }
-
-        // 第二步：轮询获取结果
-        const taskId = generateData.task_id;
-        let retries = 0;
-        const maxRetries = 30;
-        const startTime = Date.now();
-
-        // 等待3秒再开始轮询
-        await new Promise(resolve => setTimeout(resolve, 3000));
-
-        while (retries < maxRetries) {
-            try {
-                const resultResponse = await fetch(`/result?task_id=${taskId}&_t=${Date.now()}`);
-                const resultData = await resultResponse.json();
-                console.log('轮询结果:', resultData);
-
-                if (resultData.status === 'completed' && resultData.images && resultData.images.length > 0) {
-                    // 逐个替换加载中的缩略图为实际图片
-                    resultData.images.forEach((imageData, index) => {
-                        const item = thumbnails[index];
-                        if (item) {
-                            const img = document.createElement('img');
-                            img.src = imageData;
-                            img.className = 'fade-in';
-                            img.loading = 'lazy';
-                            img.onclick = () => showModal(imageData);
-                            item.innerHTML = '';
-                            item.appendChild(img);
-                        }
-                    });
-                    break;
-                } else if (resultData.status === 'pending') {
-                    // 更新状态文本
-                    thumbnails.forEach(item => {
-                        const timeEl = item.querySelector('.thumbnail-time');
-                        if (resultData.progress) {
-                            const progress = Math.round(resultData.progress * 100);
-                            if (timeEl) {
-                                timeEl.textContent = `生成中: ${progress}%`;
-                            }
-                        } else {
-                            const elapsedSeconds = Math.floor((Date.now() - startTime) / 1000);
-                            const remainingSeconds = Math.max(1, 20 - elapsedSeconds);
-                            if (timeEl) {
-                                timeEl.textContent = `预计时间: ${remainingSeconds}秒`;
-                            }
-                        }
-                    });
-                } else if (resultData.error_message) {
-                    throw new Error(resultData.error_message);
-                }
-
-                await new Promise(resolve => setTimeout(resolve, 2000));
-                retries++;
-            } catch (error) {
-                console.error('轮询出错:', error);
-                if (error.message.includes('任务不存在') || error.message.includes('已过期')) {
-                    console.log('任务暂未就绪，继续等待...');
-                    await new Promise(resolve => setTimeout(resolve, 2000));
-                    retries++;
-                    continue;
-                }
-                throw error;
-            }
-        }
-
-        if (retries >= maxRetries) {
-            throw new Error('生成超时，请重试');
-        }
-
-    } catch (error) {
-        console.error('生成失败:', error);
-        alert('生成失败：' + error.message);
-        // 移除生成任务容器
-        generationTask.remove();
-    } finally {
-        // 恢复生成按钮状态
-        generateButton.disabled = false;
-        generateButton.textContent = '生成图片';
-    }
-}
-
-// 显示图片预览
-function showModal(imageSrc) {
-    previewImage.src = imageSrc;
-    currentImageUrl = imageSrc;
-    modal.classList.add('active');
-}
-
-// 关闭预览
-function closeModal() {
-    modal.classList.remove('active');
-}
-
-// 下载图片
-function downloadImage() {
-    const link = document.createElement('a');
-    link.href = previewImage.src;
-    link.download = 'generated-image-' + new Date().getTime() + '.jpg';
-    link.click();
-}
-
-// 分享图片
-async function shareImage() {
-    try {
-        // 检查是否支持网页分享API
-        if (navigator.share) {
-            // 将图片转为Blob以便分享
-            const response = await fetch(currentImageUrl);
-            const blob = await response.blob();
-            const file = new File([blob], 'ai-generated-image.jpg', { type: 'image/jpeg' });
-            
-            await navigator.share({
-                title: 'AI生成的图片',
-                text: '看看我用AI生成的这张图片！',
-                files: [file]
-            });
-        } else {
-            // 复制图片链接到剪贴板
-            await navigator.clipboard.writeText(currentImageUrl);
-            alert('图片链接已复制到剪贴板，您可以粘贴并分享！');
-        }
-    } catch (error) {
-        console.error('分享失败:', error);
-        alert('分享失败，请手动下载图片后分享');
-    }
-}
-
-// 清除所有输入
-function clearAll() {
-    document.getElementById('prompt').value = '';
-    document.getElementById('aspect_ratio').selectedIndex = 0;
-    document.getElementById('style_format').selectedIndex = 0;
-    document.getElementById('style_color').selectedIndex = 0;
-    document.getElementById('style_light').selectedIndex = 0;
-    document.getElementById('style_composition').selectedIndex = 0;
-    resultSection.style.display = 'none';
+// 获取页面元素
+const modal = document.getElementById('preview-modal');
+const previewImage = document.getElementById('preview-image');
+const resultSection = document.querySelector('.result-section');
+const imageGrid = document.getElementById('image-grid');
+const generateButton = document.getElementById('generate');
+const clearButton = document.getElementById('clear');
+
+// 记录当前分享的图片URL
+let currentImageUrl = '';
+
+// 最近生成的结果保存在本地，重新打开页面时显示（图片由Service Worker缓存，离线也可查看）
+const HISTORY_KEY = 'generation-history';
+const HISTORY_LIMIT = 20;
+
+// 正在等待结果的任务，页面关闭时通知服务端取消
+const activeTasks = new Map();  // 等待中的任务ID -> 取消令牌
+
+// 页面加载时添加缓存和性能优化
+document.addEventListener('DOMContentLoaded', function() {
+    // 预连接到API服务器
+    const linkElement = document.createElement('link');
+    linkElement.rel = 'preconnect';
+    linkElement.href = window.location.origin;
+    document.head.appendChild(linkElement);
+    
+    // 为页面元素添加懒加载
+    if ('loading' in HTMLImageElement.prototype) {
+        // 浏览器支持懒加载
+        document.querySelectorAll('img').forEach(img => {
+            img.loading = 'lazy';
+        });
+    }
+    
+    // 显示历史生成结果
+    renderHistory();
+
+    // 添加事件监听
+    generateButton.addEventListener('click', generateImage);
+    clearButton.addEventListener('click', clearAll);
+    window.addEventListener('pagehide', cancelActiveTasks);
+    
+    // 点击模态框外部关闭
+    modal.addEventListener('click', (event) => {
+        if (event.target === modal) {
+            closeModal();
+        }
+    });
+    
+    // 注册安装事件（如果支持PWA）
+    if ('serviceWorker' in navigator) {
+        window.addEventListener('load', () => {
+            navigator.serviceWorker.register('/service-worker.js')
+                .then(reg => console.log('Service Worker registered'))
+                .catch(err => console.log('Service Worker registration failed: ', err));
+        });
+    }
+});
+
+// 翻译中文到英文
+async function translateToEnglish(text) {
+    try {
+        // 使用免费的翻译API
+        const response = await fetch(`https://api.mymemory.translated.net/get?q=${encodeURIComponent(text)}&langpair=zh|en`);
+        const data = await response.json();
+        
+        if (data && data.responseData && data.responseData.translatedText) {
+            console.log('翻译结果:', data.responseData.translatedText);
+            return data.responseData.translatedText;
+        } else {
+            console.error('翻译失败:', data);
+            return text; // 返回原文
+        }
+    } catch (error) {
+        console.error('翻译服务错误:', error);
+        return text; // 发生错误时返回原文
+    }
+}
+
+// 生成图片
+async function generateImage() {
+    const prompt = document.getElementById('prompt').value.trim();
+    if (!prompt) {
+        alert('请输入描述文字');
+        return;
+    }
+
+    // 获取选择的参数
+    const aspectRatio = document.getElementById('aspect_ratio').value;
+    
+    // 根据比例设置宽高
+    let width, height;
+    switch (aspectRatio) {
+        case '1:1':
+            width = 512;
+            height = 512;
+            break;
+        case '16:9':
+            width = 1280;
+            height = 720;
+            break;
+        case '9:16':
+            width = 720;
+            height = 1280;
+            break;
+        default:
+            width = 512;
+            height = 512;
+    }
+
+    // 获取风格参数，构建完整提示词
+    const styleFormat = document.getElementById('style_format').value;
+    const styleColor = document.getElementById('style_color').value;
+    const styleLight = document.getElementById('style_light').value;
+    const styleComposition = document.getElementById('style_composition').value;
+
+    // 构建完整提示词
+    let fullPrompt = prompt;
+    if (styleFormat !== 'none') fullPrompt += `, ${styleFormat}`;
+    if (styleColor !== 'none') fullPrompt += `, ${styleColor}`;
+    if (styleLight !== 'none') fullPrompt += `, ${styleLight}`;
+    if (styleComposition !== 'none') fullPrompt += `, ${styleComposition}`;
+
+    // 首先显示结果区域
+    resultSection.style.display = 'block';
+
+    // 获取当前时间
+    const now = new Date();
+    const timeString = now.toLocaleString('zh-CN', {
+        year: 'numeric',
+        month: '2-digit',
+        day: '2-digit',
+        hour: '2-digit',
+        minute: '2-digit',
+        second: '2-digit',
+        hour12: false
+    }).replace(/\//g, '/');
+
+    // 创建生成任务容器（4个加载中的缩略图）
+    const { generationTask, generationHeader, thumbnails } = createGenerationTask(fullPrompt, timeString, 4);
+
+    // 将任务容器添加到结果区域的最前面
+    if (imageGrid.firstChild) {
+        imageGrid.insertBefore(generationTask, imageGrid.firstChild);
+    } else {
+        imageGrid.appendChild(generationTask);
+    }
+
+    let taskId = null;
+    try {
+        // 禁用生成按钮，防止重复点击
+        generateButton.disabled = true;
+        generateButton.textContent = '翻译并生成中...';
+        
+        // 翻译提示词（如果包含中文字符）
+        let translatedPrompt = fullPrompt;
+        if (/[\u4e00-\u9fa5]/.test(fullPrompt)) {
+            translatedPrompt = await translateToEnglish(fullPrompt);
+            console.log('原始提示词:', fullPrompt);
+            console.log('翻译后提示词:', translatedPrompt);
+            
+            // 更新生成信息，显示翻译后的提示词
+            const promptEl = generationHeader.querySelector('.generation-prompt');
+            if (promptEl) {
+                promptEl.innerHTML = `生成: ${fullPrompt}<br><span class="translated-prompt">翻译: ${translatedPrompt}</span>`;
+            }
+        }
+        
+        // 第一步：提交生成任务
+        const generateResponse = await fetch('/generate', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({
+                prompt: translatedPrompt, // 使用翻译后的提示词
+                seed: Math.floor(Math.random() * 0xFFFFFFFF),
+                steps: 30,
+                guidance: 3.5,
+                max_shift: 1.15,
+                base_shift: 0.5,
+                denoise: 1.0,
+                batch_count: 4,
+                width: width,
+                height: height
+            })
+        });
+
+        const generateData = await generateResponse.json();
+        console.log('生成任务响应:', generateData);
+
+        if (generateData.error) {
+            throw new Error(generateData.error);
+        }
+
+        // 第二步：等待结果（优先使用SSE推送，浏览器不支持时退回轮询）
+        taskId = generateData.task_id;
+        if (generateData.cancel_token) {
+            activeTasks.set(taskId, generateData.cancel_token);
+        }
+        const startTime = Date.now();
+        const images = await waitForResult(taskId, {
+            onQueue: (position) => {
+                if (position === null) {
+                    return;
+                }
+                updateThumbnailStatus(thumbnails, position > 0 ? `排队中: 前面还有${position}个任务` : '即将开始生成...');
+            },
+            onProgress: (progress) => {
+                updateThumbnailStatus(thumbnails, `生成中: ${Math.round(progress * 100)}%`);
+            },
+            onPreview: (image) => showPreviewFrame(thumbnails, image),
+            onWaiting: (etaMs) => {
+                // 优先使用服务端按模板耗时估计的剩余时间
+                const elapsedSeconds = Math.floor((Date.now() - startTime) / 1000);
+                const remainingSeconds = etaMs != null ? Math.max(1, Math.ceil(etaMs / 1000)) : Math.max(1, 20 - elapsedSeconds);
+                updateThumbnailStatus(thumbnails, `预计时间: ${remainingSeconds}秒`);
+            }
+        }, generateData);
+        renderImages(thumbnails, images);
+        saveHistory({ prompt: fullPrompt, time: timeString, images });
+        logImageCacheStats();
+
+    } catch (error) {
+        console.error('生成失败:', error);
+        alert('生成失败：' + error.message);
+        // 移除生成任务容器
+        generationTask.remove();
+    } finally {
+        activeTasks.delete(taskId);
+        // 恢复生成按钮状态
+        generateButton.disabled = false;
+        generateButton.textContent = '生成图片';
+    }
+}
+
+// 页面关闭时退出仍在等待的任务，释放GPU（进入往返缓存的页面可能被恢复，不取消）；
+// 相同参数的请求会合并为同一个任务，服务端只在最后一个等待者退出时才真正取消
+function cancelActiveTasks(event) {
+    if (event.persisted || !navigator.sendBeacon) {
+        return;
+    }
+    activeTasks.forEach((token, taskId) => navigator.sendBeacon(
+        `/cancel?task_id=${encodeURIComponent(taskId)}&cancel_token=${encodeURIComponent(token)}`));
+}
+
+// 创建生成任务容器：信息头部与 count 个加载中的缩略图
+function createGenerationTask(fullPrompt, timeString, count) {
+    const generationTask = document.createElement('div');
+    generationTask.className = 'generation-task';
+
+    // 创建生成信息头部
+    const generationHeader = document.createElement('div');
+    generationHeader.className = 'generation-header';
+    generationHeader.innerHTML = `
+        <div class="generation-prompt">生成: ${fullPrompt}</div>
+        <div class="generation-time">${timeString}</div>
+    `;
+
+    // 创建图片网格
+    const grid = document.createElement('div');
+    grid.className = 'image-grid';
+
+    const thumbnails = [];
+    for (let i = 0; i < count; i++) {
+        const imageWrapper = document.createElement('div');
+        imageWrapper.className = 'image-item';
+        imageWrapper.innerHTML = `
+            <div class="thumbnail-spinner"></div>
+            <div class="thumbnail-time">预计时间：20 秒</div>
+            <div class="skeleton" style="width: 100%; height: 150px; margin-top: 10px;"></div>
+        `;
+        grid.appendChild(imageWrapper);
+        thumbnails.push(imageWrapper);
+    }
+
+    // 将头部和网格添加到任务容器
+    generationTask.appendChild(generationHeader);
+    generationTask.appendChild(grid);
+    return { generationTask, generationHeader, thumbnails };
+}
+
+// 读取历史生成结果（新的在前）
+function loadHistory() {
+    try {
+        return JSON.parse(localStorage.getItem(HISTORY_KEY)) || [];
+    } catch (error) {
+        return [];
+    }
+}
+
+// 保存一次生成结果；只保存 /images/ 地址，内联的 data URI 体积过大不保存
+function saveHistory(entry) {
+    const images = entry.images.filter(image => image.startsWith('/images/'));
+    if (images.length === 0) {
+        return;
+    }
+    const history = [{ ...entry, images }, ...loadHistory()].slice(0, HISTORY_LIMIT);
+    try {
+        localStorage.setItem(HISTORY_KEY, JSON.stringify(history));
+    } catch (error) {
+        console.log('保存历史记录失败:', error);
+    }
+}
+
+function renderHistory() {
+    const history = loadHistory();
+    if (history.length === 0) {
+        return;
+    }
+    resultSection.style.display = 'block';
+    history.forEach(entry => {
+        const { generationTask, thumbnails } = createGenerationTask(entry.prompt, entry.time, entry.images.length);
+        imageGrid.appendChild(generationTask);
+        renderImages(thumbnails, entry.images);
+    });
+    logImageCacheStats();
+}
+
+// 查询Service Worker的图片缓存统计（条目数、大小、命中次数），也可在控制台调用以调整缓存上限
+function getImageCacheStats() {
+    if (!('serviceWorker' in navigator) || !navigator.serviceWorker.controller) {
+        return Promise.resolve(null);
+    }
+    return new Promise(resolve => {
+        const channel = new MessageChannel();
+        const timer = setTimeout(() => resolve(null), 3000);
+        channel.port1.onmessage = (event) => {
+            clearTimeout(timer);
+            resolve(event.data);
+        };
+        navigator.serviceWorker.controller.postMessage({ type: 'image-cache-stats' }, [channel.port2]);
+    });
+}
+
+function logImageCacheStats() {
+    getImageCacheStats().then(stats => {
+        if (stats) {
+            console.log('图片缓存统计:', stats);
+        }
+    });
+}
+
+// 等待生成结果：优先通过 /events 接收推送，不可用时轮询 /result
+// submitted 为 /generate 的响应，其中的 retry_after_ms 决定首次查询的时间
+async function waitForResult(taskId, handlers, submitted) {
+    if ('EventSource' in window) {
+        try {
+            return await streamResult(taskId, handlers);
+        } catch (error) {
+            if (!error.fallback) {
+                throw error;
+            }
+            console.log('事件推送不可用，改为轮询');
+        }
+    }
+    return pollResult(taskId, handlers, submitted);
+}
+
+// 通过SSE接收排队位置、进度、预览帧和最终结果
+function streamResult(taskId, handlers) {
+    return new Promise((resolve, reject) => {
+        const source = new EventSource(`/events?task_id=${encodeURIComponent(taskId)}`);
+        let received = false;
+        const parse = (event) => {
+            received = true;
+            return JSON.parse(event.data);
+        };
+
+        source.addEventListener('queue', (event) => handlers.onQueue(parse(event).queue_position));
+        source.addEventListener('progress', (event) => handlers.onProgress(parse(event).progress));
+        source.addEventListener('preview', (event) => handlers.onPreview(parse(event).image));
+        // 服务端达到最长连接时间后关闭，EventSource会自动重连
+        source.addEventListener('timeout', parse);
+
+        source.addEventListener('completed', (event) => {
+            const data = parse(event);
+            source.close();
+            if (data.images && data.images.length > 0) {
+                resolve(data.images);
+            } else {
+                reject(new Error(data.error_message || '未获取到图片'));
+            }
+        });
+        source.addEventListener('failed', (event) => {
+            const data = parse(event);
+            source.close();
+            reject(new Error(data.error_message || '生成失败'));
+        });
+        source.addEventListener('cancelled', (event) => {
+            const data = parse(event);
+            source.close();
+            reject(new Error(data.error_message || '任务已取消'));
+        });
+
+        source.onerror = () => {
+            // 连接从未建立或已无法重连时退回轮询，其余情况由EventSource自动重连
+            if (!received || source.readyState === EventSource.CLOSED) {
+                source.close();
+                const error = new Error('事件推送不可用');
+                error.fallback = true;
+                reject(error);
+            }
+        };
+    });
+}
+
+// 轮询间隔：服务端未给出提示时使用的默认值与总等待时长上限
+const POLL_FIRST_DELAY_MS = 3000;
+const POLL_INTERVAL_MS = 2000;
+const POLL_TIMEOUT_MS = 11 * 60 * 1000;
+
+// 下次查询前等待的毫秒数：服务端根据预计完成时间给出 retry_after_ms（或 Retry-After 响应头），否则使用默认值
+function pollDelay(data, response, fallbackMs) {
+    if (data && typeof data.retry_after_ms === 'number') {
+        return data.retry_after_ms;
+    }
+    const header = response && response.headers.get('Retry-After');
+    if (header && !isNaN(Number(header))) {
+        return Number(header) * 1000;
+    }
+    return fallbackMs;
+}
+
+// 轮询获取结果
+async function pollResult(taskId, handlers, submitted) {
+    const deadline = Date.now() + POLL_TIMEOUT_MS;
+
+    // 首次查询时间由 /generate 返回的提示决定
+    await new Promise(resolve => setTimeout(resolve, pollDelay(submitted, null, POLL_FIRST_DELAY_MS)));
+
+    while (Date.now() < deadline) {
+        let delay = POLL_INTERVAL_MS;
+        try {
+            // wait: 服务端挂起请求直到任务结束或超时（长轮询）
+            const resultResponse = await fetch(`/result?task_id=${taskId}&wait=20&_t=${Date.now()}`);
+            const resultData = await resultResponse.json();
+            console.log('轮询结果:', resultData);
+
+            if (resultData.status === 'completed' && resultData.images && resultData.images.length > 0) {
+                return resultData.images;
+            } else if (resultData.status === 'pending') {
+                if (resultData.progress) {
+                    handlers.onProgress(resultData.progress);
+                } else {
+                    handlers.onWaiting(resultData.eta_ms);
+                }
+                delay = pollDelay(resultData, resultResponse, POLL_INTERVAL_MS);
+            } else if (resultData.error_message) {
+                throw new Error(resultData.error_message);
+            }
+        } catch (error) {
+            console.error('轮询出错:', error);
+            if (!error.message.includes('任务不存在') && !error.message.includes('已过期')) {
+                throw error;
+            }
+            console.log('任务暂未就绪，继续等待...');
+        }
+        await new Promise(resolve => setTimeout(resolve, delay));
+    }
+
+    throw new Error('生成超时，请重试');
+}
+
+// 更新所有缩略图的状态文本
+function updateThumbnailStatus(thumbnails, text) {
+    thumbnails.forEach(item => {
+        const timeEl = item.querySelector('.thumbnail-time');
+        if (timeEl) {
+            timeEl.textContent = text;
+        }
+    });
+}
+
+// 在第一个缩略图中显示采样预览帧
+function showPreviewFrame(thumbnails, image) {
+    const item = thumbnails[0];
+    if (!item) {
+        return;
+    }
+    let frame = item.querySelector('.preview-frame');
+    if (!frame) {
+        frame = document.createElement('img');
+        frame.className = 'preview-frame';
+        const skeleton = item.querySelector('.skeleton');
+        if (skeleton) {
+            skeleton.replaceWith(frame);
+        } else {
+            item.appendChild(frame);
+        }
+    }
+    frame.src = image;
+}
+
+// 逐个替换加载中的缩略图为实际图片
+// 画廊使用缩略图变体，点击预览与下载时使用原图
+function thumbnailUrl(imageData) {
+    if (imageData.startsWith('/images/') && !imageData.includes('?')) {
+        return imageData + '?variant=thumb';
+    }
+    return imageData;
+}
+
+function renderImages(thumbnails, images) {
+    images.forEach((imageData, index) => {
+        const item = thumbnails[index];
+        if (item) {
+            const img = document.createElement('img');
+            img.src = thumbnailUrl(imageData);
+            img.className = 'fade-in';
+            img.loading = 'lazy';
+            img.onclick = () => showModal(imageData);
+            item.innerHTML = '';
+            item.appendChild(img);
+        }
+    });
+}
+
+// 显示图片预览
+function showModal(imageSrc) {
+    previewImage.src = imageSrc;
+    currentImageUrl = imageSrc;
+    modal.classList.add('active');
+}
+
+// 关闭预览
+function closeModal() {
+    modal.classList.remove('active');
+}
+
+// 下载图片
+function downloadImage() {
+    const link = document.createElement('a');
+    link.href = previewImage.src;
+    link.download = 'generated-image-' + new Date().getTime() + '.jpg';
+    link.click();
+}
+
+// 分享图片
+async function shareImage() {
+    try {
+        // 检查是否支持网页分享API
+        if (navigator.share) {
+            // 将图片转为Blob以便分享
+            const response = await fetch(currentImageUrl);
+            const blob = await response.blob();
+            const file = new File([blob], 'ai-generated-image.jpg', { type: 'image/jpeg' });
+            
+            await navigator.share({
+                title: 'AI生成的图片',
+                text: '看看我用AI生成的这张图片！',
+                files: [file]
+            });
+        } else {
+            // 复制图片链接到剪贴板
+            await navigator.clipboard.writeText(currentImageUrl);
+            alert('图片链接已复制到剪贴板，您可以粘贴并分享！');
+        }
+    } catch (error) {
+        console.error('分享失败:', error);
+        alert('分享失败，请手动下载图片后分享');
+    }
+}
+
+// 清除所有输入
+function clearAll() {
+    document.getElementById('prompt').value = '';
+    document.getElementById('aspect_ratio').selectedIndex = 0;
+    document.getElementById('style_format').selectedIndex = 0;
+    document.getElementById('style_color').selectedIndex = 0;
+    document.getElementById('style_light').selectedIndex = 0;
+    document.getElementById('style_composition').selectedIndex = 0;
+    resultSection.style.display = 'none';
 } 
\ No newline at end of file
@@ -1,131 +1,357 @@
-// 缓存版本号，每次修改内容时更新
-const CACHE_VERSION = 'v1';
-const CACHE_NAME = `ai-image-generator-${CACHE_VERSION}`;
-
-// 需要缓存的资源
-const CACHE_ASSETS = [
-  '/',
-  '/index.html',
-  '/style.css',
-  '/script.js',
-  '/favicon.png',
-  '/icon-192.png',
-  '/icon-512.png',
-  '/manifest.json'
-];
-
-// 安装 Service Worker 并缓存基本资源
-self.addEventListener('install', event => {
-  console.log('Service Worker 安装中...');
-  
-  event.waitUntil(
-    caches.open(CACHE_NAME)
-      .then(cache => {
-        console.log('缓存资源中...');
-        return cache.addAll(CACHE_ASSETS);
-      })
-      .then(() => {
-        console.log('资源缓存完成');
-        return self.skipWaiting();
-      })
-  );
-});
-
-// 激活时，清理旧缓存
-self.addEventListener('activate', event => {
-  console.log('Service Worker 已激活');
-  
-  event.waitUntil(
-    caches.keys().then(cacheNames => {
-      return Promise.all(
-        cacheNames.map(cacheName => {
-          if (cacheName !== CACHE_NAME) {
-            console.log('删除旧缓存:', cacheName);
-            return caches.delete(cacheName);
-          }
-        })
-      );
-    }).then(() => self.clients.claim())
-  );
-});
-
-// 处理网络请求
-self.addEventListener('fetch', event => {
-  // 不处理API请求，让其直接走网络
-  if (event.request.url.includes('/api/') || 
-      event.request.url.includes('/generate') || 
-      event.request.url.includes('/result')) {
-    return;
-  }
-  
-  event.respondWith(
-    // 尝试从缓存中获取
-    caches.match(event.request)
-      .then(cachedResponse => {
-        // 如果缓存中存在，直接返回缓存
-        if (cachedResponse) {
-          return cachedResponse;
-        }
-        
-        // 否则请求网络
-        return fetch(event.request)
-          .then(response => {
-            // 检查是否是有效响应
-            if (!response || response.status !== 200 || response.type !== 'basic') {
-              return response;
-            }
-            
-            // 克隆响应，因为响应流只能被读取一次
-            const responseToCache = response.clone();
-            
-            // 将响应存入缓存
-            caches.open(CACHE_NAME)
-              .then(cache => {
-                cache.put(event.request, responseToCache);
-              });
-              
-            return response;
-          })
-          .catch(error => {
-            console.log('Fetch 失败:', error);
-            // 网络请求失败，返回离线页面
-            if (event.request.mode === 'navigate') {
-              return caches.match('/');
-            }
-            
-            return new Response('网络连接异常', {
-              status: 503,
-              statusText: 'Service Unavailable',
-              headers: new Headers({
-                'Content-Type': 'text/plain'
-              })
-            });
-          });
-      })
-  );
-});
-
-// 处理推送通知
-self.addEventListener('push', event => {
-  const data = event.data.json();
-  
-  const options = {
-    body: data.body,
-    icon: 'icon-192.png',
-    badge: 'icon-192.png',
-    vibrate: [100, 50, 100]
-  };
-  
-  event.waitUntil(
-    self.registration.showNotification(data.title, options)
-  );
-});
-
-// 处理通知点击
-self.addEventListener('notificationclick', event => {
-  event.notification.close();
-  
-  event.waitUntil(
-    clients.openWindow('/')
-  );
-}); 
\ No newline at end of file
+// 缓存版本号，每次修改内容时更新
+const CACHE_VERSION = 'v2';
+const CACHE_NAME = `ai-image-generator-${CACHE_VERSION}`;
+
+// 生成结果图片（/images/<task_id>/<index>，URL固定不变）单独缓存，缓存优先，按最近使用时间（LRU）淘汰
+const IMAGE_CACHE_VERSION = 'v1';
+const IMAGE_CACHE_NAME = `ai-image-generator-images-${IMAGE_CACHE_VERSION}`;
+const IMAGE_CACHE_MAX_BYTES = 200 * 1024 * 1024;  // 图片缓存总大小上限
+const IMAGE_CACHE_MAX_ENTRIES = 1000;
+const QUOTA_HIGH_WATER = 0.8;  // 存储用量超过配额的80%时开始淘汰
+const QUOTA_LOW_WATER = 0.7;   // 淘汰到70%以下
+
+// 图片的大小与最近使用时间、命中统计记录在 IndexedDB 中（Service Worker 随时可能被终止，内存状态不可靠）
+const DB_NAME = 'ai-image-generator-sw';
+
+// 需要缓存的资源
+const CACHE_ASSETS = [
+  '/',
+  '/index.html',
+  '/style.css',
+  '/script.js',
+  '/favicon.png',
+  '/icon-192.png',
+  '/icon-512.png',
+  '/manifest.json'
+];
+
+// 安装 Service Worker 并缓存基本资源
+self.addEventListener('install', event => {
+  console.log('Service Worker 安装中...');
+  
+  event.waitUntil(
+    caches.open(CACHE_NAME)
+      .then(cache => {
+        console.log('缓存资源中...');
+        return cache.addAll(CACHE_ASSETS);
+      })
+      .then(() => {
+        console.log('资源缓存完成');
+        return self.skipWaiting();
+      })
+  );
+});
+
+// 激活时，清理旧缓存
+self.addEventListener('activate', event => {
+  console.log('Service Worker 已激活');
+  
+  event.waitUntil(
+    caches.keys().then(cacheNames => {
+      return Promise.all(
+        cacheNames.map(cacheName => {
+          if (cacheName !== CACHE_NAME && cacheName !== IMAGE_CACHE_NAME) {
+            console.log('删除旧缓存:', cacheName);
+            // 图片缓存版本变化时，其LRU记录一并清空
+            const cleared = cacheName.startsWith('ai-image-generator-images-') ? clearImageRecords() : null;
+            return Promise.all([caches.delete(cacheName), cleared]);
+          }
+        })
+      );
+    }).then(() => self.clients.claim())
+  );
+});
+
+// 处理网络请求
+self.addEventListener('fetch', event => {
+  const url = new URL(event.request.url);
+  if (url.origin === self.location.origin && url.pathname.startsWith('/images/')) {
+    // Range请求（部分内容）直接走网络
+    if (event.request.method === 'GET' && !event.request.headers.has('range')) {
+      event.respondWith(cacheFirstImage(event));
+    }
+    return;
+  }
+
+  // 不处理API请求，让其直接走网络
+  if (event.request.url.includes('/api/') || 
+      event.request.url.includes('/generate') || 
+      event.request.url.includes('/result') ||
+      event.request.url.includes('/events')) {
+    return;
+  }
+  
+  event.respondWith(
+    // 尝试从缓存中获取
+    caches.match(event.request)
+      .then(cachedResponse => {
+        // 如果缓存中存在，直接返回缓存
+        if (cachedResponse) {
+          return cachedResponse;
+        }
+        
+        // 否则请求网络
+        return fetch(event.request)
+          .then(response => {
+            // 检查是否是有效响应
+            if (!response || response.status !== 200 || response.type !== 'basic') {
+              return response;
+            }
+            
+            // 克隆响应，因为响应流只能被读取一次
+            const responseToCache = response.clone();
+            
+            // 将响应存入缓存
+            caches.open(CACHE_NAME)
+              .then(cache => {
+                cache.put(event.request, responseToCache);
+              });
+              
+            return response;
+          })
+          .catch(error => {
+            console.log('Fetch 失败:', error);
+            // 网络请求失败，返回离线页面
+            if (event.request.mode === 'navigate') {
+              return caches.match('/');
+            }
+            
+            return new Response('网络连接异常', {
+              status: 503,
+              statusText: 'Service Unavailable',
+              headers: new Headers({
+                'Content-Type': 'text/plain'
+              })
+            });
+          });
+      })
+  );
+});
+
+// 处理推送通知
+self.addEventListener('push', event => {
+  const data = event.data.json();
+  
+  const options = {
+    body: data.body,
+    icon: 'icon-192.png',
+    badge: 'icon-192.png',
+    vibrate: [100, 50, 100]
+  };
+  
+  event.waitUntil(
+    self.registration.showNotification(data.title, options)
+  );
+});
+
+// 处理通知点击
+self.addEventListener('notificationclick', event => {
+  event.notification.close();
+  
+  event.waitUntil(
+    clients.openWindow('/')
+  );
+}); 
+
+// ============== 图片缓存 ==============
+let dbPromise = null;
+
+function openDatabase() {
+  if (!dbPromise) {
+    dbPromise = new Promise((resolve, reject) => {
+      const request = indexedDB.open(DB_NAME, 1);
+      request.onupgradeneeded = () => {
+        const db = request.result;
+        db.createObjectStore('images', { keyPath: 'url' }).createIndex('lastUsed', 'lastUsed');
+        db.createObjectStore('stats');
+      };
+      request.onsuccess = () => resolve(request.result);
+      request.onerror = () => {
+        dbPromise = null;
+        reject(request.error);
+      };
+    });
+  }
+  return dbPromise;
+}
+
+// 在一个读写事务中操作图片记录与统计，事务完成后返回 fn 的结果
+async function withStores(fn) {
+  const db = await openDatabase();
+  return new Promise((resolve, reject) => {
+    const tx = db.transaction(['images', 'stats'], 'readwrite');
+    const result = fn(tx.objectStore('images'), tx.objectStore('stats'));
+    tx.oncomplete = () => resolve(result);
+    tx.onerror = () => reject(tx.error);
+    tx.onabort = () => reject(tx.error);
+  });
+}
+
+function countStat(stats, name, amount = 1) {
+  stats.get(name).onsuccess = event => stats.put((event.target.result || 0) + amount, name);
+}
+
+function clearImageRecords() {
+  return withStores((images, stats) => {
+    images.clear();
+    stats.clear();
+  }).catch(error => console.log('清空图片缓存记录失败:', error));
+}
+
+// 记录一次命中或未命中；size 不为空时更新该图片的大小与最近使用时间
+function recordImageUse(url, size, stat) {
+  return withStores((images, stats) => {
+    if (size !== null) {
+      images.put({ url, size, lastUsed: Date.now() });
+    }
+    countStat(stats, stat);
+  }).catch(error => console.log('记录图片缓存失败:', error));
+}
+
+function responseSize(response) {
+  return Number(response.headers.get('Content-Length')) || 0;
+}
+
+// 只缓存最终版本的图片：变体尚未生成时服务端返回 no-cache 的原图，不能存入该URL
+function isCacheableImage(response) {
+  return response.status === 200 && response.type === 'basic' &&
+    (response.headers.get('Cache-Control') || '').includes('immutable');
+}
+
+async function cacheFirstImage(event) {
+  const request = event.request;
+  const cache = await caches.open(IMAGE_CACHE_NAME);
+  const cached = await cache.match(request);
+  if (cached) {
+    event.waitUntil(recordImageUse(request.url, responseSize(cached), 'hits'));
+    return cached;
+  }
+
+  let response;
+  try {
+    response = await fetch(request);
+  } catch (error) {
+    event.waitUntil(recordImageUse(request.url, null, 'offlineMisses'));
+    return new Response('图片未缓存，网络连接异常', {
+      status: 503,
+      statusText: 'Service Unavailable',
+      headers: new Headers({ 'Content-Type': 'text/plain' })
+    });
+  }
+
+  if (isCacheableImage(response)) {
+    const responseToCache = response.clone();
+    event.waitUntil(
+      responseToCache.blob()
+        .then(blob => cache.put(request, new Response(blob, {
+          status: responseToCache.status,
+          statusText: responseToCache.statusText,
+          headers: responseToCache.headers
+        })).then(() => recordImageUse(request.url, blob.size, 'misses')))
+        .then(evictImages)
+        .catch(error => console.log('缓存图片失败:', error))
+    );
+  } else {
+    event.waitUntil(recordImageUse(request.url, null, 'misses'));
+  }
+  return response;
+}
+
+// 图片记录按最近使用时间从旧到新排列
+function imageRecords() {
+  return withStores(images => {
+    const records = [];
+    images.index('lastUsed').openCursor().onsuccess = event => {
+      const cursor = event.target.result;
+      if (cursor) {
+        records.push(cursor.value);
+        cursor.continue();
+      }
+    };
+    return records;
+  });
+}
+
+// 超过条目数/总大小上限，或存储用量接近配额时，按LRU顺序淘汰图片；同一时间只运行一次
+let evicting = null;
+
+function evictImages() {
+  if (!evicting) {
+    evicting = doEvictImages().finally(() => {
+      evicting = null;
+    });
+  }
+  return evicting;
+}
+
+async function doEvictImages() {
+  const records = await imageRecords();
+  let bytes = records.reduce((total, record) => total + record.size, 0);
+  let bytesToFree = bytes - IMAGE_CACHE_MAX_BYTES;
+  if (navigator.storage && navigator.storage.estimate) {
+    const { usage, quota } = await navigator.storage.estimate();
+    if (quota && usage > quota * QUOTA_HIGH_WATER) {
+      bytesToFree = Math.max(bytesToFree, usage - quota * QUOTA_LOW_WATER);
+    }
+  }
+  let entriesToFree = records.length - IMAGE_CACHE_MAX_ENTRIES;
+  if (bytesToFree <= 0 && entriesToFree <= 0) {
+    return;
+  }
+
+  const evicted = [];
+  for (const record of records) {
+    if (bytesToFree <= 0 && entriesToFree <= 0) {
+      break;
+    }
+    evicted.push(record.url);
+    bytesToFree -= record.size;
+    entriesToFree -= 1;
+  }
+  const cache = await caches.open(IMAGE_CACHE_NAME);
+  await Promise.all(evicted.map(url => cache.delete(url)));
+  await withStores((images, stats) => {
+    evicted.forEach(url => images.delete(url));
+    countStat(stats, 'evictions', evicted.length);
+  });
+  console.log(`图片缓存淘汰 ${evicted.length} 张`);
+}
+
+async function imageCacheStats() {
+  const records = await imageRecords();
+  const counters = await withStores((images, stats) => {
+    const result = {};
+    ['hits', 'misses', 'offlineMisses', 'evictions'].forEach(name => {
+      stats.get(name).onsuccess = event => {
+        result[name] = event.target.result || 0;
+      };
+    });
+    return result;
+  });
+  const lookups = counters.hits + counters.misses + counters.offlineMisses;
+  const stats = {
+    cache: IMAGE_CACHE_NAME,
+    entries: records.length,
+    bytes: records.reduce((total, record) => total + record.size, 0),
+    maxEntries: IMAGE_CACHE_MAX_ENTRIES,
+    maxBytes: IMAGE_CACHE_MAX_BYTES,
+    ...counters,
+    hitRate: lookups ? counters.hits / lookups : null
+  };
+  if (navigator.storage && navigator.storage.estimate) {
+    const { usage, quota } = await navigator.storage.estimate();
+    Object.assign(stats, { usage, quota });
+  }
+  return stats;
+}
+
+// 页面通过 MessageChannel 查询图片缓存统计（条目数、大小、命中次数），用于调整上限
+self.addEventListener('message', event => {
+  if (event.data && event.data.type === 'image-cache-stats' && event.ports[0]) {
+    event.waitUntil(
+      imageCacheStats()
+        .then(stats => event.ports[0].postMessage(stats))
+        .catch(error => event.ports[0].postMessage({ error: String(error) }))
+    );
+  }
+});
@@ -0,0 +1,117 @@
+# ============== 无人等待任务回收 ==============
+# 客户端每次查询 /result、连接 /events（及事件流的每次推送/心跳）都记录一次心跳；
+# 超过 timeout 秒没有任何客户端查询的未结束任务视为已被放弃（如关闭了页面），
+# 由后台线程调用取消函数：本地排队的直接移除，已提交ComfyUI的删除或中断，释放GPU与队列名额。
+# 只记录本进程提交的任务，任务结束时（由事件跟踪回调）删除记录。
+# 每个等待任务的客户端（相同请求合并时可能有多个）持有一个取消令牌，
+# 客户端主动取消时只退出自己的等待，最后一个等待者退出时才真正取消任务。
+import logging
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger("ComfyUI-API")
+
+
+class TaskReaper:
+    """按客户端心跳回收无人等待的任务（线程安全）"""
+
+    def __init__(self, cancel, timeout: float = 180.0, interval: float = 10.0, max_tasks: int = 10000):
+        """cancel(task_id) 取消任务，返回回收的GPU秒数（未取消时返回None）"""
+        self.cancel = cancel
+        self.timeout = timeout
+        self.interval = interval
+        self.max_tasks = max_tasks
+        self.lock = threading.Lock()
+        self.heartbeats = OrderedDict()  # task_id -> 最近一次心跳时间，按时间先后排列
+        self.subscribers = {}  # task_id -> 等待该任务的客户端的取消令牌
+        self.reaped = 0
+        self.reclaimed_seconds = 0.0
+        self._stop_event = threading.Event()
+
+    def track(self, task_id: str):
+        """登记新提交的任务（提交本身算一次心跳）"""
+        with self.lock:
+            self.heartbeats[task_id] = time.monotonic()
+            self.heartbeats.move_to_end(task_id)
+            while len(self.heartbeats) > self.max_tasks:
+                self.subscribers.pop(self.heartbeats.popitem(last=False)[0], None)
+
+    def touch(self, task_id: str):
+        """客户端查询了任务：未登记或已结束的任务忽略"""
+        with self.lock:
+            if task_id in self.heartbeats:
+                self.heartbeats[task_id] = time.monotonic()
+                self.heartbeats.move_to_end(task_id)
+
+    def subscribe(self, task_id: str) -> str:
+        """登记一个等待该任务的客户端，返回它的取消令牌"""
+        token = secrets.token_urlsafe(16)
+        with self.lock:
+            self.subscribers.setdefault(task_id, set()).add(token)
+        return token
+
+    def unsubscribe(self, task_id: str, token: str):
+        """客户端退出等待，返回剩余的等待者数；令牌无效时返回None"""
+        with self.lock:
+            tokens = self.subscribers.get(task_id)
+            if not token or not tokens or token not in tokens:
+                return None
+            tokens.discard(token)
+            if not tokens:
+                del self.subscribers[task_id]
+            return len(tokens)
+
+    def task_finished(self, task_id: str, status: str = None):
+        """任务结束（由事件跟踪回调，在其锁内调用）"""
+        with self.lock:
+            self.heartbeats.pop(task_id, None)
+            self.subscribers.pop(task_id, None)
+
+    def expired(self) -> list:
+        """取出超时未查询的任务"""
+        deadline = time.monotonic() - self.timeout
+        expired = []
+        with self.lock:
+            while self.heartbeats:
+                task_id, seen = next(iter(self.heartbeats.items()))
+                if seen > deadline:
+                    break
+                self.heartbeats.popitem(last=False)
+                expired.append(task_id)
+        return expired
+
+    def reap(self):
+        for task_id in self.expired():
+            try:
+                reclaimed = self.cancel(task_id)
+            except Exception as e:
+                logger.error(f"[{task_id}] 回收无人等待的任务失败: {str(e)}")
+                continue
+            if reclaimed is not None:
+                with self.lock:
+                    self.reaped += 1
+                    self.reclaimed_seconds += reclaimed
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            self.reap()
+
+    # ---------- 生命周期 ----------
+    def start(self):
+        threading.Thread(target=self._run, name="task-reaper", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "tracked": len(self.heartbeats),
+                "subscribers": sum(len(tokens) for tokens in self.subscribers.values()),
+                "timeout": self.timeout,
+                "reaped": self.reaped,
+                "reclaimed_gpu_seconds": round(self.reclaimed_seconds, 1),
+            }
@@ -0,0 +1,201 @@
+# ============== 任务存储 ==============
+# api/app.py 的任务状态存储，按部署方式选择后端：
+# - memory: 进程内字典 + 过期时间小顶堆，写入时顺带清理已过期的任务（单进程部署）
+# - sqlite: SQLite WAL 模式，按 task_id 主键查询、按 expires_at 索引清理，
+#   多个 worker 进程（gunicorn -w N）共享同一个数据库文件，轮询落到任意 worker 都能查到任务
+# 任务记录是可JSON序列化的字典，必须包含 expires_at（time.time() 时间戳）。
+# update_if 只在任务处于预期状态时更新（比较并设置），用于多个线程/进程竞争同一任务的状态转换
+# （如执行线程写入结果与 /cancel 取消同时发生）。
+import heapq
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryTaskStore:
+    """进程内任务存储（线程安全）"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tasks = {}  # task_id -> 任务记录
+        self.expiry_heap = []  # (expires_at, task_id)，任务被覆盖写入后旧条目在清理时跳过
+
+    def get(self, task_id: str):
+        """读取任务，不存在或已过期时返回None（返回副本）"""
+        with self.lock:
+            task = self.tasks.get(task_id)
+            if task is None or task["expires_at"] <= time.time():
+                return None
+            return dict(task)
+
+    def put(self, task_id: str, task: dict):
+        with self.lock:
+            self._sweep(time.time())
+            self.tasks[task_id] = dict(task)
+            heapq.heappush(self.expiry_heap, (task["expires_at"], task_id))
+
+    def update(self, task_id: str, **fields) -> bool:
+        """更新任务的部分字段，任务不存在或已过期时返回False"""
+        return self.update_if(task_id, None, **fields)
+
+    def update_if(self, task_id: str, expect_status, **fields) -> bool:
+        """任务状态为 expect_status 时才更新（None表示不检查），未更新时返回False"""
+        with self.lock:
+            task = self.tasks.get(task_id)
+            if task is None or task["expires_at"] <= time.time():
+                return False
+            if expect_status is not None and task.get("status") != expect_status:
+                return False
+            task.update(fields)
+            if "expires_at" in fields:
+                heapq.heappush(self.expiry_heap, (fields["expires_at"], task_id))
+            return True
+
+    def delete(self, task_id: str):
+        with self.lock:
+            self.tasks.pop(task_id, None)
+
+    def purge_expired(self) -> int:
+        with self.lock:
+            return self._sweep(time.time())
+
+    def _sweep(self, now: float) -> int:
+        """从堆顶弹出到期条目，只删除过期时间仍然一致的任务（需持有锁）"""
+        removed = 0
+        heap = self.expiry_heap
+        while heap and heap[0][0] <= now:
+            expires_at, task_id = heapq.heappop(heap)
+            task = self.tasks.get(task_id)
+            if task is not None and task["expires_at"] <= now:
+                del self.tasks[task_id]
+                removed += 1
+        # 延长过期时间或删除任务会留下失效的堆条目，数量过多时重建
+        if len(heap) > 2 * len(self.tasks) + 64:
+            self.expiry_heap = [(task["expires_at"], task_id) for task_id, task in self.tasks.items()]
+            heapq.heapify(self.expiry_heap)
+        return removed
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"backend": "memory", "tasks": len(self.tasks), "heap": len(self.expiry_heap)}
+
+
+class SQLiteTaskStore:
+    """SQLite 任务存储（WAL 模式，多进程共享；每个线程一个连接）"""
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS tasks ("
+        " task_id TEXT PRIMARY KEY,"
+        " data TEXT NOT NULL,"
+        " expires_at REAL NOT NULL"
+        ") WITHOUT ROWID",
+        "CREATE INDEX IF NOT EXISTS idx_tasks_expires_at ON tasks (expires_at)",
+    )
+
+    def __init__(self, path: str, sweep_interval: float = 60.0, busy_timeout: float = 5.0):
+        self.path = path
+        self.sweep_interval = sweep_interval
+        self.busy_timeout = busy_timeout
+        self.local = threading.local()
+        self.next_sweep = 0.0
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        conn = self._conn()
+        with conn:
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+
+    def _conn(self) -> sqlite3.Connection:
+        """当前线程的连接；fork 出的子进程不能沿用父进程的连接，按进程号区分"""
+        conn = getattr(self.local, "conn", None)
+        if conn is None or self.local.pid != os.getpid():
+            # isolation_level=None：自动提交，需要事务时显式 BEGIN
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")  # WAL 下断电最多丢失最近的事务，不会损坏数据库
+            self.local.conn = conn
+            self.local.pid = os.getpid()
+        return conn
+
+    def get(self, task_id: str):
+        row = self._conn().execute(
+            "SELECT data FROM tasks WHERE task_id = ? AND expires_at > ?", (task_id, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, task_id: str, task: dict):
+        self._maybe_sweep()
+        self._conn().execute(
+            "INSERT OR REPLACE INTO tasks (task_id, data, expires_at) VALUES (?, ?, ?)",
+            (task_id, json.dumps(task, ensure_ascii=False), task["expires_at"]),
+        )
+
+    def update(self, task_id: str, **fields) -> bool:
+        return self.update_if(task_id, None, **fields)
+
+    def update_if(self, task_id: str, expect_status, **fields) -> bool:
+        """读-改-写（含状态检查）在同一个写事务内完成，避免多个进程同时更新同一任务时互相覆盖"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT data FROM tasks WHERE task_id = ? AND expires_at > ?", (task_id, time.time())
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return False
+            task = json.loads(row[0])
+            if expect_status is not None and task.get("status") != expect_status:
+                conn.execute("COMMIT")
+                return False
+            task.update(fields)
+            conn.execute(
+                "UPDATE tasks SET data = ?, expires_at = ? WHERE task_id = ?",
+                (json.dumps(task, ensure_ascii=False), task["expires_at"], task_id),
+            )
+            conn.execute("COMMIT")
+            return True
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def delete(self, task_id: str):
+        self._conn().execute("DELETE FROM tasks WHERE task_id = ?", (task_id,))
+
+    def purge_expired(self) -> int:
+        return self._conn().execute("DELETE FROM tasks WHERE expires_at <= ?", (time.time(),)).rowcount
+
+    def _maybe_sweep(self):
+        """每个进程每隔 sweep_interval 秒清理一次过期任务（走 expires_at 索引）"""
+        now = time.monotonic()
+        if now < self.next_sweep:
+            return
+        self.next_sweep = now + self.sweep_interval
+        try:
+            removed = self.purge_expired()
+            if removed:
+                logger.info(f"已清理 {removed} 个过期任务")
+        except sqlite3.Error as e:
+            logger.warning(f"清理过期任务失败: {str(e)}")
+
+    def stats(self) -> dict:
+        count = self._conn().execute("SELECT COUNT(*) FROM tasks").fetchone()[0]
+        return {"backend": "sqlite", "path": self.path, "tasks": count}
+
+
+def create_task_store(url: str = None):
+    """按配置创建任务存储：memory 或 sqlite:///数据库路径（默认放在系统临时目录）"""
+    if not url:
+        url = "sqlite:///" + os.path.join(tempfile.gettempdir(), "comfyui_api_tasks.db")
+    if url == "memory":
+        return MemoryTaskStore()
+    if url.startswith("sqlite:///"):
+        return SQLiteTaskStore(url[len("sqlite:///"):])
+    raise ValueError(f"不支持的任务存储: {url}")
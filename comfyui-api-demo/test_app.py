@@ -1,10 +1,10 @@
-from flask import Flask, send_from_directory
-
-app = Flask(__name__, static_url_path='', static_folder='static')
-
-@app.route('/')
-def index():
-    return send_from_directory('static', 'index.html')
-
-if __name__ == '__main__':
+from flask import Flask, send_from_directory
+
+app = Flask(__name__, static_url_path='', static_folder='static')
+
+@app.route('/')
+def index():
+    return send_from_directory('static', 'index.html')
+
+if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True) 
\ No newline at end of file
@@ -0,0 +1,236 @@
+# ============== 工作流模板注册表 ==============
+# 模板清单（workflows.json）按名称声明每个模板的文件、参数槽位、固定连接与校验规则：
+# - 启动时不读取任何模板，首次使用时才解析、校验并编译（CompiledWorkflow），之后复用编译结果
+# - 每次取用时检查清单与模板文件的修改时间，变化后重新加载；
+#   重新加载失败时记录错误并继续使用上一个有效版本，不影响正在运行的服务
+# - 模板文件允许 // 与 /* */ 注释，按JSON词法剥离（字符串中的 // 如URL不受影响）
+# - 模型节点（各类 Loader，或清单 model_nodes 声明的节点）的输入组成模板的模型组合，
+#   调度器据此把使用相同模型的任务排在一起，减少ComfyUI切换模型时重新加载权重
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+
+from workflow_template import CompiledWorkflow
+
+logger = logging.getLogger("ComfyUI-API")
+
+# 字符串、行注释、块注释；字符串原样保留，注释删除
+JSON_TOKEN_RE = re.compile(r'"(?:\\.|[^"\\])*"|//[^\n]*|/\*.*?\*/', re.S)
+# 参数类型：模板中的原值必须符合该类型，请求参数按该类型转换
+PARAM_TYPES = {
+    "str": (str, str),
+    "int": (int, int),
+    "float": ((int, float), float),
+}
+# 模型权重文件扩展名（用于检查模型文件是否存在）
+MODEL_FILE_SUFFIXES = (".safetensors", ".sft", ".ckpt", ".pt", ".pth", ".bin", ".gguf")
+
+
+class WorkflowError(ValueError):
+    """工作流模板无法加载或校验失败"""
+
+
+class WorkflowNotFound(WorkflowError):
+    """请求的工作流模板不存在"""
+
+
+def strip_json_comments(text: str) -> str:
+    if "/" not in text:
+        return text
+    return JSON_TOKEN_RE.sub(lambda m: m.group(0) if m.group(0).startswith('"') else "", text)
+
+
+def load_json(path: str):
+    with open(path, "r", encoding="utf-8-sig") as f:
+        return json.loads(strip_json_comments(f.read()))
+
+
+def is_link(value) -> bool:
+    """节点连接：[节点ID, 输出序号]"""
+    return isinstance(value, list) and len(value) == 2 and isinstance(value[0], str)
+
+
+def validate_template(workflow: dict, spec: dict):
+    """按清单声明校验模板：关键节点类型与输入、参数槽位与类型、固定连接"""
+    for node_id, config in spec.get("required_nodes", {}).items():
+        node = workflow.get(node_id)
+        if not node:
+            raise WorkflowError(f"缺失关键节点 {node_id}")
+        if node.get("class_type") != config["class_type"]:
+            raise WorkflowError(f"节点 {node_id} 类型错误，应为 {config['class_type']}")
+        for inp in config.get("inputs", []):
+            if inp not in node.get("inputs", {}):
+                raise WorkflowError(f"节点 {node_id} 缺少输入字段 '{inp}'")
+
+    for name, param in spec.get("params", {}).items():
+        if param.get("type") not in (None, *PARAM_TYPES):
+            raise WorkflowError(f"参数 {name} 的类型 {param['type']} 无效")
+        expected = PARAM_TYPES[param["type"]][0] if param.get("type") else None
+        for node_id, input_name in param["slots"]:
+            inputs = workflow.get(node_id, {}).get("inputs")
+            if inputs is None or input_name not in inputs:
+                raise WorkflowError(f"参数 {name} 指向不存在的输入 {node_id}.{input_name}")
+            value = inputs[input_name]
+            if expected and not is_link(value) and not isinstance(value, expected):
+                raise WorkflowError(f"节点 {node_id} 的 {input_name} 参数必须是 {param['type']} 类型")
+
+    for node_id in spec.get("model_nodes", []):
+        if node_id not in workflow:
+            raise WorkflowError(f"模型节点 {node_id} 不存在")
+
+    for node_id, input_name, value in spec.get("fixed", []):
+        if node_id not in workflow:
+            raise WorkflowError(f"固定输入指向不存在的节点 {node_id}")
+        if is_link(value) and value[0] not in workflow:
+            raise WorkflowError(f"节点 {node_id} 的 {input_name} 连接到不存在的节点 {value[0]}")
+
+
+class WorkflowTemplate:
+    """已校验、编译的工作流模板"""
+
+    def __init__(self, name: str, spec: dict, workflow: dict, path: str, mtime: int):
+        validate_template(workflow, spec)
+        self.name = name
+        self.spec = spec
+        self.path = path
+        self.workflow = workflow  # 模板文件原始内容（只读）
+        self.mtime = mtime
+        self.params = spec.get("params", {})
+        slots = {param: [tuple(target) for target in p["slots"]] for param, p in self.params.items()}
+        # 输出文件名前缀写入任务ID，输出目录索引据此精确对应任务与文件
+        slots.setdefault("filename_prefix", [(node_id, "filename_prefix") for node_id, node in workflow.items()
+                                             if node.get("class_type") == "SaveImage"])
+        fixed = {(node_id, input_name): value for node_id, input_name, value in spec.get("fixed", [])}
+        self.compiled = CompiledWorkflow(workflow, slots, fixed)
+        # 模型节点：清单未声明时取所有 Loader 类节点
+        self.model_nodes = tuple(spec.get("model_nodes") or sorted(
+            node_id for node_id, node in workflow.items() if "Loader" in node.get("class_type", "")))
+        # 模型节点的输入不含参数槽位时，模型组合与请求参数无关，只计算一次
+        patched = {node_id for targets in slots.values() for node_id, _ in targets}
+        self._model_key = None
+        if not patched & set(self.model_nodes):
+            self._model_key = self.model_key(self.compiled.template)
+
+    @property
+    def fingerprint(self) -> str:
+        return self.compiled.fingerprint
+
+    def model_key(self, workflow: dict = None) -> str:
+        """模型组合的标识：模型节点的类型与输入值（节点连接除外）相同的工作流共用已加载的权重"""
+        if workflow is None or self._model_key is not None:
+            return self._model_key
+        nodes = sorted(json.dumps([workflow[node_id]["class_type"],
+                                   {k: v for k, v in workflow[node_id]["inputs"].items() if not is_link(v)}],
+                                  sort_keys=True, ensure_ascii=False)
+                       for node_id in self.model_nodes)
+        return hashlib.sha1("\n".join(nodes).encode("utf-8")).hexdigest()[:12]
+
+    def model_files(self) -> list:
+        """模型节点引用的权重文件名"""
+        return sorted({value for node_id in self.model_nodes
+                       for value in self.compiled.template[node_id]["inputs"].values()
+                       if isinstance(value, str) and value.lower().endswith(MODEL_FILE_SUFFIXES)})
+
+    def coerce(self, name: str, value):
+        """按声明的类型转换请求参数（转换失败抛出 ValueError）"""
+        param_type = self.params[name].get("type")
+        return PARAM_TYPES[param_type][1](value) if param_type else value
+
+    def render(self, values: dict) -> dict:
+        return self.compiled.render(values)
+
+
+class WorkflowRegistry:
+    """按名称取用工作流模板（线程安全）"""
+
+    def __init__(self, manifest_path):
+        self.manifest_path = os.fspath(manifest_path)
+        self.lock = threading.Lock()
+        self.manifest = None
+        self.manifest_mtime = None
+        self.templates = {}  # 名称 -> WorkflowTemplate
+        self.failed = {}  # 名称 -> 加载失败时的 (修改时间, 清单条目)，文件再次修改前不重复尝试
+        self.loads = 0
+        self.errors = 0
+
+    @staticmethod
+    def _stat(path: str):
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError as e:
+            raise WorkflowError(f"无法读取 {os.path.basename(path)}: {e.strerror}")
+
+    def _load_manifest(self) -> dict:
+        mtime = self._stat(self.manifest_path)
+        if mtime != self.manifest_mtime:
+            try:
+                manifest = load_json(self.manifest_path)
+                manifest["templates"]
+            except (ValueError, KeyError, TypeError) as e:
+                self.errors += 1
+                if self.manifest is None:
+                    raise WorkflowError(f"模板清单无效: {str(e)}")
+                logger.error(f"模板清单重新加载失败，继续使用上一个版本: {str(e)}")
+            else:
+                self.manifest = manifest
+                logger.info(f"已加载模板清单: {os.path.basename(self.manifest_path)} | "
+                            f"{len(manifest['templates'])} 个模板")
+            self.manifest_mtime = mtime
+        return self.manifest
+
+    def get(self, name: str = None) -> WorkflowTemplate:
+        """取用模板；模板文件修改后重新加载。模板不存在时抛出 WorkflowNotFound，无法加载时抛出 WorkflowError"""
+        with self.lock:
+            manifest = self._load_manifest()
+            name = name or manifest.get("default")
+            spec = manifest["templates"].get(name)
+            if spec is None:
+                raise WorkflowNotFound(f"工作流模板不存在: {name}")
+            current = self.templates.get(name)
+            if current is not None and current.spec is spec:
+                path = current.path
+            else:
+                path = os.path.join(os.path.dirname(self.manifest_path), spec["file"])
+            mtime = self._stat(path)
+            if current is not None and current.mtime == mtime and current.spec is spec:
+                return current
+            if current is not None and ((current.mtime, current.spec) == (mtime, spec)
+                                        or self.failed.get(name) == (mtime, spec)):
+                current.spec = spec  # 清单重新加载但该模板未变化
+                return current
+            try:
+                template = WorkflowTemplate(name, spec, load_json(path), path, mtime)
+            except (ValueError, KeyError, TypeError) as e:
+                self.errors += 1
+                if current is None:
+                    raise WorkflowError(f"工作流模板 {name} 加载失败: {str(e)}")
+                logger.error(f"工作流模板 {name} 重新加载失败，继续使用上一个版本: {str(e)}")
+                self.failed[name] = (mtime, spec)
+                return current
+            self.templates[name] = template
+            self.failed.pop(name, None)
+            self.loads += 1
+            logger.info(f"工作流模板 {name} {'已重新加载' if current else '已加载'}: {spec['file']}")
+            return template
+
+    def describe(self) -> list:
+        """清单中的模板及其参数（不加载模板文件）"""
+        with self.lock:
+            manifest = self._load_manifest()
+        return [{
+            "name": name,
+            "description": spec.get("description", ""),
+            "default": name == manifest.get("default"),
+            "params": {param: p.get("default") for param, p in spec.get("params", {}).items()},
+        } for name, spec in manifest["templates"].items()]
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "loaded": sorted(self.templates),
+                "loads": self.loads,
+                "errors": self.errors,
+            }
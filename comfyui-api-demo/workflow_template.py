@@ -0,0 +1,54 @@
+# ============== 编译后的工作流模板 ==============
+# 加载时一次性定位所有参数槽位（节点ID + 输入字段），生成提交数据时：
+# - 未修改的节点直接与模板共享，不做任何复制
+# - 只为包含参数槽位的节点复制外层字典和 inputs
+# 因此生成的工作流必须视为只读，仅用于序列化提交。
+import copy
+import hashlib
+import json
+
+
+class CompiledWorkflow:
+    """预编译的工作流模板"""
+
+    def __init__(self, template: dict, slots: dict, fixed: dict = None):
+        """
+        template: ComfyUI API格式的工作流
+        slots: 参数名 -> [(节点ID, 输入字段), ...]
+        fixed: 固定写入的输入 {(节点ID, 输入字段): 值}，编译时应用一次（如节点连接）
+        """
+        template = copy.deepcopy(template)
+        for (node_id, input_name), value in (fixed or {}).items():
+            self._check_slot(template, "fixed", node_id)
+            template[node_id]["inputs"][input_name] = value
+
+        for name, targets in slots.items():
+            for node_id, input_name in targets:
+                self._check_slot(template, name, node_id)
+
+        self.template = template
+        # 模板指纹：模板变化后，按参数计算的缓存键随之失效
+        self.fingerprint = hashlib.sha256(
+            json.dumps(template, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+        self.slots = {name: tuple(targets) for name, targets in slots.items()}
+        patched = sorted({node_id for targets in slots.values() for node_id, _ in targets})
+        self.patched_nodes = tuple((node_id, template[node_id]) for node_id in patched)
+
+    @staticmethod
+    def _check_slot(template: dict, name: str, node_id: str):
+        node = template.get(node_id)
+        if not node or "inputs" not in node:
+            raise ValueError(f"参数槽位 {name} 指向不存在的节点 {node_id}")
+
+    def render(self, values: dict) -> dict:
+        """按参数生成工作流；未提供的参数保留模板中的值"""
+        workflow = dict(self.template)
+        for node_id, node in self.patched_nodes:
+            workflow[node_id] = {**node, "inputs": node["inputs"].copy()}
+        for name, value in values.items():
+            targets = self.slots.get(name)
+            if targets is None:
+                raise ValueError(f"未知的工作流参数: {name}")
+            for node_id, input_name in targets:
+                workflow[node_id]["inputs"][input_name] = value
+        return workflow